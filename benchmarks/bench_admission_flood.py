@@ -0,0 +1,101 @@
+"""
+受付制御（admission.py）の負荷試験
+
+1人の顧客が大量の写真を一度に送った状況（flood）で、他の顧客（1枚ずつ送る小口顧客）の
+受付〜処理完了までの時間を比較する。処理本体（Gemini → アップロード → シート）は sleep で模擬する。
+
+- baseline: 小口顧客だけ
+- fifo:     flood あり・全員で1つの待ち行列（変更前の「来た順に処理」に相当）
+- fair:     flood あり・ユーザーごとの同時実行上限 + ラウンドロビン
+
+fair の小口顧客の p95 が baseline の p95 × MAX_P95_RATIO を超えたら終了コード1で失敗する。
+
+使い方:
+    python benchmarks/bench_admission_flood.py [--flood 200] [--small 20] [--service-ms 100]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'line-receipt-webhook'))
+
+from admission import FairScheduler  # noqa: E402
+
+WORKERS = 8
+PER_USER = 2
+MAX_P95_RATIO = 2.0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_scenario(flood, small, service_s, interval_s, fair):
+    """
+    flood: 大量送信する顧客の件数（0なら flood なし）
+    small: 小口顧客の人数（1人1件、interval_s ごとに到着）
+    戻り値: 小口顧客の所要時間（秒）のリスト, スケジューラの metrics
+    """
+    scheduler = FairScheduler(workers=WORKERS, per_user=PER_USER if fair else WORKERS)
+    latencies = []
+    lock = threading.Lock()
+
+    def work(submitted_at, record):
+        time.sleep(service_s)
+        if record:
+            with lock:
+                latencies.append(time.monotonic() - submitted_at)
+
+    jobs = []
+    for _ in range(flood):
+        # fifo は全員を同じキーにして1本の待ち行列にする
+        jobs.append(scheduler.submit('flood' if fair else 'all', work, time.monotonic(), False))
+    for i in range(small):
+        time.sleep(interval_s)
+        jobs.append(scheduler.submit(f'small{i}' if fair else 'all', work, time.monotonic(), True))
+    for job in jobs:
+        job.done.wait()
+    return latencies, scheduler.metrics()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flood', type=int, default=200)
+    parser.add_argument('--small', type=int, default=20)
+    parser.add_argument('--service-ms', type=float, default=100)
+    parser.add_argument('--interval-ms', type=float, default=50)
+    args = parser.parse_args()
+    service_s = args.service_ms / 1000
+    interval_s = args.interval_ms / 1000
+
+    results = {
+        'baseline': run_scenario(0, args.small, service_s, interval_s, fair=True),
+        'fifo': run_scenario(args.flood, args.small, service_s, interval_s, fair=False),
+        'fair': run_scenario(args.flood, args.small, service_s, interval_s, fair=True),
+    }
+
+    print(f'workers={WORKERS} per_user={PER_USER} flood={args.flood} small={args.small} '
+          f'service={args.service_ms:.0f}ms')
+    print(f'{"":10}{"small p50":>12}{"small p95":>12}{"wait p95":>12}')
+    for name, (latencies, metrics) in results.items():
+        print(f'{name:10}{percentile(latencies, 50) * 1000:>10.0f}ms{percentile(latencies, 95) * 1000:>10.0f}ms'
+              f'{metrics["wait_p95"] * 1000:>10.0f}ms')
+
+    baseline_p95 = percentile(results['baseline'][0], 95)
+    fair_p95 = percentile(results['fair'][0], 95)
+    limit = baseline_p95 * MAX_P95_RATIO
+    if fair_p95 > limit:
+        print(f'FAIL: fair p95 {fair_p95 * 1000:.0f}ms > {limit * 1000:.0f}ms（baseline × {MAX_P95_RATIO}）')
+        return 1
+    print(f'OK: fair p95 {fair_p95 * 1000:.0f}ms <= {limit * 1000:.0f}ms（baseline × {MAX_P95_RATIO}）')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
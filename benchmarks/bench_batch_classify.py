@@ -0,0 +1,155 @@
+"""
+書類の一括分類（batch_classify.py）と1件ずつの分類の比較
+
+tools/fake_gemini_api.py の疑似サーバー（1リクエストの遅延 + 書類ごとの遅延、500エラー、
+一括分類での結果の欠落）に向けて、滞留した書類を
+- single: 1件ずつ classify_document_with_gemini（GEMINI_BATCH_WORKERS 並列）
+- batch:  batch_classify.classify_many（GEMINI_BATCH_SIZE 件ずつまとめて GEMINI_BATCH_WORKERS 並列）
+で分類し、書類あたりのリクエスト数と 書類/分 を比べる。
+さらに保留キューに積んだ書類を deferred_queue.drain_batch + process_deferred_batch で処理し、全件が処理されることを確認する。
+
+次の場合は終了コード1で失敗する。
+- batch の分類結果が書類の中身と違う（結果の振り分け違い）
+- 欠落した書類が1件ずつの分類でやり直されていない
+- batch の書類あたりのリクエスト数が single より少なくない
+- 保留キューに処理されずに残った書類がある
+
+使い方（functions/line-receipt-webhook/requirements.txt を導入した環境で）:
+    python benchmarks/bench_batch_classify.py [--docs 200] [--latency 0.8] [--per-doc-latency 0.1] [--drop-rate 0.05]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix='bench_batch_')
+PORT = 8766
+
+# main の import 前に疑似サーバーと作業ディレクトリに向ける
+os.environ['GEMINI_API_BASE'] = f'http://127.0.0.1:{PORT}'
+os.environ['GEMINI_API_KEY'] = 'bench'
+# 注入した500エラーでブレーカーが開くと比較にならないため、閾値を上げておく
+os.environ['GEMINI_BREAKER_THRESHOLD'] = '1000000'
+os.environ['EVENT_JOURNAL_ENABLED'] = '0'
+for name in ('CUSTOMER_STORE_DIR', 'PAGE_CACHE_DIR', 'DEFERRED_QUEUE_DIR', 'RECEIPT_INDEX_DIR'):
+    os.environ[name] = os.path.join(WORK_DIR, name.lower())
+os.environ['USAGE_DB_PATH'] = os.path.join(WORK_DIR, 'usage.db')
+os.environ['NOTIFY_DB_PATH'] = os.path.join(WORK_DIR, 'notify.db')
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'line-receipt-webhook'))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+
+import batch_classify  # noqa: E402
+import deferred_queue  # noqa: E402
+import main  # noqa: E402
+from fake_gemini_api import FakeGeminiApi, classify_bytes, serve  # noqa: E402
+
+KINDS = [b'receipt'] * 6 + [b'passbook', b'slip', b'other']
+
+
+def make_documents(rng, count):
+    """画像に見立てたバイト列（中身の語で疑似サーバーが分類を決める）"""
+    return [(KINDS[rng.randrange(len(KINDS))] + f':{i}:'.encode() + os.urandom(rng.randint(20_000, 200_000)),
+             'image/jpeg') for i in range(count)]
+
+
+def expected_category(content):
+    return classify_bytes(content)['category']
+
+
+def check(results, documents):
+    """(結果の振り分け違い, 障害扱いの件数)"""
+    wrong = deferred = 0
+    for classification, (content, _) in zip(results, documents):
+        if classification.get('deferrable') or classification.get('error'):
+            deferred += 1
+        elif classification.get('category') != expected_category(content):
+            wrong += 1
+    return wrong, deferred
+
+
+def run(api, label, documents, fn):
+    before = dict(api.stats)
+    started = time.perf_counter()
+    results = fn(documents)
+    elapsed = time.perf_counter() - started
+    requests_made = api.stats['requests'] - before['requests']
+    dropped = api.stats['dropped'] - before['dropped']
+    wrong, deferred = check(results, documents)
+    print(f'{label:7} {len(documents)} 件 {elapsed:6.1f}s  {len(documents) / elapsed * 60:8.0f} 件/分  '
+          f'リクエスト {requests_made:4d}（{requests_made / len(documents):.2f}/件）  '
+          f'欠落 {dropped}  障害扱い {deferred}  振り分け違い {wrong}')
+    return results, requests_made / len(documents), wrong
+
+
+def classify_single(documents):
+    with ThreadPoolExecutor(max_workers=batch_classify.GEMINI_BATCH_WORKERS) as pool:
+        return list(pool.map(lambda d: main.classify_document_with_gemini(*d), documents))
+
+
+def classify_batch(documents):
+    return batch_classify.classify_many(documents, main.classify_documents_with_gemini,
+                                        main.classify_document_with_gemini)
+
+
+def drain_deferred(documents):
+    """保留キューに積んで drain_batch で処理（分類後の保存・返信は記録だけにする）"""
+    processed = []
+    main.process_classified_document = lambda event, classification, content, *args: processed.append(
+        (classification, content))
+    for i, (content, mime_type) in enumerate(documents):
+        deferred_queue.enqueue(content, {'user_id': f'U{i % 7}', 'channel_key': 'MK', 'folder_id': '',
+                                         'status': 'お試し', 'filename': f'{i}.jpg', 'mime_type': mime_type})
+    chunk = batch_classify.GEMINI_BATCH_SIZE * batch_classify.GEMINI_BATCH_WORKERS
+    while deferred_queue.pending_entries():
+        if not deferred_queue.drain_batch(main.process_deferred_batch, chunk):
+            break
+    return processed
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.8, help='疑似サーバーの1リクエストの遅延（秒）')
+    parser.add_argument('--per-doc-latency', type=float, default=0.1, help='書類1件あたりの追加の遅延（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=20260215)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    api = FakeGeminiApi(args.latency, args.per_doc_latency, args.error_rate, args.drop_rate, seed=args.seed)
+    server = serve(api, port=PORT)
+    failed = False
+    try:
+        print(f'GEMINI_BATCH_SIZE={batch_classify.GEMINI_BATCH_SIZE} '
+              f'GEMINI_BATCH_WORKERS={batch_classify.GEMINI_BATCH_WORKERS}')
+        documents = make_documents(rng, args.docs)
+        _, single_rpd, wrong = run(api, 'single', documents, classify_single)
+        failed = failed or bool(wrong)
+        _, batch_rpd, wrong = run(api, 'batch', documents, classify_batch)
+        failed = failed or bool(wrong)
+        if batch_rpd >= single_rpd:
+            print(f'  一括分類のリクエスト数が減っていない（{batch_rpd:.2f} >= {single_rpd:.2f}）')
+            failed = True
+
+        documents = make_documents(rng, max(1, args.docs // 4))
+        started = time.perf_counter()
+        processed = drain_deferred(documents)
+        elapsed = time.perf_counter() - started
+        left = len(deferred_queue.pending_entries())
+        wrong = sum(1 for classification, content in processed
+                    if classification.get('category') != expected_category(content))
+        print(f'保留キュー {len(documents)} 件 {elapsed:6.1f}s  処理 {len(processed)} 件  残り {left} 件  '
+              f'振り分け違い {wrong}')
+        failed = failed or bool(left) or bool(wrong) or len(processed) != len(documents)
+    finally:
+        server.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_())
@@ -0,0 +1,213 @@
+"""
+一括実行スケジューラ（tools/batch_scheduler.py）と GAS版（batchRunAutoVerification_）の順番待ちの比較
+
+tools/fake_script_api.py の疑似サーバーで runClientSlice を受け、顧客ごとの未処理件数を
+1件 --item-seconds 秒で処理したことにする。--clients 件の顧客のうち、リストの前の方の1件だけ
+未処理が --heavy 件と多く、残りは数件〜数十件。
+
+- GAS版: 顧客を1件ずつ順番に、それぞれ最後まで処理する（1本・小分けなし）
+- スケジューラ: --workers 本・1回 --slice-items 件・AIの呼び出し上限あり（窓は --window 秒に縮めて確認する）
+- 顧客ごとの「完了までの時間」（p50 / p95 / 多い顧客を除いた最大）を比べる
+- 同じ顧客の同時実行がない、AIの呼び出しが上限を超えない、全件処理されたことを確認する
+- 中断: スケジューラを別プロセスで起動して途中で強制終了し、--resume で続きから完了できること、
+  完了済みの顧客をもう一度実行しないことを確認する
+- いずれかを満たさない、またはスケジューラの p95 が GAS版より悪ければ終了コード1で失敗する
+
+使い方:
+    python benchmarks/bench_batch_scheduler.py [--clients 40] [--heavy 400] [--workers 4] [--item-seconds 0.01]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOOLS = os.path.join(HERE, '..', 'tools')
+sys.path.insert(0, TOOLS)
+
+import batch_scheduler  # noqa: E402
+import fake_script_api  # noqa: E402
+from deploy_wrapper import AdaptiveLimiter, ScriptApi  # noqa: E402
+
+OPERATION = 'verification'
+
+
+def make_clients(count, heavy, rng):
+    clients = [{'partner': 'BENCH', 'code': f'MK{n:03d}', 'spreadsheetId': f'sheet{n:03d}'} for n in range(1, count + 1)]
+    backlogs = {c['spreadsheetId']: {OPERATION: rng.randint(3, 30)} for c in clients}
+    # 未処理が多い顧客はリストの3番目（GAS版ではその後ろ全員が待たされる）
+    backlogs[clients[2]['spreadsheetId']][OPERATION] = heavy
+    return clients, backlogs
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def max_in_window(times, window):
+    """どの window 秒を切り取っても数えた場合の最大の呼び出し回数"""
+    times = sorted(times)
+    best = start = 0
+    for end, t in enumerate(times):
+        while times[start] <= t - window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def run_serial(api, base, clients):
+    """GAS版と同じ: 1件ずつ、時間の許す限り最後まで（戻り値: 顧客コード → 完了までの秒数）"""
+    script = ScriptApi('dummy', AdaptiveLimiter(1), api_base=base)
+    started = time.monotonic()
+    finished = {}
+    for client in clients:
+        result = {'hasMore': True}
+        while result.get('hasMore'):
+            result, _ = script.run_function('dummy', batch_scheduler.SLICE_FUNCTION,
+                                            [OPERATION, client['spreadsheetId'], 4 * 60 * 1000, 0])
+        finished[client['code']] = time.monotonic() - started
+    return finished
+
+
+def run_scheduler(api, base, clients, args, limit):
+    script = ScriptApi('dummy', AdaptiveLimiter(args.workers), api_base=base)
+    progress = batch_scheduler.RunProgress(None, OPERATION)
+    budget = batch_scheduler.LlmBudget(limit, args.window)
+    scheduler = batch_scheduler.SliceScheduler(
+        script, 'dummy', OPERATION, budget, progress, workers=args.workers,
+        slice_items=args.slice_items, slice_seconds=60)
+    remaining = scheduler.run(clients)
+    finished = {code: entry['finished_at'] - progress.started_at
+                for code, entry in progress.data['clients'].items() if entry.get('finished_at')}
+    return finished, remaining, scheduler.stats
+
+
+def run_crash_resume(api, base, clients, backlogs, args, workdir):
+    """別プロセスで実行して強制終了し、--resume で続ける（戻り値: 問題のリスト, 中断時の状態）"""
+    problems = []
+    clients_path = os.path.join(workdir, 'clients.json')
+    progress_path = os.path.join(workdir, 'progress.json')
+    with open(clients_path, 'w', encoding='utf-8') as f:
+        json.dump(clients, f)
+    api.backlogs = json.loads(json.dumps(backlogs))
+    command = [sys.executable, os.path.join(TOOLS, 'batch_scheduler.py'), OPERATION,
+               '--clients', clients_path, '--central-script-id', 'dummy', '--api-base', base, '--token', 'dummy',
+               '--workers', str(args.workers), '--slice-items', str(args.slice_items), '--llm-per-minute', '0',
+               '--progress', progress_path]
+
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    heavy_id = clients[2]['spreadsheetId']
+    # 多い顧客が途中まで進んだところで強制終了する
+    deadline = time.monotonic() + 60
+    while api.backlogs[heavy_id][OPERATION] > args.heavy // 2 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    process.kill()
+    process.wait()
+    killed_at = time.monotonic()
+    time.sleep(args.item_seconds * args.slice_items * 2)  # 実行中だった小分けはGAS側で最後まで進む
+
+    with open(progress_path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)['clients']
+    done_before = {code for code, entry in saved.items() if entry['status'] == 'done'}
+    state = {'done': len(done_before), 'running': sum(1 for e in saved.values() if e['status'] == 'running'),
+             'heavy': saved.get(clients[2]['code'], {}).get('processed', 0)}
+    if saved.get(clients[2]['code'], {}).get('status') != 'running':
+        problems.append('中断時に多い顧客が途中になっていない')
+
+    resumed = subprocess.run(command + ['--resume'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if resumed.returncode != 0:
+        problems.append(f'再開後の終了コード {resumed.returncode}: {resumed.stdout[-300:]}')
+    rerun = {run[0] for run in api.runs if run[2] > killed_at and run[4]}
+    again = sorted(c['code'] for c in clients if c['code'] in done_before and c['spreadsheetId'] in rerun)
+    if again:
+        problems.append(f'完了済みの顧客をもう一度実行した: {again[:5]}')
+    left = {sid: b[OPERATION] for sid, b in api.backlogs.items() if b[OPERATION]}
+    if left:
+        problems.append(f'未処理が残った: {list(left.items())[:5]}')
+    with open(progress_path, 'r', encoding='utf-8') as f:
+        final = json.load(f)
+    if not final.get('finished_at') or any(e['status'] != 'done' for e in final['clients'].values()):
+        problems.append('進捗ファイルが完了になっていない')
+    return problems, state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=40)
+    parser.add_argument('--heavy', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--slice-items', type=int, default=10)
+    parser.add_argument('--item-seconds', type=float, default=0.01)
+    parser.add_argument('--window', type=float, default=1.0, help='AIの呼び出しを数える時間幅（秒、本番は60）')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--seed', type=int, default=20260215)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    clients, backlogs = make_clients(args.clients, args.heavy, rng)
+    total = sum(b[OPERATION] for b in backlogs.values())
+    api = fake_script_api.FakeScriptApi(item_seconds=args.item_seconds)
+    server = fake_script_api.serve(api, port=args.port)
+    base = f'http://127.0.0.1:{args.port}'
+    heavy_code = clients[2]['code']
+    # 上限は「ワーカーが全力で回した場合」の6割（上限で待つ場面が出るように）
+    limit = max(args.slice_items, int(args.workers / args.item_seconds * args.window * 0.6))
+
+    api.backlogs = json.loads(json.dumps(backlogs))
+    serial = run_serial(api, base, clients)
+
+    api.backlogs = json.loads(json.dumps(backlogs))
+    api.llm_calls.clear()
+    api.stats['max_parallel_per_client'] = 0
+    scheduled, remaining, stats = run_scheduler(api, base, clients, args, limit)
+    peak = max_in_window(api.llm_calls, args.window)
+    parallel = api.stats['max_parallel_per_client']
+    left = sum(b[OPERATION] for b in api.backlogs.values())
+
+    with tempfile.TemporaryDirectory(prefix='bench_batch_scheduler_') as workdir:
+        crash_problems, crash_state = run_crash_resume(api, base, clients, backlogs, args, workdir)
+    server.shutdown()
+
+    failed = False
+    print(f'顧客 {args.clients}（うち1件は {args.heavy} 件、合計 {total} 件）/ 1件 {args.item_seconds * 1000:.0f}ms')
+    print(f'{"":24}{"GAS版（順番）":>14}{"スケジューラ":>14}')
+    rows = []
+    for name, values in (('完了までの時間 p50', lambda d: percentile(d.values(), 50)),
+                         ('完了までの時間 p95', lambda d: percentile(d.values(), 95)),
+                         ('多い顧客以外の最大', lambda d: max(v for k, v in d.items() if k != heavy_code)),
+                         ('全体', lambda d: max(d.values()))):
+        a, b = values(serial), values(scheduled)
+        rows.append((name, a, b))
+        print(f'{name:24}{a:>13.2f}s{b:>13.2f}s')
+    print(f'スケジューラ: 小分けの実行 {stats["slices"]} 回、未完了 {remaining}、未処理の残り {left} 件')
+    print(f'同じ顧客の同時実行: 最大 {parallel}')
+    print(f'AIの呼び出し: {args.window:.1f}秒あたり最大 {peak} 回（上限 {limit} 回）')
+    print(f'中断: 完了 {crash_state["done"]} 件・途中 {crash_state["running"]} 件の時点で強制終了'
+          f'（多い顧客は {crash_state["heavy"]} 件まで記録）→ --resume で '
+          f'{"完了" if not crash_problems else "失敗"}')
+
+    if remaining or left:
+        print('  スケジューラで処理が残った')
+        failed = True
+    if parallel > 1:
+        print('  同じ顧客を同時に実行した')
+        failed = True
+    if peak > limit:
+        print('  AIの呼び出しが上限を超えた')
+        failed = True
+    if rows[1][2] > rows[1][1]:
+        print('  完了までの時間の p95 が GAS版より悪い')
+        failed = True
+    for problem in crash_problems:
+        print(f'  {problem}')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+書類分類レスポンスのパース比較ベンチマーク
+
+記録済みの Gemini レスポンス（corpus/classification_responses.json）を使い、
+従来の自由形式JSON（正規表現で抽出）と構造化出力（responseSchema）を比較する。
+
+- パース失敗数 / カテゴリ不一致数
+- 出力トークン数（usageMetadata.candidatesTokenCount）
+- 記録時のレイテンシ（p50 / p95）
+- パース処理時間
+
+使い方:
+    python benchmarks/bench_classification_parse.py
+"""
+import json
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'line-receipt-webhook'))
+
+from gemini_schema import Classification, output_tokens, parse_structured_response, response_text  # noqa: E402
+
+CORPUS_PATH = os.path.join(HERE, 'corpus', 'classification_responses.json')
+PARSE_REPEAT = 2000
+
+
+def parse_freeform(api_result):
+    """変更前の classify_document_with_gemini と同じパース処理"""
+    text = response_text(api_result)
+    json_match = re.search(r'\{[\s\S]*\}', text)
+    if not json_match:
+        return None
+    try:
+        return json.loads(json_match.group())
+    except ValueError:
+        return None
+
+
+def parse_structured(api_result):
+    parsed, error = parse_structured_response(api_result, Classification)
+    return None if error else parsed.to_dict()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run_mode(records, parse_fn):
+    failures = 0
+    mismatches = 0
+    for r in records:
+        result = parse_fn(r['response'])
+        if result is None:
+            failures += 1
+        elif result.get('category') != r['expected_category']:
+            mismatches += 1
+
+    start = time.perf_counter()
+    for _ in range(PARSE_REPEAT):
+        for r in records:
+            parse_fn(r['response'])
+    parse_us = (time.perf_counter() - start) / (PARSE_REPEAT * len(records)) * 1e6
+
+    tokens = [output_tokens(r['response']) or 0 for r in records]
+    latencies = [r['latency_ms'] for r in records]
+    return {
+        'documents': len(records),
+        'parse_failures': failures,
+        'category_mismatches': mismatches,
+        'output_tokens_total': sum(tokens),
+        'output_tokens_avg': round(sum(tokens) / len(tokens), 1),
+        'latency_ms_p50': percentile(latencies, 50),
+        'latency_ms_p95': percentile(latencies, 95),
+        'parse_us_per_doc': round(parse_us, 2),
+    }
+
+
+def main():
+    with open(CORPUS_PATH, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    results = {
+        'freeform': run_mode([r for r in corpus if r['mode'] == 'freeform'], parse_freeform),
+        'structured': run_mode([r for r in corpus if r['mode'] == 'structured'], parse_structured),
+    }
+
+    keys = list(results['freeform'].keys())
+    print(f'{"":24}{"freeform":>12}{"structured":>12}')
+    for key in keys:
+        print(f'{key:24}{results["freeform"][key]:>12}{results["structured"][key]:>12}')
+
+    if '--json' in sys.argv:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
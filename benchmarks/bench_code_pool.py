@@ -0,0 +1,299 @@
+"""
+未使用コードの補充（functions/stripe-webhook/code_pool.py）の API 呼び出し回数と下限の維持
+
+Drive / Sheets API の代わりに偽のサービスを使う。偽のDriveの batch は中の作成を順不同で実行し、
+親フォルダがまだない作成は失敗させる（親子を同じ batch に入れると失敗する本番の挙動に合わせる）。
+
+- 初期状態: 契約済みの行と未使用の行が少しあり、親フォルダには行のないコードフォルダ（作りかけ）もある
+- --signups 件の契約を1件ずつ割り当て、そのたびに補充して未使用の行数を確認する
+- 補充1回あたりの Drive / Sheets の呼び出し回数と、1フォルダずつ作った場合の回数を出す
+- 未使用の行が下限を下回る、コードが重複する、フォルダ構成（コード/領収書・通帳・クレカ明細）と
+  行のフォルダIDが合わない、のいずれかがあれば終了コード1で失敗する
+- --error-rate でフォルダ作成を失敗させ、失敗したコードが行に入らず、そのフォルダがゴミ箱に移ることも確認できる
+- 行のないコードフォルダ（ゴミ箱に移っていないもの）が増えていれば失敗する
+
+使い方:
+    python benchmarks/bench_code_pool.py [--signups 60] [--low 5] [--target 15] [--error-rate 0.02]
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'stripe-webhook'))
+os.environ.setdefault('CUSTOMER_STORE_DIR', tempfile.mkdtemp(prefix='bench_code_pool_'))
+os.environ.setdefault('CUSTOMER_SYNC_INTERVAL', '3600')
+os.environ.setdefault('CUSTOMER_CHECK_INTERVAL', '0')
+
+import code_pool  # noqa: E402
+import customer_store  # noqa: E402
+
+PARENT_ID = 'parent'
+
+
+class _Request:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self, num_retries=0):
+        return self._fn()
+
+
+class FakeDrive:
+    """files().list / generateIds / create / update と new_batch_http_request を持つ偽のDriveサービス"""
+
+    def __init__(self, rng, error_rate=0.0):
+        self.rng = rng
+        self.error_rate = error_rate
+        self.folders = {PARENT_ID: {'name': 'root', 'parent': None}}
+        self.ids = (f'id{n:06d}' for n in itertools.count(1))
+        self.calls = {'list': 0, 'generateIds': 0, 'batch': 0, 'create': 0, 'update': 0}
+        self.version = 1
+
+    def files(self):
+        return self
+
+    def get(self, fileId, **kwargs):
+        # 顧客管理シートの版（CustomerStore.sheet_version）
+        return _Request(lambda: {'version': str(self.version), 'modifiedTime': ''})
+
+    def list(self, q, **kwargs):
+        def run():
+            self.calls['list'] += 1
+            prefix = q.split("name contains '")[1].split("'")[0]
+            return {'files': [{'name': f['name']} for f in self.folders.values()
+                              if f['parent'] == PARENT_ID and prefix in f['name'] and not f.get('trashed')]}
+        return _Request(run)
+
+    def generateIds(self, count, **kwargs):
+        def run():
+            self.calls['generateIds'] += 1
+            return {'ids': [next(self.ids) for _ in range(count)]}
+        return _Request(run)
+
+    def create(self, body, **kwargs):
+        def run():
+            self.calls['create'] += 1
+            parent = body['parents'][0]
+            if parent not in self.folders:
+                raise RuntimeError(f'File not found: {parent}')
+            if self.rng.random() < self.error_rate:
+                raise RuntimeError('Internal error')
+            folder_id = body.get('id') or next(self.ids)
+            self.folders[folder_id] = {'name': body['name'], 'parent': parent}
+            return {'id': folder_id}
+        return _Request(run)
+
+    def update(self, fileId, body, **kwargs):
+        def run():
+            self.calls['update'] += 1
+            if fileId not in self.folders:
+                raise RuntimeError(f'File not found: {fileId}')
+            self.folders[fileId]['trashed'] = body.get('trashed', False)
+            return {'id': fileId}
+        return _Request(run)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+class FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request))
+
+    def execute(self):
+        self.drive.calls['batch'] += 1
+        # batch 内の実行順は決まっていない
+        self.drive.rng.shuffle(self.requests)
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeSheets:
+    """顧客管理シートの values().get / append / batchUpdate を持つ偽のSheetsサービス"""
+
+    def __init__(self, rows, drive):
+        self.rows = rows
+        self.drive = drive
+        self.calls = {'get': 0, 'append': 0, 'batchUpdate': 0}
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range, **kwargs):
+        def run():
+            self.calls['get'] += 1
+            return {'values': [list(r) for r in self.rows]}
+        return _Request(run)
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        def run():
+            self.calls['append'] += 1
+            self.rows.extend(list(r) for r in body['values'])
+            self.drive.version += 1
+            return {}
+        return _Request(run)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            self.calls['batchUpdate'] += 1
+            for item in body['data']:
+                cell = item['range'].split('!')[1]
+                col = ord(cell[0]) - ord('A')
+                row = self.rows[int(cell[1:]) - 1]
+                row.extend([''] * (col + 1 - len(row)))
+                row[col] = item['values'][0][0]
+            self.drive.version += 1
+            return {}
+        return _Request(run)
+
+
+def make_row(code, status, folder_id):
+    row = [''] * 21
+    row[2], row[6], row[7] = folder_id, code, status
+    return row
+
+
+def check_trees(drive, sheet_rows, new_codes):
+    """補充したコードの行とフォルダ構成が合っているか（問題のリストを返す）"""
+    problems = []
+    rows = {r[6]: r for r in sheet_rows[1:] if len(r) > 6}
+    for code in new_codes:
+        row = rows.get(code)
+        if row is None:
+            problems.append(f'{code}: 行がない')
+            continue
+        receipt = drive.folders.get(row[2])
+        main = drive.folders.get(receipt['parent']) if receipt else None
+        if not receipt or receipt['name'] != '領収書' or not main or main['name'] != code \
+                or main['parent'] != PARENT_ID:
+            problems.append(f'{code}: C列が {code}/領収書 ではない')
+            continue
+        subs = {f['name']: fid for fid, f in drive.folders.items() if f['parent'] == receipt['parent']}
+        if set(subs) != {'領収書', '通帳', 'クレカ明細'} or row[18] != subs['通帳'] or row[19] != subs['クレカ明細']:
+            problems.append(f'{code}: サブフォルダまたは S/T 列が合わない')
+    return problems
+
+
+def orphan_folders(drive, sheet_rows):
+    """行のないコードフォルダ（ゴミ箱に移っていないもの）"""
+    codes = {r[6] for r in sheet_rows[1:] if len(r) > 6}
+    return sorted(f['name'] for f in drive.folders.values()
+                  if f['parent'] == PARENT_ID and not f.get('trashed') and f['name'] not in codes)
+
+
+class LocalClaims:
+    """shared_cache.py の CLAIMS の代わり（set(only_if_absent) だけ）"""
+
+    def __init__(self):
+        self.keys = set()
+
+    def set(self, key, value, only_if_absent=False, ttl=None):
+        if only_if_absent and key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--signups', type=int, default=60)
+    parser.add_argument('--low', type=int, default=5)
+    parser.add_argument('--target', type=int, default=15)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=20260215)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    drive = FakeDrive(rng, args.error_rate)
+
+    # 初期状態: MK001〜MK003 は契約済、MK004・MK005 は未使用、MK006 はフォルダだけある（行なし）
+    sheet_rows = [['LINE ID', '名前', 'フォルダID', '', '', '', 'コード', 'ステータス']]
+    for n in range(1, 7):
+        code = f'MK{n:03d}'
+        drive.folders[f'main{n}'] = {'name': code, 'parent': PARENT_ID}
+        drive.folders[f'receipt{n}'] = {'name': '領収書', 'parent': f'main{n}'}
+        if n <= 5:
+            sheet_rows.append(make_row(code, '契約済' if n <= 3 else '未使用', f'receipt{n}'))
+    sheets = FakeSheets(sheet_rows, drive)
+
+    store = customer_store.CustomerStore(
+        'BENCH', 'sheet', {'line_id': 0, 'name': 1, 'folder_id': 2, 'code': 6, 'status': 7},
+        width=21, service_factory=lambda: sheets, drive_service_factory=lambda: drive)
+    claims = LocalClaims()
+    # 別のインスタンスが予約中の番号（MK009）は飛ばす
+    claims.set('code:MK009', True)
+    pool = code_pool.CodePool(store, PARENT_ID, 'MK', args.low, args.target,
+                              drive_service_factory=lambda: drive, claims=claims)
+
+    failed = False
+    added_all = []
+    replenish_runs = 0
+    min_unused = None
+    started = time.perf_counter()
+    for i in range(args.signups + 1):
+        if i:
+            # 契約: 一番古い未使用の行を割り当てる（assign_unused_code と同じ選び方）
+            record = store.find_by_status('未使用')[0]
+            store.update(record['row_key'], {0: f'U{i}', 7: '案内済'})
+        added = pool.replenish()
+        store.push()
+        if added:
+            replenish_runs += 1
+            added_all.extend(added)
+        unused = pool.unused_count()
+        min_unused = unused if min_unused is None else min(min_unused, unused)
+        if unused < args.low and not args.error_rate:
+            print(f'  未使用の行が下限を下回った: {i} 件目の契約後 {unused} 件')
+            failed = True
+    seconds = time.perf_counter() - started
+
+    codes = [r[6] for r in sheet_rows[1:]]
+    duplicates = sorted({c for c in codes if codes.count(c) > 1})
+    problems = check_trees(drive, sheet_rows, added_all)
+    orphans = orphan_folders(drive, sheet_rows)
+    trashed = sum(1 for f in drive.folders.values() if f['parent'] == PARENT_ID and f.get('trashed'))
+    print(f'契約 {args.signups} 件 / 補充 {replenish_runs} 回 / 追加 {len(added_all)} コード '
+          f'（{added_all[0] if added_all else "-"}〜{added_all[-1] if added_all else "-"}）{seconds:.2f}s')
+    print(f'未使用の行: 最小 {min_unused} 件（下限 {args.low} / 目標 {args.target}）')
+    print(f'Drive: batch {drive.calls["batch"]} 回・generateIds {drive.calls["generateIds"]} 回・'
+          f'list {drive.calls["list"]} 回（補充1回あたり batch {drive.calls["batch"] / max(replenish_runs, 1):.1f} 回）、'
+          f'1フォルダずつ作ると {drive.calls["create"]} 回')
+    print(f'Sheets: append {sheets.calls["append"]} 回（補充1回あたり {sheets.calls["append"] / max(replenish_runs, 1):.1f} 回）、'
+          f'行 {len(sheet_rows) - 1}')
+    print(f'ゴミ箱に移したコードフォルダ: {trashed} 件、行のないコードフォルダ: {orphans}')
+    if added_all and int(added_all[0][2:]) <= 6:
+        print(f'  フォルダだけある番号を使った: 最初のコード {added_all[0]}')
+        failed = True
+    if 'MK009' in added_all:
+        print('  予約済みの番号を使った: MK009')
+        failed = True
+    if orphans != ['MK006']:
+        print(f'  行のないコードフォルダが残った: {orphans[:5]}')
+        failed = True
+    if duplicates:
+        print(f'  コードの重複: {duplicates[:5]}')
+        failed = True
+    if problems:
+        print(f'  フォルダ構成の不一致: {problems[:5]}')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
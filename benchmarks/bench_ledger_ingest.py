@@ -0,0 +1,161 @@
+"""
+全顧客のレシート台帳（tools/ledger_store.py）の取り込み速度と集計の応答時間
+
+Sheets / Drive API の代わりに、本番シートと同じ列構成の行を返す偽のサービスを使う。
+
+- 全件取り込み: --clients 顧客 × --rows 行を読み込み、行/秒を出す
+- 差分取り込み: --changed 顧客だけ modifiedTime を進めて再同期し、読み直した顧客数と時間を出す
+- 集計: 顧客別・月別・検証対象件数の応答時間（ミリ秒）
+- 台帳の件数が偽データの件数と合わない、または顧客×月の集計表が行の集計と合わなければ終了コード1で失敗する
+
+使い方:
+    python benchmarks/bench_ledger_ingest.py [--clients 300] [--rows 2000] [--changed 10]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+
+import ledger_store  # noqa: E402
+
+HEADER = ['Status', '画像確認', '処理日時', '日付', '利用店舗名', '登録番号', '総合計', '対象額(10%)',
+          '消費税(10%)', '対象額(8%)', '消費税(8%)', '不課税', '勘定科目', '貸方科目', 'ファイル名',
+          'Debug', '検証ステータス', '検証スコア', '検証結果', '修正案JSON', '通貨']
+STATUSES = ['🟢OK', '🟢OK', '🟢OK', '🟡CHECK', '🔴ERROR', '🖊️HAND', '🟠COMPOUND']
+LABELS = ['', '', '✅ 自動確定', '⚠️ 要確認', '✅ 承認済み', '📝 要入力', '❌ エラー']
+
+
+def make_rows(rng, count):
+    rows = []
+    for i in range(count):
+        s10 = rng.randint(100, 50000)
+        rows.append([
+            rng.choice(STATUSES), '', '2026/02/15 10:00:00',
+            f'2026/{rng.randint(1, 12)}/{rng.randint(1, 28)}', f'店舗{rng.randint(1, 500)}',
+            'T1234567890123', s10 + s10 // 10, s10, s10 // 10, 0, 0, rng.choice([0, 0, 0, 150]),
+            rng.choice(['消耗品費', '旅費交通費', '会議費']), '現金', f'receipt_{i}.jpg', '',
+            rng.choice(LABELS), '', '', '', rng.choice(['JPY'] * 19 + ['USD']),
+        ])
+    return rows
+
+
+class _Request:
+    def __init__(self, result):
+        self._result = result
+
+    def execute(self, num_retries=0):
+        return self._result
+
+
+class FakeSheets:
+    """spreadsheets().values().get(...).execute() だけを持つ偽のSheetsサービス"""
+
+    def __init__(self, books):
+        self.books = books
+        self.reads = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range, **kwargs):
+        self.reads += 1
+        return _Request({'values': [HEADER] + self.books[spreadsheetId]})
+
+
+class FakeDrive:
+    """files().list(q=...) で modifiedTime が条件より新しいファイルを返す偽のDriveサービス"""
+
+    def __init__(self, modified):
+        self.modified = modified
+
+    def files(self):
+        return self
+
+    def list(self, q, **kwargs):
+        since = q.split("modifiedTime > '")[1].split("'")[0]
+        return _Request({'files': [{'id': sid, 'modifiedTime': mt}
+                                   for sid, mt in self.modified.items() if mt > since]})
+
+
+def timed_ms(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--changed', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=20260215)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    clients = [{'partner': f'P{i % 5}', 'code': f'C{i:04d}', 'status': '契約中', 'spreadsheetId': f'sheet{i:04d}'}
+               for i in range(args.clients)]
+    books = {c['spreadsheetId']: make_rows(rng, args.rows) for c in clients}
+    modified = {sid: '2026-01-01T00:00:00Z' for sid in books}
+    sheets, drive = FakeSheets(books), FakeDrive(modified)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ledger_store.LedgerStore(os.path.join(tmp, 'ledger.db'))
+
+        result = ledger_store.sync(store, clients, sheets, drive, workers=args.workers)
+        total = args.clients * args.rows
+        print(f'全件取り込み: {result["changed"]} 顧客 / {result["rows"]} 行 {result["seconds"]:.2f}s '
+              f'({result["rows"] / max(result["seconds"], 1e-9):,.0f} 行/s)')
+        if result['rows'] != total or store.count() != total:
+            print(f'  件数不一致: 期待 {total} / 取り込み {result["rows"]} / 台帳 {store.count()}')
+            failed = True
+
+        # 一部の顧客だけ更新して差分同期
+        for c in clients[:args.changed]:
+            books[c['spreadsheetId']].append(make_rows(rng, 1)[0])
+            modified[c['spreadsheetId']] = '2099-01-01T00:00:00Z'
+        sheets.reads = 0
+        result = ledger_store.sync(store, clients, sheets, drive, workers=args.workers)
+        print(f'差分取り込み: {result["changed"]} / {result["clients"]} 顧客を読み直し {result["seconds"]:.2f}s '
+              f'（Sheets読み込み {sheets.reads} 回）')
+        if result['changed'] != args.changed or store.count() != total + args.changed:
+            print(f'  差分不一致: 期待 {args.changed} 顧客 / {total + args.changed} 行、台帳 {store.count()} 行')
+            failed = True
+
+        # 集計表（monthly）と行の直接集計が一致すること
+        by_client = {r['code']: r for r in store.summary_by_client()}
+        direct = {r['client_code']: r for r in store.query(
+            "SELECT client_code, COUNT(*) AS receipts, SUM(verify_target) AS verify_targets, "
+            "SUM(verification_state = 'pending') AS pending FROM receipts GROUP BY client_code")}
+        drift = [code for code, r in direct.items()
+                 if any(by_client[code][k] != r[k] for k in ('receipts', 'verify_targets', 'pending'))]
+        if drift:
+            print(f'  集計表の不一致: {drift[:5]}')
+            failed = True
+
+        queries = [
+            ('顧客別集計', lambda: store.summary_by_client()),
+            ('パートナー別集計', lambda: store.summary_by_client('P1')),
+            ('月別集計（全顧客）', lambda: store.summary_by_month()),
+            ('月別集計（1顧客）', lambda: store.summary_by_month('C0001')),
+            ('検証対象件数', lambda: store.count(verify_target=True)),
+            ('要確認件数', lambda: store.count(verification_state='pending')),
+            ('1顧客・1か月の件数', lambda: store.count(client_code='C0001', month='2026-02')),
+        ]
+        for name, fn in queries:
+            best = min(timed_ms(fn)[1] for _ in range(5))
+            print(f'{name:14} {best:8.2f}ms')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
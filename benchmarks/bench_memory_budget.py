@@ -0,0 +1,202 @@
+"""
+画像・PDF処理のメモリ予算ベンチマーク
+
+大きな画像と複数ページのPDFを handle_image_message / handle_file_message に流し、
+memory_profile（tracemalloc）で計測したピークが予算を超えたら終了コード1で失敗する。
+LINE・Gemini・GAS への通信は模擬レスポンスに差し替える（送信データのJSON化は実際と同じく行う）。
+
+予算は benchmarks/memory_budgets.json に 種類ごとの「入力サイズ × ratio + overhead_mb」で指定する。
+
+使い方（functions/line-receipt-webhook/requirements.txt を導入した環境で）:
+    python benchmarks/bench_memory_budget.py [--json]
+"""
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUDGET_PATH = os.path.join(HERE, 'memory_budgets.json')
+WORK_DIR = tempfile.mkdtemp(prefix='bench_memory_')
+
+# main の import 前に計測を有効にし、ローカルの保存先を作業ディレクトリに向ける
+os.environ['MEMORY_PROFILE'] = '1'
+for name in ('CUSTOMER_STORE_DIR', 'PAGE_CACHE_DIR', 'DEFERRED_QUEUE_DIR', 'RECEIPT_INDEX_DIR'):
+    os.environ[name] = os.path.join(WORK_DIR, name.lower())
+os.environ['USAGE_DB_PATH'] = os.path.join(WORK_DIR, 'usage.db')
+os.environ['NOTIFY_DB_PATH'] = os.path.join(WORK_DIR, 'notify.db')
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'line-receipt-webhook'))
+
+import main  # noqa: E402
+import memory_profile  # noqa: E402
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MB = 1024 * 1024
+
+# (種類, ケース名, 目安サイズMB, ページ数)
+CASES = [
+    ('image', 'photo_2mb', 2, 1),
+    ('image', 'photo_6mb', 6, 1),
+    ('image', 'photo_12mb', 12, 1),
+    ('pdf', 'pdf_1page', 3, 1),
+    ('pdf', 'pdf_8pages', 8, 8),
+    ('pdf', 'pdf_20pages', 16, 20),
+]
+
+
+# ============================================================
+# 入力データ
+# ============================================================
+
+def noise_image(size_bytes, seed):
+    """ほぼ size_bytes のJPEG（ノイズ画像は圧縮が効かないので画素数でサイズを調整する）"""
+    rng = random.Random(seed)
+    side = max(64, int((size_bytes / 1.2) ** 0.5))
+    img = Image.frombytes('L', (side, side), bytes(rng.getrandbits(8) for _ in range(side * side)))
+    return img.convert('RGB')
+
+
+def make_input(kind, size_mb, pages, seed):
+    if Image is None:
+        # Pillow がない場合は同じサイズのバイト列（画像の復号を伴う処理は計測できない）
+        return random.Random(seed).randbytes(size_mb * MB)
+    if kind == 'image':
+        buf = io.BytesIO()
+        noise_image(size_mb * MB, seed).save(buf, 'JPEG', quality=95)
+        return buf.getvalue()
+    images = [noise_image(size_mb * MB // pages, seed + i) for i in range(pages)]
+    buf = io.BytesIO()
+    images[0].save(buf, 'PDF', save_all=True, append_images=images[1:], quality=95)
+    return buf.getvalue()
+
+
+# ============================================================
+# 通信の模擬
+# ============================================================
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, content=b''):
+        self.status_code = status_code
+        self._body = body or {}
+        self.content = content
+        self.text = json.dumps(self._body)
+
+    def json(self):
+        return self._body
+
+
+def fake_requests(content_holder):
+    classification = {
+        'receipt': {'category': 'receipt', 'confidence': 0.95,
+                    'receipt': {'date': '2026年2月15日', 'store_name': 'ベンチ商店', 'amount': 1280}},
+        'passbook': {'category': 'passbook', 'confidence': 0.95,
+                     'passbook': {'bank_name': 'ベンチ銀行', 'date_range': '2026/01/05〜01/27',
+                                  'page_number': 1, 'first_balance': 100000, 'latest_balance': 90000}},
+    }
+
+    def serialize(kwargs):
+        """送信データを実際の送信と同じ形で消費する（この分もピークに含める）"""
+        if 'json' in kwargs:
+            # requests と同じく送信前にJSON文字列 → バイト列にする
+            return json.dumps(kwargs['json'], allow_nan=False).encode('utf-8')
+        data = kwargs.get('data')
+        if hasattr(data, 'read'):
+            # ファイル形式のボディは http.client と同じく少しずつ読み出して送る
+            while data.read(8192):
+                pass
+            return b''
+        return data or b''
+
+    def get(url, **kwargs):
+        return FakeResponse(content=content_holder['content'])
+
+    def post(url, **kwargs):
+        body = serialize(kwargs)
+        if 'generativelanguage' in url:
+            category = content_holder['category']
+            text = json.dumps(classification[category], ensure_ascii=False)
+            del body
+            return FakeResponse(body={'candidates': [{'content': {'parts': [{'text': text}]}}],
+                                      'usageMetadata': {'candidatesTokenCount': 40}})
+        if url == main.GAS_UPLOAD_URL:
+            del body
+            return FakeResponse(body={'success': True, 'fileId': 'bench-file'})
+        return FakeResponse()
+
+    return types.SimpleNamespace(get=get, post=post, RequestException=Exception)
+
+
+def patch_main(content_holder):
+    main.requests = fake_requests(content_holder)
+    main.GEMINI_API_KEY = 'bench'
+    main.GAS_UPLOAD_URL = 'https://gas.example/upload'
+    main.get_customer_info = lambda user_id, channel_key='MK': {
+        'exists': True, 'status': '契約済', 'folder_id': 'bench-folder',
+        'customer_name': 'ベンチ', 'customer_code': 'MK999', 'plan': '記帳10000'}
+    main.get_or_create_subfolder = lambda parent, name: 'bench-subfolder'
+
+
+# ============================================================
+# 計測
+# ============================================================
+
+def run_case(kind, content, content_holder, seed):
+    records = []
+    memory_profile.emit = records.append
+    content_holder['content'] = content
+    content_holder['category'] = 'receipt' if kind == 'image' else 'passbook'
+    event = {'replyToken': f'bench-{seed}', 'source': {'userId': 'Ubench'},
+             'message': {'id': f'bench{seed}', 'type': kind if kind == 'image' else 'file'}}
+    if kind == 'image':
+        main.handle_image_message(event, 'MK')
+    else:
+        event['message']['fileName'] = f'bench{seed}.pdf'
+        main.handle_file_message(event, 'MK')
+    return records[-1]
+
+
+def main_():
+    with open(BUDGET_PATH, 'r', encoding='utf-8') as f:
+        budgets = json.load(f)
+
+    content_holder = {}
+    patch_main(content_holder)
+
+    results = []
+    failed = False
+    for seed, (kind, name, size_mb, pages) in enumerate(CASES, start=1):
+        content = make_input(kind, size_mb, pages, seed)
+        record = run_case(kind, content, content_holder, seed)
+        budget = budgets[kind]
+        limit = len(content) * budget['ratio'] + budget['overhead_mb'] * MB
+        ok = record['peak_bytes'] <= limit
+        failed = failed or not ok
+        results.append({
+            'case': name,
+            'input_mb': round(len(content) / MB, 2),
+            'peak_mb': round(record['peak_bytes'] / MB, 2),
+            'peak_ratio': round(record['peak_bytes'] / len(content), 2),
+            'budget_mb': round(limit / MB, 2),
+            'ok': ok,
+            'stages': {s['stage']: round(s['peak_bytes'] / MB, 2) for s in record['stages']},
+        })
+
+    print(f'{"case":14}{"input":>9}{"peak":>9}{"ratio":>7}{"budget":>9}  stages(peak MB)')
+    for r in results:
+        stages = ' '.join(f'{k}={v}' for k, v in r['stages'].items())
+        print(f'{r["case"]:14}{r["input_mb"]:>7}MB{r["peak_mb"]:>7}MB{r["peak_ratio"]:>7}'
+              f'{r["budget_mb"]:>7}MB  {stages}{"" if r["ok"] else "  ← 予算超過"}')
+    if '--json' in sys.argv:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_())
@@ -0,0 +1,258 @@
+"""
+日付・金額・顧客コードの正規化（functions/line-receipt-webhook/normalize.py）のGAS版との一致確認と速度
+
+benchmarks/corpus/normalize_cases.json は、OCR結果・通帳の読み取り結果に現れる表記
+（和暦、R6.1.2、全角数字、2桁年、時刻付き、不正な年、¥・円・カンマ付きの金額、小数、文字混じりなど）を
+組み合わせた入力と、それを GAS の normalizeDate_ / normalizePassbookDate_ / parsePassbookAmount_ /
+parseAmount / parseDate に Node で通した結果。顧客コードは以前の main.py の実装（1文字ずつ変換）の結果。
+
+- 1件ずつ・normalize_many の結果がコーパスと1件でも違えば終了コード1で失敗する
+- OCR結果のように同じ値が繰り返す列（--rows 件）で、キャッシュなし・LRUあり・normalize_many の件数/秒を出す
+
+使い方:
+    python benchmarks/bench_normalize.py [--rows 200000]
+    python benchmarks/bench_normalize.py --regenerate [--cases 3000]   # GAS版の変更後にコーパスを作り直す（Node が必要）
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GAS_DIR = os.path.join(HERE, '..', 'gas')
+CORPUS_PATH = os.path.join(HERE, 'corpus', 'normalize_cases.json')
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'line-receipt-webhook'))
+
+import normalize  # noqa: E402
+
+# GAS版を読み込んで標準入力の [{kind, input}] を変換する（年なしの通帳日付に付けた年も返す）
+NODE_RUNNER = r'''
+const fs = require('fs');
+const vm = require('vm');
+const dir = process.argv[1];
+const src = ['Config.gs', 'Utils.gs', 'Service_OCR.gs', 'PassbookEngine.gs']
+  .map(name => fs.readFileSync(dir + '/' + name, 'utf8')).join('\n');
+console.warn = () => {};
+vm.runInThisContext(src + `
+globalThis.__fns = {
+  date: normalizeDate_,
+  passbook_date: normalizePassbookDate_,
+  passbook_amount: parsePassbookAmount_,
+  amount: parseAmount,
+  parse_date: v => { const d = parseDate(v); return d ? formatDateISO(d) : null; },
+};`);
+const cases = JSON.parse(fs.readFileSync(0, 'utf8'));
+const out = cases.map(c => {
+  const v = __fns[c.kind](c.input);
+  return (typeof v === 'number' && !isFinite(v)) ? String(v) : v;
+});
+process.stdout.write(JSON.stringify({year: new Date().getFullYear(), expected: out}));
+'''
+
+FULLWIDTH = str.maketrans('0123456789.', '０１２３４５６７８９．')
+
+
+def legacy_normalize_customer_code(text):
+    """以前の main.py の normalize_customer_code（1文字ずつ連結）"""
+    if not text:
+        return None
+    text = text.strip()
+    normalized = ''
+    for char in text:
+        code = ord(char)
+        if 0xFF21 <= code <= 0xFF3A:
+            normalized += chr(code - 0xFF21 + ord('A'))
+        elif 0xFF41 <= code <= 0xFF5A:
+            normalized += chr(code - 0xFF41 + ord('a'))
+        elif 0xFF10 <= code <= 0xFF19:
+            normalized += chr(code - 0xFF10 + ord('0'))
+        else:
+            normalized += char
+    return normalized.upper()
+
+
+# ============================================================
+# コーパス生成
+# ============================================================
+
+def _maybe_fullwidth(rng, text, p=0.2):
+    return text.translate(FULLWIDTH) if rng.random() < p else text
+
+
+def make_date(rng):
+    y, m, d = rng.randint(2019, 2030), rng.randint(1, 12), rng.randint(1, 28)
+    r = y - 2018
+    text = rng.choice([
+        f'{y}-{m:02d}-{d:02d}', f'{y}/{m}/{d}', f'{y % 100:02d}/{m:02d}/{d:02d}', f'{y % 100}-{m}-{d}',
+        f'令和{r}年{m}月{d}日', f'令和 {r}年{m}月{d}日', f'R{r}.{m}.{d}', f'R.{r}/{m}/{d}', f'Ｒ{r}-{m}-{d}',
+        f'{r}年{m}月{d}日', f'{y % 100}年{m}月{d}日', f'{y}年{m}月{d}日', f'{y}年{m}月{d}日(火)',
+        f'令和{r}年{m}月{d}日 10:32', f'R{r}．{m}．{d}', f'令和{r}年{m}月 {d}日', f'令和元年{m}月{d}日',
+        f'{y}-{m:02d}-{d:02d}T10:00:00', f' {y}/{m:02d}/{d:02d} ', f'﻿{y}-{m}-{d}', f'{y}.{m}.{d}',
+        f'1999-{m:02d}-{d:02d}', f'2150/{m}/{d}', f'{m}/{d}', f'{y}/{m}', '不明', 'N/A', '', '  ',
+        f'R{r}{m:02d}{d:02d}', f'令和{r}年', f'H{r + 30}.{m}.{d}',
+    ])
+    return _maybe_fullwidth(rng, text)
+
+
+def make_passbook_date(rng):
+    y, m, d = rng.randint(2019, 2030), rng.randint(1, 12), rng.randint(1, 28)
+    text = rng.choice([
+        f'{y}-{m:02d}-{d:02d}', f'{m}/{d}', f'{m:02d}-{d:02d}', f'{y}/{m}/{d}', f'{y % 100}/{m}/{d}',
+        f' {m}/{d} ', f'{y}-{m}-{d}', f'{y}/{m:02d}/{d:02d} 取引', f'R{y - 2018}.{m}.{d}', '不明', '',
+        f'{y}年{m}月{d}日', f'{m}月{d}日',
+    ])
+    return _maybe_fullwidth(rng, text)
+
+
+def make_amount(rng, passbook=False):
+    v = rng.choice([rng.randint(0, 999), rng.randint(1000, 99999), rng.randint(100000, 9999999)])
+    if rng.random() < 0.3:
+        return rng.choice([v, -v, v + 0.5, float(v), 0, None, True, False])
+    text = rng.choice([
+        f'{v}', f'{v:,}', f'¥{v:,}', f'￥{v:,}', f'{v:,}円', f'{v:,}，', f'-{v:,}', f'+{v}', f' {v} ',
+        f'{v}.5', f'{v}.25円', f'.{v}', f'{v}e2', f'{v}abc', f'{v} 00', f'{v}　円', 'abc', '', '-',
+        'Infinity', f'△{v}', f'({v:,})', f'{v}-', f'1,2,3{v}',
+    ])
+    return _maybe_fullwidth(rng, text, 0.3 if not passbook else 0.05)
+
+
+def make_parse_date(rng):
+    y, m, d = rng.randint(2019, 2030), rng.randint(1, 13), rng.randint(1, 32)
+    return rng.choice([
+        f'{y}-{m:02d}-{d:02d}', f'{y}/{m}/{d}', f'{y}-{m}-{d}T10:00:00', f'令和{y - 2018}年{m}月{d}日',
+        f'{y}/{m}/{d} 12:00', f'領収日 令和{y - 2018}年{m}月{d}日', '不明', 'abc', '', f'{y}/{m}',
+    ])
+
+
+def make_customer_code(rng):
+    prefix = rng.choice(['MK', 'KZ', 'mk', 'kz', 'Mk', 'ＭＫ', 'ｋｚ', 'Ｍk'])
+    num = f'{rng.randint(0, 999):03d}'
+    return rng.choice(['', ' ', '  ', '　']) + prefix + _maybe_fullwidth(rng, num, 0.4) + rng.choice(['', ' ', '\n'])
+
+
+GENERATORS = {
+    'date': make_date,
+    'passbook_date': make_passbook_date,
+    'passbook_amount': lambda rng: make_amount(rng, passbook=True),
+    'amount': make_amount,
+    'parse_date': make_parse_date,
+}
+
+
+def regenerate(cases, seed):
+    rng = random.Random(seed)
+    kinds = list(GENERATORS)
+    inputs = [{'kind': kinds[i % len(kinds)], 'input': GENERATORS[kinds[i % len(kinds)]](rng)} for i in range(cases)]
+    output = json.loads(subprocess.run(
+        ['node', '-e', NODE_RUNNER, os.path.abspath(GAS_DIR)],
+        input=json.dumps(inputs, ensure_ascii=False).encode('utf-8'), capture_output=True, check=True).stdout)
+    codes = [make_customer_code(rng) for _ in range(cases // 5)]
+    rows = [dict(c, expected=e) for c, e in zip(inputs, output['expected'])]
+    rows += [{'kind': 'customer_code', 'input': c, 'expected': legacy_normalize_customer_code(c)} for c in codes]
+    os.makedirs(os.path.dirname(CORPUS_PATH), exist_ok=True)
+    with open(CORPUS_PATH, 'w', encoding='utf-8') as f:
+        f.write('{"year": %d, "cases": [\n' % output['year'])
+        f.write(',\n'.join(json.dumps(r, ensure_ascii=False) for r in rows))
+        f.write('\n]}\n')
+    print(f'{len(rows)} 件のコーパスを {CORPUS_PATH} に保存')
+
+
+# ============================================================
+# 照合・計測
+# ============================================================
+
+def comparable(kind, value):
+    """GAS版の出力と比べられる形に（date は YYYY-MM-DD、無限大は文字列）"""
+    if kind == 'parse_date':
+        return value.isoformat() if value else None
+    if isinstance(value, float) and not math.isfinite(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return value
+
+
+def kwargs_for(kind, year):
+    return {'year': year} if kind == 'passbook_date' else {}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regenerate', action='store_true')
+    parser.add_argument('--cases', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=20260215)
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.regenerate:
+        regenerate(args.cases, args.seed)
+
+    with open(CORPUS_PATH, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    year = corpus['year']
+    by_kind = {}
+    for case in corpus['cases']:
+        by_kind.setdefault(case['kind'], []).append(case)
+
+    failed = False
+    for kind, cases in by_kind.items():
+        fn = normalize.NORMALIZERS[kind]
+        kwargs = kwargs_for(kind, year)
+        scalar = [comparable(kind, fn(c['input'], **kwargs)) for c in cases]
+        batch = [comparable(kind, v) for v in normalize.normalize_many([c['input'] for c in cases], kind, **kwargs)]
+        bad = [(c, got) for c, got, many in zip(cases, scalar, batch) if got != c['expected'] or many != c['expected']]
+        print(f'{kind:16} GAS版との不一致 {len(bad)} / {len(cases)} 件')
+        for c, got in bad[:5]:
+            print(f'  input={c["input"]!r} expected={c["expected"]!r} got={got!r}')
+        failed = failed or bool(bad)
+
+    # 同じ値が繰り返す列（OCR結果は日付・金額の種類が少ない）
+    print(f'\n{args.rows} 件あたりの件数/秒（キャッシュなし / LRU / normalize_many）')
+    rng = random.Random(args.seed)
+    for kind, cases in by_kind.items():
+        distinct = [c['input'] for c in cases]
+        column = [rng.choice(distinct) for _ in range(args.rows)]
+        fn = normalize.NORMALIZERS[kind]
+        kwargs = kwargs_for(kind, year)
+        for cached in (normalize._normalize_date, normalize._normalize_passbook_date, normalize._parse_date,
+                       normalize._parse_amount, normalize._parse_passbook_amount):
+            cached.cache_clear()
+
+        if kind == 'customer_code':
+            started = time.perf_counter()
+            for v in column:
+                legacy_normalize_customer_code(v)
+            cold = time.perf_counter() - started
+        else:
+            uncached = {'date': lambda v: normalize._normalize_date.__wrapped__(normalize._js_string(v))
+                        if not normalize._is_falsy(v) else '',
+                        'passbook_date': lambda v: normalize._normalize_passbook_date.__wrapped__(
+                            normalize._js_string(v), year) if not normalize._is_falsy(v) else '',
+                        'parse_date': lambda v: normalize._parse_date.__wrapped__(normalize._js_string(v))
+                        if not normalize._is_falsy(v) else None,
+                        'amount': lambda v: normalize._parse_amount.__wrapped__(v) if isinstance(v, str) and v else v,
+                        'passbook_amount': lambda v: normalize._parse_passbook_amount.__wrapped__(v)
+                        if isinstance(v, str) and v else v}[kind]
+            started = time.perf_counter()
+            for v in column:
+                uncached(v)
+            cold = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for v in column:
+            fn(v, **kwargs)
+        warm = time.perf_counter() - started
+
+        started = time.perf_counter()
+        normalize.normalize_many(column, kind, **kwargs)
+        many = time.perf_counter() - started
+
+        label = '（以前の実装）' if kind == 'customer_code' else ''
+        print(f'{kind:16} {args.rows / cold:>12,.0f}{label} / {args.rows / warm:>12,.0f} / {args.rows / many:>12,.0f}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
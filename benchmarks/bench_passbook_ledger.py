@@ -0,0 +1,307 @@
+"""
+通帳の取り込み（tools/passbook_ledger.py）で、1年分の通帳ページが重複なし・フォルダごとに1回の書き込みで入るかの確認
+
+Sheets API の代わりに偽のサービスを使う（「通帳」シートの行と append の回数を持つ）。
+
+- 口座ごとに1年分の取引を作り、20行ずつのページ（2ページ目以降は先頭に繰越行）にして月ごとのフォルダに入れる
+  - 同じ日に出金 → 入金 → 同じ額の出金があり、取引日・摘要・金額・残高がすべて同じ行が2件ある（どちらも正しい取引）
+- 送り直し: ページをそのまま翌月のフォルダにも入れる
+- 重なり: 同じフォルダのページの境目をまたいで撮り直したページ（ページ番号なし）を入れる
+- フォルダ内の順番はばらばら、一部のフォルダはページ番号なし（残高の連続性で並べる）
+- 1口座は最初の2か月分がすでにシートに書かれている（索引はシートから作る）
+- シートの行が正しい台帳と完全に一致する（重複・抜け・順番違いがない）、書き込み回数が新しい取引のあった
+  フォルダ数と同じ、同じ入力をもう一度取り込んでも書き込みが0回、のいずれかを満たさなければ終了コード1で失敗する
+- GAS版（appendPassbookTransaction_ を1件ずつ）の appendRow 回数と、重複が入る件数も出す
+
+使い方:
+    python benchmarks/bench_passbook_ledger.py [--accounts 3] [--per-month 30] [--resend-rate 0.15] [--overlap-rate 0.2]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+
+import passbook_ledger  # noqa: E402
+
+PAGE_ROWS = 20
+DESCRIPTIONS = ['ATM', 'カード', '振込 ヤマダ', '口座振替 電気', '口座振替 ガス', '給与', '振込手数料', 'ネットバンク']
+
+
+class _Request:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self, num_retries=0):
+        return self._fn()
+
+
+class FakeSheets:
+    """spreadsheets().get / batchUpdate と values().get / update / append を持つ偽のSheetsサービス"""
+
+    def __init__(self):
+        self.sheets = {}        # spreadsheetId → 「通帳」シートの行（ヘッダー含む）
+        self.calls = {'get': 0, 'values.get': 0, 'append': 0, 'update': 0, 'batchUpdate': 0}
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+
+class _Spreadsheets:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get(self, spreadsheetId, **kwargs):
+        def run():
+            self.fake.calls['get'] += 1
+            titles = [passbook_ledger.PASSBOOK_SHEET_NAME] if spreadsheetId in self.fake.sheets else []
+            return {'sheets': [{'properties': {'title': t}} for t in titles]}
+        return _Request(run)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            self.fake.calls['batchUpdate'] += 1
+            self.fake.sheets.setdefault(spreadsheetId, [])
+            return {}
+        return _Request(run)
+
+    def values(self):
+        return _Values(self.fake)
+
+
+class _Values:
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get(self, spreadsheetId, range, **kwargs):
+        def run():
+            self.fake.calls['values.get'] += 1
+            if spreadsheetId not in self.fake.sheets:
+                raise RuntimeError(f'Unable to parse range: {range}')
+            return {'values': [list(r[:5]) for r in self.fake.sheets[spreadsheetId][1:]]}
+        return _Request(run)
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        def run():
+            self.fake.calls['update'] += 1
+            rows = self.fake.sheets[spreadsheetId]
+            if rows:
+                rows[0] = list(body['values'][0])
+            else:
+                rows.append(list(body['values'][0]))
+            return {}
+        return _Request(run)
+
+    def append(self, spreadsheetId, range, valueInputOption, insertDataOption, body):
+        def run():
+            self.fake.calls['append'] += 1
+            self.fake.sheets[spreadsheetId].extend(list(r) for r in body['values'])
+            return {}
+        return _Request(run)
+
+
+# ============================================================
+# 合成データ
+# ============================================================
+
+def make_transactions(rng, year, per_month):
+    """1年分の取引（取引日・摘要・入金・出金・残高）。同じ内容の行が2件になる日を含む"""
+    balance = rng.randint(100, 500) * 1000
+    rows = []
+    for month in range(1, 13):
+        days = sorted(rng.randint(1, 28) for _ in range(per_month))
+        for n, day in enumerate(days):
+            tx_date = datetime.date(year, month, day).isoformat()
+            if n % 10 == 5:
+                # 出金 → 入金 → 同じ額の出金（1件目と3件目がまったく同じ行になる）
+                amount = rng.randint(1, 5) * 10000
+                balance -= amount
+                rows.append((tx_date, 'ATM', None, amount, balance))
+                balance += amount
+                rows.append((tx_date, '振込 ヤマダ', amount, None, balance))
+                balance -= amount
+                rows.append((tx_date, 'ATM', None, amount, balance))
+                continue
+            if rng.random() < 0.3 or balance < 1000:
+                amount = rng.randint(1, 300) * 1000
+                balance += amount
+                rows.append((tx_date, rng.choice(DESCRIPTIONS), amount, None, balance))
+            else:
+                amount = min(balance - 100, rng.randint(1, 800) * 100)
+                balance -= amount
+                rows.append((tx_date, rng.choice(DESCRIPTIONS), None, amount, balance))
+    return rows
+
+
+def make_pages(rows):
+    """20行ずつのページ（2ページ目以降は先頭が繰越行）。戻り値: ページ（行のリスト）のリスト"""
+    pages = []
+    current = []
+    for row in rows:
+        if len(current) == PAGE_ROWS:
+            pages.append(current)
+            last = current[-1]
+            current = [(last[0], '繰越', None, None, last[4])]
+        current.append(row)
+    pages.append(current)
+    return pages
+
+
+def page_record(spreadsheet_id, folder, name, page_number, rows):
+    record = {
+        'spreadsheetId': spreadsheet_id, 'folder': folder, 'fileName': name,
+        'fileUrl': f'https://drive.google.com/file/d/{name}/view',
+        'transactions': [{'date': r[0], 'description': r[1], 'deposit': r[2], 'withdrawal': r[3], 'balance': r[4]}
+                         for r in rows],
+    }
+    if page_number is not None:
+        record['pageNumber'] = page_number
+    return record
+
+
+def build_account(rng, spreadsheet_id, args):
+    """
+    1口座分のページ入力と正しい台帳を作る
+    戻り値: (ページのリスト, 正しい台帳（行のリスト）, 入力の内訳)
+    """
+    pages = make_pages(make_transactions(rng, args.year, args.per_month))
+    ledger = [row for page in pages for row in page]
+    folders = {}
+    for number, rows in enumerate(pages, start=1):
+        folders.setdefault(rows[-1][0][:7], []).append((number, rows))
+
+    records = []
+    counts = {'pages': len(pages), 'resent': 0, 'overlap': 0}
+    months = sorted(folders)
+    for m, month in enumerate(months):
+        folder = f'{spreadsheet_id}-{month}'
+        numbered = rng.random() > args.unnumbered_rate
+        items = [(f'{folder}-p{number}', number, rows) for number, rows in folders[month]]
+        # 前のフォルダのページの送り直し
+        if m > 0:
+            for number, rows in folders[months[m - 1]]:
+                if rng.random() < args.resend_rate:
+                    items.append((f'{folder}-resent-p{number}', number, rows))
+                    counts['resent'] += 1
+        # 同じフォルダのページの境目をまたいだ撮り直し（ページ番号は読み取れない）
+        # （次のページが別のフォルダだと、まったく同じ行が2件ある箇所から始まる撮り直しは前後の区別がつかない）
+        for (number, rows), _ in zip(folders[month], folders[month][1:]):
+            if rng.random() < args.overlap_rate:
+                start = ledger.index(rows[0]) + rng.randint(8, PAGE_ROWS - 4)
+                items.append((f'{folder}-overlap-p{number}', None, ledger[start:start + rng.randint(8, 16)]))
+                counts['overlap'] += 1
+        rng.shuffle(items)
+        for name, number, rows in items:
+            records.append(page_record(spreadsheet_id, folder, name, number if numbered else None, rows))
+    return records, ledger, counts
+
+
+def to_pages(records):
+    """passbook_ledger.load_pages と同じ形に変換する"""
+    pages = []
+    for record in records:
+        page = dict(record)
+        keys = [passbook_ledger.tx_key(tx) for tx in record['transactions']]
+        page.update(keys=keys, account=record['spreadsheetId'], first_balance=keys[0][4], last_balance=keys[-1][4])
+        pages.append(page)
+    return pages
+
+
+def sheet_keys(fake, spreadsheet_id):
+    return passbook_ledger.read_passbook_keys(fake, spreadsheet_id)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--per-month', type=int, default=30, help='1か月あたりの取引数')
+    parser.add_argument('--year', type=int, default=2025)
+    parser.add_argument('--resend-rate', type=float, default=0.15, help='ページを翌月のフォルダでも送る確率')
+    parser.add_argument('--overlap-rate', type=float, default=0.2, help='境目をまたいで撮り直す確率')
+    parser.add_argument('--unnumbered-rate', type=float, default=0.3, help='ページ番号のないフォルダの割合')
+    parser.add_argument('--seed', type=int, default=20260301)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fake = FakeSheets()
+    records, truth, counts = [], {}, {'pages': 0, 'resent': 0, 'overlap': 0}
+    for n in range(1, args.accounts + 1):
+        spreadsheet_id = f'sheet{n:02d}'
+        account_records, ledger, account_counts = build_account(rng, spreadsheet_id, args)
+        records.extend(account_records)
+        truth[spreadsheet_id] = [passbook_ledger.tx_key(
+            {'date': r[0], 'description': r[1], 'deposit': r[2], 'withdrawal': r[3], 'balance': r[4]}) for r in ledger]
+        for name in counts:
+            counts[name] += account_counts[name]
+    # 1口座目は最初の2か月分のフォルダがすでに（GAS版で）書かれている
+    first = 'sheet01'
+    written_folders = {f'{first}-{args.year}-01', f'{first}-{args.year}-02'}
+    written = truth[first][:sum(len(r['transactions']) for r in records if r['folder'] in written_folders
+                                and '-resent-' not in r['fileName'] and '-overlap-' not in r['fileName'])]
+    fake.sheets[first] = [list(passbook_ledger.PASSBOOK_HEADER)] + [
+        passbook_ledger.to_sheet_row(key, {}) for key in written]
+    records = [r for r in records if r['folder'] not in written_folders or '-resent-' in r['fileName']]
+
+    pages = to_pages(records)
+    # GAS版: 全ページの全行を1件ずつ appendRow
+    gas_rows = sum(len(p['keys']) for p in pages)
+    gas_duplicates = gas_rows - sum(len(t) for t in truth.values()) + len(written)
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix='bench_passbook_ledger_') as workdir:
+        store = passbook_ledger.PassbookLedger(os.path.join(workdir, 'passbook.db'))
+        started = time.perf_counter()
+        result = passbook_ledger.import_pages(store, fake, pages)
+        elapsed = time.perf_counter() - started
+        appends = fake.calls['append']
+
+        expected_writes = len({(p['spreadsheetId'], p['folder']) for p in pages
+                               if p['folder'] not in written_folders})
+        problems = []
+        for spreadsheet_id, expected in truth.items():
+            actual = sheet_keys(fake, spreadsheet_id)
+            if actual != expected:
+                missing = len(set(expected) - set(actual))
+                problems.append(f'{spreadsheet_id}: シート {len(actual)} 行 / 正しい台帳 {len(expected)} 行'
+                                f'（抜け {missing} 種類）')
+                for i, (a, b) in enumerate(zip(actual, expected)):
+                    if a != b:
+                        problems.append(f'  {i + 2}行目から違う: {a} ≠ {b}')
+                        break
+
+        # 同じ入力をもう一度（索引はSQLiteから読み直す）
+        store.conn.close()
+        store = passbook_ledger.PassbookLedger(os.path.join(workdir, 'passbook.db'))
+        again = passbook_ledger.import_pages(store, fake, to_pages(records))
+        store.conn.close()
+        reappends = fake.calls['append'] - appends
+
+    print(f'口座 {args.accounts} / 正しい台帳 {sum(len(t) for t in truth.values())} 行 / '
+          f'入力 {len(pages)} ページ・{gas_rows} 行（送り直し {counts["resent"]}、撮り直し {counts["overlap"]}）')
+    print(f'GAS版（1件ずつ appendRow）: 書き込み {gas_rows} 回、重複 {gas_duplicates} 行')
+    print(f'passbook_ledger: 書き込み {result["writes"]} 回（フォルダ {result["folders"]}）、追加 {result["appended"]} 行、'
+          f'重複を除外 並び {result["overlap"]} 行・単独 {result["isolated"]} 行（{elapsed * 1000:.0f}ms）')
+    print(f'もう一度取り込み: 書き込み {reappends} 回、追加 {again["appended"]} 行')
+
+    for problem in problems:
+        print(f'  {problem}')
+        failed = True
+    if result['writes'] != expected_writes or appends != expected_writes:
+        print(f'  書き込み回数 {appends} がフォルダ数 {expected_writes} と違う')
+        failed = True
+    if result['errors']:
+        print(f'  書き込みエラー {result["errors"]} 件')
+        failed = True
+    if reappends or again['appended']:
+        print('  同じ入力をもう一度取り込んだら書き込まれた')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
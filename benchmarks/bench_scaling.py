@@ -0,0 +1,317 @@
+"""
+会計の一括処理（Python版）の件数に対する伸び方（1千〜100万件の処理時間・ピークメモリ・計算量の目安）
+
+入力は tools/synthetic_data.py の合成データ（乱数の種 --seed で毎回同じ）。1つの処理・件数ごとに別プロセスで
+実行し、入力を作ってから（シートやファイルから読み終えた状態）、処理時間と、処理中に増えた最大RSS（ピークメモリ）を測る。
+100万件ではプロセス全体で最大1.5GB前後使うため、メモリの少ない環境では --sizes で件数を絞る。
+
+- tax_engine:       税額の一括計算（tools/tax_engine.py の build_columns → compute。calculateAccountingData の一括版）
+- billing_count:    出力済み行数（usage_meter.count_exported_rows。BillingManagement.gs の countExportedRows と同じ規則）
+- card_normalize:   クレカ明細の日付・金額の変換（normalize.normalize_many）
+- passbook_ledger:  通帳ページの並べ替え・重複除外・書き込み（tools/passbook_ledger.py の import_pages。
+                    sortByBalanceContinuity_ の代わりの並べ替えを含む。シートへの書き込みは何もしない偽のサービス）
+- ledger_store:     本番シートの行の取り込みと集計（tools/ledger_store.py。1顧客2,000行ずつ）
+
+突合（Service_Reconcile.gs の findCandidates_）と弥生CSV（Output_Yayoi.gs の generateYayoiCSV）は
+Python版がないため対象外（合成データの card / receipts はそのまま使える）。
+
+- 件数を10倍にしたときの時間・メモリの伸びから、log-log の傾き（1.0 なら件数に比例）を出す
+- 結果は --out のJSONに保存する（既定は benchmarks/results/scaling_<リビジョン>.json）
+- --compare に前のJSONを渡すと、同じ処理・件数の時間とメモリを比べる
+- 時間の傾きが --max-exponent を超える、または --compare で時間・メモリが --tolerance を超えて悪くなっていれば
+  終了コード1で失敗する
+
+使い方:
+    python benchmarks/bench_scaling.py                                  # 1千・1万・10万・100万件（数分かかる）
+    python benchmarks/bench_scaling.py --sizes 1000,10000,100000 --engines tax_engine,passbook_ledger
+    python benchmarks/bench_scaling.py --compare benchmarks/results/scaling_<前のリビジョン>.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+RESULTS_DIR = os.path.join(HERE, 'results')
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+sys.path.insert(0, os.path.join(ROOT, 'functions', 'line-receipt-webhook'))
+
+import synthetic_data  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+ROWS_PER_CLIENT = 2000
+# 傾きの計算に使う最短の処理時間（これより短い件数は測定の揺れが大きいので除く）
+MIN_FIT_SECONDS = 0.02
+# --compare で比べる最短の処理時間
+MIN_COMPARE_SECONDS = 0.1
+
+
+def _rss_mb():
+    """ここまでの最大RSS（MB。Linux は KB、macOS はバイトで返る）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# ============================================================
+# 処理ごとの入力と実行
+# ============================================================
+
+def tax_engine_inputs(rows, seed):
+    return (list(synthetic_data.iter_receipts(rows, seed)),)
+
+
+def tax_engine_run(receipts, workdir):
+    import tax_engine
+    columns = tax_engine.build_columns(receipts)
+    result = tax_engine.compute(columns)
+    return {'rows': len(result['totalAmount']), 'fractional': int(columns['fractional'].sum()),
+            'tax': int(result['tax10'].sum() + result['tax8'].sum())}
+
+
+def billing_count_inputs(rows, seed):
+    return ([list(synthetic_data.BILLING_HEADER)] + list(synthetic_data.iter_billing_rows(rows, seed)),)
+
+
+def billing_count_run(values, workdir):
+    import usage_meter
+    return {'rows': len(values) - 1, 'exported': usage_meter.count_exported_rows(values, 2026, 3)}
+
+
+def card_normalize_inputs(rows, seed):
+    return (list(synthetic_data.iter_card_statements(rows, seed)),)
+
+
+def card_normalize_run(statements, workdir):
+    import normalize
+    dates = normalize.normalize_many([s['date'] for s in statements], 'date')
+    amounts = normalize.normalize_many([s['amount'] for s in statements], 'amount')
+    return {'rows': len(statements), 'unparsed_dates': sum(1 for d in dates if not d),
+            'total': sum(a or 0 for a in amounts)}
+
+
+class _NullSheets:
+    """「通帳」シートがない顧客スプシとして応答し、書き込みは捨てる"""
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        return self
+
+    def append(self, **kwargs):
+        return self
+
+    def update(self, **kwargs):
+        return self
+
+    def batchUpdate(self, **kwargs):
+        return self
+
+    def execute(self, num_retries=0):
+        return {}
+
+
+def passbook_ledger_inputs(rows, seed):
+    return (list(synthetic_data.iter_passbook_pages(rows, seed, rows_per_account=ROWS_PER_CLIENT)),)
+
+
+def passbook_ledger_run(pages, workdir):
+    import passbook_ledger
+    store = passbook_ledger.PassbookLedger(os.path.join(workdir, 'passbook.db'))
+    pages = [page for page in map(passbook_ledger.prepare_page, pages) if page is not None]
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = passbook_ledger.import_pages(store, _NullSheets(), pages)
+    store.conn.close()
+    return {'rows': result['transactions'], 'pages': result['pages'], 'appended': result['appended'],
+            'dropped': result['overlap'] + result['isolated'], 'writes': result['writes']}
+
+
+def ledger_store_inputs(rows, seed):
+    clients = list(synthetic_data.iter_clients(math.ceil(rows / ROWS_PER_CLIENT), seed))
+    return clients, list(synthetic_data.iter_receipt_sheet_rows(rows, seed))
+
+
+def ledger_store_run(clients, rows, workdir):
+    import ledger_store
+    store = ledger_store.LedgerStore(os.path.join(workdir, 'ledger.db'))
+    store.upsert_clients(clients)
+    rows = iter(rows)
+    ingested = sum(store.replace_client_rows(c['code'], itertools.islice(rows, ROWS_PER_CLIENT), 'synthetic')
+                   for c in clients)
+    by_client = store.summary_by_client()
+    by_month = store.summary_by_month()
+    return {'rows': ingested, 'clients': len(by_client), 'months': len(by_month),
+            'verify_targets': store.count(verify_target=True)}
+
+
+ENGINES = {
+    'tax_engine': (tax_engine_inputs, tax_engine_run),
+    'billing_count': (billing_count_inputs, billing_count_run),
+    'card_normalize': (card_normalize_inputs, card_normalize_run),
+    'passbook_ledger': (passbook_ledger_inputs, passbook_ledger_run),
+    'ledger_store': (ledger_store_inputs, ledger_store_run),
+}
+
+
+def run_child(engine, rows, seed):
+    """別プロセス側: 1つの処理・件数を実行して結果のJSONを1行出す"""
+    make_inputs, run = ENGINES[engine]
+    # 処理側のモジュールの読み込みを測定に含めないよう先に読む
+    with tempfile.TemporaryDirectory(prefix='bench_scaling_') as workdir:
+        run(*make_inputs(0, seed), workdir)
+    with tempfile.TemporaryDirectory(prefix='bench_scaling_') as workdir:
+        started = time.perf_counter()
+        inputs = make_inputs(rows, seed)
+        generate_seconds = time.perf_counter() - started
+        baseline = _rss_mb()
+        started = time.perf_counter()
+        output = run(*inputs, workdir)
+        seconds = time.perf_counter() - started
+        peak = _rss_mb()
+    print(json.dumps({'seconds': seconds, 'generate_seconds': generate_seconds,
+                      'peak_rss_mb': peak, 'rss_delta_mb': max(peak - baseline, 0.0), 'output': output}))
+
+
+# ============================================================
+# 集計・比較
+# ============================================================
+
+def exponent(points):
+    """(件数, 値) の log-log の最小二乗の傾き（2点未満なら None）"""
+    points = [(math.log(n), math.log(v)) for n, v in points if v > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    denominator = sum((x - mean_x) ** 2 for x, _ in points)
+    if not denominator:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / denominator
+
+
+def format_exponent(value):
+    return '-' if value is None else f'{value:.2f}'
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=30).stdout.strip() or 'unknown'
+    except Exception:
+        return 'unknown'
+
+
+def compare(report, baseline, tolerance):
+    """前の結果と比べて悪くなった (処理, 件数, 項目, 前, 今) のリスト"""
+    regressions = []
+    for engine, current in report['results'].items():
+        before = {run['rows']: run for run in baseline.get('results', {}).get(engine, {}).get('runs', [])}
+        for run in current['runs']:
+            old = before.get(run['rows'])
+            if not old:
+                continue
+            # 短すぎる時間・小さすぎるメモリは揺れが大きいので比べない
+            if old['seconds'] >= MIN_COMPARE_SECONDS and run['seconds'] > old['seconds'] * (1 + tolerance):
+                regressions.append((engine, run['rows'], '時間(秒)', old['seconds'], run['seconds']))
+            if run['rss_delta_mb'] > max(old['rss_delta_mb'] * (1 + tolerance), old['rss_delta_mb'] + 5):
+                regressions.append((engine, run['rows'], 'メモリ(MB)', old['rss_delta_mb'], run['rss_delta_mb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='件数（カンマ区切り）')
+    parser.add_argument('--engines', default=','.join(ENGINES), help='処理（カンマ区切り）')
+    parser.add_argument('--seed', type=int, default=20260401)
+    parser.add_argument('--out', help='結果のJSON（既定は benchmarks/results/scaling_<リビジョン>.json）')
+    parser.add_argument('--compare', help='前の結果のJSON')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='--compare で許す悪化の割合')
+    parser.add_argument('--max-exponent', type=float, default=1.3, help='許す時間の傾き（1.0 が件数に比例）')
+    parser.add_argument('--timeout', type=int, default=1800, help='1回の実行の上限（秒）')
+    parser.add_argument('--child', nargs=2, metavar=('ENGINE', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.seed)
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+    unknown = [e for e in engines if e not in ENGINES]
+    if unknown:
+        parser.error(f'不明な処理: {", ".join(unknown)}（{", ".join(ENGINES)}）')
+
+    report = {
+        'revision': revision(),
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'sizes': sizes,
+        'results': {},
+    }
+    failed = False
+    print(f'{"処理":16}{"件数":>10}{"時間(秒)":>11}{"1件(µs)":>10}{"生成(秒)":>10}{"メモリ増(MB)":>13}')
+    for engine in engines:
+        runs = []
+        for rows in sizes:
+            command = [sys.executable, os.path.abspath(__file__), '--seed', str(args.seed), '--child', engine, str(rows)]
+            try:
+                completed = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout)
+            except subprocess.TimeoutExpired:
+                print(f'{engine:16}{rows:>10,}  {args.timeout}秒で打ち切り')
+                failed = True
+                break
+            if completed.returncode != 0:
+                print(f'{engine:16}{rows:>10,}  エラー: {completed.stderr.strip()[-500:]}')
+                failed = True
+                break
+            run = json.loads(completed.stdout.strip().splitlines()[-1])
+            run['rows'] = rows
+            run['per_row_us'] = run['seconds'] / rows * 1e6 if rows else 0.0
+            runs.append(run)
+            print(f'{engine:16}{rows:>10,}{run["seconds"]:>11.3f}{run["per_row_us"]:>10.2f}'
+                  f'{run["generate_seconds"]:>10.2f}{run["rss_delta_mb"]:>13.1f}')
+        time_exp = exponent([(r['rows'], r['seconds']) for r in runs if r['seconds'] >= MIN_FIT_SECONDS])
+        memory_exp = exponent([(r['rows'], r['rss_delta_mb']) for r in runs if r['rss_delta_mb'] >= 5])
+        report['results'][engine] = {'runs': runs, 'time_exponent': time_exp, 'memory_exponent': memory_exp}
+        print(f'{"":16}傾き: 時間 {format_exponent(time_exp)} / メモリ {format_exponent(memory_exp)}')
+        if time_exp is not None and time_exp > args.max_exponent:
+            print(f'{"":16}時間の傾きが {args.max_exponent} を超えた（件数に比例するより速く伸びる）')
+            failed = True
+
+    out = args.out or os.path.join(RESULTS_DIR, f'scaling_{report["revision"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'結果: {out}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        print(f'比較: {baseline.get("revision", "?")} → {report["revision"]}（許容 +{args.tolerance:.0%}）')
+        for engine, rows, metric, before, after in regressions:
+            print(f'  {engine} {rows:,}件 {metric}: {before:.3f} → {after:.3f}')
+            failed = True
+        if not regressions:
+            print('  悪化なし')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+共有キャッシュ（functions/line-receipt-webhook/shared_cache.py）のヒット率とインスタンス間の一貫性
+
+tools/fake_redis.py の疑似サーバーを共有層にし、--instances 個のインスタンス（それぞれ別の SharedCache と
+顧客ストア）を1プロセス内に作って、共有層あり / プロセス内のみ の2通りで同じ操作を流す。
+顧客管理シートは偽のSheetsサービス（全インスタンスで共有）を使う。
+
+- 一貫性: インスタンスAでLINE連携（顧客コードの行にLINE IDを書く）・お試し登録をした直後に、
+  別のインスタンスBが LINE ID / 顧客コードで検索して新しい行が見えるか
+- ヒット率: --events 件のイベントをインスタンスに振り分け、サブフォルダID・ページ分類・処理済みイベントIDを
+  キャッシュ経由で引く。LINEの再送（--redelivery の確率で別のインスタンスにも届く）を二重に処理した件数も数える
+- 障害: 最後に共有層を止め、プロセス内の層だけで動き続けることを確認する
+- 共有層ありで食い違い・二重処理があるか、ヒット率がプロセス内のみより低ければ終了コード1で失敗する
+
+使い方:
+    python benchmarks/bench_shared_cache.py [--instances 4] [--users 200] [--events 5000] [--redelivery 0.05]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'line-receipt-webhook'))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+os.environ.setdefault('CUSTOMER_STORE_DIR', tempfile.mkdtemp(prefix='bench_shared_cache_'))
+os.environ.setdefault('CUSTOMER_SYNC_INTERVAL', '3600')
+os.environ.setdefault('CUSTOMER_CHECK_INTERVAL', '3600')
+os.environ.setdefault('SHARED_CACHE_RETRY_SECONDS', '3600')
+
+import customer_store  # noqa: E402
+import fake_redis  # noqa: E402
+import shared_cache  # noqa: E402
+
+COLUMNS = {'line_id': 0, 'name': 1, 'folder_id': 2, 'code': 6, 'status': 7}
+
+
+class _Request:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self, num_retries=0):
+        return self._fn()
+
+
+class FakeSheets:
+    """顧客管理シートの values().get / append / batchUpdate と、版を返す files().get を持つ偽のサービス"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.version = 1
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def files(self):
+        return self
+
+    def get(self, spreadsheetId=None, range=None, fileId=None, **kwargs):
+        if fileId is not None:
+            return _Request(lambda: {'version': str(self.version), 'modifiedTime': ''})
+        return _Request(lambda: {'values': [list(r) for r in self.rows]})
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        def run():
+            self.rows.extend(list(r) for r in body['values'])
+            self.version += 1
+            return {}
+        return _Request(run)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            for item in body['data']:
+                cell = item['range'].split('!')[1]
+                col = ord(cell[0]) - ord('A')
+                row = self.rows[int(cell[1:]) - 1]
+                row.extend([''] * (col + 1 - len(row)))
+                row[col] = item['values'][0][0]
+            self.version += 1
+            return {}
+        return _Request(run)
+
+
+class Instance:
+    """1つの Cloud Functions インスタンス（プロセス内のキャッシュと顧客ストアを持つ）"""
+
+    def __init__(self, index, url, sheets, tmp):
+        self.cache = shared_cache.SharedCache(url)
+        self.subfolders = self.cache.namespace('subfolders', 3600)
+        self.pages = self.cache.namespace('pages', 3600)
+        self.events = self.cache.namespace('events', 3600)
+        customers = self.cache.namespace('customers', 600, local=False) if url else None
+        self.store = customer_store.CustomerStore(
+            'MK', 'sheet', COLUMNS, width=18, service_factory=lambda: sheets,
+            drive_service_factory=lambda: sheets, cache=customers)
+        os.makedirs(os.path.join(tmp, f'instance{index}'), exist_ok=True)
+        self.store.db_path = os.path.join(tmp, f'instance{index}', 'customers.db')
+        self.store.ensure_loaded()
+
+
+def check_consistency(instances, args, rng):
+    """連携・お試し登録の直後に別のインスタンスから見えるか（戻り値: (確認数, 食い違い数)）"""
+    checks = mismatches = 0
+    for i in range(args.users):
+        writer, reader = rng.sample(instances, 2)
+        code, line_id = f'MK{i + 1:03d}', f'U{i:05d}'
+
+        # LINE連携（link_user_with_customer_code と同じ更新）
+        record = writer.store.find_by_code(code)
+        writer.store.update(record['row_key'], {COLUMNS['line_id']: line_id, COLUMNS['status']: '契約済'})
+        by_line = reader.store.find_by_line_id(line_id)
+        by_code = reader.store.find_by_code(code)
+        checks += 2
+        mismatches += 0 if by_line and by_line['row'][COLUMNS['status']] == '契約済' else 1
+        mismatches += 0 if by_code and by_code['row'][COLUMNS['line_id']] == line_id else 1
+
+        # 別のインスタンスでお試し送信回数を更新しても連携が消えない
+        other = rng.choice([x for x in instances if x is not writer])
+        other.store.update(record['row_key'], {10: 1})
+        after = writer.store.find_by_code(code)
+        checks += 1
+        mismatches += 0 if after and after['row'][COLUMNS['line_id']] == line_id else 1
+
+        # お試し登録（register_new_user と同じ追加）
+        trial_id = f'T{i:05d}'
+        row = [''] * 8
+        row[COLUMNS['line_id']], row[COLUMNS['name']], row[COLUMNS['status']] = trial_id, '未登録', 'お試し'
+        writer.store.append(row)
+        seen = reader.store.find_by_line_id(trial_id)
+        checks += 1
+        mismatches += 0 if seen and seen['row'][COLUMNS['status']] == 'お試し' else 1
+    return checks, mismatches
+
+
+def run_events(instances, args, rng):
+    """イベントを振り分けて処理（戻り値: Drive呼び出し数, Gemini呼び出し数, 二重処理数）"""
+    drive_calls = gemini_calls = duplicates = 0
+    processed = set()
+    pages = [f'page{n:05d}' for n in range(args.events // 4)]
+    for n in range(args.events):
+        event_id = f'ev{n:06d}'
+        deliveries = [rng.choice(instances)]
+        if rng.random() < args.redelivery:
+            deliveries.append(rng.choice(instances))
+        for instance in deliveries:
+            if not instance.events.set(event_id, True, only_if_absent=True):
+                continue
+            if event_id in processed:
+                duplicates += 1
+            processed.add(event_id)
+
+            # 顧客のフォルダの「通帳」サブフォルダ（get_or_create_subfolder）
+            user = min(int(rng.paretovariate(1.2)), args.users) - 1
+            key = f'folder{user:05d}:通帳'
+            if instance.subfolders.get(key) is shared_cache.MISS:
+                drive_calls += 2   # files.get（親）+ files.list
+                instance.subfolders.set(key, f'sub{user:05d}')
+
+            # ページ分類（同じページの再送・同じ通帳の再アップロード）
+            page = pages[min(int(rng.paretovariate(1.1)), len(pages)) - 1]
+            if instance.pages.get(page) is shared_cache.MISS:
+                gemini_calls += 1
+                instance.pages.set(page, {'category': 'passbook', 'confidence': 0.9})
+    return drive_calls, gemini_calls, duplicates
+
+
+def run(mode_url, args, server_api=None):
+    rng = random.Random(args.seed)
+    header = ['LINE ID', '名前', 'フォルダID', '', '', '', 'コード', 'ステータス']
+    rows = [header] + [['', '', f'folder{i:05d}', '', '', '', f'MK{i + 1:03d}', '未使用']
+                       for i in range(args.users)]
+    sheets = FakeSheets(rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        instances = [Instance(i, mode_url, sheets, tmp) for i in range(args.instances)]
+        started = time.perf_counter()
+        checks, mismatches = check_consistency(instances, args, rng)
+        drive_calls, gemini_calls, duplicates = run_events(instances, args, rng)
+        seconds = time.perf_counter() - started
+        hits = sum(x.cache.hit_ratio('subfolders') + x.cache.hit_ratio('pages') for x in instances)
+        metrics = [x.cache.metrics() for x in instances]
+        result = {
+            'checks': checks, 'mismatches': mismatches, 'drive_calls': drive_calls,
+            'gemini_calls': gemini_calls, 'duplicates': duplicates, 'seconds': seconds,
+            'hit_ratio': hits / (2 * len(instances)), 'metrics': metrics,
+        }
+
+        if server_api is not None:
+            # 共有層を止めてもプロセス内の層で動き続ける（接続済みのコネクションも切る）
+            server_api['api'].error_rate = 1.0
+            server_api['server'].shutdown()
+            server_api['server'].server_close()
+            instance = instances[0]
+            started = time.perf_counter()
+            instance.subfolders.set('after-outage', 'x')
+            ok = instance.subfolders.get('after-outage') == 'x' and instance.store.find_by_code('MK001') is not None
+            for _ in range(100):
+                instance.pages.get('missing-page')
+            result['outage_ok'] = ok and not instance.cache.shared_available
+            result['outage_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=4)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--redelivery', type=float, default=0.05)
+    parser.add_argument('--latency', type=float, default=0.0, help='疑似サーバーの1コマンドあたりの遅延（秒）')
+    parser.add_argument('--port', type=int, default=6391)
+    parser.add_argument('--seed', type=int, default=20260215)
+    args = parser.parse_args()
+
+    api = fake_redis.FakeRedis(latency=args.latency)
+    server = fake_redis.serve(api, port=args.port)
+    shared = run(f'redis://127.0.0.1:{args.port}/0', args, {'server': server, 'api': api})
+    local = run('', args)
+
+    print(f'インスタンス {args.instances} / 顧客 {args.users} / イベント {args.events}（再送 {args.redelivery:.0%}）')
+    print(f'{"":14}{"共有層あり":>12}{"プロセス内のみ":>14}')
+    print(f'{"食い違い":14}{shared["mismatches"]:>8} / {shared["checks"]}{local["mismatches"]:>10} / {local["checks"]}')
+    print(f'{"ヒット率":14}{shared["hit_ratio"]:>12.1%}{local["hit_ratio"]:>14.1%}')
+    print(f'{"Drive呼び出し":14}{shared["drive_calls"]:>12}{local["drive_calls"]:>14}')
+    print(f'{"Gemini呼び出し":14}{shared["gemini_calls"]:>12}{local["gemini_calls"]:>14}')
+    print(f'{"二重処理":14}{shared["duplicates"]:>12}{local["duplicates"]:>14}')
+    print(f'{"時間":14}{shared["seconds"]:>11.2f}s{local["seconds"]:>13.2f}s')
+    for name in ('customers', 'subfolders', 'pages'):
+        stats = [m['namespaces'][name] for m in shared['metrics'] if name in m['namespaces']]
+        local_hits, shared_hits = sum(s['local_hits'] for s in stats), sum(s['shared_hits'] for s in stats)
+        misses = sum(s['misses'] for s in stats)
+        print(f'  {name:11} プロセス内ヒット {local_hits:>6} / 共有層ヒット {shared_hits:>6} / ミス {misses:>6}')
+    print(f'共有層のコマンド数: {api.stats["commands"]}、接続数: {api.stats["connections"]}')
+    print(f'共有層の停止後: {"プロセス内で継続" if shared["outage_ok"] else "失敗"}（{shared["outage_ms"]:.1f}ms）')
+
+    failed = False
+    if shared['mismatches']:
+        print('  共有層ありでインスタンス間の食い違いがある')
+        failed = True
+    if shared['duplicates']:
+        print('  共有層ありで再送イベントを二重に処理した')
+        failed = True
+    if shared['hit_ratio'] <= local['hit_ratio']:
+        print('  共有層ありのヒット率がプロセス内のみより高くない')
+        failed = True
+    if not shared['outage_ok']:
+        print('  共有層の停止後にプロセス内の層へ切り替わらない')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+税額一括再計算（tools/tax_engine.py）のGAS版との一致確認と速度比較
+
+benchmarks/corpus/tax_cases.json は、OCRの読み取りミスのパターン（税抜・税額の欠落、税込を税抜と誤読、
+不課税額の誤読、値引、外貨、全角・記号付きの金額、小数など）を組み合わせた入力と、
+それを gas/Logic_Accounting.gs の calculateAccountingData に Node で通した結果。
+
+- 1件版・一括版の結果がコーパスの結果（GAS版）と1件でも違えば終了コード1で失敗する
+- コーパスを --rows 件まで複製し、1件ずつの計算と一括計算の時間を比べる
+
+使い方:
+    python benchmarks/bench_tax_engine.py [--rows 200000]
+    python benchmarks/bench_tax_engine.py --regenerate [--cases 2000]   # GAS版の変更後にコーパスを作り直す（Node が必要）
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GAS_DIR = os.path.join(HERE, '..', 'gas')
+CORPUS_PATH = os.path.join(HERE, 'corpus', 'tax_cases.json')
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+
+import tax_engine  # noqa: E402
+
+# GAS版を読み込んで標準入力の OCRResult 配列を計算する
+NODE_RUNNER = r'''
+const fs = require('fs');
+const vm = require('vm');
+const dir = process.argv[1];
+const src = ['Config.gs', 'Utils.gs', 'Logic_Accounting.gs']
+  .map(name => fs.readFileSync(dir + '/' + name, 'utf8')).join('\n');
+vm.runInThisContext(src + '\nglobalThis.__calculate = calculateAccountingData;');
+const cases = JSON.parse(fs.readFileSync(0, 'utf8'));
+process.stdout.write(JSON.stringify(cases.map(ocr => __calculate(ocr))));
+'''
+
+
+# ============================================================
+# コーパス生成
+# ============================================================
+
+def fmt_amount(rng, value):
+    """OCRが返しうる金額の表記ゆれ"""
+    kind = rng.random()
+    if kind < 0.7:
+        return value
+    if kind < 0.8:
+        return f'¥{value:,}'
+    if kind < 0.9:
+        return f'{value:,}円'.translate(str.maketrans('0123456789', '０１２３４５６７８９'))
+    return str(value)
+
+
+def make_case(rng):
+    """読み取りミスのパターンを組み合わせた OCRResult"""
+    has10 = rng.random() < 0.85
+    has8 = rng.random() < 0.35 or not has10
+    s10 = rng.randint(50, 80000) if has10 else 0
+    s8 = rng.randint(50, 20000) if has8 else 0
+    t10 = s10 // 10
+    t8 = s8 * 8 // 100
+    info = {'subtotal10': s10, 'tax10': t10, 'subtotal8': s8, 'tax8': t8}
+    non_taxable = 0
+    items = []
+
+    if rng.random() < 0.15:
+        key = rng.choice(['dieselTax', 'bathTax', 'accommodationTax', 'otherNonTaxable'])
+        non_taxable = rng.choice([150, 200, 300, 1065, rng.randint(10, 3000)])
+        info[key] = non_taxable
+        if rng.random() < 0.3:
+            # 軽油税の単価を合計と誤読
+            info[key] = rng.choice([32, 32.1, rng.randint(1, 99)])
+    if rng.random() < 0.08:
+        amount = rng.choice([150, 200, 300])
+        items.append({'name': rng.choice(['入湯税', '宿泊税', '観光税（市）', 'TAX']), 'amount': amount})
+        non_taxable += amount
+    items.extend({'name': f'商品{i}', 'amount': rng.randint(100, 2000)} for i in range(rng.randint(0, 3)))
+
+    total = s10 + t10 + s8 + t8 + non_taxable
+
+    mistake = rng.random()
+    if mistake < 0.12:
+        info['subtotal10'] = 0                                   # 税抜の欠落
+    elif mistake < 0.18:
+        info['subtotal8'] = 0
+    elif mistake < 0.3:
+        info['subtotal10'] = s10 + t10                           # 税込を税抜と誤読
+        if rng.random() < 0.5:
+            info['subtotal8'] = s8 + t8
+    elif mistake < 0.4:
+        info['tax10'] = 0                                        # 税額の欠落
+    elif mistake < 0.45:
+        info['tax8'] = 0
+    elif mistake < 0.52:
+        info['subtotal10'] = rng.randint(1, max(1, s10 * 3))     # 税抜の誤読
+    elif mistake < 0.58:
+        total -= rng.randint(1, 120)                             # 値引・端数
+    elif mistake < 0.62:
+        total += rng.randint(1, 40)
+    elif mistake < 0.68:
+        info = None                                              # 税情報なし
+    elif mistake < 0.7:
+        info = {}
+    elif mistake < 0.73:
+        info = {'subtotal10': 0, 'tax10': 0, 'subtotal8': 0, 'tax8': 0}
+    elif mistake < 0.75:
+        info['tax10'] = round(t10 + rng.random(), 2)             # 小数
+    elif mistake < 0.77:
+        total = rng.choice([0, -total, None])                   # 総額なし・返金
+
+    if info:
+        info = {k: fmt_amount(rng, v) if isinstance(v, int) and rng.random() < 0.2 else v
+                for k, v in info.items() if v or rng.random() < 0.5}
+
+    ocr = {
+        'date': '2026/02/15',
+        'storeName': 'テスト商店',
+        'totalAmount': fmt_amount(rng, total) if isinstance(total, int) else total,
+        'invoiceNumber': rng.choice([None, 'T1234567890123', ' T9876543210987 ', 'T12345', '1234567890123']),
+        'items': items,
+        '_subtotalInfo': info,
+        'currency': 'JPY' if rng.random() < 0.95 else rng.choice(['USD', 'EUR', '']),
+    }
+    return ocr
+
+
+def regenerate(cases, seed):
+    rng = random.Random(seed)
+    ocrs = [make_case(rng) for _ in range(cases)]
+    output = subprocess.run(['node', '-e', NODE_RUNNER, os.path.abspath(GAS_DIR)],
+                            input=json.dumps(ocrs, ensure_ascii=False).encode('utf-8'),
+                            capture_output=True, check=True).stdout
+    expected = json.loads(output)
+    os.makedirs(os.path.dirname(CORPUS_PATH), exist_ok=True)
+    with open(CORPUS_PATH, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        f.write(',\n'.join(json.dumps({'ocr': o, 'expected': e}, ensure_ascii=False)
+                           for o, e in zip(ocrs, expected)))
+        f.write('\n]\n')
+    print(f'{cases} 件のコーパスを {CORPUS_PATH} に保存')
+
+
+# ============================================================
+# 照合・計測
+# ============================================================
+
+def mismatches(results, expected):
+    bad = []
+    for i, (got, want) in enumerate(zip(results, expected)):
+        diff = {k: (got.get(k), want.get(k)) for k in tax_engine.RESULT_FIELDS if got.get(k) != want.get(k)}
+        if diff:
+            bad.append((i, diff))
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regenerate', action='store_true')
+    parser.add_argument('--cases', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=20260215)
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.regenerate:
+        regenerate(args.cases, args.seed)
+
+    with open(CORPUS_PATH, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    ocrs = [c['ocr'] for c in corpus]
+    expected = [c['expected'] for c in corpus]
+
+    failed = False
+    for name, results in (('per-row', [tax_engine.calculate_accounting_data(o) for o in ocrs]),
+                          ('columnar', tax_engine.recompute(ocrs))):
+        bad = mismatches(results, expected)
+        print(f'{name:9} GAS版との不一致 {len(bad)} / {len(corpus)} 件')
+        for i, diff in bad[:5]:
+            print(f'  #{i} {diff}  ocr={json.dumps(ocrs[i], ensure_ascii=False)}')
+        failed = failed or bool(bad)
+
+    rows = (ocrs * (args.rows // len(ocrs) + 1))[:args.rows]
+    started = time.perf_counter()
+    for ocr in rows:
+        tax_engine.calculate_accounting_data(ocr)
+    per_row = time.perf_counter() - started
+
+    started = time.perf_counter()
+    columns = tax_engine.build_columns(rows)
+    parse = time.perf_counter() - started
+    started = time.perf_counter()
+    result = tax_engine.compute(columns)
+    compute = time.perf_counter() - started
+    started = time.perf_counter()
+    tax_engine.to_records(result)
+    records = time.perf_counter() - started
+
+    print(f'{args.rows} 行: 1件ずつ {per_row:.2f}s / 一括 計 {parse + compute + records:.2f}s '
+          f'(列化 {parse:.2f}s + ルール計算 {compute * 1000:.0f}ms + 出力 {records:.2f}s)')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
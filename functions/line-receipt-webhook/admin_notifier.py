@@ -0,0 +1,277 @@
+"""
+管理者通知のまとめ送信
+
+通常の通知は管理者へLINEプッシュを直接送らず、送信待ちに積んでまとめて送る。
+
+- 通常の通知: 最初の1件から NOTIFY_WINDOW_SECONDS 秒の間に届いたものを1通のダイジェストにまとめる
+  （登録ラッシュでも管理者のLINEが埋まらず、プッシュ通数も減る）
+- 至急の通知（urgent=True）: notify() の中でその場で送る。送れなければ送信待ちに積んで再送する
+- 送信待ちは共有キャッシュ（queue に shared_cache.py の NOTIFICATIONS を渡した場合）のリストに積む。
+  共有層が使えない間は /tmp のSQLiteに積む（インスタンスが止まると失われる）
+- 送る時期が来た送信待ちはバックグラウンドのワーカーが送り、リクエストの応答を待たせない
+  （start() で起動。CPUを常に割り当て、最小インスタンス数を1にしてデプロイする。
+  共有キャッシュに積んだ送信待ちは、どのインスタンスのワーカーからでも送られる）
+- 送信失敗時は間隔を空けて NOTIFY_MAX_ATTEMPTS 回まで再送する
+
+※ このファイルは line-receipt-webhook / stripe-webhook の両方に同じ内容で配置している
+"""
+import os
+import sqlite3
+import threading
+import time
+
+NOTIFY_DB_PATH = os.environ.get('NOTIFY_DB_PATH', '/tmp/admin_notifications.db')
+NOTIFY_WINDOW_SECONDS = float(os.environ.get('NOTIFY_WINDOW_SECONDS', '60'))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', '5'))
+# 共有キャッシュの送信待ちを送る間、他のインスタンスに送らせない時間（秒）
+NOTIFY_FLUSH_LEASE_SECONDS = float(os.environ.get('NOTIFY_FLUSH_LEASE_SECONDS', '60'))
+
+# LINEのテキストメッセージは1通5000文字まで、1回のプッシュで5通まで
+MAX_TEXT_LENGTH = 5000
+MAX_MESSAGES_PER_PUSH = 5
+SEPARATOR = '\n\n――――――――――\n\n'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message TEXT NOT NULL,
+    urgent INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_at REAL NOT NULL DEFAULT 0
+);
+'''
+
+
+def build_digest(messages):
+    """
+    複数の通知を1回のプッシュで送れるテキストにまとめる
+    戻り値: テキストのリスト（最大 MAX_MESSAGES_PER_PUSH 通、入りきらない分は件数だけ記載）
+    """
+    if len(messages) == 1:
+        return [messages[0][:MAX_TEXT_LENGTH]]
+
+    texts = []
+    current = f'📬 管理者通知まとめ（{len(messages)}件）'
+    for i, message in enumerate(messages):
+        message = message[:MAX_TEXT_LENGTH - 100]
+        if len(current) + len(SEPARATOR) + len(message) <= MAX_TEXT_LENGTH:
+            current += SEPARATOR + message
+            continue
+        if len(texts) == MAX_MESSAGES_PER_PUSH - 1:
+            current += f'\n\n…ほか{len(messages) - i}件（ログを確認してください）'
+            break
+        texts.append(current)
+        current = message
+    texts.append(current[:MAX_TEXT_LENGTH])
+    return texts
+
+
+class AdminNotifier:
+    """
+    send_fn(texts) -> bool: テキストのリストを管理者に1回のプッシュで送る（成功時True）
+    queue: 送信待ちを積む共有キャッシュの名前空間（push / items / trim を持つもの。None ならSQLiteだけ）
+    queue_key: 名前空間の中のキー（送り先の管理者ごとに分ける）
+    """
+
+    def __init__(self, send_fn, window_seconds=NOTIFY_WINDOW_SECONDS, db_path=NOTIFY_DB_PATH,
+                 queue=None, queue_key='admin'):
+        self.send_fn = send_fn
+        self.window_seconds = window_seconds
+        self.db_path = db_path
+        self.queue = queue
+        self.queue_key = queue_key
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def notify(self, message, urgent=False):
+        """
+        通知を送る（通常の通知は送信待ちに追加して待たない。至急の通知はその場で送り、送れなければ送信待ちに追加）
+        """
+        if urgent:
+            try:
+                if self.send_fn([message[:MAX_TEXT_LENGTH]]):
+                    return
+            except Exception as e:
+                print(f'[notify] Send error: {e}')
+            print('[notify] Urgent notification not sent, queued for retry')
+        if self._enqueue_shared(message, urgent):
+            self._ensure_worker()
+            return
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    'INSERT INTO notifications (message, urgent, created_at, attempts, next_at) VALUES (?, ?, ?, ?, ?)',
+                    (message, 1 if urgent else 0, time.time(), 1 if urgent else 0,
+                     time.time() + 5 if urgent else 0)
+                )
+        except Exception as e:
+            # 積めない場合はその場で送る（通知を失わない）
+            print(f'[notify] Enqueue error, sending directly: {e}')
+            if not urgent:
+                self.send_fn([message[:MAX_TEXT_LENGTH]])
+            return
+        self._ensure_worker()
+
+    def _enqueue_shared(self, message, urgent):
+        """共有キャッシュの送信待ちに追加（戻り値: 追加できたか）"""
+        if self.queue is None:
+            return False
+        return self.queue.push(self.queue_key, {'message': message, 'urgent': urgent, 'created_at': time.time()})
+
+    def pending_count(self):
+        count = self._conn().execute('SELECT COUNT(*) AS n FROM notifications').fetchone()['n']
+        if self.queue is not None:
+            items = self.queue.items(self.queue_key)
+            count += len(items) if isinstance(items, list) else 0
+        return count
+
+    def start(self):
+        """
+        ワーカーを起動する（起動時に呼ぶ。別のインスタンスが積んだ共有キャッシュの送信待ちも送る）
+        """
+        self._ensure_worker()
+
+    # ----------------------------------------------------------
+    # ワーカー
+    # ----------------------------------------------------------
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='admin-notifier', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                wait = self.flush()
+            except Exception as e:
+                print(f'[notify] Flush error: {e}')
+                wait = self.window_seconds
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def flush(self, force=False):
+        """
+        送る時期が来た通知を送る
+        戻り値: 次に確認するまでの秒数
+        """
+        with self._flush_lock:
+            return self._flush(force)
+
+    def _flush(self, force):
+        wait = self._flush_local(force)
+        if self.queue is not None:
+            wait = min(wait, self._flush_shared(force))
+        return wait
+
+    def _flush_shared(self, force):
+        """共有キャッシュの送信待ちを送る（送る間は印を付けて、他のインスタンスと二重に送らない）"""
+        items = self.queue.items(self.queue_key)
+        if not isinstance(items, list) or not items:
+            return self.window_seconds
+        retry_key = f'{self.queue_key}:retry'
+        retry = self.queue.get(retry_key, None) or {'attempts': 0, 'next_at': 0}
+        now = time.time()
+        due = max(retry['next_at'], min(
+            item['created_at'] + (0 if item['urgent'] else self.window_seconds) for item in items))
+        if not force and due > now:
+            return max(0.5, due - now)
+
+        lease_key = f'{self.queue_key}:flush'
+        if not self.queue.set(lease_key, True, only_if_absent=True, ttl=NOTIFY_FLUSH_LEASE_SECONDS):
+            return self.window_seconds
+        try:
+            # 印を付ける前に別のインスタンスが送っていれば読み直した内容だけを送る
+            items = self.queue.items(self.queue_key)
+            if not isinstance(items, list) or not items:
+                return self.window_seconds
+            try:
+                ok = self.send_fn(build_digest([item['message'] for item in items]))
+            except Exception as e:
+                print(f'[notify] Send error: {e}')
+                ok = False
+            attempts = retry['attempts'] + 1
+            if ok or attempts >= NOTIFY_MAX_ATTEMPTS:
+                if not ok:
+                    for item in items:
+                        print(f'[notify] Giving up after {attempts} attempts: {item["message"][:100]}')
+                # 送っている間に追加された通知は残す
+                self.queue.trim(self.queue_key, len(items))
+                self.queue.delete(retry_key)
+                return self.window_seconds
+            delay = min(300, 5 * 2 ** (attempts - 1))
+            self.queue.set(retry_key, {'attempts': attempts, 'next_at': time.time() + delay})
+            return delay
+        finally:
+            self.queue.delete(lease_key)
+
+    def _flush_local(self, force):
+        now = time.time()
+        conn = self._conn()
+        rows = conn.execute(
+            'SELECT id, message, urgent, created_at, attempts, next_at FROM notifications ORDER BY id'
+        ).fetchall()
+        if not rows:
+            return self.window_seconds
+
+        ready = [r for r in rows if r['next_at'] <= now]
+        urgent = [r for r in ready if r['urgent']]
+        normal = [r for r in ready if not r['urgent']]
+
+        # 至急の通知は1件ずつすぐ送る
+        for r in urgent:
+            self._deliver([r])
+
+        # 通常の通知は最初の1件からウィンドウ分たったらまとめて送る
+        if normal and (force or now - normal[0]['created_at'] >= self.window_seconds):
+            self._deliver(normal)
+
+        remaining = conn.execute('SELECT created_at, next_at, urgent FROM notifications').fetchall()
+        if not remaining:
+            return self.window_seconds
+        due = min(max(r['next_at'], r['created_at'] + (0 if r['urgent'] else self.window_seconds))
+                  for r in remaining)
+        return max(0.5, due - time.time())
+
+    def _deliver(self, rows):
+        ids = [r['id'] for r in rows]
+        try:
+            ok = self.send_fn(build_digest([r['message'] for r in rows]))
+        except Exception as e:
+            print(f'[notify] Send error: {e}')
+            ok = False
+
+        conn = self._conn()
+        placeholders = ','.join('?' * len(ids))
+        with conn:
+            if ok:
+                conn.execute(f'DELETE FROM notifications WHERE id IN ({placeholders})', ids)
+                return
+            attempts = max(r['attempts'] for r in rows) + 1
+            if attempts >= NOTIFY_MAX_ATTEMPTS:
+                for r in rows:
+                    print(f'[notify] Giving up after {attempts} attempts: {r["message"][:100]}')
+                conn.execute(f'DELETE FROM notifications WHERE id IN ({placeholders})', ids)
+                return
+            # 5秒, 10秒, 20秒 ... 最大5分の間隔で再送
+            next_at = time.time() + min(300, 5 * 2 ** (attempts - 1))
+            conn.execute(
+                f'UPDATE notifications SET attempts = ?, next_at = ? WHERE id IN ({placeholders})',
+                [attempts, next_at, *ids]
+            )
@@ -0,0 +1,188 @@
+"""
+画像・PDF処理の受付制御（ユーザーごとの同時実行上限 + ユーザー間のラウンドロビン）
+
+月末に1人の顧客が数百枚の写真を送っても、他の顧客の1枚が待たされないようにする。
+
+- 処理はワーカースレッド（ADMISSION_WORKERS 本）で実行する
+- 同じユーザーの処理は同時に ADMISSION_PER_USER 件まで。ただし他に待ちがなくワーカーが空いていれば、
+  ADMISSION_RESERVED 本を他のユーザー用に残してそれ以上使ってよい（空いているワーカーを遊ばせない）
+- 空いたワーカーは「待ちのあるユーザー」を順番に回って1件ずつ取り出す（ラウンドロビン）
+- Webhook は ADMISSION_WAIT_SECONDS 秒まで処理を待つ。それまでに開始できなかった処理は
+  受付済みにする（on_queued で保存してから「順番に処理しています」と返信し、結果は開始後にプッシュで送る）。
+  on_queued はロックの外で呼び、その間に順番が来た処理は on_queued が終わるまで開始を待つ
+
+待ち件数・待ち時間（p50/p95）は metrics() で取得できる。
+
+順番を決めるのはインスタンス内のリクエストの間だけなので、Cloud Functions は --concurrency（と --cpu 1 以上）を付けて
+1インスタンスで複数のWebhookを同時に受けるようにデプロイする（README のデプロイ手順）。
+"""
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+ADMISSION_WORKERS = int(os.environ.get('ADMISSION_WORKERS', '8'))
+ADMISSION_PER_USER = int(os.environ.get('ADMISSION_PER_USER', '2'))
+ADMISSION_RESERVED = int(os.environ.get('ADMISSION_RESERVED', '2'))
+ADMISSION_WAIT_SECONDS = float(os.environ.get('ADMISSION_WAIT_SECONDS', '20'))
+
+WAIT_SAMPLES = 1000
+
+
+class Job:
+    """受付した1件の処理"""
+
+    def __init__(self, user_key, fn, args):
+        self.user_key = user_key
+        self.fn = fn
+        self.args = args
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.acknowledged = False
+        self.ack_done = threading.Event()
+        self._lock = threading.Lock()
+
+    def acknowledge_if_queued(self, on_ack):
+        """
+        まだ開始していなければ受付済みにして on_ack() を呼ぶ
+        開始との競合の判定だけをロックで行い、on_ack() はロックの外で呼ぶ（開始は on_ack() が終わるまで待つ）
+        戻り値: 受付済みにした場合 True
+        """
+        with self._lock:
+            if self.started_at is not None:
+                return False
+            self.acknowledged = True
+        try:
+            on_ack()
+        finally:
+            self.ack_done.set()
+        return True
+
+    def _start(self):
+        with self._lock:
+            self.started_at = time.monotonic()
+        self.started.set()
+
+
+class FairScheduler:
+    def __init__(self, workers=ADMISSION_WORKERS, per_user=ADMISSION_PER_USER, reserved=ADMISSION_RESERVED):
+        self.workers = workers
+        self.per_user = per_user
+        # 他に待ちがない時に1ユーザーが使える上限
+        self.burst = max(per_user, workers - reserved)
+        self._cond = threading.Condition()
+        self._queues = defaultdict(deque)   # ユーザー → 待ちの処理
+        self._ring = deque()                # 待ちのあるユーザー（ラウンドロビンの順番）
+        self._running = defaultdict(int)    # ユーザー → 実行中の件数
+        self._threads = []
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'acknowledged': 0}
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f'admission-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, user_key, fn, *args):
+        """処理を受け付ける（戻り値: Job）"""
+        job = Job(user_key, fn, args)
+        with self._cond:
+            self._ensure_workers()
+            if not self._queues[user_key]:
+                self._ring.append(user_key)
+            self._queues[user_key].append(job)
+            self._counters['submitted'] += 1
+            self._cond.notify()
+        return job
+
+    def _next_job(self):
+        """次に実行する処理（同時実行上限に達していないユーザーを順番に選ぶ）"""
+        # 待ちのあるユーザーが1人だけなら予備を残して上限を広げる
+        limit = self.burst if len(self._ring) == 1 else self.per_user
+        for _ in range(len(self._ring)):
+            user_key = self._ring.popleft()
+            queue = self._queues[user_key]
+            if self._running[user_key] >= limit:
+                self._ring.append(user_key)
+                continue
+            job = queue.popleft()
+            if queue:
+                self._ring.append(user_key)
+            else:
+                del self._queues[user_key]
+            self._running[user_key] += 1
+            return job
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+            job._start()
+            self._waits.append(job.started_at - job.enqueued_at)
+            if job.acknowledged:
+                # 受付済みの返信（保存・返信）が終わってから処理する
+                job.ack_done.wait()
+            failed = False
+            try:
+                job.fn(*job.args)
+            except Exception as e:
+                failed = True
+                print(f'[admission] Job error ({job.user_key}): {e}')
+            finally:
+                job.done.set()
+                with self._cond:
+                    self._running[job.user_key] -= 1
+                    if not self._running[job.user_key]:
+                        del self._running[job.user_key]
+                    self._counters['failed' if failed else 'completed'] += 1
+                    # 上限で止まっていたユーザーの処理を再開できるので起こす
+                    self._cond.notify_all()
+
+    def wait(self, jobs, timeout, on_queued):
+        """
+        受け付けた処理を timeout 秒まで待つ
+        開始できなかった処理は on_queued(job) を呼んで受付済みにする
+        """
+        deadline = time.monotonic() + timeout
+        for job in jobs:
+            if not job.started.wait(max(0.0, deadline - time.monotonic())):
+                if job.acknowledge_if_queued(lambda: on_queued(job)):
+                    with self._cond:
+                        self._counters['acknowledged'] += 1
+                    continue
+            job.done.wait(max(0.0, deadline - time.monotonic()))
+
+    def metrics(self):
+        """待ち件数・実行中件数・待ち時間（直近 WAIT_SAMPLES 件の p50/p95 秒）"""
+        with self._cond:
+            depth = {user: len(q) for user, q in self._queues.items()}
+            running = dict(self._running)
+            counters = dict(self._counters)
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p / 100 * len(waits)))], 3) if waits else 0.0
+
+        return {
+            'queue_depth': sum(depth.values()),
+            'queued_users': len(depth),
+            'top_queues': sorted(depth.items(), key=lambda kv: -kv[1])[:5],
+            'running': sum(running.values()),
+            'workers': self.workers,
+            'per_user': self.per_user,
+            'wait_p50': percentile(50),
+            'wait_p95': percentile(95),
+            **counters,
+        }
+
+
+SCHEDULER = FairScheduler()
@@ -0,0 +1,129 @@
+"""
+書類の一括分類（保留キュー・イベント再処理などの滞留分用）
+
+Gemini障害の復旧後やまとめて取り込んだ書類を1件ずつ classify_document_with_gemini に通すと、
+書類の数だけリクエストが出て、そのたびに同じ分類プロンプトを送ることになる。
+ここでは複数の書類を1リクエストにまとめ（書類ごとに document_id を付けて送り、結果も document_id 付きで
+受け取る）、結果を書類ごとに振り分けて、1件ずつ分類した場合と同じ形の分類結果を返す。
+
+- 1リクエストの書類数は GEMINI_BATCH_SIZE 件まで、合計サイズは GEMINI_BATCH_MAX_BYTES まで
+- PDFはページに分割し（pdf_pages.split_pdf_pages）、ページ単位でまとめて分類してから書類ごとにマージする。
+  ページ分類キャッシュにあるページは送らず、分類できたページはキャッシュに保存する
+- 結果が欠けた・読めなかった書類は1件ずつの分類でやり直す
+- 障害（deferrable）の応答はまとめた全書類を deferrable として返す（障害中に1件ずつやり直さない）
+
+※ Gemini の非同期バッチAPIは結果が返るまで長いと数時間かかり、お客様への結果通知が遅れるため使わない。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf_pages import load_cached_page, merge_page_classifications, save_cached_page, split_pdf_pages
+
+GEMINI_BATCH_SIZE = int(os.environ.get('GEMINI_BATCH_SIZE', '8'))
+# インラインデータはリクエスト全体で20MBまで（base64で4/3倍になる）
+GEMINI_BATCH_MAX_BYTES = int(os.environ.get('GEMINI_BATCH_MAX_BYTES', str(12 * 1024 * 1024)))
+GEMINI_BATCH_WORKERS = int(os.environ.get('GEMINI_BATCH_WORKERS', '4'))
+
+PDF_MIME_TYPE = 'application/pdf'
+
+_stats_lock = threading.Lock()
+STATS = {'documents': 0, 'units': 0, 'cached': 0, 'batch_requests': 0, 'fallback_requests': 0}
+
+
+def _count(**kwargs):
+    with _stats_lock:
+        for key, value in kwargs.items():
+            STATS[key] += value
+
+
+def pack(sizes, max_docs=None, max_bytes=None):
+    """
+    書類サイズのリスト → リクエストごとの添字のリスト（順番は保つ）
+    1件で max_bytes を超える書類は単独のリクエストにする
+    """
+    max_docs = max(1, max_docs or GEMINI_BATCH_SIZE)
+    max_bytes = max_bytes or GEMINI_BATCH_MAX_BYTES
+    batches, current, current_bytes = [], [], 0
+    for i, size in enumerate(sizes):
+        if current and (len(current) >= max_docs or current_bytes + size > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(i)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def classify_many(documents, classify_batch_fn, classify_fn, batch_size=None, max_bytes=None, workers=None):
+    """
+    複数の書類を一括で分類する
+    documents: [(content, mime_type), ...]
+    classify_batch_fn(units) -> units と同じ順の分類結果（結果が返らなかったものは None）
+    classify_fn(content, mime_type) -> 分類結果（1件ずつの分類。やり直しに使う）
+    戻り値: documents と同じ順の分類結果
+    """
+    # 書類 → 分類単位（画像は1件、PDFはページごと）。キャッシュ済みのページはここで結果を埋める
+    units = []          # [(content, mime_type, page_hash or None)]
+    layout = []         # 書類ごとの [単位の添字 or キャッシュ済みの結果]
+    cached = 0
+    for content, mime_type in documents:
+        if mime_type != PDF_MIME_TYPE:
+            layout.append([len(units)])
+            units.append((content, mime_type, None))
+            continue
+        slots = []
+        for page_bytes, page_hash in split_pdf_pages(content):
+            hit = load_cached_page(page_hash)
+            if hit is not None:
+                slots.append(hit)
+                cached += 1
+            else:
+                slots.append(len(units))
+                units.append((page_bytes, PDF_MIME_TYPE, page_hash))
+        layout.append(slots)
+
+    results = [None] * len(units)
+    batches = pack([len(u[0]) for u in units], batch_size, max_bytes)
+
+    def run_batch(indexes):
+        if len(indexes) == 1:
+            # 1件だけなら通常の分類と同じリクエストにする
+            content, mime_type, _ = units[indexes[0]]
+            _count(fallback_requests=1)
+            return indexes, [classify_fn(content, mime_type)]
+        _count(batch_requests=1)
+        return indexes, classify_batch_fn([(units[i][0], units[i][1]) for i in indexes])
+
+    def run_single(index):
+        content, mime_type, _ = units[index]
+        _count(fallback_requests=1)
+        return index, classify_fn(content, mime_type)
+
+    workers = max(1, min(workers or GEMINI_BATCH_WORKERS, len(batches) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for indexes, batch_results in executor.map(run_batch, batches):
+            for i, classification in zip(indexes, batch_results):
+                results[i] = classification
+
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            print(f'[batch] {len(missing)}/{len(units)} documents missing from batch results, classifying one by one')
+            for index, classification in executor.map(run_single, missing):
+                results[index] = classification
+
+    for (content, mime_type, page_hash), classification in zip(units, results):
+        if page_hash is not None:
+            save_cached_page(page_hash, classification)
+
+    _count(documents=len(documents), units=len(units), cached=cached)
+
+    merged = []
+    for (content, mime_type), slots in zip(documents, layout):
+        pages = [results[s] if isinstance(s, int) else s for s in slots]
+        if mime_type == PDF_MIME_TYPE and len(pages) > 1:
+            merged.append(merge_page_classifications(pages))
+        else:
+            merged.append(pages[0])
+    return merged
@@ -0,0 +1,167 @@
+"""
+LINEチャネル（テナント）レジストリ
+
+チャネルごとの設定（シークレット、アクセストークン、顧客管理シートID、
+列構成、顧客コードのプレフィックス）を起動時に1回だけ読み込み、
+destination（Bot User ID）や顧客コードのプレフィックスから
+辞書1回の参照でチャネルを特定できるようにする。
+
+設定は環境変数 CHANNELS_CONFIG（JSON文字列）または CHANNELS_CONFIG_PATH（JSONファイル）で指定する。
+未指定の場合は従来の環境変数から MK / KZ の2チャネルを組み立てる。
+
+設定例:
+    {
+      "MK": {
+        "name": "まるなげ経理",
+        "secret_env": "LINE_CHANNEL_SECRET",
+        "access_token_env": "LINE_CHANNEL_ACCESS_TOKEN",
+        "bot_user_id_env": "MK_BOT_USER_ID",
+        "sheet_id_env": "CUSTOMER_SHEET_ID",
+        "code_prefix": "MK",
+        "columns": {"line_id": 0, "name": 1, "folder_id": 2, "registered_at": 3,
+                    "notified": 4, "code": 6, "status": 7, "trial_count": 10},
+        "trial_defaults": {"notified": false}
+      }
+    }
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+
+DEFAULT_CHANNEL_KEY = os.environ.get('DEFAULT_CHANNEL_KEY', 'MK')
+
+# 顧客コード: 英字プレフィックス + 3桁数字（MK001, KZ123 など）
+CODE_PATTERN = re.compile(r'^([A-Z]+)(\d{3})$')
+CODE_PREFIX_PATTERN = re.compile(r'^([A-Z]+)')
+
+DEFAULT_CONFIG = {
+    # MK（まるなげ経理）: A=LINE ID, B=顧客名, C=フォルダID, D=登録日, E=通知済, F=送信日, G=コード, H=ステータス, K=お試し回数, O=プラン
+    'MK': {
+        'name': 'まるなげ経理',
+        'secret_env': 'LINE_CHANNEL_SECRET',
+        'access_token_env': 'LINE_CHANNEL_ACCESS_TOKEN',
+        'bot_user_id_env': 'MK_BOT_USER_ID',
+        'sheet_id_env': 'CUSTOMER_SHEET_ID',
+        'code_prefix': 'MK',
+        'columns': {'line_id': 0, 'name': 1, 'folder_id': 2, 'registered_at': 3,
+                    'notified': 4, 'code': 6, 'status': 7, 'trial_count': 10, 'plan': 14},
+        'trial_defaults': {'notified': False},
+    },
+    # KZ（絆パートナーズ）: A=LINE ID, B=顧客名, C=フォルダID, D=登録日, E=コード, F=ステータス, K=お試し回数, L=顧客スプシURL
+    'KZ': {
+        'name': '絆パートナーズ経理',
+        'secret_env': 'KZ_LINE_CHANNEL_SECRET',
+        'access_token_env': 'KZ_LINE_CHANNEL_ACCESS_TOKEN',
+        'bot_user_id_env': 'KZ_BOT_USER_ID',
+        'sheet_id_env': 'KZ_CUSTOMER_SHEET_ID',
+        'code_prefix': 'KZ',
+        'columns': {'line_id': 0, 'name': 1, 'folder_id': 2, 'registered_at': 3,
+                    'code': 4, 'status': 5, 'trial_count': 10, 'spreadsheet_url': 11},
+        'trial_defaults': {},
+    },
+}
+
+
+def col_letter(index):
+    """0始まりの列番号を列記号に変換（0 → A, 26 → AA）"""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def _resolve(entry, key):
+    """設定値を取得（xxx_env があれば環境変数から読む）"""
+    if entry.get(key):
+        return entry[key]
+    env_name = entry.get(f'{key}_env')
+    return os.environ.get(env_name, '') if env_name else ''
+
+
+def _build_channel(key, entry):
+    columns = dict(entry.get('columns', {}))
+    secret = _resolve(entry, 'secret')
+    return {
+        'key': key,
+        'name': entry.get('name', key),
+        'secret': secret,
+        'access_token': _resolve(entry, 'access_token'),
+        'bot_user_id': _resolve(entry, 'bot_user_id'),
+        'sheet_id': _resolve(entry, 'sheet_id'),
+        'code_prefix': entry.get('code_prefix', key),
+        'columns': columns,
+        'trial_defaults': dict(entry.get('trial_defaults', {})),
+        # HMAC鍵は事前に1回だけ初期化し、リクエストごとに copy() して使う
+        '_hmac': hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256) if secret else None,
+    }
+
+
+def load_config():
+    """チャネル設定を読み込む（CHANNELS_CONFIG → CHANNELS_CONFIG_PATH → デフォルト）"""
+    raw = os.environ.get('CHANNELS_CONFIG', '')
+    path = os.environ.get('CHANNELS_CONFIG_PATH', '')
+    try:
+        if raw:
+            return json.loads(raw)
+        if path:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f'[channel] Failed to load channel config, using defaults: {e}')
+    return DEFAULT_CONFIG
+
+
+class ChannelRegistry:
+    def __init__(self, config, default_key=DEFAULT_CHANNEL_KEY):
+        self.channels = {key: _build_channel(key, entry) for key, entry in config.items()}
+        if default_key not in self.channels:
+            default_key = next(iter(self.channels))
+        self.default_key = default_key
+        self.by_destination = {ch['bot_user_id']: key for key, ch in self.channels.items() if ch['bot_user_id']}
+        self.by_prefix = {ch['code_prefix']: key for key, ch in self.channels.items()}
+
+    def get(self, channel_key):
+        """チャネルキーからチャネル設定を取得（不明ならデフォルトチャネル）"""
+        return self.channels.get(channel_key) or self.channels[self.default_key]
+
+    def key_for_destination(self, destination):
+        """destination（Bot User ID）からチャネルキーを取得（不明ならNone）"""
+        return self.by_destination.get(destination)
+
+    def learn_destination(self, destination, channel_key):
+        """署名で特定できた destination を記録し、次回から辞書参照で判定する"""
+        if destination and channel_key in self.channels:
+            self.by_destination[destination] = channel_key
+
+    def key_for_code(self, customer_code):
+        """顧客コードのプレフィックスからチャネルキーを取得（不明ならNone）"""
+        if not customer_code:
+            return None
+        match = CODE_PREFIX_PATTERN.match(customer_code)
+        return self.by_prefix.get(match.group(1)) if match else None
+
+    def for_code(self, customer_code):
+        """顧客コードに対応するチャネル設定（不明ならデフォルトチャネル）"""
+        return self.get(self.key_for_code(customer_code))
+
+    def is_valid_code(self, customer_code):
+        """登録済みプレフィックス + 3桁数字の形式か"""
+        match = CODE_PATTERN.match(customer_code or '')
+        return bool(match) and match.group(1) in self.by_prefix
+
+    def signature_for(self, channel_key, body_bytes):
+        """チャネルのシークレットで計算した署名（シークレット未設定ならNone）"""
+        keyed = self.channels.get(channel_key, {}).get('_hmac')
+        if keyed is None:
+            return None
+        mac = keyed.copy()
+        mac.update(body_bytes)
+        return base64.b64encode(mac.digest()).decode('utf-8')
+
+
+REGISTRY = ChannelRegistry(load_config())
@@ -0,0 +1,81 @@
+"""
+サーキットブレーカー
+
+外部API（Gemini）の障害時に、連続エラーが閾値を超えたら一定時間
+呼び出しを止めて即座に失敗させる（タイムアウト待ちを繰り返さない）。
+
+状態:
+- closed:    通常どおり呼び出す
+- open:      呼び出さずに即失敗。cooldown経過後に half_open へ
+- half_open: 試行として1リクエストだけ通し、成功なら closed、失敗なら open に戻る
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, cooldown_seconds=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._on_close = []
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self):
+        """呼び出してよいか判定（open中はFalse、half_open中は1件だけTrue）"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            was_closed = self._state == CLOSED
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+            callbacks = [] if was_closed else list(self._on_close)
+        if not was_closed:
+            print(f'[breaker:{self.name}] closed')
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f'[breaker:{self.name}] on_close callback error: {e}')
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    print(f'[breaker:{self.name}] open (failures={self._failures})')
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def on_close(self, callback):
+        """open/half_open → closed に戻った時に呼ぶコールバックを登録"""
+        self._on_close.append(callback)
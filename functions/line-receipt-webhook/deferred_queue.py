@@ -0,0 +1,245 @@
+"""
+分類保留キュー
+
+Gemini障害中（サーキットブレーカーが open）に受け取った書類を保存し、
+ブレーカーが closed に戻った時点で分類をやり直すためのキュー。
+1件ごとに メタデータ(.json) と ファイル本体(.bin) をディレクトリに保存する。
+
+- 保存した本体が受け取った書類の原本になる（お試しでフォルダのない顧客も含む）。Cloud Functions の /tmp は
+  インスタンスごとに消えるため、本番では DEFERRED_QUEUE_DIR を EVENT_JOURNAL_DIR と同じ永続ボリュームに向ける
+- 処理はブレーカーが閉じたインスタンスのほか、定期実行（/usage/drain）でどのインスタンスからでも行う。
+  claims（set(only_if_absent, ttl) / delete を持つキャッシュ、line-receipt-webhook では shared_cache.py）を渡すと、
+  エントリごとに処理中の印を付け、別のインスタンスが処理中のエントリは飛ばす（DEFERRED_CLAIM_SECONDS で期限切れ）
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+DEFERRED_QUEUE_DIR = os.environ.get('DEFERRED_QUEUE_DIR', '/tmp/deferred_queue')
+DEFERRED_MAX_ATTEMPTS = int(os.environ.get('DEFERRED_MAX_ATTEMPTS', '5'))
+DEFERRED_CLAIM_SECONDS = float(os.environ.get('DEFERRED_CLAIM_SECONDS', '900'))
+
+_drain_lock = threading.Lock()
+
+
+def _meta_path(entry_id):
+    return os.path.join(DEFERRED_QUEUE_DIR, f'{entry_id}.json')
+
+
+def _content_path(entry_id):
+    return os.path.join(DEFERRED_QUEUE_DIR, f'{entry_id}.bin')
+
+
+def enqueue(content, meta):
+    """
+    書類を保留キューに追加
+    meta: user_id, channel_key, folder_id, status, filename, mime_type など
+    戻り値: エントリID（保存失敗時はNone）
+    """
+    try:
+        os.makedirs(DEFERRED_QUEUE_DIR, exist_ok=True)
+        entry_id = f'{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}'
+        with open(_content_path(entry_id), 'wb') as f:
+            f.write(content)
+        entry = dict(meta, id=entry_id, attempts=0, enqueued_at=time.time())
+        tmp_path = _meta_path(entry_id) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, _meta_path(entry_id))
+        print(f'[deferred] Enqueued {entry_id} ({meta.get("filename", "")})')
+        return entry_id
+    except Exception as e:
+        print(f'[deferred] Enqueue error: {e}')
+        return None
+
+
+def pending_entries():
+    """保留中のエントリを古い順に返す"""
+    try:
+        names = sorted(n for n in os.listdir(DEFERRED_QUEUE_DIR) if n.endswith('.json'))
+    except FileNotFoundError:
+        return []
+    entries = []
+    for name in names:
+        try:
+            with open(os.path.join(DEFERRED_QUEUE_DIR, name), 'r', encoding='utf-8') as f:
+                entries.append(json.load(f))
+        except Exception as e:
+            print(f'[deferred] Read error ({name}): {e}')
+    return entries
+
+
+def load_content(entry_id):
+    with open(_content_path(entry_id), 'rb') as f:
+        return f.read()
+
+
+def complete(entry_id):
+    """処理完了したエントリを削除"""
+    for path in (_meta_path(entry_id), _content_path(entry_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def record_attempt(entry):
+    """再試行回数を記録。上限に達したらFalseを返す"""
+    entry['attempts'] = entry.get('attempts', 0) + 1
+    try:
+        with open(_meta_path(entry['id']), 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+    except Exception as e:
+        print(f'[deferred] Update error: {e}')
+    return entry['attempts'] < DEFERRED_MAX_ATTEMPTS
+
+
+def _settle(entry, ok, on_give_up):
+    """
+    処理結果を反映する。成功なら削除、失敗なら再試行回数を記録（上限なら on_give_up を呼んで破棄）
+    戻り値: 続けて次のエントリを処理してよいか（まだ障害が続いていればFalse）
+    """
+    if ok:
+        complete(entry['id'])
+        return True
+    if not record_attempt(entry):
+        print(f'[deferred] Giving up on {entry["id"]} after {entry["attempts"]} attempts')
+        if on_give_up:
+            on_give_up(entry)
+        complete(entry['id'])
+        return True
+    return False
+
+
+def _claim(entry, claims):
+    """処理中の印を付ける（別のインスタンスが処理中ならFalse）"""
+    return claims is None or claims.set(entry['id'], True, only_if_absent=True, ttl=DEFERRED_CLAIM_SECONDS)
+
+
+def _release(entry, claims):
+    if claims is not None:
+        claims.delete(entry['id'])
+
+
+def take(entry_id, claims=None):
+    """
+    drain を通さずに1件だけ処理する前に処理中の印を付ける（処理後は complete か release）
+    戻り値: 処理してよいか（処理済み・別のインスタンスが処理中ならFalse）
+    """
+    entry = {'id': entry_id}
+    if not _claim(entry, claims):
+        return False
+    if not os.path.exists(_meta_path(entry_id)):
+        _release(entry, claims)
+        return False
+    return True
+
+
+def release(entry_id, claims=None):
+    """take で付けた処理中の印を外す（エントリは残り、次の drain で処理される）"""
+    _release({'id': entry_id}, claims)
+
+
+def _load(entry):
+    """本体を読む（消えていればエントリも削除してNone）"""
+    try:
+        return load_content(entry['id'])
+    except FileNotFoundError:
+        complete(entry['id'])
+        return None
+
+
+def drain(process_fn, limit=None, on_give_up=None, claims=None):
+    """
+    保留キューを古い順に処理する（同時に1スレッドのみ、別のインスタンスが処理中のエントリは飛ばす）
+    process_fn(entry, content) が True を返したエントリは削除、
+    False の場合は残して次回再試行（上限回数を超えたら on_give_up(entry) を呼んで破棄）
+    戻り値: 処理できた件数
+    """
+    if not _drain_lock.acquire(blocking=False):
+        return 0
+    done = 0
+    try:
+        for entry in pending_entries():
+            if limit is not None and done >= limit:
+                break
+            if not _claim(entry, claims):
+                continue
+            try:
+                content = _load(entry)
+                if content is None:
+                    continue
+                ok = process_fn(entry, content)
+                done += 1 if ok else 0
+                keep_going = _settle(entry, ok, on_give_up)
+            finally:
+                _release(entry, claims)
+            if not keep_going:
+                # まだ障害が続いている場合はここで中断
+                break
+    finally:
+        _drain_lock.release()
+    if done:
+        print(f'[deferred] Drained {done} entr{"y" if done == 1 else "ies"}')
+    return done
+
+
+def drain_batch(process_batch_fn, batch_size, limit=None, on_give_up=None, claims=None):
+    """
+    保留キューを batch_size 件ずつまとめて処理する（drain の一括版、batch_classify.py で分類する）
+    process_batch_fn([(entry, content), ...]) は同じ順の True/False のリストを返す
+    False のエントリは drain と同じく再試行回数を記録し、再試行するものが1件でもあればそこで中断する
+    戻り値: 処理できた件数
+    """
+    if not _drain_lock.acquire(blocking=False):
+        return 0
+    done = 0
+    try:
+        entries = pending_entries()
+        if limit is not None:
+            entries = entries[:limit]
+        for start in range(0, len(entries), max(1, batch_size)):
+            items = []
+            for entry in entries[start:start + batch_size]:
+                if not _claim(entry, claims):
+                    continue
+                content = _load(entry)
+                if content is not None:
+                    items.append((entry, content))
+                else:
+                    _release(entry, claims)
+            if not items:
+                continue
+            keep_going = True
+            try:
+                outcomes = process_batch_fn(items)
+                for (entry, _), ok in zip(items, outcomes):
+                    done += 1 if ok else 0
+                    keep_going = _settle(entry, ok, on_give_up) and keep_going
+            finally:
+                for entry, _ in items:
+                    _release(entry, claims)
+            if not keep_going:
+                break
+    finally:
+        _drain_lock.release()
+    if done:
+        print(f'[deferred] Drained {done} entr{"y" if done == 1 else "ies"} in batches of {batch_size}')
+    return done
+
+
+def drain_in_background(process_fn, on_give_up=None, process_batch_fn=None, batch_size=1, claims=None):
+    """
+    別スレッドで保留キューを処理（リクエスト処理をブロックしない）
+    process_batch_fn を渡し batch_size が2以上なら drain_batch でまとめて処理する
+    """
+    if process_batch_fn is not None and batch_size > 1:
+        thread = threading.Thread(target=drain_batch, args=(process_batch_fn, batch_size),
+                                  kwargs={'on_give_up': on_give_up, 'claims': claims}, daemon=True)
+    else:
+        thread = threading.Thread(target=drain, args=(process_fn,),
+                                  kwargs={'on_give_up': on_give_up, 'claims': claims}, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,288 @@
+"""
+Webhookイベントのジャーナル（追記のみ）
+
+署名検証済みのイベントを日ごとのファイル（YYYY-MM-DD.jsonl）に1行ずつ追記し、
+ダウンロードした画像・PDFは内容のハッシュ名で content/ に保存する。
+SQLiteの索引（index.db）で イベントID・ユーザー・受信時刻 から行の位置を引けるため、
+期間やユーザーを指定した再処理（tools/replay_events.py）で全ファイルを読む必要がない。
+
+- イベントIDは LINE の webhookEventId（再送されたイベントは同じIDなので1回だけ記録）
+- 処理結果の分類（receipt / unknown など）を索引に記録し、「unknown だったものだけ再処理」ができる
+- EVENT_JOURNAL_RETENTION_DAYS を過ぎた日のファイルと、どのイベントからも参照されない保存済みファイルは削除する
+
+※ Cloud Functions の /tmp はインスタンスごとに消えるため、本番では EVENT_JOURNAL_DIR を
+   永続ボリューム（Cloud Storage FUSE など）に向ける。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+EVENT_JOURNAL_DIR = os.environ.get('EVENT_JOURNAL_DIR', '/tmp/event_journal')
+EVENT_JOURNAL_RETENTION_DAYS = int(os.environ.get('EVENT_JOURNAL_RETENTION_DAYS', '30'))
+EVENT_JOURNAL_ENABLED = os.environ.get('EVENT_JOURNAL_ENABLED', '1') == '1'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    event_id TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    received_at REAL NOT NULL,
+    channel_key TEXT NOT NULL,
+    user_id TEXT,
+    event_type TEXT,
+    message_id TEXT,
+    content_sha TEXT,
+    outcome TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_received ON events (received_at);
+CREATE INDEX IF NOT EXISTS idx_events_user ON events (user_id, received_at);
+CREATE INDEX IF NOT EXISTS idx_events_message ON events (message_id);
+CREATE TABLE IF NOT EXISTS replays (
+    run_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (run_id, event_id)
+);
+'''
+
+_write_lock = threading.Lock()
+_local = threading.local()
+_last_pruned_day = None
+
+
+def _segment_path(day):
+    return os.path.join(EVENT_JOURNAL_DIR, f'{day}.jsonl')
+
+
+def _content_path(sha):
+    return os.path.join(EVENT_JOURNAL_DIR, 'content', sha[:2], f'{sha}.bin')
+
+
+def _connect():
+    """索引DBに接続（スレッドごとに接続を使い回す）"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(EVENT_JOURNAL_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(EVENT_JOURNAL_DIR, 'index.db'), timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def event_id_of(event):
+    """イベントID（webhookEventId。古い形式のイベントはメッセージIDか内容のハッシュ）"""
+    if event.get('webhookEventId'):
+        return event['webhookEventId']
+    message_id = event.get('message', {}).get('id')
+    if message_id:
+        return f'message:{message_id}'
+    return 'sha:' + hashlib.sha256(json.dumps(event, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+def append(events, channel_key):
+    """
+    署名検証済みのイベントを記録（記録済みのイベントIDは飛ばす）
+    戻り値: 新しく記録した件数
+    """
+    if not EVENT_JOURNAL_ENABLED or not events:
+        return 0
+    try:
+        now = time.time()
+        day = datetime.fromtimestamp(now).strftime('%Y-%m-%d')
+        with _write_lock:
+            conn = _connect()
+            ids = [event_id_of(e) for e in events]
+            placeholders = ','.join('?' * len(ids))
+            known = {row[0] for row in conn.execute(
+                f'SELECT event_id FROM events WHERE event_id IN ({placeholders})', ids)}
+            rows = []
+            with open(_segment_path(day), 'ab') as f:
+                offset = f.tell()
+                for event_id, event in zip(ids, events):
+                    if event_id in known:
+                        continue
+                    known.add(event_id)
+                    line = json.dumps({'event_id': event_id, 'received_at': now,
+                                       'channel_key': channel_key, 'event': event},
+                                      ensure_ascii=False).encode('utf-8') + b'\n'
+                    f.write(line)
+                    rows.append((event_id, day, offset, len(line), now, channel_key,
+                                 event.get('source', {}).get('userId'), _event_type(event),
+                                 event.get('message', {}).get('id')))
+                    offset += len(line)
+            with conn:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO events (event_id, day, offset, length, received_at, channel_key, '
+                    'user_id, event_type, message_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        _prune_on_new_day(day)
+        return len(rows)
+    except Exception as e:
+        print(f'[journal] Append error: {e}')
+        return 0
+
+
+def _event_type(event):
+    """message は中身の種類まで（message:image など）"""
+    if event.get('type') == 'message':
+        return f'message:{event.get("message", {}).get("type", "")}'
+    return event.get('type', '')
+
+
+def attach_content(message_id, content):
+    """ダウンロードした画像・PDFを保存し、そのメッセージのイベントに紐付ける"""
+    if not EVENT_JOURNAL_ENABLED or not content:
+        return
+    try:
+        sha = hashlib.sha256(content).hexdigest()
+        path = _content_path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        conn = _connect()
+        with conn:
+            conn.execute('UPDATE events SET content_sha = ? WHERE message_id = ?', (sha, str(message_id)))
+    except Exception as e:
+        print(f'[journal] Content save error ({message_id}): {e}')
+
+
+def load_content(message_id):
+    """記録済みの画像・PDF（なければNone）"""
+    if not EVENT_JOURNAL_ENABLED:
+        return None
+    try:
+        row = _connect().execute(
+            'SELECT content_sha FROM events WHERE message_id = ? AND content_sha IS NOT NULL LIMIT 1',
+            (str(message_id),)).fetchone()
+        if row is None:
+            return None
+        with open(_content_path(row['content_sha']), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f'[journal] Content read error ({message_id}): {e}')
+        return None
+
+
+def record_outcome(event, outcome):
+    """処理結果（分類カテゴリなど）を記録"""
+    if not EVENT_JOURNAL_ENABLED:
+        return
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('UPDATE events SET outcome = ? WHERE event_id = ?', (outcome, event_id_of(event)))
+    except Exception as e:
+        print(f'[journal] Outcome error: {e}')
+
+
+def find(since=None, until=None, user_id=None, event_types=None, outcomes=None, channel_key=None, limit=None):
+    """
+    条件に合うイベントの索引行を受信順に返す
+    since / until: 受信時刻（UNIX秒）の範囲 [since, until)
+    """
+    clauses, params = [], []
+    if since is not None:
+        clauses.append('received_at >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('received_at < ?')
+        params.append(until)
+    if user_id:
+        clauses.append('user_id = ?')
+        params.append(user_id)
+    if channel_key:
+        clauses.append('channel_key = ?')
+        params.append(channel_key)
+    for column, values in (('event_type', event_types), ('outcome', outcomes)):
+        if values:
+            clauses.append(f'{column} IN ({",".join("?" * len(values))})')
+            params.extend(values)
+    sql = 'SELECT * FROM events'
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY received_at, day, offset'
+    if limit:
+        sql += f' LIMIT {int(limit)}'
+    return [dict(row) for row in _connect().execute(sql, params)]
+
+
+def read_events(rows):
+    """
+    索引行からイベント本体を読む（日ごとのファイルを1回ずつ開き、位置を指定して読む）
+    戻り値: [(索引行, 記録内容 {'event_id', 'received_at', 'channel_key', 'event'})]
+    """
+    results = []
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row['day'], []).append(row)
+    for day, day_rows in sorted(by_day.items()):
+        with open(_segment_path(day), 'rb') as f:
+            for row in sorted(day_rows, key=lambda r: r['offset']):
+                f.seek(row['offset'])
+                results.append((row, json.loads(f.read(row['length']))))
+    results.sort(key=lambda item: (item[0]['received_at'], item[0]['day'], item[0]['offset']))
+    return results
+
+
+def replayed_event_ids(run_id):
+    """再処理が完了したイベントID（同じ run_id で再実行したときに飛ばす）"""
+    return {row[0] for row in _connect().execute(
+        "SELECT event_id FROM replays WHERE run_id = ? AND status = 'done'", (run_id,))}
+
+
+def record_replay(run_id, event_id, status):
+    conn = _connect()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO replays (run_id, event_id, status, finished_at) VALUES (?, ?, ?, ?)',
+                     (run_id, event_id, status, time.time()))
+
+
+def _prune_on_new_day(day):
+    """日が変わって最初の記録のときに古い記録を削除"""
+    global _last_pruned_day
+    if _last_pruned_day == day:
+        return
+    _last_pruned_day = day
+    threading.Thread(target=prune, daemon=True).start()
+
+
+def prune(retention_days=None):
+    """保存期間を過ぎた日のファイル・索引と、参照されなくなった画像・PDFを削除"""
+    retention_days = EVENT_JOURNAL_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    try:
+        with _write_lock:
+            conn = _connect()
+            with conn:
+                conn.execute('DELETE FROM events WHERE day < ?', (cutoff,))
+                conn.execute('DELETE FROM replays WHERE event_id NOT IN (SELECT event_id FROM events)')
+            for name in os.listdir(EVENT_JOURNAL_DIR):
+                if name.endswith('.jsonl') and name[:-len('.jsonl')] < cutoff:
+                    os.remove(os.path.join(EVENT_JOURNAL_DIR, name))
+            used = {row[0] for row in conn.execute('SELECT DISTINCT content_sha FROM events WHERE content_sha IS NOT NULL')}
+            content_dir = os.path.join(EVENT_JOURNAL_DIR, 'content')
+            removed = 0
+            for root, _, files in os.walk(content_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    # 保存直後でまだ索引に紐付いていないファイルは残す
+                    if (name.endswith('.bin') and name[:-len('.bin')] not in used
+                            and os.path.getmtime(path) < time.time() - 3600):
+                        os.remove(path)
+                        removed += 1
+        print(f'[journal] Pruned entries before {cutoff} ({removed} content files)')
+    except Exception as e:
+        print(f'[journal] Prune error: {e}')
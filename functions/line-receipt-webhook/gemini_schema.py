@@ -0,0 +1,421 @@
+"""
+Gemini 構造化出力（JSONスキーマ指定）とレスポンスの型付きパーサー
+
+generationConfig に responseMimeType='application/json' と responseSchema を指定し、
+Gemini に決まった形のJSONだけを返させる。レスポンスは dataclass に変換して扱う。
+
+- Classification: 書類分類（receipt / passbook / credit_slip / unknown）
+  複数の書類をまとめて分類する場合は BATCH_CLASSIFICATION_SCHEMA（書類IDごとの結果の配列）
+- ReceiptOCR:     領収書OCR（Service_OCR.gs の buildOCRPrompt_ と同じ項目）
+- PassbookPage:   通帳OCR（PassbookEngine.gs の buildPassbookOCRPrompt_ と同じ項目）
+"""
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+CATEGORIES = ['receipt', 'passbook', 'credit_slip', 'unknown']
+
+
+# ============================================================
+# レスポンススキーマ（Gemini responseSchema 形式）
+# ============================================================
+
+CLASSIFICATION_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'category': {'type': 'STRING', 'enum': CATEGORIES},
+        'confidence': {'type': 'NUMBER'},
+        'receipt': {
+            'type': 'OBJECT',
+            'nullable': True,
+            'properties': {
+                'date': {'type': 'STRING'},
+                'store_name': {'type': 'STRING'},
+                'amount': {'type': 'INTEGER', 'nullable': True},
+            },
+        },
+        'passbook': {
+            'type': 'OBJECT',
+            'nullable': True,
+            'properties': {
+                'bank_name': {'type': 'STRING'},
+                'date_range': {'type': 'STRING'},
+                'page_number': {'type': 'INTEGER', 'nullable': True},
+                'first_balance': {'type': 'INTEGER', 'nullable': True},
+                'latest_balance': {'type': 'INTEGER', 'nullable': True},
+            },
+        },
+    },
+    'required': ['category', 'confidence'],
+}
+
+# 複数書類の一括分類: 書類ごとに document_id を付けた Classification の配列
+BATCH_CLASSIFICATION_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'results': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': dict(CLASSIFICATION_SCHEMA['properties'], document_id={'type': 'STRING'}),
+                'required': ['document_id'] + CLASSIFICATION_SCHEMA['required'],
+            },
+        },
+    },
+    'required': ['results'],
+}
+
+RECEIPT_OCR_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'isHandwritten': {'type': 'BOOLEAN'},
+        'date': {'type': 'STRING'},
+        'storeName': {'type': 'STRING'},
+        'totalAmount': {'type': 'INTEGER', 'nullable': True},
+        'invoiceNumber': {'type': 'STRING', 'nullable': True},
+        'items': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'name': {'type': 'STRING'},
+                    'quantity': {'type': 'NUMBER'},
+                    'unitPrice': {'type': 'INTEGER', 'nullable': True},
+                    'amount': {'type': 'INTEGER', 'nullable': True},
+                    'taxMark': {'type': 'STRING', 'nullable': True},
+                },
+            },
+        },
+        'subtotalInfo': {
+            'type': 'OBJECT',
+            'nullable': True,
+            'properties': {
+                key: {'type': 'INTEGER', 'nullable': True}
+                for key in ['subtotal10', 'tax10', 'subtotal8', 'tax8', 'dieselTax',
+                            'bathTax', 'accommodationTax', 'otherNonTaxable']
+            },
+        },
+        'suggestedAccountTitle': {'type': 'STRING', 'nullable': True},
+        'rawText': {'type': 'STRING'},
+        'currency': {'type': 'STRING'},
+    },
+    'required': ['date', 'storeName', 'totalAmount'],
+}
+
+PASSBOOK_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'bankName': {'type': 'STRING'},
+        'accountType': {'type': 'STRING'},
+        'pageNumber': {'type': 'INTEGER', 'nullable': True},
+        'dateRange': {'type': 'STRING'},
+        'transactions': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'date': {'type': 'STRING'},
+                    'description': {'type': 'STRING'},
+                    'withdrawal': {'type': 'INTEGER', 'nullable': True},
+                    'deposit': {'type': 'INTEGER', 'nullable': True},
+                    'balance': {'type': 'INTEGER', 'nullable': True},
+                },
+                'required': ['date', 'balance'],
+            },
+        },
+    },
+    'required': ['transactions'],
+}
+
+
+def structured_generation_config(schema, max_output_tokens, temperature=0.1):
+    """構造化出力用の generationConfig を作成"""
+    return {
+        'temperature': temperature,
+        'maxOutputTokens': max_output_tokens,
+        'responseMimeType': 'application/json',
+        'responseSchema': schema,
+    }
+
+
+# ============================================================
+# 値の変換
+# ============================================================
+
+def to_int(value):
+    """金額を整数に変換（カンマ・円・*を除去、変換できなければNone）"""
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).replace(',', '').replace('円', '').replace('*', '').strip()
+    try:
+        return int(float(text))
+    except ValueError:
+        return None
+
+
+def to_str(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+# ============================================================
+# 型付き結果
+# ============================================================
+
+@dataclass
+class ReceiptData:
+    date: str = ''
+    store_name: str = ''
+    amount: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, d):
+        d = d or {}
+        return cls(
+            date=to_str(d.get('date')),
+            store_name=to_str(d.get('store_name')),
+            amount=to_int(d.get('amount')),
+        )
+
+    def to_dict(self):
+        return {
+            'date': self.date,
+            'store_name': self.store_name,
+            'amount': '' if self.amount is None else self.amount,
+        }
+
+
+@dataclass
+class PassbookData:
+    bank_name: str = ''
+    date_range: str = ''
+    page_number: Optional[int] = None
+    first_balance: Optional[int] = None
+    latest_balance: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, d):
+        d = d or {}
+        return cls(
+            bank_name=to_str(d.get('bank_name')),
+            date_range=to_str(d.get('date_range')),
+            page_number=to_int(d.get('page_number')),
+            first_balance=to_int(d.get('first_balance')),
+            latest_balance=to_int(d.get('latest_balance')),
+        )
+
+    def to_dict(self):
+        return {
+            'bank_name': self.bank_name,
+            'date_range': self.date_range,
+            'page_number': '' if self.page_number is None else self.page_number,
+            'first_balance': '' if self.first_balance is None else self.first_balance,
+            'latest_balance': '' if self.latest_balance is None else self.latest_balance,
+        }
+
+
+@dataclass
+class Classification:
+    category: str = 'unknown'
+    confidence: float = 0.0
+    receipt: Optional[ReceiptData] = None
+    passbook: Optional[PassbookData] = None
+
+    @classmethod
+    def from_dict(cls, d):
+        category = d.get('category')
+        if category not in CATEGORIES:
+            raise ValueError(f'unknown category: {category!r}')
+        # 旧形式（extracted_data）のレスポンスも受け付ける
+        extracted = d.get('extracted_data') or {}
+        receipt = d.get('receipt') or (extracted if category == 'receipt' else None)
+        passbook = d.get('passbook') or (extracted if category == 'passbook' else None)
+        return cls(
+            category=category,
+            confidence=float(d.get('confidence') or 0.0),
+            receipt=ReceiptData.from_dict(receipt) if category == 'receipt' else None,
+            passbook=PassbookData.from_dict(passbook) if category == 'passbook' else None,
+        )
+
+    def to_dict(self):
+        """既存の処理（process_classified_document 等）が使う辞書形式に変換"""
+        if self.category == 'receipt' and self.receipt:
+            extracted = self.receipt.to_dict()
+        elif self.category == 'passbook' and self.passbook:
+            extracted = self.passbook.to_dict()
+        else:
+            extracted = {}
+        return {
+            'category': self.category,
+            'confidence': self.confidence,
+            'extracted_data': extracted,
+        }
+
+
+@dataclass
+class ReceiptItem:
+    name: str = ''
+    quantity: float = 1
+    unit_price: Optional[int] = None
+    amount: int = 0
+    tax_mark: Optional[str] = None
+
+
+@dataclass
+class ReceiptOCR:
+    """領収書OCR結果（Service_OCR.gs parseGeminiResponse_ と同じ変換）"""
+    date: str = ''
+    store_name: str = 'UNKNOWN'
+    total_amount: Optional[int] = None
+    invoice_number: Optional[str] = None
+    items: List[ReceiptItem] = field(default_factory=list)
+    raw_text: str = ''
+    is_handwritten: bool = False
+    subtotal_info: Optional[dict] = None
+    suggested_account_title: Optional[str] = None
+    currency: str = 'JPY'
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            date=to_str(d.get('date')),
+            store_name=' '.join(to_str(d.get('storeName') or 'UNKNOWN').splitlines()).strip(),
+            total_amount=to_int(d.get('totalAmount')),
+            invoice_number=d.get('invoiceNumber') or None,
+            items=[
+                ReceiptItem(
+                    name=to_str(item.get('name')),
+                    quantity=item.get('quantity') or 1,
+                    unit_price=to_int(item.get('unitPrice')),
+                    amount=to_int(item.get('amount')) or 0,
+                    tax_mark=item.get('taxMark') or None,
+                )
+                for item in (d.get('items') or [])
+            ],
+            raw_text=to_str(d.get('rawText')),
+            is_handwritten=d.get('isHandwritten') is True,
+            subtotal_info=d.get('subtotalInfo') or None,
+            suggested_account_title=d.get('suggestedAccountTitle') or None,
+            currency=d.get('currency') or 'JPY',
+        )
+
+
+@dataclass
+class PassbookTransaction:
+    date: str = ''
+    description: str = ''
+    withdrawal: Optional[int] = None
+    deposit: Optional[int] = None
+    balance: Optional[int] = None
+
+
+@dataclass
+class PassbookPage:
+    """通帳OCR結果（PassbookEngine.gs parsePassbookResponse_ と同じ変換）"""
+    bank_name: str = ''
+    account_type: str = ''
+    page_number: Optional[int] = None
+    date_range: str = ''
+    transactions: List[PassbookTransaction] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, d):
+        page_number = None
+        if d.get('pageNumber') is not None:
+            digits = ''.join(ch for ch in str(d['pageNumber']) if ch.isdigit())
+            page_number = int(digits) if digits else None
+        return cls(
+            bank_name=d.get('bankName') or '',
+            account_type=d.get('accountType') or '',
+            page_number=page_number,
+            date_range=d.get('dateRange') or '',
+            transactions=[
+                PassbookTransaction(
+                    date=to_str(tx.get('date')),
+                    description=to_str(tx.get('description')),
+                    withdrawal=to_int(tx.get('withdrawal')),
+                    deposit=to_int(tx.get('deposit')),
+                    balance=to_int(tx.get('balance')),
+                )
+                for tx in (d.get('transactions') or [])
+            ],
+        )
+
+
+# ============================================================
+# パーサー
+# ============================================================
+
+def response_text(api_result):
+    """generateContent のレスポンスから本文テキストを取り出す"""
+    candidates = api_result.get('candidates') or [{}]
+    parts = candidates[0].get('content', {}).get('parts') or [{}]
+    return parts[0].get('text', '')
+
+
+def output_tokens(api_result):
+    """出力トークン数（usageMetadata がなければNone）"""
+    return api_result.get('usageMetadata', {}).get('candidatesTokenCount')
+
+
+def parse_json_text(text):
+    """
+    JSONテキストをパース
+    構造化出力ではそのままパースできるが、コードブロックで囲まれた場合も受け付ける
+    """
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        if text.rstrip().endswith('```'):
+            text = text.rstrip()[:-3]
+    return json.loads(text)
+
+
+def parse_structured_response(api_result, result_type):
+    """
+    構造化出力のレスポンスを型付きオブジェクトに変換
+    result_type: from_dict(dict) を持つ dataclass（Classification, ReceiptOCR, PassbookPage）
+    戻り値: (結果オブジェクト or None, エラー文字列 or None)
+    """
+    text = response_text(api_result)
+    try:
+        data = parse_json_text(text)
+        if not isinstance(data, dict):
+            raise ValueError('response is not an object')
+        return result_type.from_dict(data), None
+    except (ValueError, TypeError, AttributeError) as e:
+        finish_reason = (api_result.get('candidates') or [{}])[0].get('finishReason', 'N/A')
+        print(f'Structured response parse error: {e} (finishReason={finish_reason}) raw={text[:200]}')
+        return None, 'parse'
+
+
+def parse_batch_classifications(api_result, document_ids):
+    """
+    一括分類のレスポンスを書類IDごとの Classification に振り分ける
+    結果がない・読めない・知らないIDの書類は含めない（呼び出し側で1件ずつ分類し直す）
+    戻り値: ({書類ID: Classification}, エラー文字列 or None)
+    """
+    text = response_text(api_result)
+    try:
+        data = parse_json_text(text)
+        results = data.get('results') if isinstance(data, dict) else None
+        if not isinstance(results, list):
+            raise ValueError('response has no results array')
+    except (ValueError, TypeError, AttributeError) as e:
+        finish_reason = (api_result.get('candidates') or [{}])[0].get('finishReason', 'N/A')
+        print(f'Batch response parse error: {e} (finishReason={finish_reason}) raw={text[:200]}')
+        return {}, 'parse'
+
+    wanted = set(document_ids)
+    parsed = {}
+    for item in results:
+        try:
+            document_id = to_str(item.get('document_id'))
+            if document_id in wanted and document_id not in parsed:
+                parsed[document_id] = Classification.from_dict(item)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f'Batch item parse error: {e} raw={str(item)[:200]}')
+    return parsed, None
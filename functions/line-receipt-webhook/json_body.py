@@ -0,0 +1,60 @@
+"""
+base64データを含むJSONリクエストボディの送信
+
+requests の json= に base64 文字列を入れると、元のバイト列・base64文字列・JSON文字列・
+送信用バイト列がすべて同時にメモリに載る（画像サイズの約4倍）。
+Base64JsonBody は JSON のうち base64 以外の部分だけを文字列化し、base64 部分は
+エンコード結果をそのまま分割して読み出すため、ピークを元のバイト列 + base64 1つ分に抑える。
+
+    body = Base64JsonBody({'image': BLOB, 'filename': name}, content)
+    requests.post(url, data=body, headers={'Content-Type': 'application/json'})
+
+複数の書類をまとめて送る場合は BLOB を書類の数だけ置き、同じ順に blob を渡す。
+
+    body = Base64JsonBody({'docs': [BLOB, BLOB]}, content1, content2)
+"""
+import base64
+import json
+
+BLOB = '__BASE64_BLOB__'
+
+
+class Base64JsonBody:
+    """
+    payload 中の BLOB を blobs の base64 に（出現順に）置き換えたJSONを、ファイルのように読み出す
+    requests は len 属性から Content-Length を設定し、read() で少しずつ送信する
+    """
+
+    def __init__(self, payload, *blobs):
+        text = json.dumps(payload)
+        marker = json.dumps(BLOB)
+        if not blobs or text.count(marker) != len(blobs):
+            raise ValueError('payload must contain one BLOB placeholder per blob')
+        pieces = text.split(marker)
+        # base64 の文字はJSONでエスケープ不要なので、そのまま引用符で囲めばよい
+        self._parts = [memoryview((pieces[0] + '"').encode('utf-8'))]
+        for i, blob in enumerate(blobs, start=1):
+            piece = pieces[i] if i == len(blobs) else pieces[i] + '"'
+            self._parts.append(memoryview(base64.b64encode(blob)))
+            self._parts.append(memoryview(('"' + piece).encode('utf-8')))
+        self.len = sum(len(p) for p in self._parts)
+        self._part = 0
+        self._offset = 0
+
+    def __len__(self):
+        return self.len
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        chunks = []
+        while size > 0 and self._part < len(self._parts):
+            part = self._parts[self._part]
+            chunk = part[self._offset:self._offset + size]
+            chunks.append(bytes(chunk))
+            size -= len(chunk)
+            self._offset += len(chunk)
+            if self._offset >= len(part):
+                self._part += 1
+                self._offset = 0
+        return b''.join(chunks)
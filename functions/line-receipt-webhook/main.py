@@ -1,60 +1,75 @@
 import json
-import hashlib
 import hmac
-import base64
 import os
 import re
 import requests
+import time
 from datetime import datetime
 from flask import Flask, request
 from google.auth import default
 from googleapiclient.discovery import build
 
-app = Flask(__name__)
-
-# MK（まるなげ経理）チャネル
-MK_LINE_CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET', '')
-MK_LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', '')
-# KZ（絆パートナーズ）チャネル
-KZ_LINE_CHANNEL_SECRET = os.environ.get('KZ_LINE_CHANNEL_SECRET', '')
-KZ_LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('KZ_LINE_CHANNEL_ACCESS_TOKEN', '')
+import deferred_queue
+import event_journal
+import memory_profile
+from admission import ADMISSION_WAIT_SECONDS, SCHEDULER
+from admin_notifier import AdminNotifier
+import receipt_index
+import usage_meter
+from channels import REGISTRY, col_letter
+from circuit_breaker import OPEN as CIRCUIT_OPEN, CircuitBreaker
+from customer_store import CustomerStore
+from json_body import BLOB, Base64JsonBody
+from normalize import normalize_customer_code
+from shared_cache import CLAIMS, CUSTOMERS, EVENTS, NOTIFICATIONS, SHARED_CACHE, SUBFOLDERS
+from gemini_schema import (
+    BATCH_CLASSIFICATION_SCHEMA,
+    CLASSIFICATION_SCHEMA,
+    Classification,
+    output_tokens,
+    parse_batch_classifications,
+    parse_structured_response,
+    structured_generation_config,
+)
+import batch_classify
+from pdf_pages import classify_pdf_pages, set_cache_version
 
-# 後方互換のためのエイリアス（チャネル判定前のデフォルト）
-LINE_CHANNEL_SECRET = MK_LINE_CHANNEL_SECRET
-LINE_CHANNEL_ACCESS_TOKEN = MK_LINE_CHANNEL_ACCESS_TOKEN
+app = Flask(__name__)
 
-CUSTOMER_SHEET_ID = os.environ.get('CUSTOMER_SHEET_ID', '')
-KZ_CUSTOMER_SHEET_ID = os.environ.get('KZ_CUSTOMER_SHEET_ID', '')
 GAS_UPLOAD_URL = os.environ.get('GAS_UPLOAD_URL', '')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
+# ローカルの疑似API（tools/fake_gemini_api.py）に向ける場合に変更する
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+GEMINI_MODEL = 'gemini-2.0-flash'
+USAGE_API_TOKEN = os.environ.get('USAGE_API_TOKEN', '')
+# 処理中の印の期限（秒）。処理が終わらないままこの時間が過ぎたら、LINEの再送を別のインスタンスでも処理できる
+EVENT_LEASE_SECONDS = float(os.environ.get('EVENT_LEASE_SECONDS', '300'))
+# お試し送信回数の加算で、別のインスタンスの加算と重なった場合に読み直す回数
+TRIAL_COUNT_ATTEMPTS = 5
+
+# Gemini障害時のサーキットブレーカー（連続エラーで一定時間即失敗させる）
+GEMINI_BREAKER = CircuitBreaker(
+    'gemini',
+    failure_threshold=int(os.environ.get('GEMINI_BREAKER_THRESHOLD', '3')),
+    cooldown_seconds=int(os.environ.get('GEMINI_BREAKER_COOLDOWN', '60'))
+)
 
 # 管理者LINE ID
 ADMIN_USER_ID = 'U6980f7c583babed09518d986f704e959'
 
-# チャネル設定マップ: destination (Bot User ID) → チャネル情報
-# ※ 初回デプロイ後にログからBot User IDを確認して設定する
-MK_BOT_USER_ID = os.environ.get('MK_BOT_USER_ID', '')
-KZ_BOT_USER_ID = os.environ.get('KZ_BOT_USER_ID', '')
-
-CHANNELS = {
-    'MK': {
-        'secret': MK_LINE_CHANNEL_SECRET,
-        'access_token': MK_LINE_CHANNEL_ACCESS_TOKEN,
-        'name': 'まるなげ経理',
-    },
-    'KZ': {
-        'secret': KZ_LINE_CHANNEL_SECRET,
-        'access_token': KZ_LINE_CHANNEL_ACCESS_TOKEN,
-        'name': '絆パートナーズ経理',
-    },
-}
-
-def resolve_channel(body_text):
+# チャネル設定（チャネルキー → 設定）。設定内容は channels.py を参照
+# ※ destination (Bot User ID) は初回デプロイ後にログから確認して設定する
+CHANNELS = REGISTRY.channels
+
+# チャネルキー → 顧客ストア（get_customer_store で初回利用時に作成）
+CUSTOMER_STORES = {}
+
+def resolve_channel(body_text, signature=''):
     """
     Webhookリクエストのbodyからチャネルを判定する。
-    destinationフィールド（Bot User ID）で判定し、
-    不明な場合は署名検証で特定を試みる。
-    戻り値: チャネルキー ('MK' or 'KZ')
+    destinationフィールド（Bot User ID）を辞書参照で判定し、
+    不明な場合は署名検証で特定を試みる（特定できたdestinationは記録して次回から辞書参照）。
+    戻り値: チャネルキー ('MK', 'KZ' など)
     """
     try:
         data = json.loads(body_text)
@@ -62,73 +77,224 @@ def resolve_channel(body_text):
     except Exception:
         destination = ''
 
-    if destination and MK_BOT_USER_ID and destination == MK_BOT_USER_ID:
-        return 'MK'
-    if destination and KZ_BOT_USER_ID and destination == KZ_BOT_USER_ID:
-        return 'KZ'
+    channel_key = REGISTRY.key_for_destination(destination)
+    if channel_key:
+        return channel_key
+
+    if destination and signature:
+        body_bytes = body_text.encode('utf-8')
+        for key in REGISTRY.channels:
+            expected = REGISTRY.signature_for(key, body_bytes)
+            if expected and hmac.compare_digest(signature, expected):
+                REGISTRY.learn_destination(destination, key)
+                print(f'[channel] destination {destination} → {key}（{key}のBot User IDを設定すると初回の判定も不要になります）')
+                return key
 
     # Bot User IDが未設定 or 不明な場合、destinationをログに出力（初回設定用）
     if destination:
         print(f'[channel] Unknown destination: {destination} — Bot User IDの環境変数を設定してください')
 
-    # デフォルトはMK
-    return 'MK'
+    return REGISTRY.default_key
 
 def get_channel_config(channel_key):
     """チャネルキーからチャネル設定を取得"""
-    return CHANNELS.get(channel_key, CHANNELS['MK'])
+    return REGISTRY.get(channel_key)
 
 @app.route('/', methods=['GET', 'POST'])
 def line_webhook():
+    # 管理用API（利用量メーター）
+    if request.path.startswith('/usage/'):
+        return usage_api(request.path[len('/usage/'):])
     if request.method == 'GET':
         return 'OK', 200
     signature = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
 
     # チャネル判定（destination から Bot User ID で特定）
-    channel_key = resolve_channel(body)
+    channel_key = resolve_channel(body, signature)
     print(f'[webhook] channel={channel_key}')
 
     if not verify_signature(body, signature, channel_key):
         return 'Invalid signature', 403
+    failed = False
     try:
         events = json.loads(body).get('events', [])
+        # 再処理できるように検証済みのイベントを記録
+        event_journal.append(events, channel_key)
+        jobs = []
         for event in events:
-            if event['type'] == 'message':
-                msg_type = event['message']['type']
-                if msg_type == 'image':
-                    handle_image_message(event, channel_key)
-                elif msg_type == 'file':
-                    handle_file_message(event, channel_key)
-                elif msg_type == 'text':
-                    handle_text_message(event, channel_key)
-            elif event['type'] == 'follow':
-                handle_follow_event(event, channel_key)
+            event_id = event_journal.event_id_of(event)
+            # 再送されたイベントを別のインスタンスで二重に処理しない（処理中の印を最初に付けたインスタンスだけが処理）
+            if not EVENTS.set(event_id, 'processing', only_if_absent=True, ttl=EVENT_LEASE_SECONDS):
+                print(f'[webhook] Skipping already processed event: {event_id}')
+                continue
+            try:
+                if event['type'] == 'message':
+                    msg_type = event['message']['type']
+                    if msg_type in ('image', 'file'):
+                        # 画像・PDFは受付制御を通す（ユーザーごとの同時実行上限 + ラウンドロビン）
+                        # 処理済みにするのはワーカーでの処理が終わってから（run_event_job）
+                        handler = handle_image_message if msg_type == 'image' else handle_file_message
+                        user_key = f'{channel_key}:{event["source"].get("userId", "unknown")}'
+                        jobs.append(SCHEDULER.submit(user_key, run_event_job, handler, event, channel_key))
+                        continue
+                    elif msg_type == 'text':
+                        handle_text_message(event, channel_key)
+                elif event['type'] == 'follow':
+                    handle_follow_event(event, channel_key)
+            except Exception as e:
+                # 処理中の印を消して、LINEの再送で処理し直せるようにする
+                EVENTS.delete(event_id)
+                failed = True
+                print(f'Error processing event {event_id}: {e}')
+                continue
+            EVENTS.set(event_id, True)
+        if jobs:
+            SCHEDULER.wait(jobs, ADMISSION_WAIT_SECONDS, lambda job: acknowledge_queued(job.args[1], channel_key))
     except Exception as e:
+        failed = True
         print(f'Error processing event: {e}')
+    # 処理できなかったイベントがあれば LINE に再送させる（処理済みのイベントは再送されても飛ばす）
+    if failed:
+        return 'Error', 500
     return 'OK', 200
 
+def run_event_job(handler, event, channel_key='MK'):
+    """
+    受付制御のワーカーで画像・PDFを処理し、終わったら処理済みにする（失敗したら処理中の印を消す）
+    受付済みにして保留キューに保存した書類は、保留キューの処理が先に始めていなければここで処理して保留キューから消す
+    """
+    event_id = event_journal.event_id_of(event)
+    entry_id = event.pop('deferred_id', None)
+    if entry_id and not deferred_queue.take(entry_id, CLAIMS):
+        print(f'[webhook] Already taken by the deferred queue: {event_id}')
+        return
+    try:
+        handler(event, channel_key)
+    except Exception:
+        EVENTS.delete(event_id)
+        if entry_id:
+            deferred_queue.release(entry_id, CLAIMS)
+        raise
+    EVENTS.set(event_id, True)
+    if entry_id:
+        deferred_queue.complete(entry_id)
+        deferred_queue.release(entry_id, CLAIMS)
+
+def acknowledge_queued(event, channel_key='MK'):
+    """
+    混雑で処理を開始できなかった書類を保留キューに保存してから受付済みを返信（結果は処理後にプッシュで送る）
+    インスタンスが止まって処理されなかった場合も、保留キューの定期実行（/usage/drain）で処理される
+    """
+    reply_token = event.get('replyToken')
+    event['replyToken'] = None
+    entry_id = deferred_queue.enqueue(b'', {
+        'event': event,
+        'user_id': event['source'].get('userId', 'unknown'),
+        'channel_key': channel_key,
+        'filename': event['message'].get('fileName') or f'{event["message"]["id"]}.jpg',
+    })
+    if entry_id is None:
+        # 保存できなければ受付済みとは返さない（このまま順番に処理し、結果はプッシュで送る）
+        return
+    event['deferred_id'] = entry_id
+    if reply_token:
+        reply_message(reply_token,
+            '📥 受け付けました\n\n'
+            '順番に読み取りを行っています。\n'
+            '結果はまもなくお送りします。',
+            channel_key)
+
+@app.route('/usage/<action>', methods=['GET', 'POST'])
+def usage_api(action):
+    """
+    利用量メーターの管理用API（Authorization: Bearer USAGE_API_TOKEN が必要）
+    - GET  /usage/summary?month=YYYY-MM     月間の全顧客の利用量
+    - GET  /usage/customer?key=MK001        顧客の今月の利用量とプラン超過
+    - POST /usage/export {customer_key, rows, month}  出力行数を加算（gas/Output_Yayoi.gs の弥生CSV出力から呼ぶ）
+    - POST /usage/reconcile {year, month}   顧客スプシの出力済み行数で補正（定期実行）
+    - POST /usage/drain                     保留キューの書類を再分類（定期実行、Gemini障害中は何もしない）
+    - GET  /usage/admission                 画像・PDF処理の待ち件数と待ち時間
+    - GET  /usage/cache                     共有キャッシュのヒット率（名前空間ごと）
+    """
+    if not USAGE_API_TOKEN or request.headers.get('Authorization', '') != f'Bearer {USAGE_API_TOKEN}':
+        return 'Forbidden', 403
+
+    if action == 'summary':
+        return {'usage': usage_meter.monthly_summary(request.args.get('month'))}, 200
+
+    if action == 'admission':
+        return SCHEDULER.metrics(), 200
+
+    if action == 'cache':
+        return SHARED_CACHE.metrics(), 200
+
+    if action == 'customer':
+        usage = usage_meter.get_usage(request.args.get('key', ''), request.args.get('month'))
+        return {'usage': usage, 'plan': usage_meter.plan_status(usage, request.args.get('plan', ''))}, 200
+
+    data = request.get_json(silent=True) or {}
+    if action == 'export' and request.method == 'POST':
+        usage_meter.record(data.get('customer_key', ''), 'exported', int(data.get('rows', 0)), data.get('month'))
+        return {'success': True}, 200
+
+    if action == 'drain' and request.method == 'POST':
+        # 障害中に処理すると再試行回数だけ使ってしまうので、ブレーカーが閉じるまで待つ
+        if GEMINI_BREAKER.state == CIRCUIT_OPEN:
+            return {'drained': 0, 'breaker': CIRCUIT_OPEN}, 200
+        drained = drain_deferred_queue()
+        return {'drained': drained, 'pending': len(deferred_queue.pending_entries())}, 200
+
+    if action == 'reconcile' and request.method == 'POST':
+        now = datetime.now()
+        year = int(data.get('year', now.year))
+        month = int(data.get('month', now.month))
+        return {'drift': reconcile_usage(year, month)}, 200
+
+    return 'Not found', 404
+
+def reconcile_usage(year, month):
+    """全チャネルの顧客の出力行数を顧客スプシから数え直してメーターを補正"""
+    service = get_sheets_service()
+    drift = {}
+    for channel_key, config in REGISTRY.channels.items():
+        cols = config['columns']
+        url_col = cols.get('spreadsheet_url')
+        if url_col is None or not config['sheet_id']:
+            continue
+        try:
+            rows = service.spreadsheets().values().get(
+                spreadsheetId=config['sheet_id'],
+                range=f'顧客管理!A:{col_letter(max(cols.values()))}'
+            ).execute().get('values', [])
+        except Exception as e:
+            print(f'[usage] Error reading customers [{channel_key}]: {e}')
+            continue
+        for row in rows[1:]:
+            code = row[cols['code']] if len(row) > cols['code'] else ''
+            url = row[url_col] if len(row) > url_col else ''
+            match = re.search(r'/d/([a-zA-Z0-9-_]+)', url)
+            if not code or not match:
+                continue
+            drift[code] = usage_meter.reconcile_customer(service, code, match.group(1), year, month)
+    return drift
+
 def verify_signature(body, signature, channel_key=None):
     """
     署名検証。channel_keyが指定されていればそのチャネルのシークレットで検証。
     channel_keyがNoneの場合は全チャネルのシークレットで試行。
     """
+    body_bytes = body.encode('utf-8')
     if channel_key:
-        secret = CHANNELS.get(channel_key, {}).get('secret', '')
-        if not secret:
+        expected = REGISTRY.signature_for(channel_key, body_bytes)
+        if expected is None:
             return True
-        hash = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
-        expected = base64.b64encode(hash).decode('utf-8')
         return hmac.compare_digest(signature, expected)
 
     # channel_key未定の場合、全チャネルのシークレットで検証を試行
-    for key, ch in CHANNELS.items():
-        secret = ch.get('secret', '')
-        if not secret:
-            continue
-        hash = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
-        expected = base64.b64encode(hash).decode('utf-8')
-        if hmac.compare_digest(signature, expected):
+    for key in REGISTRY.channels:
+        expected = REGISTRY.signature_for(key, body_bytes)
+        if expected and hmac.compare_digest(signature, expected):
             return True
 
     return False
@@ -137,41 +303,42 @@ def get_sheets_service():
     credentials, project = default(scopes=['https://www.googleapis.com/auth/spreadsheets'])
     return build('sheets', 'v4', credentials=credentials)
 
-def get_sheet_id_for_channel(channel_key):
-    """チャネルに応じた顧客管理シートIDを返す"""
-    if channel_key == 'KZ':
-        return KZ_CUSTOMER_SHEET_ID
-    return CUSTOMER_SHEET_ID
-
-def get_status_col_for_channel(channel_key):
-    """チャネルに応じたステータス列インデックスを返す（0始まり）"""
-    if channel_key == 'KZ':
-        return 5  # F列 (KZ: 6番目, 0始まりで5)
-    return 7  # H列 (MK: 8番目, 0始まりで7)
+def get_customer_store(channel_key):
+    """チャネルの顧客ストア（ローカルSQLite + 顧客管理シートへの非同期反映）"""
+    config = get_channel_config(channel_key)
+    store = CUSTOMER_STORES.get(config['key'])
+    if store is None:
+        cols = config['columns']
+        # 共有キャッシュがあれば顧客行をインスタンス間で共有する（LINE連携直後の食い違いを防ぐ）
+        store = CustomerStore(config['key'], config['sheet_id'], cols, width=max(12, *cols.values()) + 1,
+                              cache=CUSTOMERS if SHARED_CACHE.client else None)
+        store = CUSTOMER_STORES.setdefault(config['key'], store)
+    return store
+
+def get_customer_store_for_code(customer_code):
+    """顧客コードのプレフィックスに対応する顧客ストア"""
+    return get_customer_store(REGISTRY.for_code(customer_code)['key'])
 
 def get_customer_info(user_id, channel_key='MK'):
-    """顧客情報を取得（folder_id, customer_name, status）"""
+    """顧客情報を取得（folder_id, customer_name, status, customer_code, plan）"""
     try:
-        service = get_sheets_service()
-        sheet_id = get_sheet_id_for_channel(channel_key)
-        status_col = get_status_col_for_channel(channel_key)
-        result = service.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range='顧客管理!A:M'
-        ).execute()
-        rows = result.get('values', [])
-        for row in rows[1:]:
-            if len(row) >= 1 and row[0] == user_id:
-                folder_id = row[2] if len(row) > 2 else ''
-                customer_name = row[1] if len(row) > 1 else ''
-                status = row[status_col] if len(row) > status_col else ''
-                return {
-                    'folder_id': folder_id,
-                    'customer_name': customer_name,
-                    'status': status,
-                    'exists': True
-                }
-        return {'exists': False}
+        cols = get_channel_config(channel_key)['columns']
+        store = get_customer_store(channel_key)
+        # スタッフがシートを編集していれば取り込む（変更がなければメタデータ確認のみ）
+        store.refresh_if_stale()
+        record = store.find_by_line_id(user_id)
+        if not record:
+            return {'exists': False}
+        row = record['row']
+        plan_col = cols.get('plan', len(row))
+        return {
+            'folder_id': row[cols['folder_id']],
+            'customer_name': row[cols['name']],
+            'status': row[cols['status']],
+            'customer_code': row[cols['code']],
+            'plan': row[plan_col] if len(row) > plan_col else '',
+            'exists': True
+        }
     except Exception as e:
         print(f'Error getting customer info: {e}')
         return {'exists': False}
@@ -179,51 +346,55 @@ def get_customer_info(user_id, channel_key='MK'):
 def register_new_user(user_id, channel_key='MK'):
     """新規ユーザーを「お試し」として登録"""
     try:
-        service = get_sheets_service()
-        sheet_id = get_sheet_id_for_channel(channel_key)
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        if channel_key == 'KZ':
-            # KZ: A=LINE ID, B=顧客名, C=フォルダID, D=登録日, E=コード, F=ステータス
-            values = [[user_id, '未登録', '', now, '', 'お試し']]
-            append_range = '顧客管理!A:F'
-        else:
-            # MK: A=LINE ID, B=顧客名, C=フォルダID, D=登録日, E=?, F=?, G=コード, H=ステータス
-            values = [[user_id, '未登録', '', now, False, '', '', 'お試し']]
-            append_range = '顧客管理!A:H'
-        service.spreadsheets().values().append(
-            spreadsheetId=sheet_id,
-            range=append_range,
-            valueInputOption='RAW',
-            body={'values': values}
-        ).execute()
+        config = get_channel_config(channel_key)
+        get_customer_store(channel_key).append(build_trial_row(config, user_id, now))
         print(f'New user registered [{channel_key}]: {user_id}')
         return True
     except Exception as e:
         print(f'Error registering user [{channel_key}]: {e}')
         return False
 
+def build_trial_row(config, user_id, now):
+    """お試し登録用の行（A列〜ステータス列）をチャネルの列構成に合わせて作成"""
+    cols = config['columns']
+    row = [''] * (cols['status'] + 1)
+    for name, value in config['trial_defaults'].items():
+        if cols.get(name, len(row)) < len(row):
+            row[cols[name]] = value
+    row[cols['line_id']] = user_id
+    row[cols['name']] = '未登録'
+    row[cols['registered_at']] = now
+    row[cols['status']] = 'お試し'
+    return row
+
 def update_trial_count(user_id, channel_key='MK'):
-    """お試し送信回数をカウントアップ"""
+    """
+    お試し送信回数をカウントアップ
+    同じユーザーの加算は CLAIMS の印でインスタンスをまたいで1つずつにし、シートの値が読んだ値のままの場合だけ
+    同期的に書き込む（変わっていれば読み直して加算し直す）
+    """
     try:
-        service = get_sheets_service()
-        sheet_id = get_sheet_id_for_channel(channel_key)
-        # KZはカウント列が異なる可能性があるが、同じロジックを使用
-        # MK: K列(index 10), KZ: 同様にK列を使用（なければスキップ）
-        result = service.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range='顧客管理!A:L'
-        ).execute()
-        rows = result.get('values', [])
-        for i, row in enumerate(rows[1:], start=2):
-            if len(row) >= 1 and row[0] == user_id:
-                current_count = int(row[10]) if len(row) > 10 and row[10] else 0
-                service.spreadsheets().values().update(
-                    spreadsheetId=sheet_id,
-                    range=f'顧客管理!K{i}',
-                    valueInputOption='RAW',
-                    body={'values': [[current_count + 1]]}
-                ).execute()
-                return current_count + 1
+        count_col = get_channel_config(channel_key)['columns'].get('trial_count')
+        if count_col is None:
+            return 0
+        store = get_customer_store(channel_key)
+        claim_key = f'trial:{channel_key}:{user_id}'
+        for attempt in range(TRIAL_COUNT_ATTEMPTS):
+            if not CLAIMS.set(claim_key, True, only_if_absent=True, ttl=30):
+                time.sleep(0.2 * (attempt + 1))
+                continue
+            try:
+                record = store.find_by_line_id(user_id)
+                if not record:
+                    return 0
+                current = record['row'][count_col]
+                current_count = int(current) if current else 0
+                if store.update_if(record['row_key'], {count_col: current_count + 1}, {count_col: current}) is not None:
+                    return current_count + 1
+            finally:
+                CLAIMS.delete(claim_key)
+        print(f'Trial count not updated after {TRIAL_COUNT_ATTEMPTS} attempts: {user_id} [{channel_key}]')
         return 0
     except Exception as e:
         print(f'Error updating trial count [{channel_key}]: {e}')
@@ -243,6 +414,7 @@ def handle_follow_event(event, channel_key='MK'):
             'まずは試しに1枚送ってみてください！',
             channel_key)
 
+@memory_profile.profiled('pdf')
 def handle_file_message(event, channel_key='MK'):
     """PDFファイルなどの処理"""
     message_id = event['message']['id']
@@ -251,7 +423,7 @@ def handle_file_message(event, channel_key='MK'):
 
     # PDFのみ対応
     if not file_name.lower().endswith('.pdf'):
-        reply_message(event['replyToken'],
+        reply_or_push(event,
             '⚠️ 対応していないファイル形式です。\n\n'
             '画像（JPG, PNG）またはPDFを\n'
             'お送りください。',
@@ -268,19 +440,26 @@ def handle_file_message(event, channel_key='MK'):
 
     status = customer_info.get('status', 'お試し')
     folder_id = customer_info.get('folder_id', '')
+    customer_code = customer_info.get('customer_code', '')
 
     # ファイルをダウンロード
-    file_content = download_content_from_line(message_id, channel_key)
+    with memory_profile.stage('download'):
+        file_content = download_content_from_line(message_id, channel_key)
     if not file_content:
-        reply_message(event['replyToken'], '❌ ファイルの取得に失敗しました。\nもう一度お試しください。', channel_key)
+        reply_or_push(event, '❌ ファイルの取得に失敗しました。\nもう一度お試しください。', channel_key)
         return
 
-    # Gemini で分類
-    classification = classify_document_with_gemini(file_content, 'application/pdf')
+    memory_profile.set_input_size(len(file_content))
+
+    # Gemini で分類（複数ページのPDFはページごとに並列で分類してマージ）
+    with memory_profile.stage('classify'):
+        classification = classify_pdf_pages(file_content, classify_document_with_gemini)
 
     # 分類結果に応じて処理
-    process_classified_document(event, classification, file_content, folder_id, status, user_id, file_name, channel_key)
+    with memory_profile.stage('process'):
+        process_classified_document(event, classification, file_content, folder_id, status, user_id, file_name, channel_key, customer_code)
 
+@memory_profile.profiled('image')
 def handle_image_message(event, channel_key='MK'):
     message_id = event['message']['id']
     user_id = event['source'].get('userId', 'unknown')
@@ -295,28 +474,40 @@ def handle_image_message(event, channel_key='MK'):
 
     status = customer_info.get('status', 'お試し')
     folder_id = customer_info.get('folder_id', '')
+    customer_code = customer_info.get('customer_code', '')
 
     # 画像をダウンロード
-    image_content = download_content_from_line(message_id, channel_key)
+    with memory_profile.stage('download'):
+        image_content = download_content_from_line(message_id, channel_key)
     if not image_content:
-        reply_message(event['replyToken'], '❌ 画像の取得に失敗しました。\nもう一度お試しください。', channel_key)
+        reply_or_push(event, '❌ 画像の取得に失敗しました。\nもう一度お試しください。', channel_key)
         return
 
+    memory_profile.set_input_size(len(image_content))
+
     # Gemini で分類 + OCR
-    classification = classify_document_with_gemini(image_content, 'image/jpeg')
+    with memory_profile.stage('classify'):
+        classification = classify_document_with_gemini(image_content, 'image/jpeg')
 
     # 分類結果に応じて処理
     filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{message_id}.jpg"
-    process_classified_document(event, classification, image_content, folder_id, status, user_id, filename, channel_key)
+    with memory_profile.stage('process'):
+        process_classified_document(event, classification, image_content, folder_id, status, user_id, filename, channel_key, customer_code)
 
-def process_classified_document(event, classification, content, folder_id, status, user_id, filename, channel_key='MK'):
+def process_classified_document(event, classification, content, folder_id, status, user_id, filename, channel_key='MK', customer_code=''):
     """分類結果に応じてドキュメントを処理"""
 
     category = classification.get('category', 'unknown')
+    event_journal.record_outcome(event, 'deferred' if classification.get('deferrable') else category)
+
+    # ==== Gemini障害中 → 保存して分類は後回し ====
+    if classification.get('deferrable'):
+        defer_classification(event, content, folder_id, status, user_id, filename, channel_key, customer_code)
+        return
 
     # ==== クレカ売上票 ====
     if category == 'credit_slip':
-        reply_message(event['replyToken'],
+        reply_or_push(event,
             '⚠️ クレジットカード売上票です\n\n'
             '二重計上を防ぐため、これは保存しません。\n'
             'レシート本体をお送りください📸',
@@ -325,7 +516,7 @@ def process_classified_document(event, classification, content, folder_id, statu
 
     # ==== 不明・その他 ====
     if category == 'unknown':
-        reply_message(event['replyToken'],
+        reply_or_push(event,
             '⚠️ 認識できませんでした\n\n'
             '以下のいずれかをお送りください：\n'
             '・レシート/領収書\n'
@@ -341,14 +532,16 @@ def process_classified_document(event, classification, content, folder_id, statu
             if passbook_folder_id:
                 upload_via_gas(content, filename, passbook_folder_id)
 
+        usage_meter.record(usage_meter.usage_key(channel_key, user_id, customer_code), 'passbook')
+
         if status == '契約済':
-            reply_message(event['replyToken'],
+            reply_or_push(event,
                 '✅ 通帳を受け取りました\n\n'
                 '担当者が確認いたします。',
                 channel_key)
         else:
             update_trial_count(user_id, channel_key)
-            reply_message(event['replyToken'],
+            reply_or_push(event,
                 '✅ 通帳を受け取りました\n\n'
                 '引き続き、領収書や通帳を\nお送りください📸',
                 channel_key)
@@ -356,16 +549,37 @@ def process_classified_document(event, classification, content, folder_id, statu
 
     # ==== レシート/領収書 ====
     if category == 'receipt':
+        extracted = classification.get('extracted_data', {})
+        usage_key = usage_meter.usage_key(channel_key, user_id, customer_code)
+        mime_type = 'application/pdf' if filename.lower().endswith('.pdf') else 'image/jpeg'
+
+        # 同じ領収書の再送（撮り直し・写真とPDFの両方など）は「重複の可能性」に分けて二重計上を防ぐ
+        duplicate = receipt_index.check_and_add(usage_key, content, mime_type, extracted, filename)
+        if duplicate:
+            if folder_id:
+                duplicate_folder_id = get_or_create_subfolder(folder_id, '重複の可能性')
+                if duplicate_folder_id:
+                    upload_via_gas(content, filename, duplicate_folder_id)
+            reply_or_push(event,
+                '⚠️ 同じ領収書が既に届いています\n\n'
+                f'（{duplicate["created_at"][:16]} 受付分）\n'
+                '二重計上を防ぐため、今回の分は記帳対象にしていません。\n'
+                '別の領収書の場合は担当者が確認いたします。',
+                channel_key)
+            return
+
         if folder_id:
             # レシートフォルダに保存（folder_idは既に「領収書」フォルダ）
             upload_via_gas(content, filename, folder_id)
 
-        date_str = classification.get('extracted_data', {}).get('date', '')
-        store_name = classification.get('extracted_data', {}).get('store_name', '')
-        amount = classification.get('extracted_data', {}).get('amount', '')
+        usage_meter.record(usage_key, 'receipt')
+
+        date_str = extracted.get('date', '')
+        store_name = extracted.get('store_name', '')
+        amount = extracted.get('amount', '')
 
         if status == '契約済':
-            reply_message(event['replyToken'],
+            reply_or_push(event,
                 '✅ 領収書を受け取りました\n\n'
                 '担当者が確認のうえ記帳いたします。\n'
                 '引き続きよろしくお願いいたします。',
@@ -402,120 +616,282 @@ def process_classified_document(event, classification, content, folder_id, statu
             result_lines.append('')
             result_lines.append('※超過分は20円/行')
 
-            reply_message(event['replyToken'], '\n'.join(result_lines), channel_key)
+            reply_or_push(event, '\n'.join(result_lines), channel_key)
         return
 
+def defer_classification(event, content, folder_id, status, user_id, filename, channel_key='MK', customer_code=''):
+    """
+    Gemini障害中に受け取った書類を保存し、分類を保留キューに入れる
+    - 原本は保留キュー（永続ボリューム）に保存し、顧客フォルダがあれば「未分類」にも即時保存（受信した書類を失わない）
+    - ブレーカーが閉じたとき・定期実行（/usage/drain）で保留キューから再分類し、結果をプッシュ通知する
+    - 再分類して保存し直したら「未分類」の原本はゴミ箱に移す
+    """
+    pending_file_id = None
+    if folder_id:
+        pending_folder_id = get_or_create_subfolder(folder_id, '未分類')
+        if pending_folder_id:
+            pending_file_id = upload_via_gas(content, filename, pending_folder_id)
+
+    deferred_queue.enqueue(content, {
+        'user_id': user_id,
+        'channel_key': channel_key,
+        'folder_id': folder_id,
+        'status': status,
+        'filename': filename,
+        'customer_code': customer_code,
+        'mime_type': 'application/pdf' if filename.lower().endswith('.pdf') else 'image/jpeg',
+        'pending_file_id': pending_file_id,
+    })
+
+    reply_or_push(event,
+        '📥 受け付けました\n\n'
+        'ただいま読み取りが混み合っています。\n'
+        '読み取り結果は後ほどお送りします。',
+        channel_key)
+
+def process_deferred_entry(entry, content):
+    """保留キューの1件を再分類して通常の処理に流す（成功時True）"""
+    if entry.get('event'):
+        return process_queued_event(entry)
+    if entry.get('mime_type') == 'application/pdf':
+        classification = classify_pdf_pages(content, classify_document_with_gemini)
+    else:
+        classification = classify_document_with_gemini(content, entry.get('mime_type', 'image/jpeg'))
+
+    if classification.get('deferrable'):
+        return False
+
+    # 返信トークンは失効しているため、結果はプッシュメッセージで送る
+    event = {'replyToken': None, 'source': {'userId': entry['user_id']}}
+    process_classified_document(event, classification, content, entry.get('folder_id', ''),
+                                entry.get('status', 'お試し'), entry['user_id'],
+                                entry['filename'], entry.get('channel_key', REGISTRY.default_key),
+                                entry.get('customer_code', ''))
+    discard_pending_copy(entry)
+    return True
+
+def discard_pending_copy(entry):
+    """再分類して保存し直した書類の「未分類」の原本をゴミ箱に移す"""
+    if entry.get('pending_file_id'):
+        trash_drive_file(entry['pending_file_id'])
+
+def process_queued_event(entry):
+    """受付済みにしたまま処理されなかった画像・PDFのイベントを処理（成功時True）"""
+    event = entry['event']
+    handler = handle_image_message if event['message']['type'] == 'image' else handle_file_message
+    try:
+        handler(event, entry.get('channel_key', REGISTRY.default_key))
+    except Exception as e:
+        print(f'[deferred] Event error ({entry.get("id")}): {e}')
+        return False
+    EVENTS.set(event_journal.event_id_of(event), True)
+    return True
+
+def notify_deferred_give_up(entry):
+    """再分類を諦めた書類を管理者に通知"""
+    send_admin_notification(
+        f'⚠️ 保留中の書類を分類できませんでした\n\n'
+        f'👤 {entry.get("user_id", "")}\n'
+        f'📄 {entry.get("filename", "")}\n\n'
+        f'「未分類」フォルダを確認してください。',
+        urgent=True
+    )
+
+def process_deferred_batch(items):
+    """
+    保留キューの複数件をまとめて再分類して通常の処理に流す（batch_classify.py で書類をまとめて分類）
+    items: [(entry, content), ...]  戻り値: 同じ順の成功/失敗
+    """
+    if any(entry.get('event') for entry, _ in items):
+        # 受付済みにしたイベントは1件ずつ処理し、残りの書類をまとめて分類する
+        documents = [(entry, content) for entry, content in items if not entry.get('event')]
+        results = iter(process_deferred_batch(documents) if documents else [])
+        return [process_queued_event(entry) if entry.get('event') else next(results) for entry, _ in items]
+    classifications = batch_classify.classify_many(
+        [(content, entry.get('mime_type', 'image/jpeg')) for entry, content in items],
+        classify_documents_with_gemini, classify_document_with_gemini)
+    outcomes = []
+    for (entry, content), classification in zip(items, classifications):
+        if classification.get('deferrable'):
+            outcomes.append(False)
+            continue
+        event = {'replyToken': None, 'source': {'userId': entry['user_id']}}
+        try:
+            process_classified_document(event, classification, content, entry.get('folder_id', ''),
+                                        entry.get('status', 'お試し'), entry['user_id'],
+                                        entry['filename'], entry.get('channel_key', REGISTRY.default_key),
+                                        entry.get('customer_code', ''))
+            discard_pending_copy(entry)
+            outcomes.append(True)
+        except Exception as e:
+            print(f'[deferred] Process error ({entry.get("id")}): {e}')
+            outcomes.append(False)
+    return outcomes
+
+# 保留キューは一括分類で処理する（GEMINI_BATCH_SIZE=1 なら1件ずつ）
+DEFERRED_BATCH_SIZE = (batch_classify.GEMINI_BATCH_SIZE * batch_classify.GEMINI_BATCH_WORKERS
+                       if batch_classify.GEMINI_BATCH_SIZE > 1 else 1)
+
+def drain_deferred_queue():
+    """
+    保留キューを処理（定期実行の /usage/drain から。どのインスタンスからでもよく、別のインスタンスが処理中の書類は飛ばす）
+    戻り値: 処理できた件数
+    """
+    if DEFERRED_BATCH_SIZE > 1:
+        return deferred_queue.drain_batch(process_deferred_batch, DEFERRED_BATCH_SIZE,
+                                          on_give_up=notify_deferred_give_up, claims=CLAIMS)
+    return deferred_queue.drain(process_deferred_entry, on_give_up=notify_deferred_give_up, claims=CLAIMS)
+
+# 障害が明けたインスタンスでもすぐに処理する
+GEMINI_BREAKER.on_close(
+    lambda: deferred_queue.drain_in_background(
+        process_deferred_entry, on_give_up=notify_deferred_give_up, process_batch_fn=process_deferred_batch,
+        batch_size=DEFERRED_BATCH_SIZE, claims=CLAIMS)
+)
+
+# 出力形式は responseSchema で指定するため、プロンプトは判別ポイントのみ
+CLASSIFICATION_PROMPT = '''書類を分類し、該当カテゴリの項目を抽出してください。
+- passbook（通帳）: 「普通預金」等のヘッダー、年月日/お支払金額/お預り金額/差引残高の列
+- credit_slip（クレカ売上票）: 「クレジット売上票」「CREDIT」、カード番号の一部（****1234）、承認番号、「お客様控え」
+- receipt（レシート/領収書）: 店名、日付、明細、合計金額があり credit_slip でないもの
+- unknown: 上記以外/判別不能
+receipt: date（例: 2026年2月15日）, store_name, amount（合計金額）
+passbook: bank_name, date_range（例: 2026/01/05〜01/27）, page_number（なければnull）, first_balance（最初の行の残高）, latest_balance（最後の行の残高）
+'''
+
+# 一括分類（batch_classify.py）で書類ごとの結果を返させるための追記
+BATCH_CLASSIFICATION_PROMPT = CLASSIFICATION_PROMPT + '''複数の書類を送ります。各書類の直前に「document_id: 〜」を示します。
+書類ごとに1件ずつ、document_id を付けて results に入れてください（1つの書類に複数の結果を返さない）。
+'''
+
+# プロンプト・スキーマを変えたらページ分類のキャッシュ（pdf_pages.py）を使い直さない
+set_cache_version(GEMINI_MODEL, CLASSIFICATION_PROMPT, BATCH_CLASSIFICATION_PROMPT,
+                  CLASSIFICATION_SCHEMA, BATCH_CLASSIFICATION_SCHEMA)
+
 def classify_document_with_gemini(content, mime_type):
     """Gemini で書類を分類 + データ抽出"""
     if not GEMINI_API_KEY:
         print('GEMINI_API_KEY not set')
         return {'category': 'unknown', 'error': 'config'}
-    
+
+    # Gemini障害中はタイムアウトを待たずに即失敗（分類は保留キューで後から行う）
+    if not GEMINI_BREAKER.allow_request():
+        return {'category': 'unknown', 'error': 'circuit_open', 'deferrable': True}
+
     try:
-        url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}'
-        
-        content_base64 = base64.b64encode(content).decode('utf-8')
-        
-        prompt = '''この画像を分類してください。
-
-【分類カテゴリ】
-1. receipt（レシート/領収書）
-2. passbook（通帳）
-3. credit_slip（クレジットカード売上票）
-4. unknown（上記以外/判別不能）
-
-【判別ポイント】
-
-■ passbook（通帳）の特徴：
-- 「普通預金」「当座預金」などのヘッダー
-- 年月日/お支払金額/お預り金額/差引残高 の列構成
-- 銀行の通帳形式
-
-■ credit_slip（クレカ売上票）の特徴：
-- 「クレジット売上票」「カード売上票」「CREDIT」の文言
-- カード番号の一部（****1234）
-- 承認番号、カード会社名（VISA, Mastercard, JCB等）
-- 「お客様控え」の文言
-- レシートと一緒に出てくる決済控え
-
-■ receipt（レシート/領収書）の特徴：
-- 店名、日付、商品明細、合計金額
-- 「領収書」「レシート」の文言
-- credit_slipに該当しないもの
-
-【回答形式】
-JSON形式で回答してください：
-
-{
-  "category": "receipt" | "passbook" | "credit_slip" | "unknown",
-  "confidence": 0.0〜1.0,
-  "reason": "判定理由を簡潔に",
-  "extracted_data": {
-    // categoryに応じたデータ
-  }
-}
-
-■ receipt の場合の extracted_data:
-{
-  "date": "2026年2月15日",
-  "store_name": "セブンイレブン",
-  "amount": "1234"
-}
-
-■ passbook の場合の extracted_data:
-{
-  "bank_name": "三菱UFJ銀行",
-  "date_range": "2026/01/05〜01/27",
-  "latest_balance": "451277"
-}
-
-■ credit_slip / unknown の場合:
-extracted_data は空オブジェクト {}
-'''
+        url = f'{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}'
 
         payload = {
             'contents': [{
                 'parts': [
-                    {'text': prompt},
+                    {'text': CLASSIFICATION_PROMPT},
                     {
                         'inline_data': {
                             'mime_type': mime_type,
-                            'data': content_base64
+                            'data': BLOB
                         }
                     }
                 ]
             }],
-            'generationConfig': {
-                'temperature': 0.1,
-                'maxOutputTokens': 1000
-            }
+            'generationConfig': structured_generation_config(CLASSIFICATION_SCHEMA, 256)
         }
         
-        response = requests.post(url, json=payload, timeout=30)
-        
+        try:
+            # 画像のbase64はJSON文字列に埋め込まず、そのまま分割して送る（メモリのピークを抑える）
+            response = requests.post(url, data=Base64JsonBody(payload, content),
+                                     headers={'Content-Type': 'application/json'}, timeout=30)
+        except requests.RequestException as e:
+            print(f'Gemini request error: {e}')
+            GEMINI_BREAKER.record_failure()
+            return {'category': 'unknown', 'error': 'timeout', 'deferrable': True}
+
+        if response.status_code == 429 or response.status_code >= 500:
+            print(f'Gemini API error: {response.status_code} {response.text}')
+            GEMINI_BREAKER.record_failure()
+            return {'category': 'unknown', 'error': 'api', 'deferrable': True}
+
+        # 4xx等はAPI自体は応答しているので障害扱いしない
+        GEMINI_BREAKER.record_success()
+
         if response.status_code != 200:
             print(f'Gemini API error: {response.status_code} {response.text}')
             return {'category': 'unknown', 'error': 'api'}
         
         result = response.json()
-        text = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
-        
-        # JSONを抽出
-        json_match = re.search(r'\{[\s\S]*\}', text)
-        if json_match:
-            classification = json.loads(json_match.group())
-            print(f'Classification result: {classification}')
-            return classification
-        
-        print(f'Failed to parse Gemini response: {text}')
-        return {'category': 'unknown', 'error': 'parse'}
+        parsed, error = parse_structured_response(result, Classification)
+        if error:
+            return {'category': 'unknown', 'error': error}
+
+        classification = parsed.to_dict()
+        print(f'Classification result: {classification} (output_tokens={output_tokens(result)})')
+        return classification
         
     except Exception as e:
         print(f'Gemini classification error: {e}')
         return {'category': 'unknown', 'error': str(e)}
 
+def classify_documents_with_gemini(documents):
+    """
+    複数の書類を1リクエストで分類（batch_classify.py から呼ぶ）
+    documents: [(content, mime_type), ...]
+    戻り値: documents と同じ順の分類結果。結果が返らなかった書類は None（呼び出し側で1件ずつ分類し直す）
+    """
+    if not GEMINI_API_KEY:
+        print('GEMINI_API_KEY not set')
+        return [{'category': 'unknown', 'error': 'config'} for _ in documents]
+
+    if not GEMINI_BREAKER.allow_request():
+        return [{'category': 'unknown', 'error': 'circuit_open', 'deferrable': True} for _ in documents]
+
+    try:
+        url = f'{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}'
+        document_ids = [f'doc-{i + 1}' for i in range(len(documents))]
+        parts = [{'text': BATCH_CLASSIFICATION_PROMPT}]
+        for document_id, (_, mime_type) in zip(document_ids, documents):
+            parts.append({'text': f'document_id: {document_id}'})
+            parts.append({'inline_data': {'mime_type': mime_type, 'data': BLOB}})
+        payload = {
+            'contents': [{'parts': parts}],
+            'generationConfig': structured_generation_config(BATCH_CLASSIFICATION_SCHEMA, 256 * len(documents))
+        }
+
+        try:
+            response = requests.post(url, data=Base64JsonBody(payload, *(content for content, _ in documents)),
+                                     headers={'Content-Type': 'application/json'}, timeout=30 + 10 * len(documents))
+        except requests.RequestException as e:
+            print(f'Gemini batch request error: {e}')
+            GEMINI_BREAKER.record_failure()
+            return [{'category': 'unknown', 'error': 'timeout', 'deferrable': True} for _ in documents]
+
+        if response.status_code == 429 or response.status_code >= 500:
+            print(f'Gemini API error: {response.status_code} {response.text}')
+            GEMINI_BREAKER.record_failure()
+            return [{'category': 'unknown', 'error': 'api', 'deferrable': True} for _ in documents]
+
+        GEMINI_BREAKER.record_success()
+
+        if response.status_code != 200:
+            # 書類のどれかが原因の可能性があるので、1件ずつ分類し直す
+            print(f'Gemini API error: {response.status_code} {response.text}')
+            return [None for _ in documents]
+
+        result = response.json()
+        parsed, _ = parse_batch_classifications(result, document_ids)
+        classifications = [parsed[d].to_dict() if d in parsed else None for d in document_ids]
+        print(f'Batch classification: {len(parsed)}/{len(documents)} documents '
+              f'(output_tokens={output_tokens(result)})')
+        return classifications
+
+    except Exception as e:
+        print(f'Gemini batch classification error: {e}')
+        return [None for _ in documents]
+
 def get_or_create_subfolder(parent_folder_id, subfolder_name):
-    """親フォルダ内にサブフォルダを取得または作成"""
+    """親フォルダ内にサブフォルダを取得または作成（フォルダIDは共有キャッシュに保存）"""
+    cache_key = f'{parent_folder_id}:{subfolder_name}'
+    cached = SUBFOLDERS.get(cache_key)
+    if isinstance(cached, str):
+        return cached
     try:
         credentials, project = default(scopes=['https://www.googleapis.com/auth/drive'])
         service = build('drive', 'v3', credentials=credentials)
@@ -534,6 +910,7 @@ def get_or_create_subfolder(parent_folder_id, subfolder_name):
         files = results.get('files', [])
         
         if files:
+            SUBFOLDERS.set(cache_key, files[0]['id'])
             return files[0]['id']
         
         # なければ作成
@@ -544,6 +921,7 @@ def get_or_create_subfolder(parent_folder_id, subfolder_name):
         }
         folder = service.files().create(body=folder_metadata, fields='id').execute()
         print(f'Created subfolder: {subfolder_name} ({folder["id"]})')
+        SUBFOLDERS.set(cache_key, folder['id'])
         return folder['id']
         
     except Exception as e:
@@ -554,101 +932,33 @@ def get_or_create_subfolder(parent_folder_id, subfolder_name):
 # 顧客コードの正規化・検証
 # ============================================================
 
-def get_sheet_id_for_code(customer_code):
-    """コードのプレフィックスに応じて顧客管理シートIDを返す"""
-    if customer_code and customer_code.startswith('KZ'):
-        return KZ_CUSTOMER_SHEET_ID
-    return CUSTOMER_SHEET_ID
-
-def get_code_col_for_prefix(customer_code):
-    """コードのプレフィックスに応じて顧客コード列番号を返す（0始まり）"""
-    if customer_code and customer_code.startswith('KZ'):
-        return 4  # E列 (KZ: 5番目, 0始まりで4)
-    return 6  # G列 (MK: 7番目, 0始まりで6)
-
-def get_status_col_for_prefix(customer_code):
-    """コードのプレフィックスに応じてステータス列番号を返す（1始まり、Sheets API用）"""
-    if customer_code and customer_code.startswith('KZ'):
-        return 'F'  # KZ: F列
-    return 'H'  # MK: H列
-
-def get_line_col_for_prefix(customer_code):
-    """コードのプレフィックスに応じてLINE ID列を返す（1始まり、Sheets API用）"""
-    return 'A'  # 両方ともA列
-
-def normalize_customer_code(text):
-    """
-    顧客コードを正規化
-    - 全角→半角変換
-    - 大文字変換
-    - 前後スペース除去
-    """
-    if not text:
-        return None
-    
-    # 前後スペース除去
-    text = text.strip()
-    
-    # 全角→半角変換（英数字）
-    normalized = ''
-    for char in text:
-        code = ord(char)
-        # 全角英字 A-Z (0xFF21-0xFF3A) → 半角
-        if 0xFF21 <= code <= 0xFF3A:
-            normalized += chr(code - 0xFF21 + ord('A'))
-        # 全角英字 a-z (0xFF41-0xFF5A) → 半角
-        elif 0xFF41 <= code <= 0xFF5A:
-            normalized += chr(code - 0xFF41 + ord('a'))
-        # 全角数字 0-9 (0xFF10-0xFF19) → 半角
-        elif 0xFF10 <= code <= 0xFF19:
-            normalized += chr(code - 0xFF10 + ord('0'))
-        else:
-            normalized += char
-    
-    # 大文字変換
-    normalized = normalized.upper()
-    
-    return normalized
-
 def is_valid_customer_code_format(code):
     """
     顧客コードの形式を検証
-    有効: MK + 3桁の数字 (MK001, MK123 など)
-    有効: KZ + 3桁の数字 (KZ001, KZ123 など)
+    有効: 登録済みチャネルのプレフィックス + 3桁の数字 (MK001, KZ123 など)
     """
     if not code:
         return False
-    
-    # 正規表現: MKまたはKZ + 3桁数字
-    pattern = r'^(MK|KZ)\d{3}$'
-    return bool(re.match(pattern, code))
+
+    return REGISTRY.is_valid_code(code)
 
 def customer_code_exists(customer_code):
     """
     顧客コードが顧客管理シートに存在するか確認
-    戻り値: {'exists': True/False, 'row_index': int, 'row_data': list}
+    戻り値: {'exists': True/False, 'row_key': str, 'row_data': list}
     """
     try:
-        service = get_sheets_service()
-        sheet_id = get_sheet_id_for_code(customer_code)
-        code_col = get_code_col_for_prefix(customer_code)
-        result = service.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range='顧客管理!A:M'
-        ).execute()
-        rows = result.get('values', [])
-        
-        for i, row in enumerate(rows[1:], start=2):  # 1行目はヘッダー
-            row_code = row[code_col] if len(row) > code_col else ''
-            if row_code.upper() == customer_code:
-                return {
-                    'exists': True,
-                    'row_index': i,
-                    'row_data': row
-                }
-        
+        store = get_customer_store_for_code(customer_code)
+        store.refresh_if_stale()
+        record = store.find_by_code(customer_code)
+        if record:
+            return {
+                'exists': True,
+                'row_key': record['row_key'],
+                'row_data': record['row']
+            }
         return {'exists': False}
-        
+
     except Exception as e:
         print(f'Error checking customer code: {e}')
         return {'exists': False, 'error': str(e)}
@@ -675,7 +985,7 @@ def handle_text_message(event, channel_key='MK'):
 
     # 「契約済み」の場合
     if text == '契約済み':
-        code_prefix = 'KZ' if channel_key == 'KZ' else 'MK'
+        code_prefix = get_channel_config(channel_key)['code_prefix']
         reply_message(event['replyToken'],
             '✅ ご利用ありがとうございます！\n\n'
             '▼ 既にコードをお持ちの方\n'
@@ -698,13 +1008,13 @@ def handle_text_message(event, channel_key='MK'):
             channel_key)
         return
 
-    # 顧客コードの可能性をチェック（MKで始まる、KZで始まる、または全角版）
+    # 顧客コードの可能性をチェック（登録済みチャネルのプレフィックスで始まる、または全角版）
     normalized_code = normalize_customer_code(text)
 
-    if normalized_code and (normalized_code.startswith('MK') or normalized_code.startswith('KZ')):
+    if normalized_code and REGISTRY.key_for_code(normalized_code):
         # 形式チェック
         if not is_valid_customer_code_format(normalized_code):
-            code_prefix = 'KZ' if channel_key == 'KZ' else 'MK'
+            code_prefix = get_channel_config(channel_key)['code_prefix']
             reply_message(event['replyToken'],
                 '⚠️ 顧客コードの形式が正しくありません\n\n'
                 f'正しい形式: {code_prefix} + 3桁の数字\n'
@@ -764,7 +1074,11 @@ def handle_text_message(event, channel_key='MK'):
         if customer_info.get('exists') and customer_info.get('folder_id'):
             name = customer_info.get('customer_name', '')
             status = customer_info.get('status', '')
-            reply_message(event['replyToken'], f'✅ ご登録済み\n👤 {name}\n📋 {status}', channel_key)
+            key = usage_meter.usage_key(channel_key, user_id, customer_info.get('customer_code', ''))
+            usage_lines = usage_meter.format_usage_lines(usage_meter.get_usage(key), customer_info.get('plan', ''))
+            reply_message(event['replyToken'],
+                f'✅ ご登録済み\n👤 {name}\n📋 {status}\n\n' + '\n'.join(usage_lines),
+                channel_key)
         else:
             reply_message(event['replyToken'], '📋 お試し利用中です。\n\nサービス詳細はこちら\nhttps://marunagekeiri.com', channel_key)
     else:
@@ -780,142 +1094,85 @@ def handle_text_message(event, channel_key='MK'):
 def link_user_with_customer_code(user_id, customer_code, channel_key='MK'):
     """顧客コードでLINE IDを紐付け"""
     try:
-        service = get_sheets_service()
-        sheet_id = get_sheet_id_for_code(customer_code)
-        code_col = get_code_col_for_prefix(customer_code)
-        status_col_letter = get_status_col_for_prefix(customer_code)
-        name_col = 1  # B列（0始まり）- MK/KZ共通
-        result = service.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range='顧客管理!A:M'
-        ).execute()
-        rows = result.get('values', [])
-
-        for i, row in enumerate(rows[1:], start=2):
-            row_code = row[code_col] if len(row) > code_col else ''
-            row_line_id = row[0] if len(row) > 0 else ''
-            row_name = row[name_col] if len(row) > name_col else ''
-
-            if row_code.upper() == customer_code:
-                # 既に別のユーザーが紐付いている場合
-                if row_line_id and row_line_id != user_id:
-                    return {'success': False, 'already_linked_other': True}
-
-                # 既に同じユーザーが紐付いている場合
-                if row_line_id == user_id:
-                    return {'success': True, 'already_linked': True, 'customer_name': row_name}
-
-                # 新規紐付け
-                service.spreadsheets().values().update(
-                    spreadsheetId=sheet_id,
-                    range=f'顧客管理!A{i}',
-                    valueInputOption='RAW',
-                    body={'values': [[user_id]]}
-                ).execute()
-
-                # ステータスを「契約済」に更新
-                service.spreadsheets().values().update(
-                    spreadsheetId=sheet_id,
-                    range=f'顧客管理!{status_col_letter}{i}',
-                    valueInputOption='RAW',
-                    body={'values': [['契約済']]}
-                ).execute()
-
-                print(f'Linked user {user_id} with customer code {customer_code} [{channel_key}]')
-
-                # 同じLINE IDの「お試し」行を削除
-                delete_trial_rows_for_user(user_id, target_row=i, channel_key=channel_key)
-
-                # フォルダ名を変更
-                row_folder_id = row[2] if len(row) > 2 else ''
-                if row_folder_id and row_name:
-                    rename_customer_folder(row_folder_id, f'{customer_code}_{row_name}')
-
-                # 管理者に通知
-                config = get_channel_config(channel_key)
-                send_admin_notification(
-                    f'✅ LINE連携完了 [{config["name"]}]\n\n'
-                    f'👤 {row_name}\n'
-                    f'🔑 {customer_code}\n\n'
-                    f'領収書の受付を開始しました。'
-                )
-                return {'success': True, 'customer_name': row_name}
-
-        # ここには来ないはず（事前にcustomer_code_existsでチェック済み）
-        return {'success': False, 'not_found': True}
+        store = get_customer_store_for_code(customer_code)
+        cols = REGISTRY.for_code(customer_code)['columns']
+        record = store.find_by_code(customer_code)
+        if not record:
+            # ここには来ないはず（事前にcustomer_code_existsでチェック済み）
+            return {'success': False, 'not_found': True}
+
+        row = record['row']
+        row_line_id = row[cols['line_id']]
+        row_name = row[cols['name']]
+
+        # 既に別のユーザーが紐付いている場合
+        if row_line_id and row_line_id != user_id:
+            return {'success': False, 'already_linked_other': True}
+
+        # 既に同じユーザーが紐付いている場合
+        if row_line_id == user_id:
+            return {'success': True, 'already_linked': True, 'customer_name': row_name}
+
+        # 新規紐付け + ステータスを「契約済」に更新
+        # 別のインスタンスが同じコードを紐付け中なら待たずに断る（紐付けたのが同じユーザーなら設定済み）
+        claim_key = f'link:{customer_code}'
+        if not CLAIMS.set(claim_key, user_id, only_if_absent=True):
+            if CLAIMS.get(claim_key) == user_id:
+                return {'success': True, 'already_linked': True, 'customer_name': row_name}
+            return {'success': False, 'already_linked_other': True}
+        # シートの LINE ID がまだ空の場合だけ、返信する前にシートへ書き込む（書き込んだ後はシートの値で断れるので印は消す）
+        try:
+            linked = store.update_if(record['row_key'], {cols['line_id']: user_id, cols['status']: '契約済'},
+                                     {cols['line_id']: ''})
+        finally:
+            CLAIMS.delete(claim_key)
+        if linked is None:
+            # シートでは既に紐付いていた（update_if がシートの内容を取り込んでいる）
+            current = store.find_by_code(customer_code)
+            current_line_id = current['row'][cols['line_id']] if current else ''
+            print(f'Customer code {customer_code} was not linkable on the sheet: {current_line_id or "row not found"}')
+            if current_line_id == user_id:
+                return {'success': True, 'already_linked': True, 'customer_name': row_name}
+            if current_line_id:
+                return {'success': False, 'already_linked_other': True}
+            return {'success': False, 'error': 'not_linkable'}
+
+        print(f'Linked user {user_id} with customer code {customer_code} [{channel_key}]')
+
+        # 同じLINE IDの「お試し」行を削除
+        delete_trial_rows_for_user(user_id, target_key=record['row_key'], channel_key=channel_key)
+
+        # フォルダ名を変更
+        row_folder_id = row[cols['folder_id']]
+        if row_folder_id and row_name:
+            rename_customer_folder(row_folder_id, f'{customer_code}_{row_name}')
+
+        # 管理者に通知
+        config = get_channel_config(channel_key)
+        send_admin_notification(
+            f'✅ LINE連携完了 [{config["name"]}]\n\n'
+            f'👤 {row_name}\n'
+            f'🔑 {customer_code}\n\n'
+            f'領収書の受付を開始しました。'
+        )
+        return {'success': True, 'customer_name': row_name}
 
     except Exception as e:
         print(f'Error linking user with customer code: {e}')
         return {'success': False, 'error': str(e)}
 
-def delete_trial_rows_for_user(user_id, target_row, channel_key='MK'):
+def delete_trial_rows_for_user(user_id, target_key, channel_key='MK'):
     """
     同じLINE IDの「お試し」行を削除
-    target_row: 紐付け先の行（この行は削除しない）
+    target_key: 紐付け先の行のキー（この行は削除しない）
     """
     try:
-        service = get_sheets_service()
-        spreadsheet_id = get_sheet_id_for_channel(channel_key)
-        status_col = get_status_col_for_channel(channel_key)
-        result = service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id,
-            range='顧客管理!A:M'
-        ).execute()
-        rows = result.get('values', [])
-
-        # 削除対象の行を収集（後ろから削除するため逆順）
-        rows_to_delete = []
-
-        for i, row in enumerate(rows[1:], start=2):
-            if i == target_row:
-                continue  # 紐付け先の行はスキップ
-
-            row_line_id = row[0] if len(row) > 0 else ''
-            row_status = row[status_col] if len(row) > status_col else ''
-
-            # 同じLINE IDで「お試し」ステータスの行
-            if row_line_id == user_id and row_status == 'お試し':
-                rows_to_delete.append(i)
-
-        if not rows_to_delete:
-            return
-
-        # スプレッドシートのシートIDを取得
-        spreadsheet = service.spreadsheets().get(
-            spreadsheetId=spreadsheet_id
-        ).execute()
-        sheet_gid = None
-        for sheet in spreadsheet.get('sheets', []):
-            if sheet['properties']['title'] == '顧客管理':
-                sheet_gid = sheet['properties']['sheetId']
-                break
-
-        if sheet_gid is None:
-            print('Could not find sheet ID for 顧客管理')
-            return
-
-        # 後ろの行から削除（インデックスがずれないように）
-        rows_to_delete.sort(reverse=True)
-
-        requests_list = []
-        for row_index in rows_to_delete:
-            requests_list.append({
-                'deleteDimension': {
-                    'range': {
-                        'sheetId': sheet_gid,
-                        'dimension': 'ROWS',
-                        'startIndex': row_index - 1,  # 0-indexed
-                        'endIndex': row_index
-                    }
-                }
-            })
-
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheet_id,
-            body={'requests': requests_list}
-        ).execute()
-
-        print(f'Deleted {len(rows_to_delete)} trial row(s) for user {user_id} [{channel_key}]')
+        store = get_customer_store(channel_key)
+        records = [r for r in store.find_by_status('お試し', line_id=user_id) if r['row_key'] != target_key]
+        for record in records:
+            store.delete(record['row_key'])
+        if records:
+            print(f'Deleted {len(records)} trial row(s) for user {user_id} [{channel_key}]')
 
     except Exception as e:
         print(f'Error deleting trial rows: {e}')
@@ -925,13 +1182,17 @@ def delete_trial_rows_for_user(user_id, target_row, channel_key='MK'):
 # ============================================================
 
 def download_content_from_line(message_id, channel_key='MK'):
-    """LINEから画像/ファイルをダウンロード"""
+    """LINEから画像/ファイルをダウンロード（ジャーナルに保存済みならそれを使う）"""
+    content = event_journal.load_content(message_id)
+    if content is not None:
+        return content
     config = get_channel_config(channel_key)
     url = f'https://api-data.line.me/v2/bot/message/{message_id}/content'
     headers = {'Authorization': f'Bearer {config["access_token"]}'}
     try:
         response = requests.get(url, headers=headers)
         if response.status_code == 200:
+            event_journal.attach_content(message_id, response.content)
             return response.content
         print(f'Download failed [{channel_key}]: {response.status_code}')
         return None
@@ -941,13 +1202,13 @@ def download_content_from_line(message_id, channel_key='MK'):
 
 def upload_via_gas(content, filename, folder_id):
     try:
-        content_base64 = base64.b64encode(content).decode('utf-8')
         payload = {
-            'image': content_base64,
+            'image': BLOB,
             'filename': filename,
             'folderId': folder_id
         }
-        response = requests.post(GAS_UPLOAD_URL, json=payload, timeout=30)
+        response = requests.post(GAS_UPLOAD_URL, data=Base64JsonBody(payload, content),
+                                 headers={'Content-Type': 'application/json'}, timeout=30)
         result = response.json()
         if result.get('success'):
             print(f'File uploaded via GAS: {result.get("fileId")}')
@@ -965,14 +1226,34 @@ def reply_message(reply_token, text, channel_key='MK'):
     headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {config["access_token"]}'}
     data = {'replyToken': reply_token, 'messages': [{'type': 'text', 'text': text}]}
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = requests.post(url, headers=headers, json=data, timeout=10)
         if response.status_code != 200:
             print(f'Reply failed [{channel_key}]: {response.status_code} {response.text}')
     except Exception as e:
         print(f'Error sending reply [{channel_key}]: {e}')
 
-def send_admin_notification(message, channel_key='MK'):
-    """管理者にLINE通知を送信（MKチャネル経由で送信）"""
+def push_message(user_id, text, channel_key='MK'):
+    """ユーザーにプッシュメッセージを送信（返信トークンがない場合）"""
+    config = get_channel_config(channel_key)
+    url = 'https://api.line.me/v2/bot/message/push'
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {config["access_token"]}'}
+    data = {'to': user_id, 'messages': [{'type': 'text', 'text': text}]}
+    try:
+        response = requests.post(url, headers=headers, json=data, timeout=10)
+        if response.status_code != 200:
+            print(f'Push failed [{channel_key}]: {response.status_code} {response.text}')
+    except Exception as e:
+        print(f'Error sending push [{channel_key}]: {e}')
+
+def reply_or_push(event, text, channel_key='MK'):
+    """返信トークンがあれば返信、なければプッシュで送信"""
+    if event.get('replyToken'):
+        reply_message(event['replyToken'], text, channel_key)
+    else:
+        push_message(event['source'].get('userId', ''), text, channel_key)
+
+def push_admin_messages(texts):
+    """管理者にLINEプッシュを1回送信（MKチャネル経由、成功時True）"""
     # 管理者通知は常にMKチャネルから送信
     config = get_channel_config('MK')
     url = 'https://api.line.me/v2/bot/message/push'
@@ -982,13 +1263,38 @@ def send_admin_notification(message, channel_key='MK'):
     }
     data = {
         'to': ADMIN_USER_ID,
-        'messages': [{'type': 'text', 'text': message}]
+        'messages': [{'type': 'text', 'text': text} for text in texts]
     }
 
     try:
-        requests.post(url, headers=headers, json=data)
+        response = requests.post(url, headers=headers, json=data, timeout=10)
+        if response.status_code != 200:
+            print(f'Admin notification failed: {response.status_code} {response.text}')
+            return False
+        return True
     except Exception as e:
         print(f'Admin notification error: {e}')
+        return False
+
+# 管理者通知はまとめて非同期に送る（送信待ちは共有キャッシュに積む。admin_notifier.py 参照）
+ADMIN_NOTIFIER = AdminNotifier(push_admin_messages, queue=NOTIFICATIONS, queue_key='line-receipt-webhook')
+ADMIN_NOTIFIER.start()
+
+def send_admin_notification(message, channel_key='MK', urgent=False):
+    """管理者にLINE通知（通常は一定時間分をまとめて送信、urgent=True は即時送信）"""
+    ADMIN_NOTIFIER.notify(message, urgent=urgent)
+
+def trash_drive_file(file_id):
+    """Google Driveのファイルをゴミ箱に移動"""
+    try:
+        credentials, project = default(scopes=['https://www.googleapis.com/auth/drive'])
+        service = build('drive', 'v3', credentials=credentials)
+        service.files().update(fileId=file_id, body={'trashed': True}, supportsAllDrives=True).execute()
+        print(f'File trashed: {file_id}')
+        return True
+    except Exception as e:
+        print(f'Error trashing file: {e}')
+    return False
 
 def rename_customer_folder(folder_id, new_name):
     """Google Driveのフォルダ名を変更"""
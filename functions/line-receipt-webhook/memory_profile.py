@@ -0,0 +1,107 @@
+"""
+画像・PDF処理のメモリ計測（tracemalloc）
+
+環境変数 MEMORY_PROFILE=1 のときだけ有効。1件の処理を profile() で囲み、
+処理の段階（ダウンロード・分類・保存など）を stage() で囲むと、段階ごとのピークと
+終了時点の確保量をログに1行のJSONで出力する。
+
+    [memory] {"kind": "image", "input_bytes": 3145728, "peak_bytes": 12582912,
+              "stages": [{"stage": "download", "peak_bytes": ..., "current_bytes": ...}, ...]}
+
+MEMORY_PROFILE_TOP=N を指定すると、ピーク時点の確保元の上位N行も出力する。
+
+※ tracemalloc はプロセス全体の確保量を見るため、複数の処理が並列に走ると値が混ざる。
+   本番で計測する場合は ADMISSION_WORKERS=1 にする。
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+MEMORY_PROFILE = os.environ.get('MEMORY_PROFILE', '') == '1'
+MEMORY_PROFILE_TOP = int(os.environ.get('MEMORY_PROFILE_TOP', '0'))
+MEMORY_PROFILE_FRAMES = int(os.environ.get('MEMORY_PROFILE_FRAMES', '1'))
+
+_local = threading.local()
+_start_lock = threading.Lock()
+
+
+def _ensure_tracing():
+    with _start_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_PROFILE_FRAMES)
+
+
+def emit(record):
+    """計測結果の出力先（ベンチマークでは差し替えて結果を集める）"""
+    print(f'[memory] {json.dumps(record, ensure_ascii=False)}')
+
+
+@contextmanager
+def profile(kind):
+    """1件の処理全体を計測する"""
+    if not MEMORY_PROFILE:
+        yield None
+        return
+
+    _ensure_tracing()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    record = {'kind': kind, 'input_bytes': 0, 'stages': []}
+    _local.record = record
+    _local.baseline = baseline
+    started = time.monotonic()
+    try:
+        yield record
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        record['peak_bytes'] = max([peak - baseline] + [s['peak_bytes'] for s in record['stages']])
+        record['retained_bytes'] = current - baseline
+        record['elapsed_ms'] = round((time.monotonic() - started) * 1000)
+        if MEMORY_PROFILE_TOP:
+            record['top'] = [
+                f'{stat.traceback[0].filename}:{stat.traceback[0].lineno} {stat.size}'
+                for stat in tracemalloc.take_snapshot().statistics('lineno')[:MEMORY_PROFILE_TOP]
+            ]
+        _local.record = None
+        emit(record)
+
+
+@contextmanager
+def stage(name):
+    """処理の段階を計測（profile() の中でのみ記録される）"""
+    record = getattr(_local, 'record', None)
+    if record is None:
+        yield
+        return
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        record['stages'].append({
+            'stage': name,
+            'peak_bytes': peak - _local.baseline,
+            'current_bytes': current - _local.baseline,
+        })
+
+
+def profiled(kind):
+    """関数全体を profile(kind) で囲むデコレーター"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile(kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_input_size(size):
+    """計測中の処理の入力サイズ（ダウンロードしたバイト数）を記録"""
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record['input_bytes'] = size
@@ -0,0 +1,297 @@
+"""
+日付・金額・顧客コードの正規化（GAS版と同じ結果を返すPython版）
+
+GASの次の関数と同じ規則で変換する（一致は benchmarks/bench_normalize.py のコーパスで確認）。
+- normalize_date:          Service_OCR.gs の normalizeDate_（和暦・全角数字・2桁年）
+- normalize_passbook_date: PassbookEngine.gs の normalizePassbookDate_
+- parse_passbook_amount:   PassbookEngine.gs の parsePassbookAmount_（parseInt 相当）
+- parse_amount:            Utils.gs の parseAmount（parseFloat 相当）
+- parse_date:              Utils.gs の parseDate（date を返す）
+- normalize_customer_code: 顧客コード（全角英数字→半角、大文字）
+
+正規表現はモジュール読み込み時にコンパイルし、全角→半角は変換表（str.translate）で1回で置き換える。
+OCR結果は同じ値（同じ日付・同じ金額）が繰り返し現れるため、文字列の変換結果は LRU で覚えておく。
+列単位の変換は normalize_many を使う（重複を除いてから変換する）。
+
+GASとの違い:
+- parse_date の最後の new Date(str) は ISO 8601（datetime.fromisoformat）と年月（YYYY/M）だけを解釈する
+- 数値の入力は 1e-6 〜 1e21 の範囲（JSの数値→文字列が指数表記にならない範囲）でのみ一致する
+"""
+import math
+import os
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+NORMALIZE_CACHE_SIZE = int(os.environ.get('NORMALIZE_CACHE_SIZE', '65536'))
+
+FULLWIDTH_DIGITS = str.maketrans('０１２３４５６７８９', '0123456789')
+FULLWIDTH_ALNUM = str.maketrans(
+    {**{0xFF10 + i: ord('0') + i for i in range(10)},
+     **{0xFF21 + i: ord('A') + i for i in range(26)},
+     **{0xFF41 + i: ord('a') + i for i in range(26)}})
+
+# JSの String.prototype.trim / \s が空白とみなす文字
+JS_WHITESPACE = ('\t\n\v\f\r \u00a0\u1680' + ''.join(chr(c) for c in range(0x2000, 0x200b))
+                 + '\u2028\u2029\u202f\u205f\u3000\ufeff')
+
+# normalizeDate_
+REIWA = re.compile(r'(?:令和|Ｒ|R)\.?[' + JS_WHITESPACE + r']*(\d{1,2})[年./\-](\d{1,2})[月./\-](\d{1,2})', re.ASCII)
+ISO_LIKE = re.compile(r'^(\d{2,4})[-/](\d{1,2})[-/](\d{1,2})$', re.ASCII)
+JP_SHORT = re.compile(r'^(\d{1,2})年(\d{1,2})月(\d{1,2})日', re.ASCII)
+JP_FULL = re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})日', re.ASCII)
+R_PREFIX = re.compile(r'^[RＲ]\d', re.ASCII)
+NUMBERS = re.compile(r'\d+', re.ASCII)
+
+# normalizePassbookDate_
+PASSBOOK_ISO = re.compile(r'^\d{4}-\d{2}-\d{2}$', re.ASCII)
+PASSBOOK_MD = re.compile(r'^(\d{1,2})[-/](\d{1,2})$', re.ASCII)
+PASSBOOK_YMD = re.compile(r'(\d{2,4})[-/](\d{1,2})[-/](\d{1,2})', re.ASCII)
+
+# parseAmount / parseInt / parseFloat
+AMOUNT_STRIP = re.compile(r'[¥￥,，円' + JS_WHITESPACE + r']')
+JS_FLOAT = re.compile(r'^[+-]?(?:Infinity|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)', re.ASCII)
+JS_INT = re.compile(r'^[+-]?\d+', re.ASCII)
+
+# parseDate
+PARSE_DATE_YMD = re.compile(r'^(\d{4})[-/](\d{1,2})[-/](\d{1,2})', re.ASCII)
+PARSE_DATE_REIWA = re.compile(r'令和(\d+)年(\d+)月(\d+)日', re.ASCII)
+PARSE_DATE_YEAR_MONTH = re.compile(r'^(\d{4})(?:[-/](\d{1,2}))?(?:[ T]|$)', re.ASCII)
+
+
+def _js_string(value):
+    """String(value)（整数値の数値は小数点なし）"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _is_falsy(value):
+    """JSの !value"""
+    if value is None or value is False or value == '':
+        return True
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value == 0 or (isinstance(value, float) and math.isnan(value))
+    return False
+
+
+def _ymd(year, month, day):
+    return f'{year}-{month.zfill(2)[-2:]}-{day.zfill(2)[-2:]}'
+
+
+# ============================================================
+# 日付
+# ============================================================
+
+def normalize_date(value):
+    """normalizeDate_: YYYY-MM-DD（変換できない文字列はそのまま、不正な年は空文字）"""
+    if _is_falsy(value):
+        return ''
+    return _normalize_date(_js_string(value))
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_date(text):
+    text = text.strip(JS_WHITESPACE).translate(FULLWIDTH_DIGITS)
+
+    # パターン1: 令和N年M月D日 / R.N.M.D
+    match = REIWA.search(text)
+    if match:
+        return _ymd(2018 + int(match.group(1)), match.group(2), match.group(3))
+
+    # パターン2: YYYY-MM-DD（2桁年は2000年代、2000〜2099以外は不正）
+    match = ISO_LIKE.match(text)
+    if match:
+        year = int(match.group(1))
+        if year < 100:
+            year += 2000
+        if year < 2000 or year > 2099:
+            return ''
+        return _ymd(year, match.group(2), match.group(3))
+
+    # パターン3: N年M月D日（20以下は令和とみなす）
+    match = JP_SHORT.match(text)
+    if match:
+        raw_year = int(match.group(1))
+        year = 2018 + raw_year if raw_year <= 20 else 2000 + raw_year
+        return _ymd(year, match.group(2), match.group(3))
+
+    # パターン4: YYYY年M月D日
+    match = JP_FULL.search(text)
+    if match:
+        return _ymd(int(match.group(1)), match.group(2), match.group(3))
+
+    # パターン5・6: 「令和」を含む / R+数字 で始まり、数字が3つ以上ある変則表記
+    if '令和' in text or R_PREFIX.match(text):
+        nums = NUMBERS.findall(text)
+        if len(nums) >= 3:
+            year, month, day = 2018 + int(nums[0]), int(nums[1]), int(nums[2])
+            if 2019 <= year <= 2099 and 1 <= month <= 12 and 1 <= day <= 31:
+                return f'{year}-{month:02d}-{day:02d}'
+
+    return text
+
+
+def normalize_passbook_date(value, year=None):
+    """normalizePassbookDate_: YYYY-MM-DD（年なしの M/D は year、省略時は今年を付ける）"""
+    if _is_falsy(value):
+        return ''
+    return _normalize_passbook_date(_js_string(value), year or datetime.now().year)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_passbook_date(text, year):
+    text = text.strip(JS_WHITESPACE).translate(FULLWIDTH_DIGITS)
+    if PASSBOOK_ISO.match(text):
+        return text
+    match = PASSBOOK_MD.match(text)
+    if match:
+        return _ymd(year, match.group(1), match.group(2))
+    match = PASSBOOK_YMD.search(text)
+    if match:
+        ymd_year = int(match.group(1))
+        if ymd_year < 100:
+            ymd_year += 2000
+        return _ymd(ymd_year, match.group(2), match.group(3))
+    return text
+
+
+def parse_date(value):
+    """parseDate: date（解釈できなければNone。月・日のはみ出しは new Date と同じく繰り上げる）"""
+    if _is_falsy(value):
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return _parse_date(_js_string(value))
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _parse_date(text):
+    text = text.strip(JS_WHITESPACE)
+    match = PARSE_DATE_YMD.match(text)
+    if match:
+        return _js_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    match = PARSE_DATE_REIWA.search(text)
+    if match:
+        return _js_date(2018 + int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    # new Date('2026/3') は月初（V8 の解釈）
+    match = PARSE_DATE_YEAR_MONTH.match(text)
+    if match:
+        month = int(match.group(2) or 1)
+        return date(int(match.group(1)), month, 1) if 1 <= month <= 12 else None
+    try:
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        return None
+
+
+def _js_date(year, month, day):
+    """new Date(year, month - 1, day)（13月や32日は翌年・翌月に繰り上げる）"""
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    try:
+        return date(year, month, 1) + timedelta(days=day - 1)
+    except (ValueError, OverflowError):
+        return None
+
+
+# ============================================================
+# 金額
+# ============================================================
+
+def parse_amount(value):
+    """parseAmount: 数値はそのまま、文字列は記号・空白を除き全角数字を変換して parseFloat（不可ならNone）"""
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    return _parse_amount(str(value))
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _parse_amount(text):
+    text = AMOUNT_STRIP.sub('', text).translate(FULLWIDTH_DIGITS)
+    match = JS_FLOAT.match(text)
+    if not match:
+        return None
+    num = float(match.group(0).replace('Infinity', 'inf'))
+    return int(num) if num.is_integer() else num
+
+
+def parse_passbook_amount(value):
+    """parsePassbookAmount_: カンマを除いて parseInt（不可ならNone）"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if math.isfinite(value) else None
+    return _parse_passbook_amount(str(value))
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _parse_passbook_amount(text):
+    match = JS_INT.match(text.replace(',', '').strip(JS_WHITESPACE))
+    return int(match.group(0)) if match else None
+
+
+# ============================================================
+# 顧客コード
+# ============================================================
+
+def normalize_customer_code(text):
+    """
+    顧客コードを正規化
+    - 全角→半角変換（英数字）
+    - 大文字変換
+    - 前後スペース除去
+    """
+    if not text:
+        return None
+    return text.strip().translate(FULLWIDTH_ALNUM).upper()
+
+
+# ============================================================
+# 列単位の変換
+# ============================================================
+
+NORMALIZERS = {
+    'date': normalize_date,
+    'passbook_date': normalize_passbook_date,
+    'parse_date': parse_date,
+    'amount': parse_amount,
+    'passbook_amount': parse_passbook_amount,
+    'customer_code': normalize_customer_code,
+}
+
+
+def normalize_many(values, kind, **kwargs):
+    """
+    列（値のリスト）をまとめて変換する。同じ値は1回だけ変換する
+    kind: NORMALIZERS のキー（'date' / 'amount' など）
+    """
+    fn = NORMALIZERS[kind]
+    memo = {}
+    result = []
+    for value in values:
+        try:
+            key = (type(value), value)
+            out = memo.get(key, memo)
+        except TypeError:  # ハッシュできない値はそのまま変換
+            result.append(fn(value, **kwargs))
+            continue
+        if out is memo:
+            out = memo[key] = fn(value, **kwargs)
+        result.append(out)
+    return result
+
+
+def cache_info():
+    """文字列変換の LRU の状態（ヒット率の確認用）"""
+    return {name: fn.cache_info()._asdict() for name, fn in (
+        ('date', _normalize_date), ('passbook_date', _normalize_passbook_date), ('parse_date', _parse_date),
+        ('amount', _parse_amount), ('passbook_amount', _parse_passbook_amount))}
@@ -0,0 +1,389 @@
+"""
+PDFのページ分割・並列分類
+
+複数ページのPDF（通帳など）を1ページずつに分割し、
+各ページの分類 + データ抽出を並列に実行して結果をマージする。
+ページ単位の結果はページ内容のハッシュでキャッシュし、
+同じページが再送された場合はGeminiを呼ばずに再利用する。
+キャッシュはファイルと共有キャッシュ（shared_cache.py）の両方に保存し、別のインスタンスでも再利用する。
+キーには分類のプロンプト・スキーマの版（set_cache_version）を入れ、プロンプトを変えたら以前の結果は使わない。
+ファイルのキャッシュは PAGE_CACHE_MAX_MB を超えたら古いものから消す（/tmp はメモリを使うため）。
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_cache import PAGES
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pypdf未導入の環境ではPDFを分割せず1ファイルとして扱う
+    PdfReader = None
+    PdfWriter = None
+
+PDF_PAGE_WORKERS = int(os.environ.get('PDF_PAGE_WORKERS', '8'))
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '/tmp/page_cache')
+PAGE_CACHE_MAX_MB = float(os.environ.get('PAGE_CACHE_MAX_MB', '64'))
+# 手動で以前の分類結果を使わないようにする場合に変更する
+PAGE_CACHE_VERSION = os.environ.get('PAGE_CACHE_VERSION', '')
+# 何回書き込むごとにファイルのキャッシュの容量を確認するか
+PAGE_CACHE_PRUNE_EVERY = 50
+
+# 複数ページのカテゴリをまとめる際の優先順位（先にあるものを優先）
+CATEGORY_PRIORITY = ['passbook', 'receipt', 'credit_slip', 'unknown']
+
+
+# ============================================================
+# ページ分割
+# ============================================================
+
+def split_pdf_pages(content):
+    """
+    PDFを1ページずつのPDFに分割する
+    戻り値: [(page_bytes, page_hash), ...]
+    分割できない場合は元のPDFを1ページとして返す
+    """
+    if PdfReader is None:
+        return [(content, hashlib.sha256(content).hexdigest())]
+
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        if len(reader.pages) <= 1:
+            return [(content, hashlib.sha256(content).hexdigest())]
+
+        pages = []
+        for page in reader.pages:
+            writer = PdfWriter()
+            writer.add_page(page)
+            buf = io.BytesIO()
+            writer.write(buf)
+            page_bytes = buf.getvalue()
+            pages.append((page_bytes, page_fingerprint(page, page_bytes)))
+        return pages
+    except Exception as e:
+        print(f'[pdf] Split failed, processing as single document: {e}')
+        return [(content, hashlib.sha256(content).hexdigest())]
+
+
+def page_fingerprint(page, page_bytes):
+    """
+    ページ内容のハッシュ（キャッシュキー）
+    分割後のPDFバイト列は書き出しごとにIDが変わり得るため、
+    コンテンツストリームと埋め込み画像のデータからハッシュを作る
+    読めない場合は分割後のPDFバイト列のハッシュにする（再送時に当たらないことはあるが、別のページとは一致しない）
+    """
+    h = hashlib.sha256()
+    try:
+        contents = page.get_contents()
+        if contents is not None:
+            h.update(contents.get_data())
+        resources = page.get('/Resources')
+        xobjects = resources.get_object().get('/XObject') if resources else None
+        if xobjects:
+            xobjects = xobjects.get_object()
+            for name in sorted(xobjects.keys()):
+                h.update(name.encode('utf-8'))
+                h.update(xobjects[name].get_object().get_data())
+    except Exception as e:
+        print(f'[pdf] Fingerprint fallback: {e}')
+        return hashlib.sha256(page_bytes).hexdigest()
+    return h.hexdigest()
+
+
+# ============================================================
+# ページ単位キャッシュ
+# ============================================================
+
+_cache_version = hashlib.sha256(PAGE_CACHE_VERSION.encode('utf-8')).hexdigest()[:12]
+_writes = 0
+_prune_lock = threading.Lock()
+
+
+def set_cache_version(*parts):
+    """分類結果を変えるもの（モデル・プロンプト・スキーマ）から版を決める（キャッシュのキーと保存先に入れる）"""
+    global _cache_version
+    h = hashlib.sha256(PAGE_CACHE_VERSION.encode('utf-8'))
+    for part in parts:
+        h.update(json.dumps(part, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+    _cache_version = h.hexdigest()[:12]
+
+
+def _cache_key(page_hash):
+    return f'{_cache_version}:{page_hash}'
+
+
+def _cache_path(page_hash):
+    return os.path.join(PAGE_CACHE_DIR, _cache_version, f'{page_hash}.json')
+
+
+def load_cached_page(page_hash):
+    """キャッシュ済みのページ分類結果を取得（共有キャッシュ → ファイルの順、なければNone）"""
+    cached = PAGES.get(_cache_key(page_hash))
+    if isinstance(cached, dict):
+        return cached
+    try:
+        path = _cache_path(page_hash)
+        with open(path, 'r', encoding='utf-8') as f:
+            classification = json.load(f)
+        # 容量を超えたときに最近使ったものを残す
+        os.utime(path)
+        return classification
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f'[pdf] Cache read error: {e}')
+        return None
+
+
+def save_cached_page(page_hash, classification):
+    """ページ分類結果をキャッシュ（エラー結果は保存しない）"""
+    global _writes
+    if classification.get('error'):
+        return
+    PAGES.set(_cache_key(page_hash), classification)
+    try:
+        path = _cache_path(page_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(classification, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f'[pdf] Cache write error: {e}')
+        return
+    _writes += 1
+    if _writes % PAGE_CACHE_PRUNE_EVERY == 1:
+        prune_page_cache()
+
+
+def prune_page_cache(max_bytes=None):
+    """
+    ファイルのキャッシュから以前の版を消し、max_bytes（省略時は PAGE_CACHE_MAX_MB）を超えた分を
+    最後に使った時刻の古いものから消す
+    戻り値: 削除したファイル・ディレクトリの数
+    """
+    if max_bytes is None:
+        max_bytes = PAGE_CACHE_MAX_MB * 1024 * 1024
+    if not _prune_lock.acquire(blocking=False):
+        return 0
+    removed = 0
+    try:
+        for name in os.listdir(PAGE_CACHE_DIR):
+            if name == _cache_version:
+                continue
+            path = os.path.join(PAGE_CACHE_DIR, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            removed += 1
+        files = []
+        with os.scandir(os.path.join(PAGE_CACHE_DIR, _cache_version)) as entries:
+            for entry in entries:
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'[pdf] Cache prune error: {e}')
+    finally:
+        _prune_lock.release()
+    if removed:
+        print(f'[pdf] Pruned {removed} cached pages')
+    return removed
+
+
+# ============================================================
+# 並列分類
+# ============================================================
+
+def classify_pdf_pages(content, classify_fn):
+    """
+    PDFをページ分割して並列に分類し、結果をマージする
+    classify_fn: (content, mime_type) -> classification のGemini呼び出し関数
+    """
+    pages = split_pdf_pages(content)
+
+    if len(pages) == 1:
+        page_bytes, page_hash = pages[0]
+        return _classify_page(page_bytes, page_hash, classify_fn)
+
+    print(f'[pdf] Classifying {len(pages)} pages in parallel')
+    workers = max(1, min(PDF_PAGE_WORKERS, len(pages)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda page: _classify_page(page[0], page[1], classify_fn),
+            pages
+        ))
+
+    return merge_page_classifications(results)
+
+
+def _classify_page(page_bytes, page_hash, classify_fn):
+    """1ページ分を分類（キャッシュがあれば再利用）"""
+    cached = load_cached_page(page_hash)
+    if cached is not None:
+        print(f'[pdf] Cache hit: {page_hash[:12]}')
+        return cached
+
+    classification = classify_fn(page_bytes, 'application/pdf')
+    save_cached_page(page_hash, classification)
+    return classification
+
+
+# ============================================================
+# 結果のマージ
+# ============================================================
+
+def merge_page_classifications(results):
+    """
+    ページごとの分類結果を1つの分類結果にまとめる
+    - カテゴリ: いずれかのページが通帳なら通帳、次いでレシート
+    - 通帳: 残高の連続性でページを並べ、最初/最後の残高を求める
+    """
+    if not results:
+        return {'category': 'unknown', 'error': 'empty'}
+
+    # Gemini障害で分類できなかったページがあれば、書類全体を保留扱いにする
+    deferred = next((r for r in results if r.get('deferrable')), None)
+    if deferred is not None:
+        return {'category': 'unknown', 'error': deferred.get('error'), 'deferrable': True}
+
+    pages = []
+    for i, r in enumerate(results):
+        pages.append({
+            'page_index': i,
+            'category': r.get('category', 'unknown'),
+            'confidence': r.get('confidence'),
+            'extracted_data': r.get('extracted_data') or {},
+            'error': r.get('error'),
+        })
+
+    categories = {p['category'] for p in pages}
+    category = next((c for c in CATEGORY_PRIORITY if c in categories), 'unknown')
+
+    merged = {
+        'category': category,
+        'page_count': len(pages),
+    }
+
+    confidences = [p['confidence'] for p in pages if isinstance(p['confidence'], (int, float))]
+    if confidences:
+        merged['confidence'] = min(confidences)
+
+    # 全ページがエラーの場合はエラーとして扱う
+    if all(p['error'] for p in pages):
+        merged['error'] = pages[0]['error']
+
+    if category == 'passbook':
+        passbook_pages = sort_passbook_pages([p for p in pages if p['category'] == 'passbook'])
+        merged['extracted_data'] = _merge_passbook_data(passbook_pages)
+        merged['pages'] = passbook_pages
+    else:
+        first = next((p for p in pages if p['category'] == category), pages[0])
+        merged['extracted_data'] = first['extracted_data']
+        merged['pages'] = pages
+
+    return merged
+
+
+def _merge_passbook_data(pages):
+    """並べ替え済みの通帳ページから全体の抽出データを作成"""
+    first_data = pages[0]['extracted_data']
+    last_data = pages[-1]['extracted_data']
+
+    bank_name = next((p['extracted_data'].get('bank_name') for p in pages
+                      if p['extracted_data'].get('bank_name')), '')
+
+    start = str(first_data.get('date_range', '')).split('〜')[0].strip()
+    end = str(last_data.get('date_range', '')).split('〜')[-1].strip()
+    date_range = f'{start}〜{end}' if start and end else (start or end)
+
+    return {
+        'bank_name': bank_name,
+        'date_range': date_range,
+        'first_balance': first_data.get('first_balance', ''),
+        'latest_balance': last_data.get('latest_balance', ''),
+    }
+
+
+def _parse_balance(value):
+    """残高文字列を数値に変換（変換できなければNone）"""
+    if value is None or value == '':
+        return None
+    try:
+        return int(str(value).replace(',', '').replace('円', '').replace('*', '').strip())
+    except ValueError:
+        return None
+
+
+def sort_passbook_pages(pages):
+    """
+    通帳ページを並べ替え（PassbookEngine.gs の sortPassbookPages_ と同じ規則）
+    1. ページ番号が全ページにあればページ番号順
+    2. なければ残高の連続性（前ページの最後の残高 = 次ページの最初の残高）
+    """
+    if len(pages) <= 1:
+        return pages
+
+    page_numbers = [_parse_balance(p['extracted_data'].get('page_number')) for p in pages]
+    if all(n is not None for n in page_numbers):
+        return [p for _, p in sorted(zip(page_numbers, pages), key=lambda x: x[0])]
+
+    def first_bal(p):
+        return _parse_balance(p['extracted_data'].get('first_balance'))
+
+    def last_bal(p):
+        return _parse_balance(p['extracted_data'].get('latest_balance'))
+
+    remaining = list(pages)
+
+    # 最初の残高が他のどのページの最後の残高とも一致しないページを先頭にする
+    last_balances = {}
+    for p in remaining:
+        lb = last_bal(p)
+        if lb is not None:
+            last_balances[lb] = last_balances.get(lb, 0) + 1
+
+    first_page = None
+    for p in remaining:
+        fb = first_bal(p)
+        own = 1 if fb is not None and last_bal(p) == fb else 0
+        if fb is None or last_balances.get(fb, 0) - own == 0:
+            first_page = p
+            break
+    if first_page is None:
+        first_page = remaining[0]
+
+    sorted_pages = [first_page]
+    remaining.remove(first_page)
+
+    # 残りは残高が一致するページ、なければ最も近い残高のページを連結
+    while remaining:
+        lb = last_bal(sorted_pages[-1])
+        next_page = None
+        if lb is not None:
+            next_page = next((p for p in remaining if first_bal(p) == lb), None)
+            if next_page is None:
+                candidates = [p for p in remaining if first_bal(p) is not None]
+                if candidates:
+                    next_page = min(candidates, key=lambda p: abs(first_bal(p) - lb))
+                    print(f'[pdf] 残高が一致しないページがあります。最も近い残高で連結: '
+                          f'{lb} → {first_bal(next_page)}')
+        if next_page is None:
+            next_page = remaining[0]
+        sorted_pages.append(next_page)
+        remaining.remove(next_page)
+
+    return sorted_pages
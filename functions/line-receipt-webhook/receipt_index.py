@@ -0,0 +1,366 @@
+"""
+領収書の重複検知インデックス（顧客ごと。共有キャッシュ、使えない間はSQLite）
+
+同じ領収書を2回撮影した・写真とPDFで1回ずつ送ったなど、バイト列が違う重複を
+次の2つのキーで検知する。どちらも全件走査ではなく索引付きのバケット参照で候補を絞る。
+
+- 知覚ハッシュ（64bit dHash）: 8bitずつ8つのバンドに分けて索引を張る。
+  ハミング距離が7以下の2つのハッシュは少なくとも1つのバンドが完全一致するため、
+  バンド一致で候補を引いてから距離を計算すれば取りこぼしがない
+- 読み取り結果（日付, 金額, 店名）: (金額, 日付) の索引で「同額・前後1日」を引き、店名の類似度で判定
+
+インデックスは共有キャッシュ（shared_cache.py の RECEIPTS）に置き、どのインスタンスで受け取っても
+同じ顧客の過去の領収書と比べる。バンド・金額ごとのハッシュ（フィールド = 領収書ID）がSQLiteの索引の代わりになる。
+同じ顧客の確認〜登録は CLAIMS の印でインスタンスをまたいで直列にする。
+共有層が使えない間は RECEIPT_INDEX_DIR のSQLite（インスタンスごと）で確認・登録する。
+
+画像の復号には Pillow、PDFの埋め込み画像の取り出しには pypdf を使う（未導入なら知覚ハッシュなしで判定）。
+"""
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import date, datetime, timedelta
+from difflib import SequenceMatcher
+
+from shared_cache import CLAIMS, MISS, RECEIPTS
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow未導入の環境では知覚ハッシュを使わない
+    Image = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+RECEIPT_INDEX_DIR = os.environ.get('RECEIPT_INDEX_DIR', '/tmp/receipt_index')
+PHASH_MAX_DISTANCE = int(os.environ.get('PHASH_MAX_DISTANCE', '6'))
+STORE_SIMILARITY = 0.6
+DATE_TOLERANCE_DAYS = 1
+BAND_COUNT = 8
+# 同じ顧客の確認〜登録を別のインスタンスと直列にする印の期限と、印が取れるまで待つ最長時間（秒）
+SHARED_LOCK_SECONDS = 30
+SHARED_LOCK_WAIT = 5.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS receipts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phash INTEGER,
+    band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+    band4 INTEGER, band5 INTEGER, band6 INTEGER, band7 INTEGER,
+    receipt_date TEXT,
+    amount INTEGER,
+    store TEXT,
+    filename TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_receipts_amount_date ON receipts (amount, receipt_date);
+''' + ''.join(
+    f'CREATE INDEX IF NOT EXISTS idx_receipts_band{i} ON receipts (band{i});\n' for i in range(BAND_COUNT)
+)
+
+_local = threading.local()
+_customer_locks = {}
+_customer_locks_guard = threading.Lock()
+
+
+def _safe_name(customer_key):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', customer_key)
+
+
+def _store_matches(store, other):
+    # 店名が読み取れていない側があれば、同額・同日付近だけでは重複とみなさない
+    return bool(store and other) and (
+        store == other or SequenceMatcher(None, store, other).ratio() >= STORE_SIMILARITY
+    )
+
+
+def _connect(customer_key):
+    """顧客ごとのDBに接続（スレッドごとに接続を使い回す）"""
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(customer_key)
+    if conn is None:
+        os.makedirs(RECEIPT_INDEX_DIR, exist_ok=True)
+        path = os.path.join(RECEIPT_INDEX_DIR, f'receipts_{_safe_name(customer_key)}.db')
+        conn = sqlite3.connect(path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        conns[customer_key] = conn
+    return conn
+
+
+# ============================================================
+# 知覚ハッシュ
+# ============================================================
+
+def _largest_pdf_image(content):
+    """PDFの1ページ目で一番大きい埋め込み画像（スキャン・写真のPDF）のバイト列"""
+    if PdfReader is None:
+        return None
+    try:
+        page = PdfReader(io.BytesIO(content)).pages[0]
+        images = list(page.images)
+        if not images:
+            return None
+        return max(images, key=lambda img: len(img.data)).data
+    except Exception as e:
+        print(f'[dup] PDF image extraction failed: {e}')
+        return None
+
+
+def perceptual_hash(content, mime_type='image/jpeg'):
+    """
+    64bit dHash（9x8のグレースケールに縮小し、横に隣り合う画素の大小をビットにする）
+    画像を復号できない場合は None
+    """
+    if Image is None:
+        return None
+    data = _largest_pdf_image(content) if mime_type == 'application/pdf' else content
+    if not data:
+        return None
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.draft('L', (64, 64))  # JPEGは縮小して復号（大きな写真でも速い）
+        pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    except Exception as e:
+        print(f'[dup] Perceptual hash failed: {e}')
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    # SQLite の INTEGER は符号付き64bitのため、符号付きに変換して保存する
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _bands(phash):
+    unsigned = phash & ((1 << 64) - 1)
+    return [(unsigned >> (8 * i)) & 0xFF for i in range(BAND_COUNT)]
+
+
+def hamming(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+# ============================================================
+# 読み取り結果の正規化
+# ============================================================
+
+DATE_PATTERN = re.compile(r'(\d{4})\D{1,3}(\d{1,2})\D{1,3}(\d{1,2})')
+
+
+def normalize_date(value):
+    """日付を YYYY-MM-DD に（解釈できなければ空文字）"""
+    text = unicodedata.normalize('NFKC', str(value or ''))
+    match = DATE_PATTERN.search(text)
+    if not match:
+        return ''
+    try:
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3))).isoformat()
+    except ValueError:
+        return ''
+
+
+def normalize_amount(value):
+    """金額を整数に（カンマ・円・全角を除去、解釈できなければNone）"""
+    if isinstance(value, bool) or value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = re.sub(r'[^\d-]', '', unicodedata.normalize('NFKC', str(value)))
+    try:
+        return int(digits)
+    except ValueError:
+        return None
+
+
+def normalize_store(value):
+    """店名を比較用に正規化（全角半角・大文字小文字・空白・法人格の表記ゆれを除去）"""
+    text = unicodedata.normalize('NFKC', str(value or '')).lower()
+    text = re.sub(r'(株式会社|有限会社|\(株\)|\(有\)|㈱|㈲)', '', text)
+    return re.sub(r'[\s・\-_.,、。]', '', text)
+
+
+# ============================================================
+# 検索・登録
+# ============================================================
+
+def find_duplicate(customer_key, phash, extracted):
+    """
+    重複の候補を探す
+    extracted: 分類結果の extracted_data（date, amount, store_name）
+    戻り値: {'id', 'filename', 'created_at', 'reason', 'distance'} or None
+    """
+    if not customer_key:
+        return None
+    shared = _find_shared(customer_key, phash, extracted)
+    if shared is not MISS:
+        return shared
+    conn = _connect(customer_key)
+
+    if phash is not None:
+        bands = _bands(phash)
+        where = ' OR '.join(f'band{i} = ?' for i in range(BAND_COUNT))
+        best = None
+        for r in conn.execute(f'SELECT id, phash, filename, created_at FROM receipts WHERE {where}', bands):
+            distance = hamming(phash, r['phash'])
+            if distance <= PHASH_MAX_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, r)
+        if best:
+            distance, r = best
+            return {'id': r['id'], 'filename': r['filename'], 'created_at': r['created_at'],
+                    'reason': 'image', 'distance': distance}
+
+    receipt_date = normalize_date(extracted.get('date'))
+    amount = normalize_amount(extracted.get('amount'))
+    if not receipt_date or not amount:
+        return None
+    store = normalize_store(extracted.get('store_name'))
+    day = datetime.strptime(receipt_date, '%Y-%m-%d').date()
+    rows = conn.execute(
+        'SELECT id, store, filename, created_at FROM receipts '
+        'WHERE amount = ? AND receipt_date BETWEEN ? AND ?',
+        (amount, (day - timedelta(days=DATE_TOLERANCE_DAYS)).isoformat(),
+         (day + timedelta(days=DATE_TOLERANCE_DAYS)).isoformat())
+    )
+    for r in rows:
+        if _store_matches(store, r['store']):
+            return {'id': r['id'], 'filename': r['filename'], 'created_at': r['created_at'],
+                    'reason': 'data', 'distance': None}
+    return None
+
+
+def _find_shared(customer_key, phash, extracted):
+    """共有キャッシュのインデックスで重複の候補を探す（共有層が使えなければ MISS）"""
+    if phash is not None:
+        best = None
+        for i, band in enumerate(_bands(phash)):
+            bucket = RECEIPTS.get_fields(f'{customer_key}:band{i}:{band}')
+            if bucket is MISS:
+                return MISS
+            for receipt_id, other in bucket.items():
+                distance = hamming(phash, other)
+                if distance <= PHASH_MAX_DISTANCE and (best is None or distance < best[0]):
+                    best = (distance, receipt_id)
+        if best:
+            distance, receipt_id = best
+            record = RECEIPTS.get_fields(f'{customer_key}:records', [receipt_id])
+            if record is MISS:
+                return MISS
+            record = record[receipt_id] or {}
+            return {'id': int(receipt_id), 'filename': record.get('filename'),
+                    'created_at': record.get('created_at'), 'reason': 'image', 'distance': distance}
+
+    receipt_date = normalize_date(extracted.get('date'))
+    amount = normalize_amount(extracted.get('amount'))
+    if not receipt_date or not amount:
+        return None
+    store = normalize_store(extracted.get('store_name'))
+    day = datetime.strptime(receipt_date, '%Y-%m-%d').date()
+    low = (day - timedelta(days=DATE_TOLERANCE_DAYS)).isoformat()
+    high = (day + timedelta(days=DATE_TOLERANCE_DAYS)).isoformat()
+    bucket = RECEIPTS.get_fields(f'{customer_key}:amount:{amount}')
+    if bucket is MISS:
+        return MISS
+    for receipt_id, record in sorted(bucket.items(), key=lambda item: int(item[0])):
+        if low <= (record.get('receipt_date') or '') <= high and _store_matches(store, record.get('store')):
+            return {'id': int(receipt_id), 'filename': record.get('filename'),
+                    'created_at': record.get('created_at'), 'reason': 'data', 'distance': None}
+    return None
+
+
+def _add_shared(customer_key, phash, record):
+    """共有キャッシュのインデックスに登録（戻り値: 登録したか。共有層が使えなければ False）"""
+    receipt_id = RECEIPTS.incr_field(f'{customer_key}:seq', 'id')
+    if receipt_id is MISS:
+        return False
+    receipt_id = str(receipt_id)
+    if not RECEIPTS.set_fields(f'{customer_key}:records', {receipt_id: record}):
+        return False
+    if phash is not None:
+        for i, band in enumerate(_bands(phash)):
+            RECEIPTS.set_fields(f'{customer_key}:band{i}:{band}', {receipt_id: phash})
+    if record['amount'] and record['receipt_date']:
+        RECEIPTS.set_fields(f'{customer_key}:amount:{record["amount"]}', {receipt_id: record})
+    return True
+
+
+def add(customer_key, phash, extracted, filename):
+    """領収書をインデックスに登録"""
+    if not customer_key:
+        return
+    record = {
+        'receipt_date': normalize_date(extracted.get('date')) or None,
+        'amount': normalize_amount(extracted.get('amount')),
+        'store': normalize_store(extracted.get('store_name')) or None,
+        'filename': filename,
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    if _add_shared(customer_key, phash, record):
+        return
+    bands = _bands(phash) if phash is not None else [None] * BAND_COUNT
+    try:
+        conn = _connect(customer_key)
+        with conn:
+            conn.execute(
+                'INSERT INTO receipts (phash, band0, band1, band2, band3, band4, band5, band6, band7, '
+                'receipt_date, amount, store, filename, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [phash, *bands, record['receipt_date'], record['amount'], record['store'],
+                 filename, record['created_at']]
+            )
+    except Exception as e:
+        print(f'[dup] Index add error ({customer_key}): {e}')
+
+
+def _customer_lock(customer_key):
+    with _customer_locks_guard:
+        return _customer_locks.setdefault(customer_key, threading.Lock())
+
+
+def _acquire_shared_lock(customer_key):
+    """
+    別のインスタンスとの直列化の印を付ける（SHARED_LOCK_WAIT 秒まで待つ）
+    戻り値: 印を付けたか（共有層が使えない・待っても取れない場合は False のまま進める）
+    """
+    deadline = time.monotonic() + SHARED_LOCK_WAIT
+    while not CLAIMS.set(f'dup:{customer_key}', True, only_if_absent=True, ttl=SHARED_LOCK_SECONDS):
+        if not CLAIMS.cache.shared_available or time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def check_and_add(customer_key, content, mime_type, extracted, filename):
+    """
+    重複を確認し、重複でなければ登録する
+    （同じ顧客の確認〜登録はインスタンス内・インスタンス間で直列にし、同時に届いた2枚がどちらも登録されるのを防ぐ）
+    戻り値: 重複候補（find_duplicate の戻り値）or None
+    """
+    if not customer_key:
+        return None
+    phash = perceptual_hash(content, mime_type)
+    with _customer_lock(customer_key):
+        locked = _acquire_shared_lock(customer_key)
+        try:
+            try:
+                duplicate = find_duplicate(customer_key, phash, extracted)
+            except Exception as e:
+                print(f'[dup] Check error ({customer_key}): {e}')
+                return None
+            if duplicate:
+                print(f'[dup] Possible duplicate of {duplicate["filename"]} ({duplicate["reason"]}): {filename}')
+                return duplicate
+            add(customer_key, phash, extracted, filename)
+        finally:
+            if locked:
+                CLAIMS.delete(f'dup:{customer_key}')
+    return None
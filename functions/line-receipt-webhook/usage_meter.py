@@ -0,0 +1,336 @@
+"""
+顧客別・月別の利用量メーター
+
+領収書/通帳の受付数と会計ソフト向けの出力行数を、発生時点で顧客×月のカウンタに加算する。
+「今月の利用量」は1回の参照で返せるため、月末に全顧客のシートを数え直さなくても、
+プラン上限（30/100/200行）の超過が途中で分かる。
+
+- カウンタは共有キャッシュ（shared_cache.py の USAGE、月ごとのハッシュを HINCRBY で加算）に保存し、
+  どのインスタンスで受け付けても同じカウンタに数える
+- 共有層が使えない間はローカルのSQLite（インスタンスごと）に保存・参照し、加算分は未反映として残して
+  共有層が戻ったら HINCRBY で共有キャッシュに加算し直す（_replay_unsynced）
+- 出力行数は顧客スプシの出力処理（gas/Output_Yayoi.gs）から POST /usage/export で加算し、
+  定期的に顧客スプシの「出力済」行数（BillingManagement.gs の countExportedRows と同じ数え方）で
+  上書きして補正する（reconcile_customer）
+"""
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from shared_cache import MISS, USAGE
+
+USAGE_DB_PATH = os.environ.get('USAGE_DB_PATH', '/tmp/usage_meter.db')
+
+# プラン別の月間行数上限と超過単価
+PLAN_ROW_LIMITS = {
+    '記帳5000': 30,
+    '記帳10000': 100,
+    '記帳14000': 200,
+}
+OVERAGE_UNIT_PRICE = 20  # 円/行
+
+_local = threading.local()
+_replay_lock = threading.Lock()
+# 未反映の加算があるかもしれない間 True（起動時は前のプロセスが残した分を確認する）
+_unsynced_pending = True
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS usage (
+    customer_key TEXT NOT NULL,
+    month TEXT NOT NULL,
+    receipts INTEGER NOT NULL DEFAULT 0,
+    passbooks INTEGER NOT NULL DEFAULT 0,
+    exported_rows INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    reconciled_at TEXT,
+    PRIMARY KEY (customer_key, month)
+);
+CREATE INDEX IF NOT EXISTS idx_usage_month ON usage (month);
+CREATE TABLE IF NOT EXISTS unsynced (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_key TEXT NOT NULL,
+    month TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+'''
+
+COUNTER_COLUMNS = {'receipt': 'receipts', 'passbook': 'passbooks', 'exported': 'exported_rows'}
+USAGE_FIELDS = ('receipts', 'passbooks', 'exported_rows', 'reconciled_at')
+
+
+def _connect():
+    """スレッドごとに1つの接続を使い回す"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(USAGE_DB_PATH, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def current_month(now=None):
+    return (now or datetime.now()).strftime('%Y-%m')
+
+
+def usage_key(channel_key, user_id, customer_code=''):
+    """メーターのキー（顧客コードがあればコード、なければチャネル+LINE ID）"""
+    return customer_code or f'{channel_key}:{user_id}'
+
+
+def _field(customer_key, column):
+    """共有キャッシュの月ごとのハッシュのフィールド名"""
+    return f'{customer_key}/{column}'
+
+
+def _replay_unsynced():
+    """共有層が使えない間にSQLiteへ保存した加算を、共有キャッシュに加算し直す"""
+    global _unsynced_pending
+    if not _unsynced_pending or not USAGE.cache.shared_available or not _replay_lock.acquire(blocking=False):
+        return
+    # 読んだ後に追加された分は record が True に戻す
+    _unsynced_pending = False
+    try:
+        conn = _connect()
+        rows = conn.execute('SELECT id, customer_key, month, column_name, count FROM unsynced ORDER BY id').fetchall()
+        for r in rows:
+            if USAGE.incr_field(r['month'], _field(r['customer_key'], r['column_name']), r['count']) is MISS:
+                _unsynced_pending = True
+                return
+            with conn:
+                conn.execute('DELETE FROM unsynced WHERE id = ?', (r['id'],))
+        if rows:
+            print(f'[usage] Replayed {len(rows)} counts recorded while the shared cache was unavailable')
+    except Exception as e:
+        _unsynced_pending = True
+        print(f'[usage] Replay error: {e}')
+    finally:
+        _replay_lock.release()
+
+
+def _shared_usage(customer_key, month, values):
+    """共有キャッシュのフィールドの値から利用量の辞書を作る"""
+    usage = {'customer_key': customer_key, 'month': month}
+    for column in USAGE_FIELDS:
+        value = values.get(_field(customer_key, column))
+        usage[column] = value if value is not None or column == 'reconciled_at' else 0
+    return usage
+
+
+# ============================================================
+# カウンタ更新
+# ============================================================
+
+def record(customer_key, counter, count=1, month=None):
+    """
+    カウンタを加算
+    counter: 'receipt'（領収書受付）/ 'passbook'（通帳受付）/ 'exported'（出力行数）
+    """
+    global _unsynced_pending
+    column = COUNTER_COLUMNS.get(counter)
+    if not column or not customer_key:
+        return
+    month = month or current_month()
+    _replay_unsynced()
+    if USAGE.incr_field(month, _field(customer_key, column), count) is not MISS:
+        return
+    try:
+        conn = _connect()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with conn:
+            conn.execute(
+                f'INSERT INTO usage (customer_key, month, {column}, updated_at) VALUES (?, ?, ?, ?) '
+                f'ON CONFLICT(customer_key, month) DO UPDATE SET '
+                f'{column} = {column} + excluded.{column}, updated_at = excluded.updated_at',
+                (customer_key, month, count, now)
+            )
+            if USAGE.cache.client is not None:
+                # 共有層が戻ったら加算し直す
+                conn.execute(
+                    'INSERT INTO unsynced (customer_key, month, column_name, count) VALUES (?, ?, ?, ?)',
+                    (customer_key, month, column, count)
+                )
+                _unsynced_pending = True
+    except Exception as e:
+        print(f'[usage] Record error ({customer_key}): {e}')
+
+
+def reconcile(customer_key, month, exported_rows):
+    """
+    出力行数をシートの実数で上書き（定期補正）
+    戻り値: 補正前との差分（シート - メーター）
+    """
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    _replay_unsynced()
+    # 読んでから上書きするまでに加算された分を失わないように、上書き前の値と上書きを1つのトランザクションで行う
+    swapped = USAGE.swap_fields(month, {_field(customer_key, 'exported_rows'): exported_rows,
+                                        _field(customer_key, 'reconciled_at'): now})
+    if swapped is None:
+        print(f'[usage] Reconcile skipped, counter kept changing ({customer_key} {month})')
+        return 0
+    if swapped is not MISS:
+        before = swapped[_field(customer_key, 'exported_rows')] or 0
+        if exported_rows != before:
+            print(f'[usage] Reconciled {customer_key} {month}: {before} → {exported_rows}')
+        return exported_rows - before
+    try:
+        conn = _connect()
+        with conn:
+            row = conn.execute(
+                'SELECT exported_rows FROM usage WHERE customer_key = ? AND month = ?',
+                (customer_key, month)
+            ).fetchone()
+            before = row['exported_rows'] if row else 0
+            conn.execute(
+                'INSERT INTO usage (customer_key, month, exported_rows, updated_at, reconciled_at) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT(customer_key, month) DO UPDATE SET '
+                'exported_rows = excluded.exported_rows, reconciled_at = excluded.reconciled_at',
+                (customer_key, month, exported_rows, now, now)
+            )
+        drift = exported_rows - before
+        if drift:
+            print(f'[usage] Reconciled {customer_key} {month}: {before} → {exported_rows}')
+        return drift
+    except Exception as e:
+        print(f'[usage] Reconcile error ({customer_key}): {e}')
+        return 0
+
+
+# ============================================================
+# 参照
+# ============================================================
+
+def get_usage(customer_key, month=None):
+    """顧客の月間利用量（主キー参照）"""
+    month = month or current_month()
+    _replay_unsynced()
+    shared = USAGE.get_fields(month, [_field(customer_key, column) for column in USAGE_FIELDS])
+    if shared is not MISS:
+        return _shared_usage(customer_key, month, shared)
+    empty = {'customer_key': customer_key, 'month': month, 'receipts': 0,
+             'passbooks': 0, 'exported_rows': 0, 'reconciled_at': None}
+    try:
+        row = _connect().execute(
+            'SELECT customer_key, month, receipts, passbooks, exported_rows, reconciled_at '
+            'FROM usage WHERE customer_key = ? AND month = ?',
+            (customer_key, month)
+        ).fetchone()
+        return dict(row) if row else empty
+    except Exception as e:
+        print(f'[usage] Read error ({customer_key}): {e}')
+        return empty
+
+
+def monthly_summary(month=None):
+    """月間の全顧客の利用量（管理画面用）"""
+    month = month or current_month()
+    _replay_unsynced()
+    shared = USAGE.get_fields(month)
+    if shared is not MISS:
+        keys = sorted({field.rsplit('/', 1)[0] for field in shared})
+        return [_shared_usage(key, month, shared) for key in keys]
+    try:
+        rows = _connect().execute(
+            'SELECT customer_key, month, receipts, passbooks, exported_rows, reconciled_at '
+            'FROM usage WHERE month = ? ORDER BY customer_key',
+            (month,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+    except Exception as e:
+        print(f'[usage] Summary error: {e}')
+        return []
+
+
+def plan_status(usage, plan):
+    """
+    プラン上限に対する利用状況
+    行数は出力済み行数を基準にし、未出力の受付分も見込みとして返す
+    """
+    limit = PLAN_ROW_LIMITS.get(plan)
+    rows = usage.get('exported_rows', 0)
+    projected = max(rows, usage.get('receipts', 0) + usage.get('passbooks', 0))
+    status = {'plan': plan, 'limit': limit, 'rows': rows, 'projected_rows': projected,
+              'overage_rows': 0, 'overage_fee': 0}
+    if limit is not None:
+        status['overage_rows'] = max(0, rows - limit)
+        status['overage_fee'] = status['overage_rows'] * OVERAGE_UNIT_PRICE
+    return status
+
+
+def format_usage_lines(usage, plan=''):
+    """「状態確認」の返信用の利用量テキスト"""
+    status = plan_status(usage, plan)
+    lines = [f'📨 今月の受付: {usage["receipts"] + usage["passbooks"]}件']
+    if status['limit'] is not None:
+        lines.append(f'📊 今月の出力: {status["rows"]}行 / {status["limit"]}行')
+        if status['overage_rows']:
+            lines.append(f'⚠️ 超過: {status["overage_rows"]}行（{status["overage_fee"]:,}円）')
+    else:
+        lines.append(f'📊 今月の出力: {status["rows"]}行')
+    return lines
+
+
+# ============================================================
+# シートとの補正
+# ============================================================
+
+def _serial_to_date(value):
+    """Sheets APIの日付シリアル値を日付に変換（GASで Date 型になるセルのみ対象）"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime(1899, 12, 30) + timedelta(days=value)
+    return None
+
+
+def _find_column(headers, names):
+    lowered = [str(h).lower().strip() for h in headers]
+    for i, header in enumerate(lowered):
+        if header in names:
+            return i
+    return -1
+
+
+def count_exported_rows(values, year, month):
+    """
+    出力済み行数を数える（BillingManagement.gs の countExportedRows と同じ規則）
+    values: valueRenderOption='UNFORMATTED_VALUE' で取得したシートの値
+    """
+    if len(values) < 2:
+        return 0
+    headers = values[0]
+    date_col = _find_column(headers, ('日付', 'date'))
+    exported_col = _find_column(headers, ('出力済', 'exported'))
+    rows_col = _find_column(headers, ('出力行数', 'export_rows'))
+    if date_col == -1 or exported_col == -1:
+        return 0
+
+    count = 0
+    for row in values[1:]:
+        if len(row) <= max(date_col, exported_col) or row[exported_col] is not True:
+            continue
+        date = _serial_to_date(row[date_col])
+        if date and date.year == year and date.month == month:
+            rows = row[rows_col] if rows_col != -1 and len(row) > rows_col else 1
+            # GAS と同じく数値なら整数・小数を問わず使う（12.0 のように小数で返るセルもある）
+            is_number = isinstance(rows, (int, float)) and not isinstance(rows, bool) and math.isfinite(rows)
+            count += int(rows) if is_number and rows > 0 else 1
+    return count
+
+
+def reconcile_customer(service, customer_key, spreadsheet_id, year, month):
+    """顧客スプシの「本番シート」「通帳」から出力行数を数え直してメーターを補正"""
+    total = 0
+    for sheet_name in ('本番シート', '通帳'):
+        try:
+            result = service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=sheet_name,
+                valueRenderOption='UNFORMATTED_VALUE'
+            ).execute()
+            total += count_exported_rows(result.get('values', []), year, month)
+        except Exception as e:
+            print(f'[usage] Count error ({customer_key} {sheet_name}): {e}')
+    return reconcile(customer_key, f'{year}-{month:02d}', total)
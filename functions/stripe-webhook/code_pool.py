@@ -0,0 +1,232 @@
+"""
+未使用コードの補充（顧客コードとDriveフォルダの事前作成）
+
+assign_unused_code は顧客管理シートの「未使用」行（コードとフォルダIDが入った行）を割り当てるだけなので、
+未使用の行がなくなると契約したお客様にコードを送れず、管理者が手動で発行するまで止まってしまう。
+ここでは未使用の行が一定数を下回ったら、GASの「新規フォルダ作成」と同じ構成のフォルダと行を先に作っておく。
+
+- 未使用の行が CODE_POOL_LOW_WATERMARK 件を下回ったら CODE_POOL_TARGET 件まで補充する
+- 新しいコードは、シートのコードと親フォルダ内のコードフォルダのうち最大の番号の次から振る
+  （フォルダだけ作られて行がない番号も使わない）
+- 番号は claims（shared_cache.py の CLAIMS）に SET NX で予約し、別のインスタンスが予約した番号は飛ばす
+  （共有キャッシュがない場合は、行を追加する直前にシートを読み直して先に追加された番号を使わないだけ）
+- フォルダIDは files.generateIds でまとめて払い出し、IDを指定して batch リクエスト（1回100件まで）で作る。
+  batch 内の実行順は決まっていないため、コードフォルダ → サブフォルダ（領収書・通帳・クレカ明細）の2段階で送る
+- 行は CustomerStore.append_now でシートへ同期的に1回の append で書き込む
+- サブフォルダが揃わなかった・使わなかったコードのフォルダはゴミ箱に移す（行のないフォルダを残さない）
+- 補充は同時に1つだけ。別スレッドで実行し、コードの割り当ては補充を待たない
+
+行の列構成は GAS の registerFoldersToSheetFromList と同じ（C=領収書フォルダ, G=コード, H=未使用,
+S=通帳フォルダ, T=クレカ明細フォルダ）。顧客用スプレッドシート（R列）は作らない。
+"""
+import os
+import re
+import threading
+
+from google.auth import default
+from googleapiclient.discovery import build
+
+CODE_POOL_PARENT_FOLDER_ID = os.environ.get('CODE_POOL_PARENT_FOLDER_ID', '')
+CODE_POOL_PREFIX = os.environ.get('CODE_POOL_PREFIX', 'MK')
+CODE_POOL_LOW_WATERMARK = int(os.environ.get('CODE_POOL_LOW_WATERMARK', '5'))
+CODE_POOL_TARGET = int(os.environ.get('CODE_POOL_TARGET', '15'))
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SUBFOLDERS = ('領収書', '通帳', 'クレカ明細')
+UNUSED_STATUS = '未使用'
+# Drive の batch リクエストは1回100件まで
+DRIVE_BATCH_LIMIT = 100
+
+# 行の列（0始まり）
+COL_FOLDER_ID = 2            # C: 領収書フォルダ
+COL_CODE = 6                 # G
+COL_STATUS = 7               # H
+COL_PASSBOOK_FOLDER_ID = 18  # S
+COL_CC_FOLDER_ID = 19        # T
+ROW_WIDTH = 21               # A〜U
+
+
+def get_drive_service():
+    credentials, project = default(scopes=['https://www.googleapis.com/auth/drive'])
+    return build('drive', 'v3', credentials=credentials)
+
+
+class CodePool:
+    """
+    1つの顧客管理シートの未使用コードを補充する
+    store: CustomerStore（find_by_status / codes / append_now を使う）
+    claims: 番号の予約に使うキャッシュ（set(only_if_absent) を持つもの。None ならインスタンス内でだけ絞る）
+    """
+
+    def __init__(self, store, parent_folder_id=CODE_POOL_PARENT_FOLDER_ID, prefix=CODE_POOL_PREFIX,
+                 low_watermark=CODE_POOL_LOW_WATERMARK, target=CODE_POOL_TARGET,
+                 drive_service_factory=get_drive_service, claims=None):
+        self.store = store
+        self.claims = claims
+        self.parent_folder_id = parent_folder_id
+        self.prefix = prefix.upper()
+        self.low_watermark = low_watermark
+        self.target = max(target, low_watermark)
+        self.drive_service_factory = drive_service_factory
+        self.code_pattern = re.compile(rf'^{re.escape(self.prefix)}(\d+)$')
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.parent_folder_id)
+
+    def unused_count(self):
+        return len(self.store.find_by_status(UNUSED_STATUS))
+
+    def _max_number(self, names):
+        numbers = [int(m.group(1)) for m in map(self.code_pattern.match, names) if m]
+        return max(numbers, default=0)
+
+    def _existing_folder_names(self, service):
+        """親フォルダ内のコードフォルダ名"""
+        names = []
+        page_token = None
+        query = (f"'{self.parent_folder_id}' in parents and mimeType='{FOLDER_MIME_TYPE}' "
+                 f"and name contains '{self.prefix}' and trashed=false")
+        while True:
+            result = service.files().list(
+                q=query, fields='nextPageToken, files(name)', pageSize=1000, pageToken=page_token,
+                supportsAllDrives=True, includeItemsFromAllDrives=True
+            ).execute()
+            names.extend(f['name'].upper() for f in result.get('files', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return names
+
+    def _generate_ids(self, service, count):
+        ids = []
+        while len(ids) < count:
+            result = service.files().generateIds(count=min(count - len(ids), 1000), space='drive').execute()
+            ids.extend(result.get('ids', []))
+        return ids
+
+    def _create_folders(self, service, folders):
+        """
+        IDを指定してフォルダをまとめて作る
+        folders: [(folder_id, name, parent_id), ...]
+        戻り値: 作成に失敗したフォルダIDの集合
+        """
+        failed = set()
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                print(f'[code_pool] Folder create error ({request_id}): {exception}')
+                failed.add(request_id)
+
+        for start in range(0, len(folders), DRIVE_BATCH_LIMIT):
+            batch = service.new_batch_http_request(callback=callback)
+            for folder_id, name, parent_id in folders[start:start + DRIVE_BATCH_LIMIT]:
+                batch.add(service.files().create(
+                    body={'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]},
+                    fields='id', supportsAllDrives=True
+                ), request_id=folder_id)
+            batch.execute()
+        return failed
+
+    def _reserve_codes(self, last, count):
+        """last の次の番号から count 件のコードを予約する（別のインスタンスが予約済みの番号は飛ばす）"""
+        codes = []
+        number = last
+        while len(codes) < count:
+            number += 1
+            code = f'{self.prefix}{number:03d}'
+            if self.claims is None or self.claims.set(f'code:{code}', True, only_if_absent=True):
+                codes.append(code)
+        return codes
+
+    def _trash_folders(self, service, folder_ids):
+        """使わなかったコードのフォルダをまとめてゴミ箱に移す（サブフォルダも一緒に移る）"""
+        def callback(request_id, response, exception):
+            if exception is not None:
+                print(f'[code_pool] Folder trash error ({request_id}): {exception}')
+
+        folder_ids = list(folder_ids)
+        for start in range(0, len(folder_ids), DRIVE_BATCH_LIMIT):
+            batch = service.new_batch_http_request(callback=callback)
+            for folder_id in folder_ids[start:start + DRIVE_BATCH_LIMIT]:
+                batch.add(service.files().update(
+                    fileId=folder_id, body={'trashed': True}, fields='id', supportsAllDrives=True
+                ), request_id=folder_id)
+            batch.execute()
+        if folder_ids:
+            print(f'[code_pool] Trashed {len(folder_ids)} unused code folders')
+
+    def replenish(self, wait=False):
+        """
+        未使用の行が下限を下回っていれば目標数まで補充する
+        同時に1つだけ。実行中なら何もしない（wait=True なら実行中の補充が終わるのを待ってから確認する）
+        戻り値: 追加したコードのリスト
+        """
+        if not self.enabled or not self._lock.acquire(blocking=wait):
+            return []
+        try:
+            # シートが編集されていれば先に取り込む（スタッフが手で追加した行も数える）
+            self.store.refresh_if_stale()
+            unused = self.unused_count()
+            if unused >= self.low_watermark:
+                return []
+            count = self.target - unused
+
+            service = self.drive_service_factory()
+            last = max(self._max_number(self.store.codes()),
+                       self._max_number(self._existing_folder_names(service)))
+            codes = self._reserve_codes(last, count)
+
+            ids = iter(self._generate_ids(service, count * (1 + len(SUBFOLDERS))))
+            trees = [(code, next(ids), {name: next(ids) for name in SUBFOLDERS}) for code in codes]
+
+            failed = self._create_folders(
+                service, [(main_id, code, self.parent_folder_id) for code, main_id, _ in trees])
+            trees = [tree for tree in trees if tree[1] not in failed]
+            failed = self._create_folders(
+                service, [(sub_id, name, main_id) for _, main_id, subs in trees for name, sub_id in subs.items()])
+            # サブフォルダが揃わなかったコードは使わない
+            discarded = [tree for tree in trees if failed.intersection(tree[2].values())]
+            trees = [tree for tree in trees if not failed.intersection(tree[2].values())]
+
+            # 作成中に別のインスタンスが同じ番号を追加していれば使わない
+            self.store.refresh(force=True)
+            taken = set(self.store.codes())
+            discarded += [tree for tree in trees if tree[0] in taken]
+            trees = [tree for tree in trees if tree[0] not in taken]
+
+            rows = []
+            for code, main_id, subs in trees:
+                row = [''] * ROW_WIDTH
+                row[COL_FOLDER_ID] = subs['領収書']
+                row[COL_CODE] = code
+                row[COL_STATUS] = UNUSED_STATUS
+                row[COL_PASSBOOK_FOLDER_ID] = subs['通帳']
+                row[COL_CC_FOLDER_ID] = subs['クレカ明細']
+                rows.append(row)
+            try:
+                if rows:
+                    self.store.append_now(rows)
+            except Exception:
+                discarded += trees
+                raise
+            finally:
+                self._trash_folders(service, [main_id for _, main_id, _ in discarded])
+            added = [row[COL_CODE] for row in rows]
+            if added:
+                print(f'[code_pool] Added {len(added)} unused codes ({added[0]}〜{added[-1]}), '
+                      f'unused {unused} → {unused + len(added)}')
+            return added
+        except Exception as e:
+            print(f'[code_pool] Replenish error: {e}')
+            return []
+        finally:
+            self._lock.release()
+
+    def replenish_in_background(self):
+        """別スレッドで補充（リクエスト処理をブロックしない）"""
+        if not self.enabled:
+            return None
+        thread = threading.Thread(target=self.replenish, name='code-pool-replenish', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,709 @@
+"""
+顧客ストア（ローカルSQLite + 顧客管理シートへの非同期反映）
+
+Webhookの読み書きはローカルのSQLite（LINE ID・顧客コード・ステータスに索引あり）に対して行い、
+顧客管理シートへの反映はバックグラウンドの同期ワーカーが行う。
+
+- 読み取り: SQLiteの索引付きクエリ（Sheets APIを待たない）
+- 書き込み: SQLiteをトランザクションで更新し、同じトランザクションで送信待ち（outbox）に記録
+            （失えない・取り合う書き込みは update_if / append_now でシートへ同期的に書き込む）
+- 反映: ワーカーが outbox を順に処理。行番号ではなく キー（顧客コード or LINE ID）で
+        シート上の現在の行を探してから書き込むため、スタッフが途中で行を挿入しても壊れない
+        （連続する行の追加は1回の append にまとめる）
+- 取り込み: ワーカーが定期的にシートを読み、スタッフの編集をキー単位でSQLiteに取り込む
+            （送信待ちの変更があるキーはローカルを優先）
+- 変更検知: 取り込み前に Drive の version / modifiedTime を確認し、前回から変わっていなければ
+            シートを読まない。確認・取り込みはシートごとに single-flight（同時に来た要求は
+            実行中の1回の結果を待つ）で、リクエスト経路からの確認も CUSTOMER_CHECK_INTERVAL 秒に1回まで。
+            版の確認は同期ロックの外で行い、リクエスト経路はワーカーの反映中に取り込みを待たない（反映後にワーカーが取り込む）。
+            自分の反映で変わった版は反映後に記録し、自分の書き込みを取り込み直さない
+            （反映中のスタッフの編集を取りこぼしても CUSTOMER_FULL_PULL_INTERVAL 秒ごとに読み直す）
+- 共有キャッシュ（任意）: cache（get / set を持つキャッシュ、line-receipt-webhook では shared_cache.py）を渡すと、
+            LINE ID・顧客コードでの検索は共有キャッシュを先に見る。書き込み・取り込みで変わった行は
+            共有キャッシュにも書くため、別のインスタンスがシートとの同期を待たずに新しい行を読める
+
+※ このファイルは line-receipt-webhook / stripe-webhook の両方に同じ内容で配置している
+   （Cloud Functions のデプロイ単位が関数ディレクトリのため）
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from googleapiclient.discovery import build
+from google.auth import default
+
+CUSTOMER_STORE_DIR = os.environ.get('CUSTOMER_STORE_DIR', '/tmp/customer_store')
+CUSTOMER_SYNC_INTERVAL = float(os.environ.get('CUSTOMER_SYNC_INTERVAL', '30'))
+CUSTOMER_CHECK_INTERVAL = float(os.environ.get('CUSTOMER_CHECK_INTERVAL', '5'))
+CUSTOMER_FULL_PULL_INTERVAL = float(os.environ.get('CUSTOMER_FULL_PULL_INTERVAL', '600'))
+SHEET_NAME = '顧客管理'
+
+# 共有キャッシュにない場合の印
+_MISSING = object()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS customers (
+    row_key TEXT PRIMARY KEY,
+    line_id TEXT,
+    code TEXT,
+    status TEXT,
+    row_json TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_customers_line_id ON customers (line_id);
+CREATE INDEX IF NOT EXISTS idx_customers_code ON customers (code);
+CREATE INDEX IF NOT EXISTS idx_customers_status ON customers (status, seq);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    row_key TEXT NOT NULL,
+    op TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def col_letter(index):
+    """0始まりの列番号を列記号に変換（0 → A, 26 → AA）"""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def get_sheets_service():
+    credentials, project = default(scopes=['https://www.googleapis.com/auth/spreadsheets'])
+    return build('sheets', 'v4', credentials=credentials)
+
+
+def get_drive_service():
+    credentials, project = default(scopes=['https://www.googleapis.com/auth/drive.metadata.readonly'])
+    return build('drive', 'v3', credentials=credentials)
+
+
+class SingleFlight:
+    """
+    同じ処理の同時実行を1回にまとめる
+    実行中に呼ばれた場合は新たに実行せず、実行中の処理の結果（または例外）を受け取る
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flight = None
+
+    def do(self, fn):
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = {'done': threading.Event(), 'result': None, 'error': None}
+        if leader:
+            try:
+                flight['result'] = fn()
+            except Exception as e:
+                flight['error'] = e
+            finally:
+                with self._lock:
+                    self._flight = None
+                flight['done'].set()
+        else:
+            flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return flight['result']
+
+
+class CustomerStore:
+    """
+    1つの顧客管理シートに対応するローカルストア
+    columns: 列名 → 列番号（0始まり）。line_id / code / status は必須
+    """
+
+    def __init__(self, name, sheet_id, columns, width=None, service_factory=get_sheets_service,
+                 drive_service_factory=get_drive_service, cache=None):
+        self.name = name
+        self.sheet_id = sheet_id
+        self.columns = columns
+        self.width = width or (max(columns.values()) + 1)
+        self.last_col = col_letter(self.width - 1)
+        self.service_factory = service_factory
+        self.drive_service_factory = drive_service_factory
+        self.cache = cache
+        self.db_path = os.path.join(CUSTOMER_STORE_DIR, f'customers_{name}.db')
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._load_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._refresh_flight = SingleFlight()
+        self._checked_at = 0.0
+
+    # ----------------------------------------------------------
+    # SQLite
+    # ----------------------------------------------------------
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(CUSTOMER_STORE_DIR, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _cell(self, row, name):
+        index = self.columns.get(name)
+        if index is None or len(row) <= index:
+            return ''
+        value = row[index]
+        return '' if value is None else str(value)
+
+    def row_key(self, row):
+        """行のキー（顧客コードがあればコード、なければLINE ID）"""
+        code = self._cell(row, 'code').upper()
+        if code:
+            return f'code:{code}'
+        line_id = self._cell(row, 'line_id')
+        return f'line:{line_id}' if line_id else None
+
+    def _pad(self, row):
+        row = list(row)
+        return row + [''] * (self.width - len(row)) if len(row) < self.width else row
+
+    def _upsert_local(self, conn, key, row, seq=None):
+        if seq is None:
+            current = conn.execute('SELECT seq FROM customers WHERE row_key = ?', (key,)).fetchone()
+            seq = current['seq'] if current else self._next_seq(conn)
+        conn.execute(
+            'INSERT OR REPLACE INTO customers (row_key, line_id, code, status, row_json, seq) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (key, self._cell(row, 'line_id'), self._cell(row, 'code').upper(),
+             self._cell(row, 'status'), json.dumps(row, ensure_ascii=False), seq)
+        )
+
+    def _next_seq(self, conn):
+        row = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 AS seq FROM customers').fetchone()
+        return row['seq']
+
+    @staticmethod
+    def _to_record(r):
+        return {'row_key': r['row_key'], 'row': json.loads(r['row_json'])} if r else None
+
+    # ----------------------------------------------------------
+    # 読み取り
+    # ----------------------------------------------------------
+
+    def ensure_loaded(self):
+        """プロセス内で初回のみシートから同期的に読み込む（以降はワーカーが更新）"""
+        if self._loaded.is_set():
+            return
+        with self._load_lock:
+            if not self._loaded.is_set():
+                try:
+                    self.refresh(force=True)
+                except Exception as e:
+                    # 以前に取り込んだデータが残っていればそれで続行
+                    has_data = self._conn().execute(
+                        "SELECT value FROM meta WHERE name = 'pulled_at'"
+                    ).fetchone()
+                    if not has_data:
+                        raise
+                    print(f'[store:{self.name}] Initial pull failed, using local data: {e}')
+                self._loaded.set()
+                self.start_worker()
+
+    def find_by_line_id(self, line_id):
+        """LINE IDで顧客行を検索（最初に登録された行）"""
+        self.ensure_loaded()
+        return self._cached('line', line_id, lambda: self._find_local('line_id', line_id))
+
+    def find_by_code(self, code):
+        self.ensure_loaded()
+        return self._cached('code', code.upper(), lambda: self._find_local('code', code.upper()))
+
+    def _find_local(self, column, value):
+        r = self._conn().execute(
+            f'SELECT row_key, row_json FROM customers WHERE {column} = ? ORDER BY seq LIMIT 1', (value,)
+        ).fetchone()
+        return self._to_record(r)
+
+    def find_by_status(self, status, line_id=None):
+        """ステータスで顧客行を検索（line_id指定時はそのLINE IDの行のみ）"""
+        self.ensure_loaded()
+        if line_id is None:
+            rows = self._conn().execute(
+                'SELECT row_key, row_json FROM customers WHERE status = ? ORDER BY seq', (status,)
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                'SELECT row_key, row_json FROM customers WHERE status = ? AND line_id = ? ORDER BY seq',
+                (status, line_id)
+            ).fetchall()
+        return [self._to_record(r) for r in rows]
+
+    def codes(self):
+        """登録済みの顧客コード（大文字）"""
+        self.ensure_loaded()
+        return [r['code'] for r in self._conn().execute("SELECT code FROM customers WHERE code != ''")]
+
+    # ----------------------------------------------------------
+    # 共有キャッシュ
+    # ----------------------------------------------------------
+
+    def _cached(self, kind, value, find):
+        """共有キャッシュ → ローカルの順に探し、ローカルで見つけた結果はまだなければ共有キャッシュに入れる"""
+        if self.cache is None or not value:
+            return find()
+        key = f'{self.name}:{kind}:{value}'
+        hit = self.cache.get(key, _MISSING)
+        if hit is not _MISSING:
+            return hit
+        record = find()
+        # 別のインスタンスが先に書いた新しい行を、ローカルの古い行で上書きしない
+        self.cache.set(key, record, only_if_absent=True)
+        return record
+
+    def _publish(self, rows):
+        """書き込み・取り込みで変わった行の LINE ID・顧客コードについて、ローカルの現在の結果を共有キャッシュに書く"""
+        if self.cache is None:
+            return
+        keys = set()
+        for row in rows:
+            line_id, code = self._cell(row, 'line_id'), self._cell(row, 'code').upper()
+            if line_id:
+                keys.add(('line', 'line_id', line_id))
+            if code:
+                keys.add(('code', 'code', code))
+        try:
+            for kind, column, value in keys:
+                self.cache.set(f'{self.name}:{kind}:{value}', self._find_local(column, value))
+        except Exception as e:
+            print(f'[store:{self.name}] Cache publish error: {e}')
+
+    def _cached_row(self, row_key):
+        """共有キャッシュにある行キーの行（別のインスタンスが書き込んだ新しい行。なければNone）"""
+        if self.cache is None:
+            return None
+        hit = self.cache.get(f'{self.name}:{row_key}', _MISSING)
+        if hit is _MISSING or hit is None or hit['row_key'] != row_key:
+            return None
+        return hit['row']
+
+    # ----------------------------------------------------------
+    # 書き込み（ローカル更新 + outbox）
+    # ----------------------------------------------------------
+
+    def update(self, row_key, fields):
+        """
+        行の一部の列を更新
+        fields: 列番号 → 値
+        戻り値: 更新後の行（行がなければNone）
+        """
+        self.ensure_loaded()
+        # 別のインスタンスが先に更新していれば、その行に重ねて更新する
+        cached_row = self._cached_row(row_key)
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                current = conn.execute('SELECT row_json FROM customers WHERE row_key = ?', (row_key,)).fetchone()
+                if not current:
+                    return None
+                before = json.loads(current['row_json'])
+                row = self._pad(cached_row if cached_row is not None else before)
+                for index, value in fields.items():
+                    row[index] = value
+                # 外部から見つけるためのキー（更新前のキー）で outbox に積む
+                self._enqueue(conn, row_key, 'update', {str(k): v for k, v in fields.items()})
+                new_key = self.row_key(row) or row_key
+                if new_key != row_key:
+                    conn.execute('UPDATE customers SET row_key = ? WHERE row_key = ?', (new_key, row_key))
+                self._upsert_local(conn, new_key, row)
+        self._wake.set()
+        self._publish([before, row])
+        return row
+
+    def update_if(self, row_key, fields, expected):
+        """
+        シートの現在の行が expected（列番号 → 値）と一致する場合だけ、fields の列をシートへ同期的に書き込む
+        （顧客コードの割り当てなど、書き込みを失えない・取り合う更新用。送信待ちの変更は先にシートへ反映する）
+        別のインスタンスとの取り合いは呼び出し側で防ぐ（stripe-webhook では shared_cache.py の CLAIMS）
+        戻り値: 更新後の行（行がない・一致しない場合はNone。一致しない場合はシートの内容を取り込む）
+        """
+        self.ensure_loaded()
+        with self._sync_lock:
+            self._push()
+            service = self.service_factory()
+            rows = self._read_sheet(service)
+            row_numbers = self._find_sheet_rows(rows, row_key)
+            if not row_numbers:
+                return None
+            row_number = row_numbers[0]
+            row = self._pad(rows[row_number - 1])
+            if any(str(row[index]) != str(value) for index, value in expected.items()):
+                print(f'[store:{self.name}] Row changed on sheet, not updating: {row_key}')
+                self._pull(rows)
+                return None
+            changed = {index: value for index, value in fields.items() if str(row[index]) != str(value)}
+            if changed:
+                service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.sheet_id,
+                    body={'valueInputOption': 'RAW', 'data': [
+                        {'range': f'{SHEET_NAME}!{col_letter(index)}{row_number}', 'values': [[value]]}
+                        for index, value in changed.items()
+                    ]}
+                ).execute()
+            for index, value in changed.items():
+                row[index] = value
+            with self._write_lock:
+                conn = self._conn()
+                with conn:
+                    current = conn.execute('SELECT row_json FROM customers WHERE row_key = ?', (row_key,)).fetchone()
+                    before = json.loads(current['row_json']) if current else row
+                    new_key = self.row_key(row) or row_key
+                    if new_key != row_key:
+                        conn.execute('UPDATE customers SET row_key = ? WHERE row_key = ?', (new_key, row_key))
+                    self._upsert_local(conn, new_key, row)
+        self._publish([before, row])
+        return row
+
+    def append(self, row):
+        """行を追加"""
+        self.ensure_loaded()
+        row = self._pad(row)
+        key = self.row_key(row)
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                self._upsert_local(conn, key, row, seq=self._next_seq(conn))
+                self._enqueue(conn, key, 'append', row)
+        self._wake.set()
+        self._publish([row])
+        return key
+
+    def append_many(self, rows):
+        """複数の行を1回のトランザクションで追加（シートへは連続する追加をまとめて1回で書き込む）"""
+        self.ensure_loaded()
+        keys = []
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                seq = self._next_seq(conn)
+                for offset, row in enumerate(rows):
+                    row = self._pad(row)
+                    key = self.row_key(row)
+                    self._upsert_local(conn, key, row, seq=seq + offset)
+                    self._enqueue(conn, key, 'append', row)
+                    keys.append(key)
+        self._wake.set()
+        self._publish(rows)
+        return keys
+
+    def append_now(self, rows):
+        """
+        複数の行をシートへ同期的に1回の append で追加してからSQLiteに入れる（送信待ちの変更は先にシートへ反映する）
+        戻り値: 行キーのリスト
+        """
+        self.ensure_loaded()
+        rows = [self._pad(row) for row in rows]
+        with self._sync_lock:
+            self._push()
+            self.service_factory().spreadsheets().values().append(
+                spreadsheetId=self.sheet_id,
+                range=f'{SHEET_NAME}!A:{self.last_col}',
+                valueInputOption='RAW',
+                body={'values': rows}
+            ).execute()
+            keys = []
+            with self._write_lock:
+                conn = self._conn()
+                with conn:
+                    seq = self._next_seq(conn)
+                    for offset, row in enumerate(rows):
+                        key = self.row_key(row)
+                        self._upsert_local(conn, key, row, seq=seq + offset)
+                        keys.append(key)
+        self._publish(rows)
+        return keys
+
+    def delete(self, row_key):
+        """行を削除"""
+        self.ensure_loaded()
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                current = conn.execute('SELECT row_json FROM customers WHERE row_key = ?', (row_key,)).fetchone()
+                conn.execute('DELETE FROM customers WHERE row_key = ?', (row_key,))
+                self._enqueue(conn, row_key, 'delete', None)
+        self._wake.set()
+        if current:
+            self._publish([json.loads(current['row_json'])])
+
+    def _enqueue(self, conn, row_key, op, payload):
+        conn.execute(
+            'INSERT INTO outbox (row_key, op, payload, created_at) VALUES (?, ?, ?, ?)',
+            (row_key, op, json.dumps(payload, ensure_ascii=False), time.time())
+        )
+
+    def pending_count(self):
+        return self._conn().execute('SELECT COUNT(*) AS n FROM outbox').fetchone()['n']
+
+    # ----------------------------------------------------------
+    # 同期（シートへの反映・シートからの取り込み）
+    # ----------------------------------------------------------
+
+    def _read_sheet(self, service):
+        result = service.spreadsheets().values().get(
+            spreadsheetId=self.sheet_id,
+            range=f'{SHEET_NAME}!A:{self.last_col}'
+        ).execute()
+        return result.get('values', [])
+
+    def _find_sheet_rows(self, rows, row_key):
+        """キーに一致するシート上の行番号のリスト（1始まり）"""
+        return [i for i, row in enumerate(rows[1:], start=2) if self.row_key(row) == row_key]
+
+    def push(self):
+        """outbox の変更を古い順にシートへ反映（戻り値: 反映件数）"""
+        with self._sync_lock:
+            return self._push()
+
+    def _push(self):
+        conn = self._conn()
+        entries = conn.execute('SELECT id, row_key, op, payload FROM outbox ORDER BY id').fetchall()
+        if not entries:
+            return 0
+
+        service = self.service_factory()
+        # 反映の前からシートが変わっていなければ、反映後の版を記録して自分の書き込みを取り込み直さない
+        known = self._get_meta('sheet_version')
+        unchanged = known is not None and self._try_version() == known
+        rows = self._read_sheet(service)
+        sheet_gid = None
+        done = 0
+
+        # 連続する追加はまとめて1回の append で書き込む
+        groups = []
+        for entry in entries:
+            if entry['op'] == 'append' and groups and groups[-1][0]['op'] == 'append':
+                groups[-1].append(entry)
+            else:
+                groups.append([entry])
+
+        for group in groups:
+            entry = group[0]
+            payload = json.loads(entry['payload'])
+            try:
+                if entry['op'] == 'append':
+                    values = [json.loads(e['payload']) for e in group]
+                    service.spreadsheets().values().append(
+                        spreadsheetId=self.sheet_id,
+                        range=f'{SHEET_NAME}!A:{self.last_col}',
+                        valueInputOption='RAW',
+                        body={'values': values}
+                    ).execute()
+                    rows.extend(values)
+                else:
+                    row_numbers = self._find_sheet_rows(rows, entry['row_key'])
+                    row_number = row_numbers[0] if row_numbers else None
+                    if row_number is None:
+                        print(f'[store:{self.name}] Row not found on sheet, skipping {entry["op"]}: {entry["row_key"]}')
+                    elif entry['op'] == 'update':
+                        data = [
+                            {'range': f'{SHEET_NAME}!{col_letter(int(k))}{row_number}', 'values': [[v]]}
+                            for k, v in payload.items()
+                        ]
+                        service.spreadsheets().values().batchUpdate(
+                            spreadsheetId=self.sheet_id,
+                            body={'valueInputOption': 'RAW', 'data': data}
+                        ).execute()
+                        row = rows[row_number - 1]
+                        row.extend([''] * (self.width - len(row)))
+                        for k, v in payload.items():
+                            row[int(k)] = v
+                    elif entry['op'] == 'delete':
+                        # 同じキーの重複行もまとめて削除（後ろの行から削除してインデックスのずれを防ぐ）
+                        if sheet_gid is None:
+                            sheet_gid = self._sheet_gid(service)
+                        row_numbers.sort(reverse=True)
+                        service.spreadsheets().batchUpdate(
+                            spreadsheetId=self.sheet_id,
+                            body={'requests': [{'deleteDimension': {'range': {
+                                'sheetId': sheet_gid, 'dimension': 'ROWS',
+                                'startIndex': n - 1, 'endIndex': n
+                            }}} for n in row_numbers]}
+                        ).execute()
+                        for n in row_numbers:
+                            del rows[n - 1]
+            except Exception as e:
+                print(f'[store:{self.name}] Push error ({entry["op"]} {entry["row_key"]}): {e}')
+                break
+            with self._write_lock, conn:
+                conn.executemany('DELETE FROM outbox WHERE id = ?', [(e['id'],) for e in group])
+            done += len(group)
+
+        if done and unchanged:
+            version = self._try_version()
+            if version is not None:
+                with self._write_lock, conn:
+                    self._set_meta(conn, 'sheet_version', version)
+        return done
+
+    def _sheet_gid(self, service):
+        spreadsheet = service.spreadsheets().get(spreadsheetId=self.sheet_id).execute()
+        for sheet in spreadsheet.get('sheets', []):
+            if sheet['properties']['title'] == SHEET_NAME:
+                return sheet['properties']['sheetId']
+        raise RuntimeError(f'{SHEET_NAME} sheet not found')
+
+    def pull(self, rows=None):
+        """
+        シートの内容をSQLiteに取り込む（スタッフの編集を反映）
+        送信待ちの変更があるキーはローカルの内容を残す
+        """
+        with self._sync_lock:
+            return self._pull(rows)
+
+    def _pull(self, rows, version=None):
+        """シートの行とローカルを比較し、内容が変わった行・増減した行だけをSQLiteに反映"""
+        if rows is None:
+            rows = self._read_sheet(self.service_factory())
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                pending = {r['row_key'] for r in conn.execute('SELECT DISTINCT row_key FROM outbox')}
+                local = {
+                    r['row_key']: (r['row_json'], r['seq'])
+                    for r in conn.execute('SELECT row_key, row_json, seq FROM customers')
+                }
+                seen = set()
+                changed = 0
+                touched = []
+                for seq, row in enumerate(rows[1:], start=1):
+                    key = self.row_key(row)
+                    if not key or key in pending or key in seen:
+                        continue
+                    seen.add(key)
+                    row = self._pad(row)
+                    row_json = json.dumps(row, ensure_ascii=False)
+                    if local.get(key) != (row_json, seq):
+                        self._upsert_local(conn, key, row, seq=seq)
+                        changed += 1
+                        # 行の位置だけが変わった場合は共有キャッシュに書かない
+                        if key not in local:
+                            touched.append(row)
+                        elif local[key][0] != row_json:
+                            touched.extend([row, json.loads(local[key][0])])
+                removed = [key for key in local if key not in seen and key not in pending]
+                touched.extend(json.loads(local[key][0]) for key in removed)
+                conn.executemany('DELETE FROM customers WHERE row_key = ?', [(key,) for key in removed])
+                self._set_meta(conn, 'pulled_at', str(time.time()))
+                if version is not None:
+                    self._set_meta(conn, 'sheet_version', version)
+        if changed or removed:
+            print(f'[store:{self.name}] Pulled {changed} changed / {len(removed)} removed rows')
+            # 初回の取り込みは全行が変更扱いになるため共有キャッシュには書かない（検索時に入れる）
+            if local:
+                self._publish(touched)
+        return len(seen)
+
+    @staticmethod
+    def _set_meta(conn, name, value):
+        conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value))
+
+    def _get_meta(self, name):
+        r = self._conn().execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return r['value'] if r else None
+
+    # ----------------------------------------------------------
+    # 変更検知つき取り込み
+    # ----------------------------------------------------------
+
+    def sheet_version(self):
+        """スプレッドシートの版（Drive の version と modifiedTime、メタデータのみで本体は読まない）"""
+        meta = self.drive_service_factory().files().get(
+            fileId=self.sheet_id, fields='version,modifiedTime', supportsAllDrives=True
+        ).execute()
+        return f'{meta.get("version", "")}:{meta.get("modifiedTime", "")}'
+
+    def _try_version(self):
+        """シートの版（Drive API が使えない場合はNone）"""
+        try:
+            return self.sheet_version()
+        except Exception as e:
+            print(f'[store:{self.name}] Version check failed: {e}')
+            return None
+
+    def refresh(self, force=False, wait=True):
+        """
+        シートが前回の取り込みから変わっていれば取り込む（single-flight）
+        wait=False なら、ワーカーが反映中の場合は待たずにワーカーに取り込みを任せる
+        戻り値: 取り込んだ場合 True
+        """
+        return self._refresh_flight.do(lambda: self._refresh(force, wait))
+
+    def _is_current(self, version):
+        """取り込み済みの版と同じで、全体を読み直す時期でもない"""
+        if version is None or version != self._get_meta('sheet_version'):
+            return False
+        return time.time() - float(self._get_meta('pulled_at') or 0) < CUSTOMER_FULL_PULL_INTERVAL
+
+    def _refresh(self, force, wait):
+        self._checked_at = time.monotonic()
+        # 版の確認は同期ロックの外で行う（Drive API が使えない場合は毎回取り込む）
+        version = self._try_version()
+        if not force and self._is_current(version):
+            return False
+        if not self._sync_lock.acquire(blocking=wait):
+            self._wake.set()
+            return False
+        try:
+            # ロックを待つ間に取り込まれた・自分の反映で版が記録された場合は読まない
+            if not force and self._is_current(version):
+                return False
+            self._pull(None, version)
+            return True
+        finally:
+            self._sync_lock.release()
+
+    def refresh_if_stale(self):
+        """リクエスト経路用: 前回の確認から CUSTOMER_CHECK_INTERVAL 秒以上経っていれば変更を確認"""
+        if not self._loaded.is_set() or time.monotonic() - self._checked_at < CUSTOMER_CHECK_INTERVAL:
+            return False
+        try:
+            return self.refresh(wait=False)
+        except Exception as e:
+            print(f'[store:{self.name}] Refresh error: {e}')
+            return False
+
+    def sync_once(self):
+        """反映 → 取り込み（変更があった場合のみ）を1回実行"""
+        try:
+            self.push()
+            self.refresh()
+        except Exception as e:
+            print(f'[store:{self.name}] Sync error: {e}')
+
+    def start_worker(self):
+        """同期ワーカーを起動（プロセスごとに1つ）"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, name=f'customer-sync-{self.name}', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(CUSTOMER_SYNC_INTERVAL)
+            self._wake.clear()
+            self.sync_once()
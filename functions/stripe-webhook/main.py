@@ -6,6 +6,11 @@ from datetime import datetime
 from google.auth import default
 from googleapiclient.discovery import build
 
+from admin_notifier import AdminNotifier
+from code_pool import CodePool
+from customer_store import CustomerStore
+from shared_cache import CLAIMS, NOTIFICATIONS
+
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
 CUSTOMER_SHEET_ID = os.environ.get('CUSTOMER_SHEET_ID', '')
 LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', '')
@@ -65,7 +70,8 @@ def handle_checkout_completed(session):
             f'👤 {customer_name}\n'
             f'✉️ {customer_email}\n'
             f'💰 {amount:,}円/月\n\n'
-            f'手動でコードを発行してください。'
+            f'手動でコードを発行してください。',
+            urgent=True
         )
 
 def handle_payment_failed(invoice):
@@ -77,77 +83,89 @@ def handle_payment_failed(invoice):
         f'⚠️ 支払いが失敗しました\n\n'
         f'Customer ID: {customer_id}\n'
         f'Email: {customer_email}\n\n'
-        f'確認してください。'
+        f'確認してください。',
+        urgent=True
     )
 
 def get_sheets_service():
     credentials, project = default(scopes=['https://www.googleapis.com/auth/spreadsheets'])
     return build('sheets', 'v4', credentials=credentials)
 
+# 顧客管理シート（A〜U列）のローカルストア: A=LINE ID, C=フォルダID, G=コード, H=ステータス
+CUSTOMER_STORE = CustomerStore(
+    'MK', CUSTOMER_SHEET_ID,
+    {'line_id': 0, 'name': 1, 'folder_id': 2, 'code': 6, 'status': 7},
+    width=21, service_factory=get_sheets_service
+)
+
+# 未使用コードの補充（CODE_POOL_PARENT_FOLDER_ID 未設定なら無効）
+CODE_POOL = CodePool(CUSTOMER_STORE, claims=CLAIMS)
+
 def assign_unused_code(customer_id, name, email, amount):
     """未使用コードを探して顧客情報を割り当て"""
     try:
-        service = get_sheets_service()
-        
-        # 全データ取得
-        result = service.spreadsheets().values().get(
-            spreadsheetId=CUSTOMER_SHEET_ID,
-            range='顧客管理!A:R'
-        ).execute()
-        rows = result.get('values', [])
-        
-        # 未使用の行を探す
-        for i, row in enumerate(rows[1:], start=2):
-            status = row[7] if len(row) > 7 else ''
-            
-            if status == '未使用':
-                code = row[6] if len(row) > 6 else ''
-                folder_id = row[2] if len(row) > 2 else ''
-                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                # プランを金額から判定
-                if amount <= 5500:
-                    plan = '記帳5000'
-                elif amount <= 11000:
-                    plan = '記帳10000'
-                else:
-                    plan = '記帳14000'
-                
-                # 行を更新（A列〜R列）
-                update_values = [[
-                    '',                 # A: line_user_id（後でLINE連携時に入る）
-                    name or '未設定',   # B: customer_name
-                    folder_id,          # C: folder_id（既存のまま）
-                    now,                # D: registered_at
-                    False,              # E: notified
-                    '',                 # F: sent_at
-                    code,               # G: customer_code（既存のまま）
-                    '案内済',           # H: status
-                    email or '',        # I: email
-                    '',                 # J: phone
-                    0,                  # K: trial_count
-                    0,                  # L: total_count
-                    '',                 # M: memo
-                    customer_id,        # N: stripe_customer_id
-                    plan,               # O: プラン
-                    amount,             # P: 月額料金
-                    now,                # Q: 課金開始日
-                    ''                  # R: 備考
-                ]]
-                
-                service.spreadsheets().values().update(
-                    spreadsheetId=CUSTOMER_SHEET_ID,
-                    range=f'顧客管理!A{i}:R{i}',
-                    valueInputOption='RAW',
-                    body={'values': update_values}
-                ).execute()
-                
-                print(f'Assigned code {code} to {name}')
-                return {'success': True, 'code': code}
-        
+        # 未使用の行を探す（シートが編集されていれば先に取り込む）
+        CUSTOMER_STORE.refresh_if_stale()
+        unused = CUSTOMER_STORE.find_by_status('未使用')
+        if not unused and CODE_POOL.enabled:
+            # 補充が間に合わなかった場合だけ、この場で補充を待つ
+            print('No unused code available, replenishing now')
+            CODE_POOL.replenish(wait=True)
+            unused = CUSTOMER_STORE.find_by_status('未使用')
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        # プランを金額から判定
+        if amount <= 5500:
+            plan = '記帳5000'
+        elif amount <= 11000:
+            plan = '記帳10000'
+        else:
+            plan = '記帳14000'
+
+        # 書き込む列（B・D〜F・H〜R）。A列（LINE連携で入る）と C・G列（フォルダID・コード）は書き込まない
+        update_values = {
+            1: name or '未設定',   # B: customer_name
+            3: now,                # D: registered_at
+            4: False,              # E: notified
+            5: '',                 # F: sent_at
+            7: '案内済',           # H: status
+            8: email or '',        # I: email
+            9: '',                 # J: phone
+            10: 0,                 # K: trial_count
+            11: 0,                 # L: total_count
+            12: '',                # M: memo
+            13: customer_id,       # N: stripe_customer_id
+            14: plan,              # O: プラン
+            15: amount,            # P: 月額料金
+            16: now,               # Q: 課金開始日
+            17: '',                # R: 備考
+        }
+
+        for record in unused:
+            code = record['row'][6]
+            # 別のインスタンスが同じコードを割り当て中なら次のコードにする
+            if not CLAIMS.set(f'assign:{code}', customer_id or email, only_if_absent=True):
+                print(f'Code {code} is being assigned by another instance')
+                continue
+            # シートの H列がまだ「未使用」の場合だけ、返信する前にシートへ書き込む
+            try:
+                row = CUSTOMER_STORE.update_if(record['row_key'], update_values, {7: '未使用'})
+            except Exception:
+                CLAIMS.delete(f'assign:{code}')
+                raise
+            if row is None:
+                print(f'Code {code} is no longer unused on the sheet')
+                continue
+
+            print(f'Assigned code {code} to {name}')
+            # 残りが少なくなっていれば裏で補充する
+            CODE_POOL.replenish_in_background()
+            return {'success': True, 'code': code}
+
         print('No unused code available')
         return {'success': False, 'error': 'no_unused_code'}
-        
+
     except Exception as e:
         print(f'Error assigning code: {e}')
         return {'success': False, 'error': str(e)}
@@ -166,12 +184,8 @@ def send_code_email(email, name, code, amount):
     # TODO: 実際のメール送信実装
     # SendGrid, AWS SES, Gmail API など
 
-def send_line_notification(message):
-    """管理者にLINE通知を送信"""
-    if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_NOTIFY_USER_ID:
-        print('LINE notification not configured')
-        return
-    
+def push_line_messages(texts):
+    """管理者にLINEプッシュを1回送信（成功時True）"""
     url = 'https://api.line.me/v2/bot/message/push'
     headers = {
         'Content-Type': 'application/json',
@@ -179,14 +193,28 @@ def send_line_notification(message):
     }
     data = {
         'to': LINE_NOTIFY_USER_ID,
-        'messages': [{'type': 'text', 'text': message}]
+        'messages': [{'type': 'text', 'text': text} for text in texts]
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = requests.post(url, headers=headers, json=data, timeout=10)
         if response.status_code == 200:
             print('LINE notification sent')
-        else:
-            print(f'LINE notification failed: {response.status_code}')
+            return True
+        print(f'LINE notification failed: {response.status_code}')
+        return False
     except Exception as e:
         print(f'LINE notification error: {e}')
+        return False
+
+# 管理者通知はまとめて非同期に送る（送信待ちは共有キャッシュに積む。admin_notifier.py 参照）
+# 新規契約はまとめて送り、未使用コードがない・支払い失敗だけを至急（その場で送信）にする
+LINE_NOTIFIER = AdminNotifier(push_line_messages, queue=NOTIFICATIONS, queue_key='stripe-webhook')
+LINE_NOTIFIER.start()
+
+def send_line_notification(message, urgent=False):
+    """管理者にLINE通知（通常は一定時間分をまとめて送信、urgent=True は即時送信）"""
+    if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_NOTIFY_USER_ID:
+        print('LINE notification not configured')
+        return
+    LINE_NOTIFIER.notify(message, urgent=urgent)
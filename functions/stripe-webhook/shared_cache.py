@@ -0,0 +1,378 @@
+"""
+インスタンス間で共有するキャッシュ（Redis互換の共有層 + プロセス内の層）
+
+Cloud Functions はインスタンスが増えるたびにプロセス内のキャッシュが空から始まり、
+LINE連携・お試し登録のあとしばらくはインスタンスごとに顧客の状態が食い違う。
+SHARED_CACHE_URL（redis://[:password@]host:port/db）を設定すると、次のデータを全インスタンスで共有する。
+
+- customers:  顧客行（LINE ID・顧客コード・行キー → 行）。書き込んだインスタンスが新しい行を共有層に書く
+- subfolders: Driveのサブフォルダ（親フォルダID + 名前 → フォルダID）
+- pages:      ページ単位の分類結果（ページ内容のハッシュ → 分類結果）
+- events:     処理中・処理済みのイベントID（SET NX で最初に受け取ったインスタンスだけが処理する。
+              処理中の印は短い期限で付け、処理できたら長い期限の処理済みに置き換える）
+- claims:     保留キューのエントリ・割り当て中の顧客コードなどの処理中の印（SET NX で印を付けたインスタンスだけが処理する）
+- notifications: 管理者通知の送信待ち（リスト。admin_notifier.py）
+- usage:      顧客×月の利用量カウンタ（月ごとのハッシュ。usage_meter.py）
+- receipts:   領収書の重複検知インデックス（顧客×バンド・金額ごとのハッシュ。receipt_index.py）
+
+名前空間ごとに、プロセス内の層（期限つきLRU）を使うかを決める。内容が変わらないもの（フォルダID・分類結果・
+処理済みID・処理中の印）はプロセス内の層を先に見て、変わるもの（顧客行・送信待ち・カウンタ・インデックス）は共有層だけを見る（インスタンス間で食い違わないように）。
+SHARED_CACHE_URL が未設定、または共有層に接続できない間はプロセス内の層だけで動く
+（顧客行はプロセス内では持たない。各インスタンスの顧客ストアがそのまま使われる）。
+
+共有層との通信は RESP（Redisのプロトコル）で、GET / SET（PX・NX）/ DEL / PEXPIRE とリストの RPUSH / LRANGE / LTRIM、
+ハッシュの HINCRBY / HSET / HMGET / HGETALL、上書き前の値を読む WATCH / MULTI / EXEC だけを使う。
+接続エラーが出たら SHARED_CACHE_RETRY_SECONDS 秒は共有層を使わない（タイムアウトを毎回待たない）。
+動作確認は tools/fake_redis.py の疑似サーバーで行える。
+
+※ このファイルは line-receipt-webhook / stripe-webhook の両方に同じ内容で配置している
+   （stripe-webhook は claims で顧客コードの割り当て・補充を1つのインスタンスに絞るために使う）
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL', '')
+SHARED_CACHE_TIMEOUT = float(os.environ.get('SHARED_CACHE_TIMEOUT', '0.5'))
+SHARED_CACHE_RETRY_SECONDS = float(os.environ.get('SHARED_CACHE_RETRY_SECONDS', '30'))
+SHARED_CACHE_PREFIX = os.environ.get('SHARED_CACHE_PREFIX', 'marunage:')
+# 顧客行はシートとの同期（CUSTOMER_SYNC_INTERVAL）より十分長く、それ以外（変わらないもの）は1日
+SHARED_CACHE_CUSTOMER_TTL = float(os.environ.get('SHARED_CACHE_CUSTOMER_TTL', '600'))
+SHARED_CACHE_TTL = float(os.environ.get('SHARED_CACHE_TTL', '86400'))
+# 利用量カウンタは請求の確認に使うため約13か月残す
+SHARED_CACHE_USAGE_TTL = float(os.environ.get('SHARED_CACHE_USAGE_TTL', str(400 * 86400)))
+# 重複検知インデックスは同じ領収書を後から送られても気づけるように約13か月残す
+SHARED_CACHE_RECEIPT_TTL = float(os.environ.get('SHARED_CACHE_RECEIPT_TTL', str(400 * 86400)))
+LOCAL_CACHE_SIZE = int(os.environ.get('LOCAL_CACHE_SIZE', '4096'))
+
+# キャッシュにない場合の戻り値（None は「ないことが分かっている」の意味で保存できる）
+MISS = object()
+
+
+class RespError(Exception):
+    """共有層がエラー応答（-ERR など）を返した"""
+
+
+class RespClient:
+    """Redis互換サーバーの最小クライアント（スレッドごとに接続を1本使い回す）"""
+
+    def __init__(self, url, timeout=SHARED_CACHE_TIMEOUT):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def execute(self, *args):
+        """コマンドを1つ送って応答を返す（通信エラーなら接続を捨てて例外）"""
+        if getattr(self._local, 'sock', None) is None:
+            self._connect()
+        try:
+            return self._call(*args)
+        except (OSError, ConnectionError):
+            self.close()
+            raise
+
+    def _call(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self._local.sock.sendall(b''.join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._local.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RespError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f'Unexpected reply: {line[:20]!r}')
+
+
+class LocalCache:
+    """プロセス内の期限つきLRU"""
+
+    def __init__(self, size=LOCAL_CACHE_SIZE):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISS
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, only_if_absent=False):
+        with self._lock:
+            item = self._data.get(key)
+            if only_if_absent and item is not None and item[1] >= time.monotonic():
+                return False
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SharedCache:
+    """共有層（あれば）とプロセス内の層をまとめたキャッシュ"""
+
+    def __init__(self, url=SHARED_CACHE_URL, prefix=SHARED_CACHE_PREFIX, local_size=LOCAL_CACHE_SIZE):
+        self.client = RespClient(url) if url else None
+        self.prefix = prefix
+        self.local = LocalCache(local_size)
+        self._down_until = 0.0
+        self._stats_lock = threading.Lock()
+        self.stats = {}
+
+    def namespace(self, name, ttl, local=True):
+        """
+        名前空間（キーの接頭辞・有効期限・プロセス内の層を使うか）
+        local=False の名前空間は共有層がない間は何も保存しない
+        """
+        return CacheNamespace(self, name, ttl, local)
+
+    @property
+    def shared_available(self):
+        return self.client is not None and time.monotonic() >= self._down_until
+
+    def _count(self, name, key):
+        with self._stats_lock:
+            stats = self.stats.setdefault(name, {'local_hits': 0, 'shared_hits': 0, 'misses': 0,
+                                                 'sets': 0, 'errors': 0})
+            stats[key] += 1
+
+    def _shared(self, name, *args):
+        """共有層にコマンドを送る（使えない・失敗した場合は MISS）"""
+        if not self.shared_available:
+            return MISS
+        try:
+            return self.client.execute(*args)
+        except Exception as e:
+            self._count(name, 'errors')
+            self._down_until = time.monotonic() + SHARED_CACHE_RETRY_SECONDS
+            print(f'[cache] Shared cache unavailable for {SHARED_CACHE_RETRY_SECONDS:.0f}s: {e}')
+            return MISS
+
+    def metrics(self):
+        """共有層の状態と名前空間ごとのヒット数・ヒット率（/usage/cache）"""
+        with self._stats_lock:
+            namespaces = {name: dict(stats) for name, stats in self.stats.items()}
+        for name, stats in namespaces.items():
+            stats['hit_ratio'] = round(self.hit_ratio(name), 4)
+        return {'shared': self.client is not None, 'shared_available': self.shared_available,
+                'namespaces': namespaces}
+
+    def hit_ratio(self, name=None):
+        """ヒット率（name 省略時は全名前空間）"""
+        with self._stats_lock:
+            rows = [s for n, s in self.stats.items() if name is None or n == name]
+        hits = sum(s['local_hits'] + s['shared_hits'] for s in rows)
+        total = hits + sum(s['misses'] for s in rows)
+        return hits / total if total else 0.0
+
+
+class CacheNamespace:
+    def __init__(self, cache, name, ttl, local):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.use_local = local
+
+    def _key(self, key):
+        return f'{self.cache.prefix}{self.name}:{key}'
+
+    def get(self, key, default=MISS):
+        """値を返す（なければ default）"""
+        full_key = self._key(key)
+        if self.use_local:
+            value = self.cache.local.get(full_key)
+            if value is not MISS:
+                self.cache._count(self.name, 'local_hits')
+                return value
+        raw = self.cache._shared(self.name, 'GET', full_key)
+        if raw is MISS or raw is None:
+            self.cache._count(self.name, 'misses')
+            return default
+        value = json.loads(raw)
+        self.cache._count(self.name, 'shared_hits')
+        if self.use_local:
+            self.cache.local.set(full_key, value, self.ttl)
+        return value
+
+    def set(self, key, value, only_if_absent=False, ttl=None):
+        """
+        値を保存（None も保存できる）
+        only_if_absent=True なら、まだない場合だけ保存する（戻り値: 保存したか）
+        ttl: この値だけの有効期限（秒、省略時は名前空間の有効期限）
+        """
+        full_key = self._key(key)
+        ttl = self.ttl if ttl is None else ttl
+        self.cache._count(self.name, 'sets')
+        args = ['SET', full_key, json.dumps(value, ensure_ascii=False), 'PX', int(ttl * 1000)]
+        if only_if_absent:
+            args.append('NX')
+        reply = self.cache._shared(self.name, *args)
+        if reply is MISS:
+            if not self.use_local:
+                return False
+            return self.cache.local.set(full_key, value, ttl, only_if_absent)
+        stored = reply == 'OK'
+        if self.use_local and (stored or not only_if_absent):
+            self.cache.local.set(full_key, value, ttl)
+        return stored
+
+    def delete(self, key):
+        full_key = self._key(key)
+        self.cache.local.delete(full_key)
+        self.cache._shared(self.name, 'DEL', full_key)
+
+    # リスト（共有層だけに保存する。プロセス内の層は使わない）
+
+    def push(self, key, value):
+        """リストの末尾に追加して有効期限を延ばす（戻り値: 追加したか。共有層が使えなければ False）"""
+        full_key = self._key(key)
+        reply = self.cache._shared(self.name, 'RPUSH', full_key, json.dumps(value, ensure_ascii=False))
+        if reply is MISS:
+            return False
+        self.cache._shared(self.name, 'PEXPIRE', full_key, int(self.ttl * 1000))
+        return True
+
+    def items(self, key):
+        """リストの全要素（共有層が使えなければ MISS）"""
+        reply = self.cache._shared(self.name, 'LRANGE', self._key(key), 0, -1)
+        if reply is MISS:
+            return MISS
+        return [json.loads(raw) for raw in reply or []]
+
+    def trim(self, key, count):
+        """リストの先頭から count 件を取り除く（その間に末尾へ追加された要素は残る）"""
+        self.cache._shared(self.name, 'LTRIM', self._key(key), count, -1)
+
+    # ハッシュ（共有層だけに保存する。プロセス内の層は使わない）
+
+    def incr_field(self, key, field, count=1):
+        """ハッシュのフィールドに count を加算して有効期限を延ばす（戻り値: 加算後の値。共有層が使えなければ MISS）"""
+        full_key = self._key(key)
+        reply = self.cache._shared(self.name, 'HINCRBY', full_key, field, int(count))
+        if reply is not MISS:
+            self.cache._shared(self.name, 'PEXPIRE', full_key, int(self.ttl * 1000))
+        return reply
+
+    def set_fields(self, key, values):
+        """ハッシュのフィールドをまとめて上書き（戻り値: 保存したか）"""
+        full_key = self._key(key)
+        args = []
+        for field, value in values.items():
+            args += [field, json.dumps(value, ensure_ascii=False)]
+        reply = self.cache._shared(self.name, 'HSET', full_key, *args)
+        if reply is MISS:
+            return False
+        self.cache._shared(self.name, 'PEXPIRE', full_key, int(self.ttl * 1000))
+        return True
+
+    def swap_fields(self, key, values, attempts=5):
+        """
+        ハッシュのフィールドをまとめて上書きし、上書き前の値を返す
+        （WATCH / MULTI / EXEC で、読んでから書くまでの間に別の書き込みがあれば読み直して上書きし直す）
+        戻り値: 上書き前のフィールド → 値（共有層が使えなければ MISS、書き込みが続いて上書きできなければ None）
+        """
+        full_key = self._key(key)
+        fields = list(values)
+        args = []
+        for field, value in values.items():
+            args += [field, json.dumps(value, ensure_ascii=False)]
+        for _ in range(attempts):
+            if self.cache._shared(self.name, 'WATCH', full_key) is MISS:
+                return MISS
+            before = self.cache._shared(self.name, 'HMGET', full_key, *fields)
+            if before is MISS or self.cache._shared(self.name, 'MULTI') is MISS:
+                return MISS
+            self.cache._shared(self.name, 'HSET', full_key, *args)
+            self.cache._shared(self.name, 'PEXPIRE', full_key, int(self.ttl * 1000))
+            reply = self.cache._shared(self.name, 'EXEC')
+            if reply is MISS:
+                return MISS
+            if reply is not None:
+                return {field: None if raw is None else json.loads(raw) for field, raw in zip(fields, before)}
+        return None
+
+    def get_fields(self, key, fields=None):
+        """
+        ハッシュのフィールド → 値（fields 省略時は全フィールド。ないフィールドは None）
+        共有層が使えなければ MISS
+        """
+        full_key = self._key(key)
+        if fields is None:
+            reply = self.cache._shared(self.name, 'HGETALL', full_key)
+            if reply is MISS:
+                return MISS
+            pairs = zip(reply[0::2], reply[1::2])
+            return {field.decode('utf-8'): json.loads(raw) for field, raw in pairs}
+        reply = self.cache._shared(self.name, 'HMGET', full_key, *fields)
+        if reply is MISS:
+            return MISS
+        return {field: None if raw is None else json.loads(raw) for field, raw in zip(fields, reply)}
+
+
+# プロセス全体で共有するキャッシュと名前空間
+SHARED_CACHE = SharedCache()
+CUSTOMERS = SHARED_CACHE.namespace('customers', SHARED_CACHE_CUSTOMER_TTL, local=False)
+SUBFOLDERS = SHARED_CACHE.namespace('subfolders', SHARED_CACHE_TTL)
+PAGES = SHARED_CACHE.namespace('pages', SHARED_CACHE_TTL)
+EVENTS = SHARED_CACHE.namespace('events', SHARED_CACHE_TTL)
+CLAIMS = SHARED_CACHE.namespace('claims', SHARED_CACHE_TTL)
+NOTIFICATIONS = SHARED_CACHE.namespace('notifications', SHARED_CACHE_TTL, local=False)
+USAGE = SHARED_CACHE.namespace('usage', SHARED_CACHE_USAGE_TTL, local=False)
+RECEIPTS = SHARED_CACHE.namespace('receipts', SHARED_CACHE_RECEIPT_TTL, local=False)
@@ -11,7 +11,15 @@ const CONFIG = {
   SHEET_NAME: {
     MAIN: '本番シート',
     MAPPING: 'Config_Mapping',
-    FOLDERS: 'Config_Folders'
+    FOLDERS: 'Config_Folders',
+    VERIFICATION_CACHE: '_VerificationCache'
+  },
+
+  // AI検証キャッシュ
+  // プロンプト・パース処理の変更は自動で検知するが、判定ルールだけを変えた場合はこの番号を上げる
+  VERIFICATION_CACHE: {
+    RULES_VERSION: 1,
+    MAX_RESULT_LENGTH: 45000  // セルの上限（50,000文字）未満
   },
 
   // Gemini API
@@ -62,6 +70,7 @@ const CONFIG = {
 var _targetSpreadsheet = null;
 var _isBatchMode = false;
 var _batchMaxTimeMs = null;
+var _batchMaxItems = null;
 
 /**
  * 処理対象のスプシを取得する共通関数。
@@ -77,15 +86,26 @@ function getTargetSpreadsheet_() {
  * 外部からスプシIDを指定してレシート処理を実行する。
  * 管理GASからの一括実行用。
  * @param {string} spreadsheetId - 対象スプシのID
+ * @param {number} [maxTimeMs] - 実行時間の上限（ms）
+ * @param {number} [maxItems] - 処理するファイル数の上限（小分け実行用。残りは次回の呼び出しで処理）
+ * @return {{processed: number, errors: number, timedOut: boolean, hasMore: boolean}}
  */
-function processReceiptsById(spreadsheetId) {
+function processReceiptsById(spreadsheetId, maxTimeMs, maxItems) {
   _targetSpreadsheet = SpreadsheetApp.openById(spreadsheetId);
   _isBatchMode = true;
+  if (maxTimeMs) {
+    _batchMaxTimeMs = maxTimeMs;
+  }
+  if (maxItems) {
+    _batchMaxItems = maxItems;
+  }
   try {
-    processReceipts();
+    return processReceipts();
   } finally {
     _targetSpreadsheet = null;
     _isBatchMode = false;
+    _batchMaxTimeMs = null;
+    _batchMaxItems = null;
   }
 }
 
@@ -94,22 +114,37 @@ function processReceiptsById(spreadsheetId) {
  * 管理GASからの一括実行用。
  * @param {string} spreadsheetId - 対象スプシのID
  * @param {number} [maxTimeMs] - 実行時間の上限（ms）。中央管理側の残り時間を渡す。
+ * @param {number} [maxItems] - 検証する行数の上限（小分け実行用。残りは次回の呼び出しで処理）
  */
-function runAutoVerificationById(spreadsheetId, maxTimeMs) {
+function runAutoVerificationById(spreadsheetId, maxTimeMs, maxItems) {
   _targetSpreadsheet = SpreadsheetApp.openById(spreadsheetId);
   _isBatchMode = true;
   if (maxTimeMs) {
     _batchMaxTimeMs = maxTimeMs;
   }
+  if (maxItems) {
+    _batchMaxItems = maxItems;
+  }
   try {
     return runAutoVerification();
   } finally {
     _targetSpreadsheet = null;
     _isBatchMode = false;
     _batchMaxTimeMs = null;
+    _batchMaxItems = null;
   }
 }
 
+/**
+ * 実行時間の上限（ms）。バッチモードで中央管理側から渡されていればそちらを優先する。
+ * @return {number}
+ */
+function getEffectiveMaxTimeMs_() {
+  return (_batchMaxTimeMs && _batchMaxTimeMs < CONFIG.PROCESSING.MAX_EXECUTION_TIME_MS)
+    ? _batchMaxTimeMs
+    : CONFIG.PROCESSING.MAX_EXECUTION_TIME_MS;
+}
+
 /**
  * バッチモード判定（中央管理GASからの呼び出し時にtrue）
  * @return {boolean}
@@ -8,6 +8,7 @@
  * - 「弥生エクスポート」シートに書き出し
  * - UTF-8 BOM付きCSVファイルを生成・ダウンロード
  * - 出力済フラグ・出力行数をセット（課金カウント用）
+ * - 新たに出力した行数を利用量メーター（line-receipt-webhook の /usage/export）に送る
  */
 
 /**
@@ -117,6 +118,7 @@ function generateYayoiCSV() {
   // 弥生形式の行を生成 & 出力対象行を記録
   const yayoiRows = [];
   const exportedRows = []; // { row: 行番号, exportRows: 出力行数 }
+  const usageByMonth = {};  // 取引月（yyyy-MM）→ 新たに出力した行数（出力済の行の再出力は数えない）
 
   for (let i = 0; i < data.length; i++) {
     const row = data[i];
@@ -208,6 +210,10 @@ function generateYayoiCSV() {
     // 出力対象行を記録
     if (rowExportCount > 0) {
       exportedRows.push({ row: rowNum, exportRows: rowExportCount });
+      if (row[exportColIdx.exported - 1] !== true) {
+        const month = Utilities.formatDate(date, 'JST', 'yyyy-MM');
+        usageByMonth[month] = (usageByMonth[month] || 0) + rowExportCount;
+      }
     }
   }
 
@@ -227,6 +233,9 @@ function generateYayoiCSV() {
     mainSheet.getRange(item.row, exportColIdx.exportRows).setValue(item.exportRows);
   }
 
+  // 利用量メーターに出力行数を加算（失敗しても出力は続ける。定期補正でシートの値に合わせる）
+  reportExportedRows_(ss, usageByMonth);
+
   // ── Step 3: UTF-8 BOM付きCSVファイルを生成 ──
   const csvRows = [YAYOI_COLUMNS].concat(yayoiRows);
   const csvContent = '\uFEFF' + csvRows.map(toCSVRow).join('\r\n');
@@ -364,6 +373,42 @@ function resetExportFlagOnEdit(e) {
   }
 }
 
+// ============================================================
+// 利用量メーター
+// ============================================================
+
+/**
+ * 新たに出力した行数を利用量メーター（POST /usage/export）に送る
+ * USAGE_API_URL（line-receipt-webhook のURL）は Config シートまたは ScriptProperties、
+ * USAGE_API_TOKEN は ScriptProperties だけから読む。未設定なら送らない
+ * 顧客コードは Config シートの CUSTOMER_CODE、なければスプシ名（{顧客コード}_レシート読込）から取る
+ * @param {GoogleAppsScript.Spreadsheet.Spreadsheet} ss
+ * @param {Object} usageByMonth - 取引月（yyyy-MM）→ 行数
+ */
+function reportExportedRows_(ss, usageByMonth) {
+  const url = getConfig_('USAGE_API_URL', '');
+  const token = PropertiesService.getScriptProperties().getProperty('USAGE_API_TOKEN') || '';
+  const customerKey = getConfig_('CUSTOMER_CODE', '') || ss.getName().split('_')[0];
+  if (!url || !token || !customerKey) return;
+
+  for (const month of Object.keys(usageByMonth)) {
+    try {
+      const response = UrlFetchApp.fetch(url.replace(/\/$/, '') + '/usage/export', {
+        method: 'post',
+        contentType: 'application/json',
+        headers: { 'Authorization': 'Bearer ' + token },
+        payload: JSON.stringify({ customer_key: customerKey, rows: usageByMonth[month], month: month }),
+        muteHttpExceptions: true
+      });
+      if (response.getResponseCode() !== 200) {
+        Logger.log('利用量の送信に失敗: ' + response.getResponseCode() + ' ' + response.getContentText());
+      }
+    } catch (e) {
+      Logger.log('利用量の送信エラー: ' + e);
+    }
+  }
+}
+
 // ============================================================
 // ヘルパー関数
 // ============================================================
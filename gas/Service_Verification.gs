@@ -201,8 +201,7 @@ function verifyOneRow_(sheet, row, apiKey) {
       return;
     }
 
-    // Base64に変換
-    const base64Image = convertToBase64_(imageFile);
+    const imageBytes = imageFile.getBytes();
 
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     // ステップ2: 行データを構造化
@@ -222,17 +221,25 @@ function verifyOneRow_(sheet, row, apiKey) {
     };
 
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    // ステップ3: プロンプトを構築
+    // ステップ3: 検証キャッシュを確認（画像と行データが同じなら前回の結果を使う）
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    const prompt = buildVerificationPrompt_(rowData, []);
+    const cacheKey = buildVerificationCacheKey_(imageBytes, rowData);
+    let result = getCachedVerification_(cacheKey);
 
-    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    // ステップ4: GPT-5 APIで検証
-    // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    Logger.log('Row ' + row + ': GPT-5検証開始');
-    const response = callGPT5ForVerification_(imageFile, base64Image, prompt);
-    const responseText = extractGPT5Text_(response);
-    const result = parseVerificationResponse_(responseText);
+    if (result) {
+      Logger.log('Row ' + row + ': 検証キャッシュを使用');
+    } else {
+      // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+      // ステップ4: GPT-5 APIで検証
+      // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+      const base64Image = Utilities.base64Encode(imageBytes);
+      const prompt = buildVerificationPrompt_(rowData, []);
+      Logger.log('Row ' + row + ': GPT-5検証開始');
+      const response = callGPT5ForVerification_(imageFile, base64Image, prompt);
+      const responseText = extractGPT5Text_(response);
+      result = parseVerificationResponse_(responseText);
+      putCachedVerification_(cacheKey, result);
+    }
 
     // ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     // ステップ5: 事後修正（内税/外税判定ミス）
@@ -1608,14 +1615,14 @@ function runAutoVerification() {
     let errorCount = 0;
 
     // バッチモード時は中央管理側から渡された残り時間を使う
-    const effectiveMaxTime = (_batchMaxTimeMs && _batchMaxTimeMs < CONFIG.PROCESSING.MAX_EXECUTION_TIME_MS)
-      ? _batchMaxTimeMs
-      : CONFIG.PROCESSING.MAX_EXECUTION_TIME_MS;
+    const effectiveMaxTime = getEffectiveMaxTimeMs_();
     if (_batchMaxTimeMs) {
       console.log('runAutoVerification: effectiveMaxTime=' + Math.round(effectiveMaxTime / 1000) + '秒（中央管理から制限）');
     }
+    // 小分け実行時は先頭から maxItems 行だけ検証する（残りは次回の呼び出しで対象になる）
+    const sliceRows = _batchMaxItems ? targetRows.slice(0, _batchMaxItems) : targetRows;
 
-    for (const row of targetRows) {
+    for (const row of sliceRows) {
       // タイムアウトチェック
       if (Date.now() - startTime > effectiveMaxTime) {
         console.log('runAutoVerification: タイムアウト（' + processedCount + '/' + targetRows.length + '件処理済み）');
@@ -1698,7 +1705,8 @@ function runAutoVerification() {
       approved: approvedCount,
       pending: pendingCount,
       errors: errorCount,
-      timedOut: (processedCount < targetRows.length && Date.now() - startTime > effectiveMaxTime)
+      timedOut: (processedCount < sliceRows.length && Date.now() - startTime > effectiveMaxTime),
+      hasMore: (processedCount + errorCount < targetRows.length)
     };
 
   } finally {
@@ -1928,6 +1936,181 @@ function shouldAutoApprove_(verResult) {
   return true;
 }
 
+// ============================================================
+// 検証キャッシュ
+// ============================================================
+//
+// 画像のバイト列 + 行データ（正規化後）+ バージョンのハッシュをキーに、
+// parseVerificationResponse_ の結果を「_VerificationCache」シートに保存する。
+// 検証列を消して再実行した・同じ内容を再取り込みした場合はAPIを呼ばずに結果を返す。
+//
+// バージョンはプロンプト（固定の行データで組み立てた文面）・API呼び出し・パース処理のソースと
+// CONFIG.VERIFICATION_CACHE.RULES_VERSION のハッシュ。どれかが変わるとキーが変わり、
+// 古いバージョンの行は次回の読み込み時にシートから削除される。
+
+/** キャッシュに含める行データの項目（金額は数値として比較） */
+var VERIFICATION_CACHE_FIELDS_ = ['date', 'storeName', 'registrationNumber', 'totalAmount',
+  'taxable10', 'tax10', 'taxable8', 'tax8', 'nonTaxable', 'account'];
+var VERIFICATION_CACHE_AMOUNT_FIELDS_ = ['totalAmount', 'taxable10', 'tax10', 'taxable8', 'tax8', 'nonTaxable'];
+
+/** 実行中のキャッシュ（スプシごと）: { spreadsheetId, version, entries: {key: JSON文字列}, sheet } */
+var _verificationCache = null;
+var _verificationCacheVersion = null;
+
+/**
+ * バイト列を16進文字列に変換
+ * @param {Array<number>} bytes
+ * @return {string}
+ */
+function bytesToHex_(bytes) {
+  return bytes.map(function(b) { return ('0' + (b & 0xFF).toString(16)).slice(-2); }).join('');
+}
+
+/**
+ * キャッシュのバージョン（プロンプト・パース処理・ルールのどれかが変わると変わる）
+ * @return {string}
+ */
+function getVerificationCacheVersion_() {
+  if (_verificationCacheVersion) return _verificationCacheVersion;
+
+  var sampleRow = {};
+  VERIFICATION_CACHE_FIELDS_.forEach(function(field) { sampleRow[field] = '{' + field + '}'; });
+  var source = [
+    String(CONFIG.VERIFICATION_CACHE.RULES_VERSION),
+    buildVerificationPrompt_(sampleRow, []),
+    callGPT5ForVerification_.toString(),
+    extractGPT5Text_.toString(),
+    parseVerificationResponse_.toString()
+  ].join('\u0000');
+  _verificationCacheVersion = bytesToHex_(
+    Utilities.computeDigest(Utilities.DigestAlgorithm.SHA_256, source, Utilities.Charset.UTF_8)
+  ).slice(0, 16);
+  return _verificationCacheVersion;
+}
+
+/**
+ * 行データの1項目を正規化（全角半角・空白・桁区切りの違いを無視する）
+ * @param {string} field
+ * @param {*} value
+ * @return {string}
+ */
+function normalizeVerificationField_(field, value) {
+  var text = String(value == null ? '' : value).normalize('NFKC').replace(/\s+/g, ' ').trim();
+  if (VERIFICATION_CACHE_AMOUNT_FIELDS_.indexOf(field) !== -1) {
+    var num = Number(text.replace(/[¥,円\s]/g, ''));
+    return isNaN(num) ? text : String(num);
+  }
+  if (field === 'registrationNumber') {
+    return text.toUpperCase();
+  }
+  return text;
+}
+
+/**
+ * キャッシュキー（画像のハッシュ + 正規化した行データ + バージョン）
+ * @param {Array<number>} imageBytes
+ * @param {Object} rowData
+ * @return {string}
+ */
+function buildVerificationCacheKey_(imageBytes, rowData) {
+  var imageHash = bytesToHex_(Utilities.computeDigest(Utilities.DigestAlgorithm.SHA_256, imageBytes));
+  var fields = VERIFICATION_CACHE_FIELDS_.map(function(field) {
+    return normalizeVerificationField_(field, rowData[field]);
+  });
+  var source = [getVerificationCacheVersion_(), imageHash].concat(fields).join('\u0000');
+  return bytesToHex_(
+    Utilities.computeDigest(Utilities.DigestAlgorithm.SHA_256, source, Utilities.Charset.UTF_8)
+  );
+}
+
+/**
+ * キャッシュシートを読み込む（1回の実行でスプシごとに1回だけ）
+ * 古いバージョンの行はここで削除する
+ * @return {Object}
+ */
+function loadVerificationCache_() {
+  var ss = getTargetSpreadsheet_();
+  var spreadsheetId = ss.getId();
+  if (_verificationCache && _verificationCache.spreadsheetId === spreadsheetId) {
+    return _verificationCache;
+  }
+
+  var version = getVerificationCacheVersion_();
+  var cache = { spreadsheetId: spreadsheetId, version: version, entries: {}, sheet: null };
+  var sheet = ss.getSheetByName(CONFIG.SHEET_NAME.VERIFICATION_CACHE);
+
+  if (sheet && sheet.getLastRow() > 1) {
+    var values = sheet.getRange(2, 1, sheet.getLastRow() - 1, 4).getValues();
+    var current = values.filter(function(r) { return r[1] === version; });
+    current.forEach(function(r) { cache.entries[r[0]] = r[2]; });
+
+    if (current.length < values.length) {
+      // 古いバージョンの結果を削除して詰め直す
+      sheet.getRange(2, 1, values.length, 4).clearContent();
+      if (current.length > 0) {
+        sheet.getRange(2, 1, current.length, 4).setValues(current);
+      }
+      console.log('検証キャッシュ: 古いバージョンの ' + (values.length - current.length) + ' 件を削除');
+    }
+  }
+  cache.sheet = sheet;
+  _verificationCache = cache;
+  return cache;
+}
+
+/**
+ * キャッシュ済みの検証結果を取得
+ * @param {string} key
+ * @return {Object|null} parseVerificationResponse_ の結果（呼び出し側で変更してよいコピー）
+ */
+function getCachedVerification_(key) {
+  try {
+    var json = loadVerificationCache_().entries[key];
+    return json ? JSON.parse(json) : null;
+  } catch (e) {
+    console.warn('検証キャッシュ読み込み失敗: ' + e.message);
+    return null;
+  }
+}
+
+/**
+ * 検証結果をキャッシュに保存
+ * @param {string} key
+ * @param {Object} result
+ */
+function putCachedVerification_(key, result) {
+  try {
+    var json = JSON.stringify(result);
+    if (json.length > CONFIG.VERIFICATION_CACHE.MAX_RESULT_LENGTH) return;
+
+    var cache = loadVerificationCache_();
+    if (!cache.sheet) {
+      var ss = getTargetSpreadsheet_();
+      cache.sheet = ss.insertSheet(CONFIG.SHEET_NAME.VERIFICATION_CACHE);
+      cache.sheet.appendRow(['キー', 'バージョン', '検証結果', '保存日時']);
+      cache.sheet.setFrozenRows(1);
+      cache.sheet.hideSheet();
+    }
+    cache.sheet.appendRow([key, cache.version, json, new Date()]);
+    cache.entries[key] = json;
+  } catch (e) {
+    console.warn('検証キャッシュ保存失敗: ' + e.message);
+  }
+}
+
+/**
+ * 検証キャッシュを全件削除する（メニューから実行）
+ */
+function clearVerificationCache() {
+  var ss = getTargetSpreadsheet_();
+  var sheet = ss.getSheetByName(CONFIG.SHEET_NAME.VERIFICATION_CACHE);
+  if (sheet && sheet.getLastRow() > 1) {
+    sheet.getRange(2, 1, sheet.getLastRow() - 1, 4).clearContent();
+  }
+  _verificationCache = null;
+  console.log('検証キャッシュを削除しました');
+}
+
 // ============================================================
 // 継続トリガー管理
 // ============================================================
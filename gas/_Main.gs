@@ -35,6 +35,7 @@ function onOpen() {
     .addSeparator()
     .addItem('CHK/ERRのみリセット', 'resetCheckErrorMarks')
     .addItem('全マークをリセット', 'resetProcessedMarks')
+    .addItem('検証キャッシュを削除', 'clearVerificationCache')
     .addToUi();
 
   ui.createMenu('設定')
@@ -108,6 +109,8 @@ function promptStatementSpreadsheetId() {
 
 /**
  * レシート処理メイン（多重実行ガード付き）
+ * バッチモードでは中央管理側から渡された実行時間・件数の上限で打ち切り、結果を返す。
+ * @return {{processed: number, errors: number, timedOut: boolean, hasMore: boolean}|undefined}
  */
 function processReceipts() {
   const batchMode = isBatchMode();
@@ -123,18 +126,20 @@ function processReceipts() {
 
   try {
     const startTime = Date.now();
+    const maxTimeMs = getEffectiveMaxTimeMs_();
     const folderConfigs = loadFolderConfigs_();
     let processedCount = 0;
+    let errorCount = 0;
     let hasNext = false;
 
     console.log('バッチ処理を開始...');
 
     for (const folderConfig of folderConfigs) {
       // タイムアウトチェック
-      if (Date.now() - startTime > CONFIG.PROCESSING.MAX_EXECUTION_TIME_MS) {
+      if (Date.now() - startTime > maxTimeMs) {
         console.log('タイムアウト: トリガーを設定して中断');
         scheduleContinuation_('processReceipts');
-        return;
+        return { processed: processedCount, errors: errorCount, timedOut: true, hasMore: true };
       }
 
       let folder;
@@ -150,10 +155,10 @@ function processReceipts() {
 
       while (files.hasNext()) {
         // タイムアウトチェック
-        if (Date.now() - startTime > CONFIG.PROCESSING.MAX_EXECUTION_TIME_MS) {
+        if (Date.now() - startTime > maxTimeMs) {
           console.log('タイムアウト: トリガーを設定して中断');
           scheduleContinuation_('processReceipts');
-          return;
+          return { processed: processedCount, errors: errorCount, timedOut: true, hasMore: true };
         }
 
         const file = files.next();
@@ -179,6 +184,12 @@ function processReceipts() {
 
         hasNext = true;
 
+        // 小分け実行: 上限件数に達したら残りは次回の呼び出しで処理する
+        if (_batchMaxItems && processedCount + errorCount >= _batchMaxItems) {
+          console.log('件数上限（' + _batchMaxItems + '件）: 残りは次回');
+          return { processed: processedCount, errors: errorCount, timedOut: false, hasMore: true };
+        }
+
         try {
           console.log('処理中: ' + fileName);
           processOneReceipt_(file, folderConfig);
@@ -186,6 +197,7 @@ function processReceipts() {
         } catch (e) {
           console.error('処理エラー (' + fileName + '): ' + e.message);
           markFileAsError_(file, e.message);
+          errorCount++;
         }
       }
     }
@@ -201,6 +213,7 @@ function processReceipts() {
     } else {
       console.log('処理完了: ' + processedCount + '件');
     }
+    return { processed: processedCount, errors: errorCount, timedOut: false, hasMore: false };
 
   } finally {
     if (lock) lock.releaseLock();
@@ -10,6 +10,7 @@
  * - 全顧客のレシート処理（1時間毎トリガー）
  * - 全顧客のAI検証（1日1回トリガー）
  * - ラッパーGASの一括配布
+ * - 外部スケジューラ（tools/batch_scheduler.py）からの顧客単位の小分け実行
  * - パートナー管理（顧客管理シートの登録）
  *
  * 【パートナー設定】
@@ -383,6 +384,33 @@ function batchRunAutoVerification_(isContinuation) {
   logExecution_('AI検証' + (isContinuation ? '（継続）' : ''), clients.length, processedCount, errorCount);
 }
 
+// ============================================================
+// 外部スケジューラからの小分け実行
+// ============================================================
+
+/**
+ * 1顧客分の処理を小分けで実行する（tools/batch_scheduler.py から Apps Script API の scripts.run で呼ぶ）。
+ * スケジューラが顧客ごとに何度も呼び、hasMore が false になるまで続ける。
+ * 顧客間の順番・並列数・AIの呼び出し回数の上限・進捗の保存はスケジューラ側で行う。
+ * @param {string} operation - 'receipts'（レシート処理）または 'verification'（AI検証）
+ * @param {string} spreadsheetId - 顧客スプシのID
+ * @param {number} maxTimeMs - 1回の実行時間の上限（ms）
+ * @param {number} maxItems - 1回で処理する件数の上限
+ * @return {{processed: number, errors: number, timedOut: boolean, hasMore: boolean}}
+ */
+function runClientSlice(operation, spreadsheetId, maxTimeMs, maxItems) {
+  let result;
+  if (operation === 'receipts') {
+    result = ReceiptEngine.processReceiptsById(spreadsheetId, maxTimeMs, maxItems);
+  } else if (operation === 'verification') {
+    result = ReceiptEngine.runAutoVerificationById(spreadsheetId, maxTimeMs, maxItems);
+  } else {
+    throw new Error('不明な処理: ' + operation);
+  }
+  // 対象シートがない・データがない場合は何も返らない（処理するものがない）
+  return result || { processed: 0, errors: 0, timedOut: false, hasMore: false };
+}
+
 /**
  * 中央管理GAS用の継続トリガー削除。
  * @param {string} functionName - 削除対象の関数名
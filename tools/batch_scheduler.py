@@ -0,0 +1,502 @@
+"""
+全顧客のレシート処理・AI検証の一括実行（CentralAdmin.gs の batchProcessAllReceipts / batchRunAutoVerification_ のPython版）
+
+GAS版は全顧客を1件ずつ順番に処理し、時間切れになると継続トリガーで「次の顧客」から再開していたため、
+未処理が大量に溜まった顧客が1件あると、その後ろの顧客すべてが待たされていた。このツールは:
+
+- 顧客ごとの処理を小分け（1回 --slice-items 件・--slice-seconds 秒まで）にして、
+  中央管理GASの runClientSlice を Apps Script API（scripts.run）で呼ぶ
+- 小分けの実行はワーカー（--workers 本）で並列に行う。同じ顧客の実行は同時に1つだけで、
+  続きがある顧客は待ち行列の最後に回す（ラウンドロビン）。大量に溜まった顧客がいても他の顧客は先に終わる
+- AI（Gemini）の呼び出し回数を全顧客の合計で --llm-per-minute 回/分までに抑える。
+  小分け1回ぶん（件数 × --llm-calls-per-item）を実行前に確保し、処理しなかった分は終了時に戻す
+- Apps Script API の429は deploy_wrapper.py と同じく、全体で間隔を広げて並列数を下げる
+- 顧客ごとの進捗（完了・処理件数・エラー件数・所要時間）を小分け1回ごとにローカルのJSONに保存し、
+  中断しても --resume で途中の顧客から続ける（処理済みのファイル・検証済みの行はGAS側で対象外になる）
+- 終了時に中央管理スプシの「実行ログ」へ logExecution_ と同じ形式で1行、
+  「実行ログ（顧客別）」へ顧客ごとの処理件数・所要時間を書く
+
+使い方:
+    python tools/batch_scheduler.py verification --central-sheet-id <中央管理スプシID> \\
+        --central-script-id <中央管理GASのscriptId>
+    # 中断した場合・--max-seconds で打ち切った場合は続きから
+    python tools/batch_scheduler.py verification --central-sheet-id ... --central-script-id ... --resume
+
+    # ローカルの疑似API（tools/fake_script_api.py）に向けて動作確認
+    python tools/batch_scheduler.py receipts --clients clients.json --central-script-id dummy \\
+        --api-base http://127.0.0.1:8765 --token dummy
+
+中央管理GASは appsscript.json の executionApi で API からの実行を許可しておく
+（scripts.run は devMode で最新の保存内容を実行するため、トークンは中央管理GASのオーナーのものを使う）。
+
+環境変数:
+    SCRIPT_API_BASE          Apps Script API のベースURL（デフォルト https://script.googleapis.com）
+    GOOGLE_OAUTH_TOKEN       アクセストークン（未指定時は google.auth.default で取得）
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from deploy_wrapper import (
+    SCRIPT_API_BASE, AdaptiveLimiter, ScriptApi, load_clients_from_json, load_clients_from_sheets,
+)
+
+OPERATIONS = {'receipts': 'レシート処理', 'verification': 'AI検証'}
+SLICE_FUNCTION = 'runClientSlice'
+LOG_SHEET_NAME = '実行ログ'
+CLIENT_LOG_SHEET_NAME = '実行ログ（顧客別）'
+LOG_HEADER = ['実行日時', '処理', '対象件数', '成功', 'エラー']
+CLIENT_LOG_HEADER = ['実行日時', '処理', 'パートナー', '顧客コード', '結果', '処理件数', 'エラー件数',
+                     '実行回数', '処理時間（秒）', '開始までの待ち（秒）', '完了までの時間（秒）']
+# runClientSlice が呼ぶ ReceiptEngine の処理に必要なスコープ（中央管理GASの appsscript.json と同じ）
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/script.projects',
+    'https://www.googleapis.com/auth/script.external_request',
+    'https://www.googleapis.com/auth/script.scriptapp',
+]
+
+
+# ============================================================
+# AIの呼び出し回数の上限（全ワーカーで共有）
+# ============================================================
+
+class LlmBudget:
+    """
+    直近 window 秒のAI呼び出し回数を per_minute 回までに抑える
+    小分けの実行前に回数を確保し、実行後に実際の回数へ減らして「終了時刻から window 秒」数える
+    （実行中の呼び出しも窓に入るので、どの window 秒を切り取っても上限を超えない）
+    per_minute <= 0 なら制限しない
+    """
+
+    def __init__(self, per_minute, window=60.0):
+        self.limit = per_minute
+        self.window = window
+        self._entries = []          # {'calls': 回数, 'done_at': 終了時刻 or None（実行中）}
+        self._cond = threading.Condition()
+
+    def _used(self, now):
+        self._entries = [e for e in self._entries if e['done_at'] is None or e['done_at'] > now - self.window]
+        return sum(e['calls'] for e in self._entries)
+
+    def acquire(self, calls):
+        """calls 回ぶん確保できるまで待つ（戻り値: release に渡す確保分）"""
+        if self.limit <= 0:
+            return None
+        calls = min(calls, self.limit)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._used(now) + calls <= self.limit:
+                    entry = {'calls': calls, 'done_at': None}
+                    self._entries.append(entry)
+                    return entry
+                expiries = [e['done_at'] + self.window - now for e in self._entries if e['done_at'] is not None]
+                self._cond.wait(max(min(expiries), 0.01) if expiries else None)
+
+    def release(self, entry, used=None):
+        """実行後に呼ぶ（used: 実際の呼び出し回数。不明なら確保した回数のまま数える）"""
+        if entry is None:
+            return
+        with self._cond:
+            if used is not None:
+                entry['calls'] = min(entry['calls'], used)
+            entry['done_at'] = time.monotonic()
+            self._cond.notify_all()
+
+
+# ============================================================
+# 進捗（ローカルJSON）
+# ============================================================
+
+class RunProgress:
+    """
+    1回の一括実行の顧客ごとの進捗
+    {"operation", "started_at", "finished_at", "clients": {"MK001": {"partner", "status", "slices",
+     "processed", "errors", "busy_seconds", "first_started_at", "finished_at", "attempts", "error"}}}
+    status: running（途中）/ done / error。時刻は UNIX 時間（中断をまたいで比べられるように）
+    """
+
+    def __init__(self, path, operation, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {'operation': operation, 'started_at': time.time(), 'finished_at': None, 'clients': {}}
+        if resume and path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            # 同じ処理の途中の実行だけ引き継ぐ（完了済みの実行・別の処理の進捗からは再開しない）
+            if saved.get('operation') == operation and not saved.get('finished_at'):
+                self.data = saved
+            else:
+                print(f'進捗ファイルに再開できる {OPERATIONS[operation]} の実行がないため、最初から実行します')
+
+    @property
+    def started_at(self):
+        return self.data['started_at']
+
+    def get(self, code):
+        return self.data['clients'].get(code, {})
+
+    def is_finished(self, code):
+        return self.get(code).get('status') in ('done', 'error')
+
+    def _entry(self, code, partner, started_at):
+        return self.data['clients'].setdefault(code, {
+            'partner': partner, 'status': 'running', 'slices': 0, 'processed': 0, 'errors': 0,
+            'busy_seconds': 0.0, 'first_started_at': started_at, 'finished_at': None, 'attempts': 0,
+        })
+
+    def record_slice(self, code, partner, processed, errors, seconds, started_at, done):
+        with self._lock:
+            entry = self._entry(code, partner, started_at)
+            entry['slices'] += 1
+            entry['processed'] += processed
+            entry['errors'] += errors
+            entry['busy_seconds'] = round(entry['busy_seconds'] + seconds, 3)
+            entry['attempts'] = 0
+            entry['error'] = ''
+            if done:
+                entry['status'] = 'done'
+                entry['finished_at'] = time.time()
+            self._save()
+            return dict(entry)
+
+    def record_failure(self, code, partner, error, started_at, max_attempts):
+        """小分けの実行が失敗した（連続 max_attempts 回でこの顧客は打ち切り。戻り値: 連続失敗回数）"""
+        with self._lock:
+            entry = self._entry(code, partner, started_at)
+            entry['attempts'] += 1
+            entry['error'] = error
+            if entry['attempts'] >= max_attempts:
+                entry['status'] = 'error'
+                entry['finished_at'] = time.time()
+            self._save()
+            return entry['attempts']
+
+    def finish(self):
+        with self._lock:
+            self.data['finished_at'] = time.time()
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+# ============================================================
+# スケジューラ
+# ============================================================
+
+class SliceScheduler:
+    """
+    顧客ごとの小分け実行をワーカーで回す
+    待ち行列には「続きのある顧客」が1件ずつ並び、ワーカーは先頭の顧客を1回ぶん実行して、
+    続きがあれば最後尾に戻す（同じ顧客の実行は同時に1つだけ）
+    """
+
+    def __init__(self, api, script_id, operation, budget, progress, workers=4, slice_items=10,
+                 slice_seconds=60.0, llm_calls_per_item=1, max_attempts=3, max_idle_slices=3, dev_mode=True):
+        self.api = api
+        self.script_id = script_id
+        self.operation = operation
+        self.budget = budget
+        self.progress = progress
+        self.workers = workers
+        self.slice_items = slice_items
+        self.slice_seconds = slice_seconds
+        self.llm_calls_per_item = llm_calls_per_item
+        self.max_attempts = max_attempts
+        self.max_idle_slices = max_idle_slices
+        self.dev_mode = dev_mode
+        self.stats = {'slices': 0, 'rate_limited': 0, 'failed': 0}
+        self._ring = deque()
+        self._active = 0
+        self._idle = {}             # 顧客コード → 続けて1件も進まなかった回数
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._deadline = None
+
+    def stop(self):
+        """新しい小分けを始めない（実行中のものは終わるまで待つ）"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def run(self, clients, max_seconds=None):
+        """
+        全顧客の処理が終わる（または stop / max_seconds）まで実行する
+        戻り値: 完了していない顧客の数
+        """
+        todo = [c for c in clients if not self.progress.is_finished(c['code'])]
+        # 前回途中だった顧客を先に（残りが少ないはずなので早く終わらせる）
+        todo.sort(key=lambda c: 0 if self.progress.get(c['code']) else 1)
+        self._ring.extend(todo)
+        self._deadline = time.monotonic() + max_seconds if max_seconds else None
+        print(f'=== {OPERATIONS[self.operation]} 開始: {len(todo)}件'
+              f'（完了済み {len(clients) - len(todo)}件、途中から {sum(1 for c in todo if self.progress.get(c["code"]))}件）===')
+
+        threads = [threading.Thread(target=self._worker, name=f'slice-{i}', daemon=True)
+                   for i in range(self.workers)]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            print('中断: 実行中の小分けが終わるのを待っています（進捗は保存済み）...')
+            self.stop()
+            for t in threads:
+                t.join()
+        return sum(1 for c in clients if not self.progress.is_finished(c['code']))
+
+    def _stopped(self):
+        return self._stop.is_set() or (self._deadline is not None and time.monotonic() >= self._deadline)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ring and self._active and not self._stopped():
+                    self._cond.wait(1.0)
+                if not self._ring or self._stopped():
+                    self._cond.notify_all()
+                    return
+                client = self._ring.popleft()
+                self._active += 1
+            again = False
+            try:
+                again = self.run_slice(client)
+            except Exception as e:
+                print(f'[{client["code"]}] 予期しないエラー: {e}')
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if again:
+                        self._ring.append(client)
+                    self._cond.notify_all()
+
+    def run_slice(self, client):
+        """1顧客を1回ぶん実行（戻り値: 続きがあるか）"""
+        code = client['code']
+        partner = client.get('partner', '')
+        ticket = self.budget.acquire(self.slice_items * self.llm_calls_per_item)
+        started_at = time.time()
+        try:
+            result, rate_limited = self.api.run_function(
+                self.script_id, SLICE_FUNCTION,
+                [self.operation, client['spreadsheetId'], int(self.slice_seconds * 1000), self.slice_items],
+                dev_mode=self.dev_mode,
+            )
+        except Exception as e:
+            # GAS側で途中まで処理された可能性があるので、確保した回数はそのまま数える
+            self.budget.release(ticket)
+            with self._cond:
+                self.stats['failed'] += 1
+            attempts = self.progress.record_failure(code, partner, str(e), started_at, self.max_attempts)
+            if attempts >= self.max_attempts:
+                print(f'[{code}] エラー（{attempts}回失敗、この顧客は打ち切り）: {e}')
+                return False
+            print(f'[{code}] エラー（{attempts}/{self.max_attempts}回目、後で再実行）: {e}')
+            return True
+        if rate_limited:
+            self.budget.release(ticket, 0)
+            with self._cond:
+                self.stats['rate_limited'] += 1
+            return True
+
+        result = result or {}
+        processed = int(result.get('processed') or 0)
+        errors = int(result.get('errors') or 0)
+        used = processed + errors
+        self.budget.release(ticket, used * self.llm_calls_per_item)
+        has_more = bool(result.get('hasMore'))
+
+        # 続きがあるのに1件も進まない場合は打ち切る（同じ顧客を延々と回さない）
+        idle = self._idle.get(code, 0) + 1 if has_more and not used else 0
+        self._idle[code] = idle
+        stalled = idle >= self.max_idle_slices
+        entry = self.progress.record_slice(code, partner, processed, errors, time.time() - started_at,
+                                           started_at, done=not has_more)
+        with self._cond:
+            self.stats['slices'] += 1
+        if stalled:
+            self.progress.record_failure(code, partner, f'{idle}回続けて1件も処理できませんでした',
+                                         started_at, max_attempts=1)
+            print(f'[{code}] {idle}回続けて1件も処理できないため打ち切り')
+            return False
+        if not has_more:
+            print(f'[{code}] 完了: 処理={entry["processed"]}件, エラー={entry["errors"]}件, '
+                  f'実行={entry["slices"]}回, 処理時間={entry["busy_seconds"]:.1f}秒')
+        return has_more
+
+
+# ============================================================
+# 実行ログ（中央管理スプシ）
+# ============================================================
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y/%m/%d %H:%M:%S')
+
+
+def build_log_rows(operation, clients, progress):
+    """
+    「実行ログ」の1行（logExecution_ と同じ: 実行日時, 処理, 対象件数, 成功, エラー）と「実行ログ（顧客別）」の行
+    成功・エラーは顧客の数（GAS版と同じ）。今回完了しなかった顧客は顧客別の行だけ「途中」で書く
+    """
+    now = _format_time(time.time())
+    label = f'{OPERATIONS[operation]}（スケジューラ）'
+    success = errors = 0
+    client_rows = []
+    for client in clients:
+        entry = progress.get(client['code'])
+        if not entry:
+            continue
+        status = entry.get('status')
+        success += status == 'done'
+        errors += status == 'error'
+        finished_at = entry.get('finished_at')
+        client_rows.append([
+            now, label, entry.get('partner', ''), client['code'],
+            {'done': '完了', 'error': 'エラー'}.get(status, '途中'),
+            entry.get('processed', 0), entry.get('errors', 0), entry.get('slices', 0),
+            round(entry.get('busy_seconds', 0), 1),
+            round(entry['first_started_at'] - progress.started_at, 1),
+            round(finished_at - progress.started_at, 1) if finished_at else '',
+        ])
+    return [now, label, len(clients), success, errors], client_rows
+
+
+def write_execution_log(service, central_sheet_id, summary_row, client_rows):
+    """中央管理スプシに実行ログを追記（シートがなければ logExecution_ と同じ見出しで作る）"""
+    try:
+        titles = {
+            s['properties']['title'] for s in service.spreadsheets().get(
+                spreadsheetId=central_sheet_id, fields='sheets.properties.title'
+            ).execute().get('sheets', [])
+        }
+        for name, header in ((LOG_SHEET_NAME, LOG_HEADER), (CLIENT_LOG_SHEET_NAME, CLIENT_LOG_HEADER)):
+            if name in titles:
+                continue
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=central_sheet_id,
+                body={'requests': [{'addSheet': {'properties': {'title': name, 'gridProperties': {'frozenRowCount': 1}}}}]}
+            ).execute()
+            service.spreadsheets().values().update(
+                spreadsheetId=central_sheet_id, range=f'{name}!A1', valueInputOption='RAW', body={'values': [header]}
+            ).execute()
+        service.spreadsheets().values().append(
+            spreadsheetId=central_sheet_id, range=LOG_SHEET_NAME, valueInputOption='USER_ENTERED',
+            body={'values': [summary_row]}
+        ).execute()
+        if client_rows:
+            service.spreadsheets().values().append(
+                spreadsheetId=central_sheet_id, range=CLIENT_LOG_SHEET_NAME, valueInputOption='USER_ENTERED',
+                body={'values': client_rows}
+            ).execute()
+        print(f'実行ログを記録: {LOG_SHEET_NAME} 1行, {CLIENT_LOG_SHEET_NAME} {len(client_rows)}行')
+    except Exception as e:
+        print(f'実行ログの記録に失敗: {e}')
+
+
+def print_timing(client_rows):
+    """顧客ごとの完了までの時間（p50/p95/最大）と、処理時間の長い顧客"""
+    finished = sorted(row[10] for row in client_rows if row[10] != '')
+    if finished:
+        def percentile(p):
+            return finished[min(len(finished) - 1, int(p / 100 * len(finished)))]
+        print(f'完了までの時間: p50={percentile(50):.1f}秒, p95={percentile(95):.1f}秒, 最大={finished[-1]:.1f}秒')
+    for row in sorted(client_rows, key=lambda r: -r[8])[:5]:
+        print(f'  {row[3]}（{row[2]}）: {row[4]} 処理={row[5]}件 エラー={row[6]}件 実行={row[7]}回 処理時間={row[8]}秒')
+
+
+def get_token(args):
+    if args.token or os.environ.get('GOOGLE_OAUTH_TOKEN'):
+        return args.token or os.environ['GOOGLE_OAUTH_TOKEN']
+    import google.auth
+    import google.auth.transport.requests
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    credentials.refresh(google.auth.transport.requests.Request())
+    return credentials.token
+
+
+def get_sheets_service():
+    import google.auth
+    from googleapiclient.discovery import build
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    return build('sheets', 'v4', credentials=credentials)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='全顧客のレシート処理・AI検証を小分けにして並列実行')
+    parser.add_argument('operation', choices=sorted(OPERATIONS), help='receipts（レシート処理）/ verification（AI検証）')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--central-sheet-id', help='中央管理スプシのID（アクティブな顧客を読み、実行ログを書く）')
+    source.add_argument('--clients', help='顧客一覧JSON（実行ログはシートに書かない）')
+    parser.add_argument('--central-script-id', required=True, help='中央管理GASのスクリプトID（runClientSlice を呼ぶ）')
+    parser.add_argument('--workers', type=int, default=4, help='同時に実行する顧客数の上限（デフォルト4）')
+    parser.add_argument('--slice-items', type=int, default=10, help='1回で処理する件数（デフォルト10）')
+    parser.add_argument('--slice-seconds', type=float, default=60, help='1回の実行時間の上限（秒、デフォルト60）')
+    parser.add_argument('--llm-per-minute', type=int, default=60,
+                        help='AI呼び出し回数の上限（全顧客合計・回/分、0で無制限。デフォルト60）')
+    parser.add_argument('--llm-window', type=float, default=60.0, help='AI呼び出し回数を数える時間幅（秒、デフォルト60）')
+    parser.add_argument('--llm-calls-per-item', type=int, default=1, help='1件あたりのAI呼び出し回数（デフォルト1）')
+    parser.add_argument('--max-attempts', type=int, default=3, help='同じ顧客で続けて失敗したら打ち切る回数（デフォルト3）')
+    parser.add_argument('--max-retries', type=int, default=3, help='429時のリトライ回数（デフォルト3）')
+    parser.add_argument('--max-seconds', type=float, help='この秒数を過ぎたら新しい小分けを始めない（続きは --resume）')
+    parser.add_argument('--progress', default='batch_progress.json', help='進捗ファイル')
+    parser.add_argument('--resume', action='store_true', help='進捗ファイルの途中の実行を続ける')
+    parser.add_argument('--api-base', default=SCRIPT_API_BASE, help='Apps Script API のベースURL')
+    parser.add_argument('--token', help='アクセストークン')
+    args = parser.parse_args(argv)
+
+    service = None
+    if args.central_sheet_id:
+        service = get_sheets_service()
+        clients = load_clients_from_sheets(service, args.central_sheet_id, active_only=True)
+    else:
+        clients = load_clients_from_json(args.clients)
+    if not clients:
+        print('対象の顧客が見つかりません。')
+        return 1
+
+    progress = RunProgress(args.progress, args.operation, resume=args.resume)
+    limiter = AdaptiveLimiter(args.workers)
+    # scripts.run は実行が終わるまで応答しないので、タイムアウトは1回の実行時間の上限より長くする
+    api = ScriptApi(get_token(args), limiter, api_base=args.api_base, max_retries=args.max_retries,
+                    timeout=args.slice_seconds + 120)
+    budget = LlmBudget(args.llm_per_minute, args.llm_window)
+    scheduler = SliceScheduler(
+        api, args.central_script_id, args.operation, budget, progress, workers=args.workers,
+        slice_items=args.slice_items, slice_seconds=args.slice_seconds,
+        llm_calls_per_item=args.llm_calls_per_item, max_attempts=args.max_attempts,
+    )
+
+    started = time.monotonic()
+    remaining = scheduler.run(clients, max_seconds=args.max_seconds)
+    if not remaining:
+        progress.finish()
+
+    summary_row, client_rows = build_log_rows(args.operation, clients, progress)
+    print(f'=== {OPERATIONS[args.operation]} {"完了" if not remaining else "中断"}（{time.monotonic() - started:.1f}秒）: '
+          f'対象={summary_row[2]}, 成功={summary_row[3]}, エラー={summary_row[4]}, 未完了={remaining}, '
+          f'実行={scheduler.stats["slices"]}回, レート制限で保留={scheduler.stats["rate_limited"]}回 ===')
+    print_timing(client_rows)
+    if service is not None and not remaining:
+        write_execution_log(service, args.central_sheet_id, summary_row, client_rows)
+    if remaining:
+        print(f'未完了の顧客があります。--resume を付けて再実行してください（進捗: {args.progress}）')
+    return 1 if remaining or summary_row[4] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,559 @@
+"""
+ラッパーGAS一括配布（CentralAdmin.gs の deployWrapperToAllClients_ のPython版）
+
+GAS版は1件ずつ順番に配布し、4分で打ち切って継続トリガーで再開、429で5分停止、
+同じコードが入っている顧客にも毎回アップロードしていた。このツールは:
+
+- 配布内容（Code + appsscript.json）のハッシュを計算し、各顧客の現在の内容と同じならスキップ
+- 残りを同時実行数を絞ったスレッドプールで配布
+- 429 は fetchWithRetry_ と同じく「待ってリトライ → 上限回数で rateLimited」。
+  待ち時間と同時実行数は全体で共有し、429が続くほど間隔を広げ・並列数を下げ、成功が続けば戻す
+- 進捗をローカルのJSONに保存し、中断しても次回は未完了の顧客だけを処理（--resume）
+
+使い方:
+    # 顧客一覧を中央管理スプシの「パートナー設定」から読む（scriptIdの書き戻しもシートへ）
+    python tools/deploy_wrapper.py --central-sheet-id <ID> --wrapper gas/client-wrappers/_TEMPLATE.gs \\
+        --engine-script-id <ReceiptEngineのscriptId>
+
+    # 顧客一覧をJSONで渡す（[{"partner", "code", "spreadsheetId", "scriptId"}]）
+    python tools/deploy_wrapper.py --clients clients.json --wrapper ... --engine-script-id ...
+
+    # ローカルの疑似API（tools/fake_script_api.py）に向けて動作確認
+    python tools/deploy_wrapper.py --clients clients.json --wrapper ... --engine-script-id dummy \\
+        --api-base http://127.0.0.1:8765 --token dummy
+
+環境変数:
+    SCRIPT_API_BASE          Apps Script API のベースURL（デフォルト https://script.googleapis.com）
+    GOOGLE_OAUTH_TOKEN       アクセストークン（未指定時は google.auth.default で取得）
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import requests
+
+SCRIPT_API_BASE = os.environ.get('SCRIPT_API_BASE', 'https://script.googleapis.com')
+PARTNER_SHEET_NAME = 'パートナー設定'
+PROJECT_TITLE = 'レシート処理'
+SCOPES = [
+    'https://www.googleapis.com/auth/script.projects',
+    'https://www.googleapis.com/auth/spreadsheets',
+]
+
+
+# ============================================================
+# 配布内容
+# ============================================================
+
+def build_files(wrapper_code, engine_script_id):
+    """配布するファイル一式（updateScriptContent_ と同じ内容）"""
+    return [
+        {
+            'name': 'Code',
+            'type': 'SERVER_JS',
+            'source': wrapper_code,
+        },
+        {
+            'name': 'appsscript',
+            'type': 'JSON',
+            'source': json.dumps({
+                'timeZone': 'Asia/Tokyo',
+                'dependencies': {
+                    'libraries': [{
+                        'userSymbol': 'ReceiptEngine',
+                        'libraryId': engine_script_id,
+                        'version': '0',
+                        'developmentMode': True,
+                    }]
+                },
+                'exceptionLogging': 'STACKDRIVER',
+                'runtimeVersion': 'V8',
+            }),
+        },
+    ]
+
+
+def _normalize_source(file):
+    """比較用にソースを正規化（JSONは意味が同じなら同じ、コードは改行コードと末尾空白を無視）"""
+    source = file.get('source') or ''
+    if file.get('type') == 'JSON':
+        try:
+            return json.dumps(json.loads(source), sort_keys=True, ensure_ascii=False)
+        except ValueError:
+            pass
+    return source.replace('\r\n', '\n').rstrip()
+
+
+def content_hash(files):
+    """ファイル一式のハッシュ（ファイルの並び順には依存しない）"""
+    digest = hashlib.sha256()
+    for file in sorted(files, key=lambda f: (f.get('name', ''), f.get('type', ''))):
+        digest.update(f'{file.get("name")}\0{file.get("type")}\0'.encode('utf-8'))
+        digest.update(_normalize_source(file).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# ============================================================
+# レート制限（全ワーカーで共有）
+# ============================================================
+
+class AdaptiveLimiter:
+    """
+    429 を受けたら全体の送信間隔を倍にして並列数を半分にし、
+    成功が続いたら間隔を縮めて並列数を1ずつ戻す（AIMD）
+    """
+
+    def __init__(self, max_concurrency, base_delay=0.0, max_delay=60.0):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.delay = base_delay
+        self.active = 0
+        self.successes = 0
+        self.next_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+            # 送信間隔を全体で空ける
+            now = time.monotonic()
+            start = max(now, self.next_at)
+            self.next_at = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self.successes += 1
+            if self.successes >= self.limit:
+                self.successes = 0
+                self.delay = max(self.base_delay, self.delay / 2)
+                if self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._cond.notify_all()
+
+    def on_rate_limited(self, retry_after=None):
+        """429 を記録し、次の試行までの待ち時間（秒）を返す"""
+        with self._cond:
+            self.successes = 0
+            self.delay = min(self.max_delay, max(1.0, self.delay * 2))
+            self.limit = max(1, self.limit // 2)
+            wait = max(self.delay, retry_after or 0)
+            self.next_at = max(self.next_at, time.monotonic() + wait)
+            return wait
+
+
+# ============================================================
+# Apps Script API
+# ============================================================
+
+class ScriptApi:
+    def __init__(self, token, limiter, api_base=SCRIPT_API_BASE, max_retries=3, timeout=60):
+        self.api_base = api_base.rstrip('/')
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def fetch_with_retry(self, method, path, body=None):
+        """
+        fetchWithRetry_ と同じ: 429 なら待ってリトライし、max_retries 回とも429なら rate_limited=True
+        戻り値: (response, rate_limited)
+        """
+        response = None
+        for attempt in range(1, self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.request(method, self.api_base + path, json=body, timeout=self.timeout)
+            finally:
+                self.limiter.release()
+            if response.status_code != 429:
+                self.limiter.on_success()
+                return response, False
+            retry_after = response.headers.get('Retry-After')
+            wait = self.limiter.on_rate_limited(float(retry_after) if retry_after and retry_after.isdigit() else None)
+            print(f'429 Rate Limit (attempt {attempt}/{self.max_retries})。{wait:.0f}秒待機...')
+        print(f'429 Rate Limit: {self.max_retries}回リトライしても解消されず')
+        return response, True
+
+    def get_content(self, script_id):
+        """現在のファイル一式（戻り値: (files or None, rate_limited)）"""
+        response, rate_limited = self.fetch_with_retry('GET', f'/v1/projects/{script_id}/content')
+        if rate_limited:
+            return None, True
+        if response.status_code != 200:
+            raise RuntimeError(f'GASコード取得失敗: {response.status_code} {response.text[:200]}')
+        return response.json().get('files', []), False
+
+    def create_project(self, spreadsheet_id):
+        """createBoundScript_ と同じ（戻り値: (scriptId or None, rate_limited)）"""
+        response, rate_limited = self.fetch_with_retry(
+            'POST', '/v1/projects', {'title': PROJECT_TITLE, 'parentId': spreadsheet_id}
+        )
+        if rate_limited:
+            return None, True
+        if response.status_code != 200:
+            print(f'GASプロジェクト作成失敗: {response.text[:200]}')
+            return None, False
+        return response.json().get('scriptId'), False
+
+    def update_content(self, script_id, files):
+        """updateScriptContent_ と同じ（戻り値: rate_limited）"""
+        response, rate_limited = self.fetch_with_retry(
+            'PUT', f'/v1/projects/{script_id}/content', {'files': files}
+        )
+        if rate_limited:
+            return True
+        if response.status_code != 200:
+            raise RuntimeError(f'GASコード更新失敗: {response.text[:200]}')
+        return False
+
+    def run_function(self, script_id, function, parameters, dev_mode=True):
+        """
+        scripts.run で関数を実行（戻り値: (関数の戻り値, rate_limited)）
+        スクリプト内の例外は RuntimeError にする
+        """
+        response, rate_limited = self.fetch_with_retry(
+            'POST', f'/v1/scripts/{script_id}:run',
+            {'function': function, 'parameters': parameters, 'devMode': dev_mode}
+        )
+        if rate_limited:
+            return None, True
+        if response.status_code != 200:
+            raise RuntimeError(f'GAS実行失敗: {response.status_code} {response.text[:200]}')
+        body = response.json()
+        if 'error' in body:
+            details = body['error'].get('details') or [{}]
+            raise RuntimeError(f'GAS実行エラー: {details[0].get("errorMessage") or body["error"].get("message")}')
+        return body.get('response', {}).get('result'), False
+
+
+# ============================================================
+# 進捗（ローカルJSON）
+# ============================================================
+
+class Progress:
+    """
+    顧客コードごとの配布状況
+    {"target_hash": ..., "clients": {"MK001": {"status", "hash", "scriptId", "updated_at", "error"}}}
+    """
+
+    def __init__(self, path, target_hash, resume=True):
+        self.path = path
+        self.target_hash = target_hash
+        self._lock = threading.Lock()
+        self.data = {'target_hash': target_hash, 'clients': {}}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            # 再開でない場合・配布内容が変わった場合は完了状況を引き継がない（作成済みの scriptId だけ残す）
+            if resume and saved.get('target_hash') == target_hash:
+                self.data = saved
+            else:
+                self.data['clients'] = {
+                    code: {'scriptId': entry['scriptId']}
+                    for code, entry in saved.get('clients', {}).items() if entry.get('scriptId')
+                }
+
+    def get(self, code):
+        return self.data['clients'].get(code, {})
+
+    def is_done(self, code):
+        entry = self.get(code)
+        return entry.get('status') in ('updated', 'unchanged') and entry.get('hash') == self.target_hash
+
+    def record(self, code, **fields):
+        with self._lock:
+            entry = self.data['clients'].setdefault(code, {})
+            entry.update(fields)
+            entry['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+# ============================================================
+# 顧客一覧
+# ============================================================
+
+SPREADSHEET_URL_PATTERN = re.compile(r'/spreadsheets/d/([a-zA-Z0-9-_]+)')
+
+
+def load_clients_from_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [
+            {
+                'partner': c.get('partner', ''),
+                'code': c['code'],
+                'spreadsheetId': c['spreadsheetId'],
+                'scriptId': c.get('scriptId', ''),
+            }
+            for c in json.load(f)
+        ]
+
+
+def _cell(row, index):
+    return str(row[index]).strip() if 0 <= index < len(row) and row[index] is not None else ''
+
+
+def load_clients_from_sheets(service, central_sheet_id, active_only=False):
+    """
+    中央管理スプシの「パートナー設定」から配布対象を読む（getAllClientsForDeploy_ と同じ条件）
+    書き戻し用に顧客管理シートのID・シート名・行番号・scriptId列を保持する
+    active_only=True ならステータスがアクティブ条件に合う顧客だけ（getAllActiveClients_ と同じ条件）
+    """
+    partners = service.spreadsheets().values().get(
+        spreadsheetId=central_sheet_id, range=PARTNER_SHEET_NAME
+    ).execute().get('values', [])
+
+    clients = []
+    for p in partners[1:]:
+        enabled = _cell(p, 7).upper()
+        sheet_id = _cell(p, 1)
+        if enabled != 'TRUE' or not sheet_id:
+            continue
+        name = _cell(p, 0)
+        sheet_name = _cell(p, 2) or '顧客管理'
+        code_col = int(_cell(p, 3) or 0)
+        status_col = int(_cell(p, 4) or 0)
+        url_col = int(_cell(p, 5) or 0)
+        active_statuses = [s.strip() for s in _cell(p, 6).split(',') if s.strip()]
+        script_id_col = int(_cell(p, 8)) if _cell(p, 8) else -1
+        try:
+            rows = service.spreadsheets().values().get(
+                spreadsheetId=sheet_id, range=sheet_name
+            ).execute().get('values', [])
+        except Exception as e:
+            print(f'[{name}] 読み込みエラー: {e}')
+            continue
+
+        count = 0
+        for i, row in enumerate(rows[1:], start=2):
+            code = _cell(row, code_col)
+            match = SPREADSHEET_URL_PATTERN.search(_cell(row, url_col))
+            if not code or not match:
+                continue
+            status = _cell(row, status_col)
+            if active_only and status not in active_statuses:
+                continue
+            clients.append({
+                'partner': name,
+                'code': code,
+                'status': status,
+                'spreadsheetId': match.group(1),
+                'scriptId': _cell(row, script_id_col) if script_id_col >= 0 else '',
+                '_sheet': (sheet_id, sheet_name, i, script_id_col),
+            })
+            count += 1
+        print(f'[{name}] 配布対象: {count}件')
+    return clients
+
+
+def col_letter(index):
+    """0始まりの列番号を列記号に変換（0 → A, 26 → AA）"""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def write_back_script_ids(service, clients, created):
+    """新規作成した scriptId を顧客管理シートに書き戻す（シートごとに1回の batchUpdate）"""
+    by_sheet = {}
+    for client in clients:
+        script_id = created.get(client['code'])
+        target = client.get('_sheet')
+        if not script_id or not target:
+            continue
+        sheet_id, sheet_name, row, col = target
+        if col < 0:
+            print(f'[{client["code"]}] scriptId列が未設定のため書き戻しできません。手動で記録してください: {script_id}')
+            continue
+        by_sheet.setdefault(sheet_id, []).append(
+            {'range': f'{sheet_name}!{col_letter(col)}{row}', 'values': [[script_id]]}
+        )
+    for sheet_id, data in by_sheet.items():
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=sheet_id, body={'valueInputOption': 'RAW', 'data': data}
+        ).execute()
+        print(f'scriptIdを顧客管理シートに記録: {len(data)}件')
+
+
+# ============================================================
+# 配布
+# ============================================================
+
+def deploy_one(api, client, files, target_hash, progress, dry_run=False):
+    """
+    1顧客に配布
+    戻り値: 'unchanged' / 'updated' / 'created' / 'rate_limited' / 'error'
+    """
+    code = client['code']
+    script_id = client.get('scriptId') or progress.get(code).get('scriptId', '')
+
+    if not script_id:
+        if dry_run:
+            print(f'[{code}] 新規作成予定')
+            return 'created'
+        script_id, rate_limited = api.create_project(client['spreadsheetId'])
+        if rate_limited:
+            return 'rate_limited'
+        if not script_id:
+            progress.record(code, status='error', error='GASプロジェクト作成失敗')
+            return 'error'
+        # コード更新前に scriptId を保存しておく（中断しても次回は作成し直さない）
+        progress.record(code, status='created', scriptId=script_id)
+        created = True
+    else:
+        created = False
+        files_now, rate_limited = api.get_content(script_id)
+        if rate_limited:
+            return 'rate_limited'
+        if content_hash(files_now) == target_hash:
+            progress.record(code, status='unchanged', hash=target_hash, scriptId=script_id)
+            return 'unchanged'
+        if dry_run:
+            print(f'[{code}] 更新予定: {script_id}')
+            return 'updated'
+
+    if api.update_content(script_id, files):
+        return 'rate_limited'
+    progress.record(code, status='updated', hash=target_hash, scriptId=script_id, error='')
+    print(f'[{code}] {"新規作成＋更新" if created else "更新"}完了: {script_id}')
+    return 'created' if created else 'updated'
+
+
+def deploy_all(api, clients, files, progress, workers=4, dry_run=False):
+    """全顧客に配布（戻り値: 結果ごとの件数, 新規作成した scriptId, エラー一覧）"""
+    target_hash = content_hash(files)
+    counts = {'unchanged': 0, 'updated': 0, 'created': 0, 'rate_limited': 0, 'error': 0, 'skipped': 0}
+    created_ids = {}
+    errors = []
+
+    todo = []
+    for client in clients:
+        if progress.is_done(client['code']):
+            counts['skipped'] += 1
+        else:
+            todo.append(client)
+    print(f'=== ラッパー配布開始: {len(todo)}件（前回までに完了 {counts["skipped"]}件）===')
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(deploy_one, api, client, files, target_hash, progress, dry_run): client
+            for client in todo
+        }
+        for future in as_completed(futures):
+            client = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = 'error'
+                progress.record(client['code'], status='error', error=str(e))
+                errors.append(f'{client["code"]}: {e}')
+                print(f'[{client["code"]}] エラー: {e}')
+            counts[result] += 1
+    # 新規作成した scriptId（コード更新が429で保留になった顧客も含む）
+    for client in todo:
+        entry = progress.get(client['code'])
+        if not client.get('scriptId') and entry.get('scriptId'):
+            created_ids[client['code']] = entry['scriptId']
+    return counts, created_ids, errors
+
+
+def get_token(args):
+    if args.token or os.environ.get('GOOGLE_OAUTH_TOKEN'):
+        return args.token or os.environ['GOOGLE_OAUTH_TOKEN']
+    import google.auth
+    import google.auth.transport.requests
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    credentials.refresh(google.auth.transport.requests.Request())
+    return credentials.token
+
+
+def get_sheets_service():
+    import google.auth
+    from googleapiclient.discovery import build
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    return build('sheets', 'v4', credentials=credentials)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ラッパーGAS一括配布（差分のみ・並列）')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--central-sheet-id', help='中央管理スプシのID（パートナー設定から顧客を読む）')
+    source.add_argument('--clients', help='顧客一覧JSON')
+    parser.add_argument('--wrapper', required=True, help='ラッパーGASのソースファイル')
+    parser.add_argument('--engine-script-id', required=True, help='ReceiptEngine のスクリプトID')
+    parser.add_argument('--workers', type=int, default=4, help='同時実行数の上限（デフォルト4）')
+    parser.add_argument('--max-retries', type=int, default=3, help='429時のリトライ回数（デフォルト3）')
+    parser.add_argument('--progress', default='deploy_progress.json', help='進捗ファイル')
+    parser.add_argument('--resume', action='store_true', help='進捗ファイルで完了済みの顧客を飛ばす')
+    parser.add_argument('--dry-run', action='store_true', help='差分確認のみ（作成・更新しない）')
+    parser.add_argument('--api-base', default=SCRIPT_API_BASE, help='Apps Script API のベースURL')
+    parser.add_argument('--token', help='アクセストークン')
+    args = parser.parse_args(argv)
+
+    with open(args.wrapper, 'r', encoding='utf-8') as f:
+        files = build_files(f.read(), args.engine_script_id)
+    target_hash = content_hash(files)
+
+    service = None
+    if args.central_sheet_id:
+        service = get_sheets_service()
+        clients = load_clients_from_sheets(service, args.central_sheet_id)
+    else:
+        clients = load_clients_from_json(args.clients)
+    if not clients:
+        print('配布対象の顧客が見つかりません。')
+        return 1
+
+    progress = Progress(args.progress, target_hash, resume=args.resume)
+
+    limiter = AdaptiveLimiter(args.workers)
+    api = ScriptApi(get_token(args), limiter, api_base=args.api_base, max_retries=args.max_retries)
+
+    started = time.monotonic()
+    counts, created_ids, errors = deploy_all(api, clients, files, progress, args.workers, args.dry_run)
+
+    if service is not None and created_ids and not args.dry_run:
+        write_back_script_ids(service, clients, created_ids)
+
+    print(f'=== ラッパー配布完了（{time.monotonic() - started:.1f}秒）: '
+          f'更新={counts["updated"]}, 新規={counts["created"]}, 変更なし={counts["unchanged"]}, '
+          f'完了済み={counts["skipped"]}, レート制限で保留={counts["rate_limited"]}, エラー={counts["error"]} ===')
+    if errors:
+        print('エラー詳細:\n' + '\n'.join(errors[:20]))
+    if counts['rate_limited']:
+        print(f'レート制限で保留した顧客があります。--resume を付けて再実行してください（進捗: {args.progress}）')
+    return 1 if counts['error'] or counts['rate_limited'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Gemini generateContent の疑似サーバー（line-receipt-webhook の分類・一括分類の動作確認用）
+
+書類の中身（バイト列）に含まれる語で分類を決めて、構造化出力と同じ形のJSONを返す。
+  b'receipt' → receipt / b'passbook' → passbook / b'slip' → credit_slip / それ以外 → unknown
+responseSchema に results がある（一括分類の）リクエストは、直前の「document_id: 〜」ごとに結果を返す。
+
+- 遅延: --latency（1リクエスト）+ --per-doc-latency × 書類数
+- 障害: --error-rate の確率で 500 を返す
+- 部分的な欠落: 一括分類のリクエストで、--drop-rate の確率で書類の結果を返さない
+
+使い方:
+    python tools/fake_gemini_api.py --port 8766 --latency 0.8 --per-doc-latency 0.1 --drop-rate 0.05
+    GEMINI_API_BASE=http://127.0.0.1:8766 GEMINI_API_KEY=dummy python ...
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def classify_bytes(content):
+    """書類の中身 → 分類結果（Classification の形）"""
+    if b'passbook' in content:
+        return {'category': 'passbook', 'confidence': 0.95,
+                'passbook': {'bank_name': 'テスト銀行', 'date_range': '2026/01/05〜01/27',
+                             'page_number': None, 'first_balance': 100000, 'latest_balance': 80000}}
+    if b'slip' in content:
+        return {'category': 'credit_slip', 'confidence': 0.9}
+    if b'receipt' in content:
+        return {'category': 'receipt', 'confidence': 0.9,
+                'receipt': {'date': '2026年2月15日', 'store_name': 'テスト商店', 'amount': len(content) % 10000}}
+    return {'category': 'unknown', 'confidence': 0.5}
+
+
+class FakeGeminiApi:
+    def __init__(self, latency=0.0, per_doc_latency=0.0, error_rate=0.0, drop_rate=0.0, seed=None):
+        self.latency = latency
+        self.per_doc_latency = per_doc_latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'batch_requests': 0, 'documents': 0, 'errors': 0, 'dropped': 0}
+        self._lock = threading.Lock()
+
+    def handle(self, body):
+        """戻り値: (status, dict)"""
+        parts = body.get('contents', [{}])[0].get('parts', [])
+        schema = body.get('generationConfig', {}).get('responseSchema', {})
+        batch = 'results' in schema.get('properties', {})
+
+        documents = []
+        document_id = None
+        for part in parts:
+            if 'text' in part and part['text'].startswith('document_id: '):
+                document_id = part['text'][len('document_id: '):].strip()
+            elif 'inline_data' in part:
+                documents.append((document_id, base64.b64decode(part['inline_data']['data'])))
+                document_id = None
+
+        time.sleep(self.latency + self.per_doc_latency * len(documents))
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['batch_requests'] += 1 if batch else 0
+            self.stats['documents'] += len(documents)
+            if self.random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, {'error': {'code': 500, 'message': 'Internal error'}}
+            dropped = {i for i in range(len(documents)) if batch and self.random.random() < self.drop_rate}
+            self.stats['dropped'] += len(dropped)
+
+        if batch:
+            data = {'results': [dict(classify_bytes(content), document_id=doc_id)
+                                for i, (doc_id, content) in enumerate(documents) if i not in dropped]}
+        else:
+            data = classify_bytes(documents[0][1]) if documents else {'category': 'unknown', 'confidence': 0}
+        text = json.dumps(data, ensure_ascii=False)
+        return 200, {
+            'candidates': [{'content': {'parts': [{'text': text}]}, 'finishReason': 'STOP'}],
+            'usageMetadata': {'candidatesTokenCount': len(text) // 4},
+        }
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            status, payload = api.handle(json.loads(self.rfile.read(length) or b'{}'))
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(api, host='127.0.0.1', port=8766):
+    """別スレッドで起動（戻り値: server。server.shutdown() で停止）"""
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gemini generateContent 疑似サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.0, help='1リクエストあたりの遅延（秒）')
+    parser.add_argument('--per-doc-latency', type=float, default=0.0, help='書類1件あたりの追加の遅延（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500を返す確率（0〜1）')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='一括分類で書類の結果を返さない確率（0〜1）')
+    args = parser.parse_args()
+
+    api = FakeGeminiApi(args.latency, args.per_doc_latency, args.error_rate, args.drop_rate)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    print(f'Fake Gemini API: http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(api.stats))
+
+
+if __name__ == '__main__':
+    main()
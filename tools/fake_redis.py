@@ -0,0 +1,259 @@
+"""
+Redis互換の疑似サーバー（line-receipt-webhook の共有キャッシュ shared_cache.py の動作確認用）
+
+RESP で GET / SET（EX・PX・NX・XX）/ DEL / EXISTS / PEXPIRE / RPUSH / LRANGE / LTRIM /
+HINCRBY / HSET / HMGET / HGETALL / WATCH / UNWATCH / MULTI / EXEC / DISCARD / PING / AUTH / SELECT /
+FLUSHALL / DBSIZE に応答する（WATCH したキーが EXEC までに書き換えられたら EXEC は nil を返す）。
+データはメモリ上の辞書のみ（DB番号・永続化なし）。
+
+- 遅延: --latency（1コマンドあたり、同じリージョンのキャッシュを想定した往復時間）
+- 障害: --error-rate の確率で接続を切る（共有層が使えない間の切り替えを確認する）
+
+使い方:
+    python tools/fake_redis.py --port 6390 --latency 0.0005
+    SHARED_CACHE_URL=redis://127.0.0.1:6390/0 python ...
+"""
+import argparse
+import json
+import random
+import socketserver
+import threading
+import time
+
+
+# 書き込みのコマンド（WATCH したキーの書き換えとして数える）
+WRITE_COMMANDS = {'SET', 'DEL', 'PEXPIRE', 'RPUSH', 'LTRIM', 'HINCRBY', 'HSET'}
+
+
+class FakeRedis:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.data = {}          # key → (value, 期限の time.monotonic() or None)
+        self.versions = {}      # key → 書き込み回数（WATCH で書き換えを検知する）
+        self.stats = {'commands': 0, 'connections': 0, 'dropped': 0}
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] < time.monotonic():
+            del self.data[key]
+            return None
+        return item
+
+    def handle(self, args, session=None):
+        """
+        コマンド（bytes のリスト）→ 応答（str は +、int は :、bytes/None は $、list は *、Exception は -）
+        session: 接続ごとの状態（WATCH したキー・MULTI 中のコマンド）。None ならトランザクションなし
+        """
+        name = args[0].decode('utf-8').upper()
+        with self._lock:
+            self.stats['commands'] += 1
+            if session is not None:
+                if name == 'WATCH':
+                    session.setdefault('watch', {}).update({key: self.versions.get(key, 0) for key in args[1:]})
+                    return 'OK'
+                if name == 'UNWATCH':
+                    session.pop('watch', None)
+                    return 'OK'
+                if name == 'MULTI':
+                    session['multi'] = []
+                    return 'OK'
+                if name == 'DISCARD':
+                    session.pop('multi', None)
+                    session.pop('watch', None)
+                    return 'OK'
+                if name == 'EXEC':
+                    queued = session.pop('multi', None)
+                    watched = session.pop('watch', {})
+                    if queued is None:
+                        return ValueError('ERR EXEC without MULTI')
+                    if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                        return None
+                    return [self._execute(command) for command in queued]
+                if 'multi' in session:
+                    session['multi'].append(args)
+                    return 'QUEUED'
+            return self._execute(args)
+
+    def _execute(self, args):
+        name = args[0].decode('utf-8').upper()
+        if name in WRITE_COMMANDS:
+            for key in (args[1:] if name == 'DEL' else args[1:2]):
+                self.versions[key] = self.versions.get(key, 0) + 1
+        if name in ('PING', 'AUTH', 'SELECT'):
+            return 'PONG' if name == 'PING' else 'OK'
+        if name == 'GET':
+            item = self._alive(args[1])
+            return item[0] if item else None
+        if name == 'SET':
+            return self._set(args[1], args[2], [a.decode('utf-8').upper() for a in args[3:]])
+        if name == 'DEL':
+            return sum(1 for key in args[1:] if self._alive(key) and self.data.pop(key, None))
+        if name == 'EXISTS':
+            return sum(1 for key in args[1:] if self._alive(key))
+        if name == 'PEXPIRE':
+            item = self._alive(args[1])
+            if item is None:
+                return 0
+            self.data[args[1]] = (item[0], time.monotonic() + int(args[2]) / 1000)
+            return 1
+        if name in ('RPUSH', 'LRANGE', 'LTRIM'):
+            return self._list(name, args[1], args[2:])
+        if name in ('HINCRBY', 'HSET', 'HMGET', 'HGETALL'):
+            return self._hash(name, args[1], args[2:])
+        if name == 'FLUSHALL':
+            self.data.clear()
+            return 'OK'
+        if name == 'DBSIZE':
+            return sum(1 for key in list(self.data) if self._alive(key))
+        return ValueError(f"ERR unknown command '{name}'")
+
+    def _list(self, name, key, args):
+        item = self._alive(key)
+        if item is not None and not isinstance(item[0], list):
+            return ValueError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        values = item[0] if item else []
+        if name == 'RPUSH':
+            values.extend(args)
+            self.data[key] = (values, item[1] if item else None)
+            return len(values)
+        start, stop = int(args[0]), int(args[1])
+        # Redis と同じく stop を含む（負の値は末尾から数える）
+        stop = len(values) if stop == -1 else (stop + 1 if stop >= 0 else len(values) + stop + 1)
+        selected = values[start:stop]
+        if name == 'LRANGE':
+            return selected
+        if selected:
+            self.data[key] = (selected, item[1])
+        elif item:
+            del self.data[key]
+        return 'OK'
+
+    def _hash(self, name, key, args):
+        item = self._alive(key)
+        if item is not None and not isinstance(item[0], dict):
+            return ValueError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        values = item[0] if item else {}
+        if name == 'HMGET':
+            return [values.get(field) for field in args]
+        if name == 'HGETALL':
+            return [part for field, value in values.items() for part in (field, value)]
+        if name == 'HINCRBY':
+            count = int(values.get(args[0], b'0')) + int(args[1])
+            values[args[0]] = str(count).encode('utf-8')
+            result = count
+        else:
+            pairs = list(zip(args[0::2], args[1::2]))
+            result = sum(1 for field, _ in pairs if field not in values)
+            values.update(pairs)
+        self.data[key] = (values, item[1] if item else None)
+        return result
+
+    def _set(self, key, value, options):
+        expires_at = None
+        nx = xx = False
+        i = 0
+        while i < len(options):
+            option = options[i]
+            if option in ('EX', 'PX'):
+                seconds = float(options[i + 1]) / (1000 if option == 'PX' else 1)
+                expires_at = time.monotonic() + seconds
+                i += 1
+            elif option == 'NX':
+                nx = True
+            elif option == 'XX':
+                xx = True
+            i += 1
+        exists = self._alive(key) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.data[key] = (value, expires_at)
+        return 'OK'
+
+
+def encode(reply):
+    if isinstance(reply, Exception):
+        return f'-{reply}\r\n'.encode('utf-8')
+    if isinstance(reply, str):
+        return f'+{reply}\r\n'.encode('utf-8')
+    if isinstance(reply, int):
+        return f':{reply}\r\n'.encode('utf-8')
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(encode(item) for item in reply)
+    return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+def read_command(rfile):
+    """RESP の配列（*N）を1つ読む。切断されたら None"""
+    line = rfile.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        # インラインコマンド（redis-cli の PING など）
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        length = int(rfile.readline()[1:-2])
+        args.append(rfile.read(length + 2)[:-2])
+    return args
+
+
+def make_handler(api):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            with api._lock:
+                api.stats['connections'] += 1
+            session = {}
+            while True:
+                args = read_command(self.rfile)
+                if not args:
+                    return
+                if api.latency:
+                    time.sleep(api.latency)
+                if api.error_rate and api.random.random() < api.error_rate:
+                    with api._lock:
+                        api.stats['dropped'] += 1
+                    return
+                self.wfile.write(encode(api.handle(args, session)))
+
+    return Handler
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(api, host='127.0.0.1', port=6390):
+    """別スレッドで起動（戻り値: server。server.shutdown() で停止）"""
+    server = _Server((host, port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Redis互換の疑似サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    parser.add_argument('--latency', type=float, default=0.0, help='1コマンドあたりの遅延（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='接続を切る確率（0〜1）')
+    args = parser.parse_args()
+
+    api = FakeRedis(args.latency, args.error_rate)
+    server = _Server((args.host, args.port), make_handler(api))
+    print(f'Fake Redis: redis://{args.host}:{args.port}/0')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(api.stats))
+
+
+if __name__ == '__main__':
+    main()
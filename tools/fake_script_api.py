@@ -0,0 +1,211 @@
+"""
+Apps Script API の疑似サーバー（deploy_wrapper.py / batch_scheduler.py の動作確認用）
+
+projects.create / projects.getContent / projects.updateContent と、
+scripts.run の runClientSlice（中央管理GASの小分け実行）だけを実装し、プロジェクトはメモリ上に保持する。
+レイテンシと429の発生を指定できる。
+
+runClientSlice は顧客ごとの未処理件数（backlogs）を1件 --item-seconds 秒で処理したことにし、
+1件ごとにAIの呼び出し時刻を記録する（スケジューラのレート制限の確認用）。
+
+使い方:
+    python tools/fake_script_api.py --port 8765 --latency 0.3 --rate-limit 0.1 \\
+        --seed-clients clients.json --seed-source gas/client-wrappers/_TEMPLATE.gs
+
+    --seed-clients の顧客のうち scriptId があるものは、最初から --seed-source の内容を持つ
+    （--stale で指定した割合は古い内容のまま）ものとして登録する。
+
+    python tools/fake_script_api.py --port 8765 --backlogs backlogs.json --item-seconds 0.05
+    （backlogs.json: {"<spreadsheetId>": {"receipts": 120, "verification": 40}}）
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_PATH = re.compile(r'^/v1/projects/([^/]+)/content$')
+RUN_PATH = re.compile(r'^/v1/scripts/([^/]+):run$')
+
+
+class FakeScriptApi:
+    def __init__(self, latency=0.0, rate_limit=0.0, item_seconds=0.0, item_error_rate=0.0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.item_seconds = item_seconds
+        self.item_error_rate = item_error_rate
+        self.projects = {}
+        # runClientSlice 用: spreadsheetId → {'receipts': 未処理件数, 'verification': 未処理件数}
+        self.backlogs = {}
+        self.llm_calls = []       # AIの呼び出し時刻（time.monotonic()）
+        self.runs = []            # (spreadsheetId, operation, 開始, 終了, 処理件数)
+        self.running = {}         # spreadsheetId → 実行中の runClientSlice の数
+        self.stats = {'create': 0, 'get': 0, 'update': 0, 'run': 0, 'rate_limited': 0,
+                      'max_parallel_per_client': 0}
+        self._lock = threading.Lock()
+
+    def handle(self, method, path, body):
+        """戻り値: (status, dict)"""
+        time.sleep(self.latency)
+        if method == 'POST' and RUN_PATH.match(path):
+            with self._lock:
+                if random.random() < self.rate_limit:
+                    self.stats['rate_limited'] += 1
+                    return 429, {'error': {'code': 429, 'message': 'Quota exceeded'}}
+                self.stats['run'] += 1
+            # 実行中はロックを持たない（複数の顧客の実行を並行させる）
+            return self._run(body)
+
+        with self._lock:
+            if random.random() < self.rate_limit:
+                self.stats['rate_limited'] += 1
+                return 429, {'error': {'code': 429, 'message': 'Quota exceeded'}}
+
+            if method == 'POST' and path == '/v1/projects':
+                script_id = uuid.uuid4().hex
+                self.projects[script_id] = {'parentId': body.get('parentId'), 'files': []}
+                self.stats['create'] += 1
+                return 200, {'scriptId': script_id, 'title': body.get('title'), 'parentId': body.get('parentId')}
+
+            match = CONTENT_PATH.match(path)
+            if not match or match.group(1) not in self.projects:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            project = self.projects[match.group(1)]
+            if method == 'GET':
+                self.stats['get'] += 1
+                return 200, {'scriptId': match.group(1), 'files': project['files']}
+            if method == 'PUT':
+                self.stats['update'] += 1
+                project['files'] = body.get('files', [])
+                return 200, {'scriptId': match.group(1), 'files': project['files']}
+            return 405, {'error': {'code': 405, 'message': 'Method not allowed'}}
+
+    def _run(self, body):
+        """scripts.run（runClientSlice のみ）。スクリプトのエラーは200 + error で返る"""
+        if body.get('function') != 'runClientSlice':
+            return 200, {'done': True, 'error': {'code': 3, 'message': 'ScriptError', 'details': [
+                {'errorMessage': f'Script function not found: {body.get("function")}', 'errorType': 'ScriptError'}]}}
+        operation, spreadsheet_id, max_time_ms, max_items = body.get('parameters', [])
+        started = time.monotonic()
+        processed = errors = 0
+        timed_out = False
+        with self._lock:
+            self.running[spreadsheet_id] = self.running.get(spreadsheet_id, 0) + 1
+            self.stats['max_parallel_per_client'] = max(self.stats['max_parallel_per_client'],
+                                                        self.running[spreadsheet_id])
+        try:
+            while True:
+                with self._lock:
+                    backlog = self.backlogs.setdefault(spreadsheet_id, {})
+                    if not backlog.get(operation) or (max_items and processed + errors >= max_items):
+                        break
+                    # processReceipts / runAutoVerification と同じく1件ごとに時間を確認する
+                    if time.monotonic() - started > max_time_ms / 1000:
+                        timed_out = True
+                        break
+                    backlog[operation] -= 1
+                    self.llm_calls.append(time.monotonic())
+                time.sleep(self.item_seconds)
+                if random.random() < self.item_error_rate:
+                    errors += 1
+                else:
+                    processed += 1
+        finally:
+            with self._lock:
+                self.running[spreadsheet_id] -= 1
+                has_more = bool(self.backlogs.get(spreadsheet_id, {}).get(operation))
+                self.runs.append((spreadsheet_id, operation, started, time.monotonic(), processed + errors))
+        return 200, {'done': True, 'response': {
+            '@type': 'type.googleapis.com/google.apps.script.v1.ExecutionResponse',
+            'result': {'processed': processed, 'errors': errors, 'timedOut': timed_out, 'hasMore': has_more},
+        }}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def _dispatch(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+            status, payload = api.handle(method, self.path, body)
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except BrokenPipeError:
+                # 呼び出し側が応答を待たずに終了した（scripts.run の実行中に中断された場合など）
+                pass
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def do_PUT(self):
+            self._dispatch('PUT')
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def seed(api, clients_path, source_path, engine_script_id, stale):
+    """clients.json の scriptId を既存プロジェクトとして登録"""
+    from deploy_wrapper import build_files
+    with open(clients_path, 'r', encoding='utf-8') as f:
+        clients = json.load(f)
+    with open(source_path, 'r', encoding='utf-8') as f:
+        current = build_files(f.read(), engine_script_id)
+    old = build_files('// old wrapper', engine_script_id)
+    for client in clients:
+        if client.get('scriptId'):
+            files = old if random.random() < stale else current
+            api.projects[client['scriptId']] = {'parentId': client['spreadsheetId'], 'files': files}
+
+
+def serve(api, host='127.0.0.1', port=8765):
+    """別スレッドで起動（戻り値: server。server.shutdown() で停止）"""
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apps Script API 疑似サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='1リクエストあたりの遅延（秒）')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='429を返す確率（0〜1）')
+    parser.add_argument('--seed-clients', help='既存プロジェクトとして登録する顧客一覧JSON')
+    parser.add_argument('--seed-source', help='既存プロジェクトの Code の内容')
+    parser.add_argument('--engine-script-id', default='dummy')
+    parser.add_argument('--stale', type=float, default=0.5, help='古い内容にしておく割合（0〜1）')
+    parser.add_argument('--backlogs', help='runClientSlice の未処理件数JSON（{spreadsheetId: {operation: 件数}}）')
+    parser.add_argument('--item-seconds', type=float, default=0.0, help='runClientSlice の1件あたりの処理時間（秒）')
+    parser.add_argument('--item-error-rate', type=float, default=0.0, help='runClientSlice の1件がエラーになる確率')
+    args = parser.parse_args()
+
+    api = FakeScriptApi(args.latency, args.rate_limit, args.item_seconds, args.item_error_rate)
+    if args.seed_clients and args.seed_source:
+        seed(api, args.seed_clients, args.seed_source, args.engine_script_id, args.stale)
+    if args.backlogs:
+        with open(args.backlogs, 'r', encoding='utf-8') as f:
+            api.backlogs = json.load(f)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    print(f'Fake Apps Script API: http://{args.host}:{args.port}（{len(api.projects)} projects）')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(api.stats))
+
+
+if __name__ == '__main__':
+    main()
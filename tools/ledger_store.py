@@ -0,0 +1,482 @@
+"""
+全顧客のレシート台帳（SQLite）
+
+中央管理GAS（getAllActiveClients_ / showAllClientsSummary / batchRunAutoVerification_）は
+顧客横断の集計のたびに全パートナーのシートと全顧客のスプシを開いて全範囲を読んでいた。
+このツールは各顧客の「本番シート」を1つのSQLiteに取り込み、集計はSQLiteに問い合わせる。
+
+- 取り込みは差分のみ: DriveのmodifiedTimeが前回の取り込み時から変わった顧客だけ読み直す
+  （前回同期以降に更新されたスプレッドシートを files.list 1回で調べる）
+- 読み直した顧客は行を入れ替える（1顧客1トランザクション、並列に読み込み・書き込みは1本）
+- 索引: 顧客コード・月・ステータス・検証状態。顧客別・月別の集計は取り込み時に作る
+  顧客×月の集計表（monthly）から引くため、全顧客分でも数ミリ秒で返る
+
+使い方:
+    # 取り込み（初回は全件、2回目以降は更新された顧客のみ）
+    python tools/ledger_store.py sync --central-sheet-id <中央管理スプシID>
+
+    # 集計
+    python tools/ledger_store.py summary                 # 顧客別の件数・未検証・要確認
+    python tools/ledger_store.py summary --by month --client MK001
+    python tools/ledger_store.py unverified              # 検証対象（runAutoVerification の対象条件）の件数
+
+環境変数:
+    LEDGER_DB_PATH   台帳のSQLiteファイル（デフォルト ledger.db）
+"""
+import argparse
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from deploy_wrapper import load_clients_from_sheets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions', 'line-receipt-webhook'))
+
+from normalize import normalize_date as normalize_receipt_date, parse_amount  # noqa: E402
+
+LEDGER_DB_PATH = os.environ.get('LEDGER_DB_PATH', 'ledger.db')
+MAIN_SHEET_NAME = '本番シート'
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets.readonly',
+    'https://www.googleapis.com/auth/drive.metadata.readonly',
+]
+
+# 本番シートの列（0始まり、getOrCreateMainSheet_ のヘッダー順）
+COL_STATUS, COL_PROCESSED_AT, COL_DATE, COL_STORE, COL_REGISTRATION = 0, 2, 3, 4, 5
+COL_TOTAL, COL_TAXABLE10, COL_TAX10, COL_TAXABLE8, COL_TAX8, COL_NON_TAXABLE = 6, 7, 8, 9, 10, 11
+COL_ACCOUNT, COL_CREDIT, COL_FILE_NAME, COL_VERIFICATION, COL_SCORE = 12, 13, 14, 16, 17
+
+STATUS_EMOJI = re.compile(r'^[🟢🔴🟡🟠🖊️]+')
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+VERIFY_TARGET_STATUSES = ('CHECK', 'ERROR', 'HAND')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS clients (
+    code TEXT PRIMARY KEY,
+    partner TEXT NOT NULL,
+    spreadsheet_id TEXT NOT NULL,
+    status TEXT,
+    modified_time TEXT,
+    ingested_at REAL,
+    row_count INTEGER DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS receipts (
+    client_code TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    receipt_date TEXT,
+    month TEXT,
+    store TEXT,
+    registration_number TEXT,
+    total INTEGER,
+    taxable10 INTEGER,
+    tax10 INTEGER,
+    taxable8 INTEGER,
+    tax8 INTEGER,
+    non_taxable INTEGER,
+    account TEXT,
+    credit_account TEXT,
+    file_name TEXT,
+    currency TEXT,
+    verification_status TEXT,
+    verification_state TEXT NOT NULL,
+    verification_score REAL,
+    verify_target INTEGER NOT NULL,
+    processed_at TEXT,
+    PRIMARY KEY (client_code, row_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_receipts_client_month ON receipts (client_code, month);
+CREATE INDEX IF NOT EXISTS idx_receipts_month ON receipts (month);
+CREATE INDEX IF NOT EXISTS idx_receipts_status ON receipts (status, client_code);
+CREATE INDEX IF NOT EXISTS idx_receipts_verification ON receipts (verification_state, client_code);
+CREATE INDEX IF NOT EXISTS idx_receipts_verify_target ON receipts (verify_target, client_code) WHERE verify_target = 1;
+-- 顧客×月の集計（取り込みのたびにその顧客分だけ作り直す。全顧客の集計はここから引く）
+CREATE TABLE IF NOT EXISTS monthly (
+    client_code TEXT NOT NULL,
+    month TEXT NOT NULL,
+    receipts INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    check_count INTEGER NOT NULL,
+    error INTEGER NOT NULL,
+    verify_targets INTEGER NOT NULL,
+    unverified INTEGER NOT NULL,
+    pending INTEGER NOT NULL,
+    approved INTEGER NOT NULL,
+    total_amount INTEGER NOT NULL,
+    tax INTEGER NOT NULL,
+    PRIMARY KEY (client_code, month)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_monthly_month ON monthly (month);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+RECEIPT_COLUMNS = ['client_code', 'row_number', 'status', 'receipt_date', 'month', 'store',
+                   'registration_number', 'total', 'taxable10', 'tax10', 'taxable8', 'tax8',
+                   'non_taxable', 'account', 'credit_account', 'file_name', 'currency',
+                   'verification_status', 'verification_state', 'verification_score',
+                   'verify_target', 'processed_at']
+REBUILD_MONTHLY = '''
+INSERT INTO monthly
+SELECT client_code, COALESCE(month, ''), COUNT(*), SUM(status = 'OK'), SUM(status = 'CHECK'),
+       SUM(status = 'ERROR'), SUM(verify_target), SUM(verification_state = 'unverified'),
+       SUM(verification_state = 'pending'), SUM(verification_state = 'approved'),
+       SUM(total), SUM(tax10 + tax8)
+FROM receipts WHERE client_code = ? GROUP BY month
+'''
+INSERT_RECEIPT = (f'INSERT INTO receipts ({", ".join(RECEIPT_COLUMNS)}) '
+                  f'VALUES ({", ".join("?" * len(RECEIPT_COLUMNS))})')
+
+
+# ============================================================
+# 行の変換
+# ============================================================
+
+def _cell(row, index):
+    if index < 0 or index >= len(row) or row[index] is None:
+        return ''
+    return str(row[index]).strip()
+
+
+def _amount(row, index):
+    value = row[index] if 0 <= index < len(row) else None
+    num = parse_amount(value)
+    return int(num) if num and math.isfinite(num) else 0
+
+
+def normalize_date(text):
+    """normalizeDate_ と同じ規則で YYYY-MM-DD に（解釈できなければ空）"""
+    normalized = normalize_receipt_date(text)
+    return normalized if ISO_DATE.match(normalized) else ''
+
+
+def verification_state(label):
+    """検証ステータス列（17列目）の表示 → 状態"""
+    if not label:
+        return 'unverified'
+    if '承認' in label:
+        return 'approved'
+    if '要確認' in label:
+        return 'pending'
+    if '要入力' in label:
+        return 'needs_input'
+    if 'エラー' in label or '❌' in label:
+        return 'error'
+    if '自動確定' in label:
+        return 'verified'
+    return 'other'
+
+
+def to_receipt(client_code, row_number, row, currency_col):
+    """本番シートの1行 → receipts の1行（空行はNone）"""
+    raw_status = _cell(row, COL_STATUS)
+    if not raw_status and not _cell(row, COL_STORE) and not _cell(row, COL_TOTAL):
+        return None
+    status = STATUS_EMOJI.sub('', raw_status)
+    receipt_date = normalize_date(_cell(row, COL_DATE))
+    label = _cell(row, COL_VERIFICATION)
+    currency = _cell(row, currency_col)
+    non_taxable = _amount(row, COL_NON_TAXABLE)
+    # runAutoVerification の対象条件
+    verify_target = (not label and currency in ('', 'JPY')
+                     and (status in VERIFY_TARGET_STATUSES or (status == 'COMPOUND' and non_taxable == 0)))
+    score = _cell(row, COL_SCORE)
+    try:
+        score = float(score) if score else None
+    except ValueError:
+        score = None
+    return (
+        client_code, row_number, status, receipt_date, receipt_date[:7] or None,
+        _cell(row, COL_STORE), _cell(row, COL_REGISTRATION),
+        _amount(row, COL_TOTAL), _amount(row, COL_TAXABLE10), _amount(row, COL_TAX10),
+        _amount(row, COL_TAXABLE8), _amount(row, COL_TAX8), non_taxable,
+        _cell(row, COL_ACCOUNT), _cell(row, COL_CREDIT), _cell(row, COL_FILE_NAME), currency,
+        label, verification_state(label), score, int(verify_target), _cell(row, COL_PROCESSED_AT),
+    )
+
+
+# ============================================================
+# 台帳
+# ============================================================
+
+class LedgerStore:
+    def __init__(self, path=LEDGER_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_meta(self, key):
+        row = self._connect().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def clients(self):
+        """取り込み済みの顧客 {code: 行}"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            return {row['code']: dict(row) for row in conn.execute('SELECT * FROM clients')}
+        finally:
+            conn.row_factory = None
+
+    def upsert_clients(self, clients):
+        """顧客一覧を更新し、一覧から外れた顧客の行を削除"""
+        codes = [c['code'] for c in clients]
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.executemany(
+                'INSERT INTO clients (code, partner, spreadsheet_id, status) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(code) DO UPDATE SET partner = excluded.partner, status = excluded.status, '
+                'modified_time = CASE WHEN clients.spreadsheet_id = excluded.spreadsheet_id '
+                'THEN clients.modified_time END, spreadsheet_id = excluded.spreadsheet_id',
+                [(c['code'], c['partner'], c['spreadsheetId'], c.get('status', '')) for c in clients])
+            placeholders = ','.join('?' * len(codes)) or "''"
+            conn.execute(f'DELETE FROM receipts WHERE client_code NOT IN ({placeholders})', codes)
+            conn.execute(f'DELETE FROM monthly WHERE client_code NOT IN ({placeholders})', codes)
+            conn.execute(f'DELETE FROM clients WHERE code NOT IN ({placeholders})', codes)
+
+    def replace_client_rows(self, client_code, rows, modified_time, currency_col=-1):
+        """
+        顧客の本番シートの行（ヘッダー除く）で台帳を入れ替える
+        戻り値: 取り込んだ行数
+        """
+        receipts = []
+        for row_number, row in enumerate(rows, start=2):
+            receipt = to_receipt(client_code, row_number, row, currency_col)
+            if receipt is not None:
+                receipts.append(receipt)
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute('DELETE FROM receipts WHERE client_code = ?', (client_code,))
+            conn.executemany(INSERT_RECEIPT, receipts)
+            conn.execute('DELETE FROM monthly WHERE client_code = ?', (client_code,))
+            conn.execute(REBUILD_MONTHLY, (client_code,))
+            conn.execute('UPDATE clients SET modified_time = ?, ingested_at = ?, row_count = ?, error = NULL '
+                         'WHERE code = ?', (modified_time, time.time(), len(receipts), client_code))
+        return len(receipts)
+
+    def record_error(self, client_code, message):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute('UPDATE clients SET error = ? WHERE code = ?', (message[:500], client_code))
+
+    # ---------- 集計 ----------
+
+    def query(self, sql, params=()):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.row_factory = None
+
+    def summary_by_client(self, partner=None):
+        """顧客別: 件数・検証対象・要確認・承認済み・合計金額"""
+        where, params = ('WHERE c.partner = ?', (partner,)) if partner else ('', ())
+        return self.query(f'''
+            SELECT c.partner, c.code, COALESCE(SUM(m.receipts), 0) AS receipts,
+                   COALESCE(SUM(m.verify_targets), 0) AS verify_targets,
+                   COALESCE(SUM(m.unverified), 0) AS unverified,
+                   COALESCE(SUM(m.pending), 0) AS pending,
+                   COALESCE(SUM(m.approved), 0) AS approved,
+                   COALESCE(SUM(m.total_amount), 0) AS total_amount, c.error
+            FROM clients c LEFT JOIN monthly m ON m.client_code = c.code
+            {where}
+            GROUP BY c.code ORDER BY c.partner, c.code''', params)
+
+    def summary_by_month(self, client_code=None):
+        """月別: 件数・ステータス別件数・合計金額（日付を読めなかった行は month が空）"""
+        where, params = ('WHERE client_code = ?', (client_code,)) if client_code else ('', ())
+        return self.query(f'''
+            SELECT month, SUM(receipts) AS receipts, SUM(ok) AS ok, SUM(check_count) AS check_count,
+                   SUM(error) AS error, SUM(pending) AS pending,
+                   SUM(total_amount) AS total_amount, SUM(tax) AS tax
+            FROM monthly {where}
+            GROUP BY month ORDER BY month''', params)
+
+    def count(self, verification_state=None, status=None, client_code=None, month=None, verify_target=None):
+        """条件に合う件数（索引に沿った条件のみ）"""
+        clauses, params = [], []
+        for column, value in (('verification_state', verification_state), ('status', status),
+                              ('client_code', client_code), ('month', month)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if verify_target is not None:
+            clauses.append('verify_target = ?')
+            params.append(int(verify_target))
+        sql = 'SELECT COUNT(*) FROM receipts' + (' WHERE ' + ' AND '.join(clauses) if clauses else '')
+        return self._connect().execute(sql, params).fetchone()[0]
+
+
+# ============================================================
+# 取り込み
+# ============================================================
+
+def modified_times(drive_service, spreadsheet_ids, since=None):
+    """
+    スプレッドシートの modifiedTime {id: RFC3339}
+    since がある場合はそれ以降に更新されたファイルだけを files.list で1回（ページ送り）で調べる。
+    ない場合（初回）は対象すべてを返すため空の値を入れる
+    """
+    wanted = set(spreadsheet_ids)
+    if since is None:
+        return {sid: '' for sid in wanted}
+    result = {}
+    page_token = None
+    query = (f"mimeType = 'application/vnd.google-apps.spreadsheet' and modifiedTime > '{since}' "
+             f"and trashed = false")
+    while True:
+        response = drive_service.files().list(
+            q=query, fields='nextPageToken, files(id, modifiedTime)', pageSize=1000,
+            pageToken=page_token, supportsAllDrives=True, includeItemsFromAllDrives=True,
+        ).execute(num_retries=5)
+        for f in response.get('files', []):
+            if f['id'] in wanted:
+                result[f['id']] = f['modifiedTime']
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return result
+
+
+def read_main_sheet(sheets_service, spreadsheet_id):
+    """本番シートの全行（ヘッダー, 行のリスト）"""
+    values = sheets_service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id, range=MAIN_SHEET_NAME,
+        valueRenderOption='UNFORMATTED_VALUE', dateTimeRenderOption='FORMATTED_STRING',
+    ).execute(num_retries=5).get('values', [])
+    return (values[0] if values else []), values[1:]
+
+
+def sync(store, clients, sheets_service, drive_service, workers=8, full=False):
+    """
+    更新された顧客だけを読み直して台帳に取り込む
+    戻り値: {'clients', 'changed', 'rows', 'errors', 'seconds'}
+    """
+    started = time.monotonic()
+    sync_started = datetime.now(timezone.utc)
+    store.upsert_clients(clients)
+    known = store.clients()
+
+    since = None if full else store.get_meta('last_sync')
+    changed_times = modified_times(drive_service, [c['spreadsheetId'] for c in clients], since)
+    targets = []
+    for c in clients:
+        # 未取り込み（modified_time なし）の顧客は必ず読む
+        if c['spreadsheetId'] in changed_times or not known.get(c['code'], {}).get('modified_time'):
+            targets.append((c, changed_times.get(c['spreadsheetId']) or sync_started.isoformat()))
+
+    rows_total = 0
+    errors = 0
+
+    def ingest(client, modified_time):
+        header, rows = read_main_sheet(sheets_service, client['spreadsheetId'])
+        currency_col = header.index('通貨') if '通貨' in header else -1
+        return store.replace_client_rows(client['code'], rows, modified_time, currency_col)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ingest, c, mt): c for c, mt in targets}
+        for future in as_completed(futures):
+            client = futures[future]
+            try:
+                rows_total += future.result()
+            except Exception as e:
+                errors += 1
+                store.record_error(client['code'], str(e))
+                print(f'[{client["code"]}] 取り込みエラー: {e}')
+
+    # 次回は今回の開始時刻（少し前）以降に更新されたものを調べる
+    if not errors:
+        store.set_meta('last_sync', (sync_started - timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+    return {'clients': len(clients), 'changed': len(targets), 'rows': rows_total, 'errors': errors,
+            'seconds': round(time.monotonic() - started, 2)}
+
+
+def get_services():
+    import google.auth
+    from googleapiclient.discovery import build
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    return (build('sheets', 'v4', credentials=credentials, cache_discovery=False),
+            build('drive', 'v3', credentials=credentials, cache_discovery=False))
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def print_table(rows):
+    if not rows:
+        print('（該当なし）')
+        return
+    columns = list(rows[0].keys())
+    widths = [max(len(str(c)), *(len(str(r[c])) for r in rows)) for c in columns]
+    print('  '.join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for r in rows:
+        print('  '.join(str(r[c] if r[c] is not None else '').ljust(w) for c, w in zip(columns, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='全顧客のレシート台帳')
+    parser.add_argument('--db', default=LEDGER_DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_sync = sub.add_parser('sync', help='更新された顧客を取り込む')
+    p_sync.add_argument('--central-sheet-id', required=True)
+    p_sync.add_argument('--workers', type=int, default=8)
+    p_sync.add_argument('--full', action='store_true', help='全顧客を読み直す')
+    p_summary = sub.add_parser('summary', help='集計を表示')
+    p_summary.add_argument('--by', choices=['client', 'month'], default='client')
+    p_summary.add_argument('--client')
+    p_summary.add_argument('--partner')
+    sub.add_parser('unverified', help='検証対象の件数')
+    args = parser.parse_args(argv)
+
+    store = LedgerStore(args.db)
+    if args.command == 'sync':
+        sheets_service, drive_service = get_services()
+        clients = load_clients_from_sheets(sheets_service, args.central_sheet_id, active_only=True)
+        result = sync(store, clients, sheets_service, drive_service, workers=args.workers, full=args.full)
+        print(f'顧客 {result["clients"]} 件中 {result["changed"]} 件を取り込み '
+              f'（{result["rows"]} 行、エラー {result["errors"]} 件、{result["seconds"]} 秒）')
+        return 1 if result['errors'] else 0
+
+    started = time.perf_counter()
+    if args.command == 'unverified':
+        rows = [{'verify_targets': store.count(verify_target=True),
+                 'unverified': store.count(verification_state='unverified'),
+                 'pending': store.count(verification_state='pending')}]
+    elif args.by == 'month':
+        rows = store.summary_by_month(args.client)
+    else:
+        rows = store.summary_by_client(args.partner)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print_table(rows)
+    last_sync = store.get_meta('last_sync')
+    print(f'（{elapsed_ms:.1f}ms、最終同期 {last_sync or "なし"}）')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,443 @@
+"""
+通帳の取引を重複なしで「通帳」シートに書き込む（PassbookEngine.gs の processPassbookFolder の書き込み部分のPython版）
+
+GAS版は読み取った取引を1件ずつ appendPassbookTransaction_（sheet.appendRow）で書き、
+すでにシートにある取引かどうかを確認しないため、送り直したページや前のページと重なって撮ったページの
+取引がそのまま二重に入っていた。このツールは:
+
+- 口座ごとに、書き込んだ取引の索引（取引日・摘要・入金・出金・残高）をSQLiteに持つ
+  （初回は顧客スプシの「通帳」シートの既存行から作る）
+- ページは GAS版と同じくページ番号順に並べ、ページ番号のないページがあれば、書き込み済みの最後の取引から
+  残高が続くページを順に選ぶ（送り直し・撮り直しのページで並びが崩れないように）。取引は1件ずつ索引と照合する
+  - 索引にある取引が、前後の取引も含めて索引と同じ並びなら、送り直し・重なりとして除く
+  - 前後が並ばない1件だけの一致は、残高の連続性で判断する: 直前に書いた取引の残高から続く
+    （残高 − 入金 + 出金 = 直前の残高）なら新しい取引（同じ日に同じ金額の出し入れがある場合）、続かなければ重複。
+    入出金のない行（繰越）は一致すれば重複
+- 1フォルダ分の取引を values.append 1回でまとめて書き込む（新しい取引がなければ書き込まない）
+  書き込みに失敗したフォルダは索引にも入れない（次回そのまま再実行できる）
+
+入力は1行1ページのJSONL（parsePassbookResponse_ の結果 + ファイル情報）:
+    {"spreadsheetId": "<顧客スプシID>", "folder": "<通帳フォルダID>", "fileName": "...", "fileUrl": "...",
+     "pageNumber": 3, "account": "<口座（省略時は spreadsheetId）>",
+     "transactions": [{"date": "2026-01-05", "description": "ATM", "deposit": null, "withdrawal": 10000, "balance": 52000}]}
+
+使い方:
+    python tools/passbook_ledger.py import --input pages.jsonl
+    python tools/passbook_ledger.py import --input pages.jsonl --dry-run        # 追加・除外の件数だけ確認
+    python tools/passbook_ledger.py rebuild --spreadsheet-id <顧客スプシID>      # シートから索引を作り直す
+
+環境変数:
+    PASSBOOK_DB_PATH   索引のSQLiteファイル（デフォルト passbook.db）
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions', 'line-receipt-webhook'))
+
+from normalize import normalize_passbook_date, parse_passbook_amount  # noqa: E402
+
+PASSBOOK_DB_PATH = os.environ.get('PASSBOOK_DB_PATH', 'passbook.db')
+PASSBOOK_SHEET_NAME = '通帳'
+# getOrCreatePassbookSheet_ のヘッダー
+PASSBOOK_HEADER = ['取引日', '摘要', '入金', '出金', '残高', '勘定科目', '補助科目', '画像リンク', 'ステータス']
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS transactions (
+    account TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    tx_date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    deposit INTEGER,
+    withdrawal INTEGER,
+    balance INTEGER,
+    folder TEXT,
+    file_name TEXT,
+    imported_at REAL,
+    PRIMARY KEY (account, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_transactions_key
+    ON transactions (account, tx_date, description, deposit, withdrawal, balance);
+CREATE TABLE IF NOT EXISTS accounts (
+    account TEXT PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    seeded_at REAL
+);
+'''
+
+
+# ============================================================
+# 取引
+# ============================================================
+
+def _amount(value):
+    """金額（appendPassbookTransaction_ は 0 と空欄を区別せず空欄で書くので、索引でも None にそろえる）"""
+    return parse_passbook_amount(value) or None
+
+
+def tx_key(tx):
+    """索引のキー: (取引日, 摘要, 入金, 出金, 残高)"""
+    return (
+        normalize_passbook_date(tx.get('date')),
+        str(tx.get('description') or '').strip(),
+        _amount(tx.get('deposit')),
+        _amount(tx.get('withdrawal')),
+        parse_passbook_amount(tx.get('balance')),
+    )
+
+
+def opening_balance(key):
+    """その取引の直前の残高（残高 − 入金 + 出金。残高がなければ None）"""
+    _, _, deposit, withdrawal, balance = key
+    if balance is None:
+        return None
+    return balance - (deposit or 0) + (withdrawal or 0)
+
+
+def to_sheet_row(key, page):
+    """appendPassbookTransaction_ と同じ列（残高 0 は空欄にせず 0 で書く）"""
+    tx_date, description, deposit, withdrawal, balance = key
+    file_url = page.get('fileUrl')
+    return [
+        tx_date, description, deposit or '', withdrawal or '', '' if balance is None else balance, '', '',
+        f'=HYPERLINK("{file_url}", "画像")' if file_url else '',
+        '未確認',
+    ]
+
+
+# ============================================================
+# ページの並べ替え
+# ============================================================
+
+def _first_date(page):
+    return page['keys'][0][0] if page['keys'] else ''
+
+
+def order_pages(ledger, pages):
+    """
+    ページを照合する順に1枚ずつ返す（呼び出し側が merge してから次を取り出すこと）
+    ページ番号が全ページにあればページ番号順（sortPassbookPages_ と同じ）。なければ sortByBalanceContinuity_ と
+    同じく残高の連続性で選ぶが、つなぐ先は索引の最後の取引にする:
+      1. 最初の行（繰越行）の残高、または最初の取引の直前の残高が最後の残高と同じ
+      2. 最後の取引を途中に含む（前のページと重なって撮ったページ）
+      3. すべての取引が索引にある（送り直し。どこで照合しても除かれる）
+      4. どれもなければ最初の取引日が最も早いページ
+    """
+    if all(p.get('pageNumber') is not None for p in pages):
+        yield from sorted(pages, key=lambda p: p['pageNumber'])
+        return
+    remaining = sorted(pages, key=_first_date)
+    while remaining:
+        index = None
+        if ledger.keys:
+            tail = ledger.keys[-1]
+            index = next((i for i, p in enumerate(remaining)
+                          if p['first_balance'] == tail[4]
+                          or (p['keys'][0] not in ledger.index and opening_balance(p['keys'][0]) == tail[4])), None)
+            if index is None:
+                index = next((i for i, p in enumerate(remaining) if tail in p['keys'][:-1]), None)
+            if index is None:
+                index = next((i for i, p in enumerate(remaining)
+                              if all(key in ledger.index for key in p['keys'])), None)
+        yield remaining.pop(index or 0)
+
+
+# ============================================================
+# 口座ごとの索引
+# ============================================================
+
+class AccountLedger:
+    """1口座の書き込み済み取引（書き込んだ順）と、キー → 位置の索引"""
+
+    def __init__(self, account, keys):
+        self.account = account
+        self.keys = list(keys)
+        self.index = {}
+        for position, key in enumerate(self.keys):
+            self.index.setdefault(key, []).append(position)
+        self.stored = len(self.keys)
+
+    @property
+    def tail_balance(self):
+        return self.keys[-1][4] if self.keys else None
+
+    def _aligned(self, keys, i, position):
+        """ページの i 件目と索引の position 件目が、前後の取引も含めて同じ並びか"""
+        if i > 0 and position > 0 and self.keys[position - 1] == keys[i - 1]:
+            return True
+        if i + 1 < len(keys) and position + 1 < len(self.keys) and self.keys[position + 1] == keys[i + 1]:
+            return True
+        return False
+
+    def merge(self, keys):
+        """
+        1ページ分の取引を照合して、新しい取引を末尾に加える
+        戻り値: (新しい取引の位置のリスト, {'overlap': 並びで一致した件数, 'isolated': 1件だけ一致した件数})
+        """
+        accepted = []
+        dropped = {'overlap': 0, 'isolated': 0}
+        for i, key in enumerate(keys):
+            positions = self.index.get(key)
+            if positions:
+                if any(self._aligned(keys, i, p) for p in positions):
+                    dropped['overlap'] += 1
+                    continue
+                # 1件だけの一致: 直前に書いた取引から残高が続くなら新しい取引
+                # （入出金のない行（繰越など）は残高が続いて見えるので、一致した時点で重複とする）
+                opening = opening_balance(key)
+                if opening is None or opening != self.tail_balance or not (key[2] or key[3]):
+                    dropped['isolated'] += 1
+                    continue
+            self.index.setdefault(key, []).append(len(self.keys))
+            accepted.append(len(self.keys))
+            self.keys.append(key)
+        return accepted, dropped
+
+    def rollback(self):
+        """書き込みに失敗した分を索引から外す"""
+        for position in range(self.stored, len(self.keys)):
+            positions = self.index[self.keys[position]]
+            positions.remove(position)
+            if not positions:
+                del self.index[self.keys[position]]
+        del self.keys[self.stored:]
+
+
+class PassbookLedger:
+    def __init__(self, path=PASSBOOK_DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def is_seeded(self, account):
+        return self.conn.execute('SELECT 1 FROM accounts WHERE account = ?', (account,)).fetchone() is not None
+
+    def load(self, account):
+        rows = self.conn.execute(
+            'SELECT tx_date, description, deposit, withdrawal, balance FROM transactions '
+            'WHERE account = ? ORDER BY seq', (account,)).fetchall()
+        return AccountLedger(account, [tuple(r) for r in rows])
+
+    def seed(self, account, spreadsheet_id, keys):
+        """シートの既存行で索引を作り直す"""
+        with self.conn:
+            self.conn.execute('DELETE FROM transactions WHERE account = ?', (account,))
+            self.conn.executemany(
+                'INSERT INTO transactions (account, seq, tx_date, description, deposit, withdrawal, balance, '
+                'folder, file_name, imported_at) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL, ?)',
+                [(account, seq, *key, time.time()) for seq, key in enumerate(keys)])
+            self.conn.execute('INSERT OR REPLACE INTO accounts (account, spreadsheet_id, seeded_at) VALUES (?, ?, ?)',
+                              (account, spreadsheet_id, time.time()))
+
+    def save(self, ledger, sources, write):
+        """
+        ledger に加えた取引を保存する。write()（シートへの書き込み）が失敗したら保存せずに例外を投げる
+        sources: 加えた取引ごとの (フォルダ, ファイル名)
+        """
+        rows = [(ledger.account, seq, *ledger.keys[seq], folder, file_name, time.time())
+                for seq, (folder, file_name) in zip(range(ledger.stored, len(ledger.keys)), sources)]
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO transactions (account, seq, tx_date, description, deposit, withdrawal, balance, '
+                'folder, file_name, imported_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            write()
+        ledger.stored = len(ledger.keys)
+
+
+# ============================================================
+# シート
+# ============================================================
+
+def read_passbook_keys(sheets_service, spreadsheet_id):
+    """「通帳」シートの既存行のキー（シートがなければ空）"""
+    try:
+        values = sheets_service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id, range=f'{PASSBOOK_SHEET_NAME}!A2:E',
+            valueRenderOption='UNFORMATTED_VALUE', dateTimeRenderOption='FORMATTED_STRING',
+        ).execute(num_retries=5).get('values', [])
+    except Exception as e:
+        if 'Unable to parse range' in str(e):
+            return []
+        raise
+    keys = []
+    for row in values:
+        row = list(row) + [''] * (5 - len(row))
+        if not any(str(v).strip() for v in row[:5]):
+            continue
+        keys.append(tx_key({'date': row[0], 'description': row[1], 'deposit': row[2],
+                            'withdrawal': row[3], 'balance': row[4]}))
+    return keys
+
+
+def ensure_passbook_sheet(sheets_service, spreadsheet_id):
+    """「通帳」シートがなければ getOrCreatePassbookSheet_ と同じヘッダーで作る"""
+    titles = {
+        s['properties']['title'] for s in sheets_service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields='sheets.properties.title'
+        ).execute(num_retries=5).get('sheets', [])
+    }
+    if PASSBOOK_SHEET_NAME in titles:
+        return
+    sheets_service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={'requests': [{'addSheet': {'properties': {
+            'title': PASSBOOK_SHEET_NAME, 'gridProperties': {'frozenRowCount': 1}}}}]}
+    ).execute(num_retries=5)
+    sheets_service.spreadsheets().values().update(
+        spreadsheetId=spreadsheet_id, range=f'{PASSBOOK_SHEET_NAME}!A1', valueInputOption='RAW',
+        body={'values': [PASSBOOK_HEADER]}
+    ).execute(num_retries=5)
+
+
+def append_rows(sheets_service, spreadsheet_id, rows):
+    """まとめて1回で追記（appendRow と同じく入力値として解釈させる: 日付・HYPERLINK）"""
+    sheets_service.spreadsheets().values().append(
+        spreadsheetId=spreadsheet_id, range=f'{PASSBOOK_SHEET_NAME}!A:I', valueInputOption='USER_ENTERED',
+        insertDataOption='INSERT_ROWS', body={'values': rows}
+    ).execute(num_retries=5)
+
+
+# ============================================================
+# 取り込み
+# ============================================================
+
+def prepare_page(page):
+    """入力の1ページに照合用のキーを加える（取引のないページは None）"""
+    keys = [tx_key(tx) for tx in page.get('transactions') or []]
+    if not keys:
+        print(f'取引データがないページを除外: {page.get("fileName", "")}')
+        return None
+    page['keys'] = keys
+    page['account'] = page.get('account') or page['spreadsheetId']
+    page['first_balance'] = keys[0][4]
+    page['last_balance'] = keys[-1][4]
+    return page
+
+
+def load_pages(path):
+    """JSONL → ページ（取引のないページは除く）"""
+    pages = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            page = prepare_page(json.loads(line))
+            if page is not None:
+                pages.append(page)
+    return pages
+
+
+def import_pages(store, sheets_service, pages, dry_run=False):
+    """
+    フォルダごとに並べ替え・照合して、新しい取引をフォルダごとに1回で書き込む
+    戻り値: {'folders', 'pages', 'transactions', 'appended', 'overlap', 'isolated', 'writes', 'errors'}
+    """
+    groups = {}
+    for page in pages:
+        groups.setdefault((page['spreadsheetId'], page['account'], page.get('folder', '')), []).append(page)
+
+    result = {'folders': len(groups), 'pages': len(pages), 'transactions': 0, 'appended': 0,
+              'overlap': 0, 'isolated': 0, 'writes': 0, 'errors': 0}
+    ledgers = {}
+    ready_sheets = set()
+    for (spreadsheet_id, account, folder), folder_pages in groups.items():
+        ledger = ledgers.get(account)
+        if ledger is None:
+            if not store.is_seeded(account) and sheets_service is not None:
+                keys = read_passbook_keys(sheets_service, spreadsheet_id)
+                print(f'[{account}] 通帳シートの既存 {len(keys)} 行から索引を作成')
+                if dry_run:
+                    ledger = AccountLedger(account, keys)
+                else:
+                    store.seed(account, spreadsheet_id, keys)
+            ledger = ledgers[account] = ledger or store.load(account)
+
+        rows, sources = [], []
+        dropped = {'overlap': 0, 'isolated': 0}
+        for page in order_pages(ledger, folder_pages):
+            accepted, page_dropped = ledger.merge(page['keys'])
+            for name, count in page_dropped.items():
+                dropped[name] += count
+            for position in accepted:
+                rows.append(to_sheet_row(ledger.keys[position], page))
+                sources.append((folder, page.get('fileName', '')))
+        total = sum(len(p['keys']) for p in folder_pages)
+        result['transactions'] += total
+        result['overlap'] += dropped['overlap']
+        result['isolated'] += dropped['isolated']
+        label = f'[{account}] {folder or "-"}: ページ {len(folder_pages)}, 取引 {total} 件 → 追加 {len(rows)} 件' \
+                f'（重複を除外: 並び {dropped["overlap"]} 件, 単独 {dropped["isolated"]} 件）'
+
+        if dry_run or not rows:
+            result['appended'] += len(rows)
+            print(label)
+            continue
+
+        def write():
+            if spreadsheet_id not in ready_sheets:
+                ensure_passbook_sheet(sheets_service, spreadsheet_id)
+                ready_sheets.add(spreadsheet_id)
+            append_rows(sheets_service, spreadsheet_id, rows)
+
+        try:
+            store.save(ledger, sources, write)
+            result['appended'] += len(rows)
+            result['writes'] += 1
+            print(label)
+        except Exception as e:
+            ledger.rollback()
+            result['errors'] += 1
+            print(f'{label} 書き込みエラー（索引には入れていません）: {e}')
+    return result
+
+
+def get_sheets_service():
+    import google.auth
+    from googleapiclient.discovery import build
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    return build('sheets', 'v4', credentials=credentials, cache_discovery=False)
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='通帳の取引を重複なしで通帳シートに書き込む')
+    parser.add_argument('--db', default=PASSBOOK_DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_import = sub.add_parser('import', help='通帳ページ（JSONL）を取り込む')
+    p_import.add_argument('--input', required=True, help='1行1ページのJSONL')
+    p_import.add_argument('--dry-run', action='store_true', help='追加・除外の件数だけ表示（シート・索引は変えない）')
+    p_rebuild = sub.add_parser('rebuild', help='通帳シートから索引を作り直す')
+    p_rebuild.add_argument('--spreadsheet-id', required=True)
+    p_rebuild.add_argument('--account', help='口座（省略時は spreadsheetId）')
+    args = parser.parse_args(argv)
+
+    store = PassbookLedger(args.db)
+    if args.command == 'rebuild':
+        keys = read_passbook_keys(get_sheets_service(), args.spreadsheet_id)
+        store.seed(args.account or args.spreadsheet_id, args.spreadsheet_id, keys)
+        print(f'索引を作り直しました: {len(keys)} 行')
+        return 0
+
+    pages = load_pages(args.input)
+    if not pages:
+        print('取り込むページがありません。')
+        return 0
+    started = time.perf_counter()
+    result = import_pages(store, get_sheets_service(), pages, dry_run=args.dry_run)
+    print(f'フォルダ {result["folders"]} / ページ {result["pages"]} / 取引 {result["transactions"]} 件 → '
+          f'追加 {result["appended"]} 件、重複を除外 {result["overlap"] + result["isolated"]} 件、'
+          f'書き込み {result["writes"]} 回、エラー {result["errors"]} 件'
+          f'（{time.perf_counter() - started:.1f}秒）')
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Webhookイベントの再処理（event_journal.py に記録したイベントを処理し直す）
+
+Gemini障害で unknown になった書類などを、お客様に送り直してもらわずに処理し直す。
+line-receipt-webhook の処理（handle_image_message など）をそのまま呼び、
+画像・PDFはジャーナルに保存した内容を使う（保存がなければLINEから再ダウンロード）。
+
+- 受付制御（admission.py の FairScheduler）で並列に処理する。同じユーザーの同時処理数は --per-user 件まで
+- 処理済みのイベントは索引に run_id ごとに記録し、同じ条件で再実行すると未完了分だけ処理する（--force で全件）
+- お客様への返信・プッシュは既定では送らずログに出す（--notify で送信）
+- --dry-run は対象イベントの一覧と件数だけを出力する
+- --batch は画像・PDFを GEMINI_BATCH_SIZE 件ずつまとめて分類してから処理する（batch_classify.py。大量の再処理向け）
+
+使い方（line-receipt-webhook と同じ環境変数を設定して）:
+    # 2026-02-15 に unknown になった画像・PDFを確認してから再処理
+    python tools/replay_events.py --day 2026-02-15 --outcome unknown --dry-run
+    python tools/replay_events.py --day 2026-02-15 --outcome unknown
+
+    # 特定ユーザーの期間指定
+    python tools/replay_events.py --since 2026-02-15T09:00 --until 2026-02-15T18:00 --user U1234...
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'functions', 'line-receipt-webhook'))
+
+DEFAULT_TYPES = ['message:image', 'message:file']
+
+
+def parse_time(text):
+    """YYYY-MM-DD または YYYY-MM-DDTHH:MM → UNIX秒"""
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f'日時の形式が不正です: {text}')
+
+
+def build_run_id(args):
+    """抽出条件から再処理IDを作る（同じ条件なら同じIDになり、再実行で続きから処理する）"""
+    key = json.dumps({
+        'since': args.since, 'until': args.until, 'user': args.user, 'channel': args.channel,
+        'types': sorted(args.types), 'outcome': sorted(args.outcome or []), 'notify': args.notify,
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+
+
+def handlers(main):
+    return {
+        'message:image': main.handle_image_message,
+        'message:file': main.handle_file_message,
+        'message:text': main.handle_text_message,
+        'follow': main.handle_follow_event,
+    }
+
+
+def silence_customer_messages(main, log):
+    """お客様への返信・プッシュを送らずに記録する"""
+    def push_message(user_id, text, channel_key='MK'):
+        log.append((user_id, channel_key, text))
+        print(f'[replay] (未送信) {channel_key}:{user_id} {text.splitlines()[0]}')
+
+    def reply_message(reply_token, text, channel_key='MK'):
+        push_message('(reply)', text, channel_key)
+
+    main.reply_message = reply_message
+    main.push_message = push_message
+
+
+def use_prefetched_classifications(main, prefetched):
+    """
+    画像の分類に、まとめて分類済みの結果（内容のハッシュ → 分類結果）を使う
+    戻り値: 差し替え前の1件ずつの分類関数
+    """
+    classify = main.classify_document_with_gemini
+
+    def classify_document_with_gemini(content, mime_type):
+        hit = prefetched.pop(hashlib.sha256(content).hexdigest(), None)
+        return hit if hit is not None else classify(content, mime_type)
+
+    main.classify_document_with_gemini = classify_document_with_gemini
+    return classify
+
+
+def prefetch_classifications(main, batch_classify, event_journal, window, prefetched, classify_single):
+    """
+    window のイベントの画像・PDF（ジャーナルに保存済みのもの）をまとめて分類する
+    画像の結果は prefetched に入れ、PDFの結果はページ分類キャッシュに入る
+    """
+    documents = []
+    for row, record in window:
+        message = record['event'].get('message', {})
+        if not row['content_sha']:
+            continue
+        if row['event_type'] == 'message:image':
+            mime_type = 'image/jpeg'
+        elif row['event_type'] == 'message:file' and message.get('fileName', '').lower().endswith('.pdf'):
+            mime_type = 'application/pdf'
+        else:
+            continue
+        content = event_journal.load_content(message.get('id'))
+        if content:
+            documents.append((content, mime_type))
+    if not documents:
+        return
+    results = batch_classify.classify_many(documents, main.classify_documents_with_gemini, classify_single)
+    for (content, mime_type), classification in zip(documents, results):
+        if mime_type == 'image/jpeg' and not classification.get('error'):
+            prefetched[hashlib.sha256(content).hexdigest()] = classification
+
+
+def print_plan(items, replayed):
+    print(f'{"received":20}{"ch":4}{"user":14}{"type":15}{"outcome":12}{"content":9}replayed')
+    for row, _ in items:
+        received = datetime.fromtimestamp(row['received_at']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f'{received:20}{row["channel_key"]:4}{(row["user_id"] or "-")[:12]:14}{row["event_type"]:15}'
+              f'{row["outcome"] or "-":12}{"saved" if row["content_sha"] else "LINE":9}'
+              f'{"yes" if row["event_id"] in replayed else ""}')
+    counts = Counter(row['outcome'] or '-' for row, _ in items)
+    print(f'対象 {len(items)} 件（再処理済み {sum(1 for row, _ in items if row["event_id"] in replayed)} 件）'
+          f' 直前の結果: {dict(counts)}')
+
+
+def main_():
+    parser = argparse.ArgumentParser(description='ジャーナルに記録したWebhookイベントを再処理する')
+    parser.add_argument('--day', help='対象日（YYYY-MM-DD）。--since/--until の代わり')
+    parser.add_argument('--since', help='開始日時（YYYY-MM-DD[THH:MM]）')
+    parser.add_argument('--until', help='終了日時（この時刻は含まない）')
+    parser.add_argument('--user', help='LINEのユーザーID')
+    parser.add_argument('--channel', help='チャネルキー（MK / KZ など）')
+    parser.add_argument('--types', default=','.join(DEFAULT_TYPES),
+                        help=f'イベント種別（カンマ区切り、デフォルト {",".join(DEFAULT_TYPES)}）')
+    parser.add_argument('--outcome', action='append', help='直前の処理結果で絞る（unknown など、複数指定可）')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--per-user', type=int, default=2)
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--notify', action='store_true', help='お客様に結果を送信する')
+    parser.add_argument('--force', action='store_true', help='再処理済みのイベントも処理し直す')
+    parser.add_argument('--batch', action='store_true', help='画像・PDFをまとめて分類する')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    args.types = [t for t in args.types.split(',') if t]
+    if args.day:
+        args.since = args.since or args.day
+        args.until = args.until or (datetime.strptime(args.day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    import main  # noqa: E402  （環境変数を読んでから import する）
+    import batch_classify  # noqa: E402
+    import event_journal  # noqa: E402
+    from admission import FairScheduler  # noqa: E402
+
+    rows = event_journal.find(
+        since=parse_time(args.since) if args.since else None,
+        until=parse_time(args.until) if args.until else None,
+        user_id=args.user, event_types=args.types, outcomes=args.outcome,
+        channel_key=args.channel, limit=args.limit)
+    items = event_journal.read_events(rows)
+    run_id = build_run_id(args)
+    replayed = event_journal.replayed_event_ids(run_id)
+    print(f'[replay] run_id={run_id}')
+
+    if args.dry_run:
+        print_plan(items, replayed)
+        return 0
+
+    todo = [(row, record) for row, record in items if args.force or row['event_id'] not in replayed]
+    messages = []
+    if not args.notify:
+        silence_customer_messages(main, messages)
+    table = handlers(main)
+    scheduler = FairScheduler(workers=args.workers, per_user=args.per_user)
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def replay_one(row, record):
+        event = dict(record['event'])
+        # 返信トークンは期限切れなので、結果はプッシュで送る（または記録する）
+        event['replyToken'] = None
+        try:
+            table[row['event_type']](event, record['channel_key'])
+            status = 'done'
+        except Exception as e:
+            print(f'[replay] Error ({row["event_id"]}): {e}')
+            status = 'failed'
+        event_journal.record_replay(run_id, row['event_id'], status)
+        with lock:
+            statuses[status] += 1
+
+    started = time.monotonic()
+    supported = []
+    for row, record in todo:
+        if row['event_type'] not in table:
+            print(f'[replay] Skip unsupported event type {row["event_type"]} ({row["event_id"]})')
+            continue
+        supported.append((row, record))
+
+    # --batch のときは、並列数 × 1リクエストの書類数 ずつまとめて分類してから処理する
+    prefetched = {}
+    window_size = len(supported) or 1
+    if args.batch:
+        classify_single = use_prefetched_classifications(main, prefetched)
+        window_size = max(1, batch_classify.GEMINI_BATCH_SIZE * batch_classify.GEMINI_BATCH_WORKERS)
+
+    jobs = []
+    for start in range(0, len(supported), window_size):
+        window = supported[start:start + window_size]
+        if args.batch:
+            prefetch_classifications(main, batch_classify, event_journal, window, prefetched, classify_single)
+        window_jobs = []
+        for row, record in window:
+            user_key = f'{record["channel_key"]}:{row["user_id"] or "unknown"}'
+            window_jobs.append(scheduler.submit(user_key, replay_one, row, record))
+        for job in window_jobs:
+            job.done.wait()
+        jobs.extend(window_jobs)
+    elapsed = time.monotonic() - started
+
+    todo_ids = {row['event_id'] for row, _ in todo}
+    outcomes = Counter(r['outcome'] or '-' for r in event_journal.find(
+        since=parse_time(args.since) if args.since else None,
+        until=parse_time(args.until) if args.until else None,
+        user_id=args.user, event_types=args.types, channel_key=args.channel)
+        if r['event_id'] in todo_ids)
+    print(f'[replay] {len(jobs)} 件を {elapsed:.1f} 秒で処理（{dict(statuses)}、'
+          f'スキップ {len(items) - len(todo)} 件） 処理後の結果: {dict(outcomes)}')
+    if messages:
+        print(f'[replay] 送信しなかったメッセージ {len(messages)} 件（--notify で送信）')
+    return 1 if statuses['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_())
@@ -0,0 +1,366 @@
+"""
+会計処理のテスト用の合成データ（乱数の種を決めれば毎回同じデータになる）
+
+顧客数・件数を本番の10〜100倍にしたときの処理時間・メモリを測るためのデータを作る
+（benchmarks/bench_scaling.py が使う）。どの関数も1件ずつ返すイテレータで、100万件でも全件をメモリに持たない。
+
+- iter_clients:          顧客一覧（load_clients_from_sheets と同じ形。パートナー・顧客コード・ステータス）
+- iter_receipts:         レシートの読み取り結果（OCRResult: 店名・日付・総額・税率別の小計・明細・登録番号・通貨）
+- receipt_sheet_row:     読み取り結果 → 本番シートの1行（ledger_store が読む列）
+- iter_billing_rows:     出力済み行数を数えるシートの値（countExportedRows が読む列、UNFORMATTED_VALUE の形）
+- iter_card_statements:  クレカ明細（利用日・利用店名・金額。カード会社ごとの表記ゆれ）
+- iter_passbook_pages:   通帳ページ（passbook_ledger の入力と同じJSON。繰越行・送り直し・撮り直し）
+
+含める例外的なデータ:
+- 8%と10%の混在、8%のみ、入湯税・宿泊税・軽油税などの不課税額（明細行のみ・小計情報のみ）
+- 税額だけ・税抜だけの読み取り、税込を税抜として読んだ小計、値引による端数差
+- 全角数字・円記号・カンマ付きの金額、和暦・年なしの日付、外貨（小数あり）、返金（マイナス）、総額なし
+- 登録番号の形式違い（桁不足・Tなし・前後の空白）
+- 同じ日に同じ金額の出し入れがあり、取引日・摘要・金額・残高がまったく同じ通帳の行
+
+使い方:
+    python tools/synthetic_data.py receipts --rows 100000 --seed 1 > receipts.jsonl
+    python tools/synthetic_data.py passbook --rows 20000 --seed 1 > pages.jsonl   # passbook_ledger.py import --input に渡せる
+    python tools/synthetic_data.py clients|card|billing --rows N
+"""
+import argparse
+import datetime
+import json
+import random
+import sys
+
+# (店名, 種類) 種類で税率・不課税・金額の範囲を決める
+STORES = [
+    ('セブン-イレブン 渋谷道玄坂店', 'conbini'), ('ファミリーマート 新宿西口店', 'conbini'),
+    ('ローソン 梅田駅前店', 'conbini'), ('ミニストップ 札幌北口店', 'conbini'),
+    ('イオン 幕張新都心店', 'super'), ('ライフ 東中野店', 'super'), ('成城石井 アトレ恵比寿店', 'super'),
+    ('スターバックス コーヒー 丸の内店', 'cafe'), ('ドトールコーヒーショップ 神田店', 'cafe'),
+    ('居酒屋 和民 池袋東口店', 'restaurant'), ('すき家 五反田店', 'restaurant'), ('鮨 まつもと', 'restaurant'),
+    ('ヨドバシカメラ マルチメディアAkiba', 'retail'), ('ビックカメラ 有楽町店', 'retail'),
+    ('東急ハンズ 心斎橋店', 'retail'), ('Amazon.co.jp', 'retail'), ('ASKUL', 'retail'),
+    ('ENEOS 環八用賀SS', 'fuel'), ('出光 名神高速 大津SA', 'fuel'),
+    ('JR東日本 新宿駅', 'transport'), ('東京メトロ 大手町駅', 'transport'), ('SMARTEX 東海道新幹線', 'transport'),
+    ('NEXCO中日本 東名高速', 'transport'), ('日本交通 タクシー', 'transport'),
+    ('箱根湯本温泉 ホテル天成園', 'hotel'), ('東横INN 博多口駅前', 'hotel'), ('京都 旅館 柊家', 'hotel'),
+    ('Starbucks Coffee Seattle', 'foreign'), ('Hilton Singapore', 'foreign'),
+]
+# クレカ明細での表記（カード会社ごとの表記ゆれ）
+CARD_MERCHANTS = {
+    'スターバックス コーヒー 丸の内店': ['ｽﾀｰﾊﾞｯｸｽ ｺｰﾋｰ', 'STARBUCKS COFFEE', 'SBX マルノウチ'],
+    'SMARTEX 東海道新幹線': ['SMARTEX', 'JR東海 EX予約', 'ＥＸ予約'],
+    'NEXCO中日本 東名高速': ['ETC NEXCO中日本', 'ＥＴＣ利用'],
+    'Amazon.co.jp': ['AMAZON.CO.JP', 'ｱﾏｿﾞﾝ'],
+    'セブン-イレブン 渋谷道玄坂店': ['ｾﾌﾞﾝ-ｲﾚﾌﾞﾝ', 'SEVEN-ELEVEN'],
+}
+PARTNERS = ['MK', 'KZ', 'TS', 'OS']
+CLIENT_STATUSES = ['契約済', '契約済', '契約済', '契約済', '準備中', '解約済', '']
+SHEET_STATUSES = ['🟢OK', '🟢OK', '🟢OK', '🟡CHECK', '🔴ERROR', '🖊️HAND', '🟠COMPOUND']
+VERIFICATION_LABELS = ['', '', '✅ 自動確定', '⚠️ 要確認', '✅ 承認済み', '📝 要入力', '❌ エラー']
+PASSBOOK_DESCRIPTIONS = ['ATM', 'カード', '振込 ヤマダ（カ', '口座振替 電気', '口座振替 ガス', '給与',
+                         '振込手数料', 'ネットバンク', 'ﾌﾘｺﾐ ｶ)ｻﾝﾌﾟﾙｼｮｳｼﾞ', '利息']
+INVOICE_NUMBERS = ['T1234567890123', 'T9876543210987', ' T5010401012345 ', 'T12345', '1234567890123', None]
+BILLING_HEADER = ['日付', '利用店舗名', '総合計', '勘定科目', '出力済', '出力行数']
+SHEET_SERIAL_EPOCH = datetime.date(1899, 12, 30)
+PASSBOOK_PAGE_ROWS = 20
+
+
+def _random_date(rng, year):
+    return datetime.date(year, 1, 1) + datetime.timedelta(days=rng.randrange(365))
+
+
+def _format_amount(rng, value):
+    """読み取り結果の金額の書き方（大半は数値、一部は全角・円記号・カンマ付きの文字列）"""
+    kind = rng.random()
+    if kind < 0.85:
+        return value
+    if kind < 0.92:
+        return f'{value:,}'
+    if kind < 0.97:
+        return f'¥{value:,}'
+    return f'{value:,}円'.translate(str.maketrans('0123456789,', '０１２３４５６７８９，'))
+
+
+def _format_date(rng, day):
+    kind = rng.random()
+    if kind < 0.8:
+        return day.isoformat()
+    if kind < 0.9:
+        return f'{day.year}/{day.month}/{day.day}'
+    if kind < 0.97:
+        return f'R{day.year - 2018}.{day.month}.{day.day}'
+    return f'{day.month}月{day.day}日'
+
+
+# ============================================================
+# 顧客
+# ============================================================
+
+def iter_clients(count, seed=0):
+    rng = random.Random(seed)
+    for n in range(1, count + 1):
+        partner = PARTNERS[rng.randrange(len(PARTNERS))] if n > len(PARTNERS) else PARTNERS[n - 1]
+        yield {
+            'partner': partner,
+            'code': f'{partner}{n:05d}',
+            'status': rng.choice(CLIENT_STATUSES),
+            'spreadsheetId': f'synthetic-sheet-{n:07d}',
+            'scriptId': '',
+        }
+
+
+# ============================================================
+# レシート
+# ============================================================
+
+def _split(rng, kind):
+    """種類ごとの税率別の税抜額と不課税額 (subtotal10, subtotal8, 不課税の種類, 不課税額)"""
+    if kind == 'super':
+        return rng.randint(0, 8000), rng.randint(100, 12000), None, 0
+    if kind == 'conbini':
+        has10 = rng.random() < 0.5
+        return (rng.randint(100, 2000) if has10 else 0), rng.randint(100, 1500), None, 0
+    if kind in ('cafe', 'restaurant'):
+        takeout = rng.random() < 0.25
+        amount = rng.randint(300, 30000 if kind == 'restaurant' else 3000)
+        return (0, amount, None, 0) if takeout else (amount, 0, None, 0)
+    if kind == 'fuel':
+        liters = rng.randint(20, 80)
+        diesel = rng.random() < 0.3
+        return liters * 160, 0, ('dieselTax' if diesel else None), (liters * 32 if diesel else 0)
+    if kind == 'hotel':
+        guests = rng.randint(1, 3)
+        spa = rng.random() < 0.4
+        return rng.randint(8000, 60000), 0, ('bathTax' if spa else 'accommodationTax'), guests * (150 if spa else 200)
+    if kind == 'transport':
+        return rng.randint(170, 30000), 0, None, 0
+    return rng.randint(500, 150000), 0, None, 0
+
+
+def make_receipt(rng, year=2026):
+    """読み取り結果（OCRResult）1件。総額・小計は税率どおりに作り、一部に読み取りミスを混ぜる"""
+    store, kind = STORES[rng.randrange(len(STORES))]
+    day = _random_date(rng, year)
+    if kind == 'foreign':
+        total = round(rng.uniform(3, 400), 2)
+        return {'storeName': store, 'date': day.isoformat(), 'totalAmount': total,
+                'currency': rng.choice(['USD', 'SGD', 'EUR']), 'items': [], 'invoiceNumber': None}
+
+    s10, s8, non_taxable_key, non_taxable = _split(rng, kind)
+    t10, t8 = s10 // 10, s8 * 8 // 100
+    total = s10 + t10 + s8 + t8 + non_taxable
+    info = {'subtotal10': s10, 'tax10': t10, 'subtotal8': s8, 'tax8': t8}
+    items = [{'name': f'品目{i + 1}', 'amount': rng.randint(100, 3000)} for i in range(rng.randint(0, 3))]
+    if non_taxable_key:
+        if rng.random() < 0.5:
+            info[non_taxable_key] = non_taxable
+        else:
+            items.append({'name': '入湯税' if non_taxable_key == 'bathTax' else '宿泊税', 'amount': non_taxable})
+
+    mistake = rng.random()
+    if mistake < 0.10:
+        info = None                                             # 税の情報なし（10%内税とみなされる）
+    elif mistake < 0.18:
+        info['subtotal10'] = 0                                  # 税額だけ読めた
+    elif mistake < 0.24:
+        info['tax10'] = 0                                       # 税抜だけ読めた
+    elif mistake < 0.29:
+        info['subtotal10'] = s10 + t10                          # 税込を税抜として読んだ
+    elif mistake < 0.36:
+        total -= rng.randint(1, 80)                             # 値引・端数
+    elif mistake < 0.38:
+        total = rng.choice([0, None, -total])                   # 総額なし・返金
+    if info:
+        info = {k: _format_amount(rng, v) for k, v in info.items() if v or rng.random() < 0.3}
+
+    return {
+        'storeName': store,
+        'date': _format_date(rng, day),
+        'totalAmount': _format_amount(rng, total) if isinstance(total, int) and total > 0 else total,
+        '_subtotalInfo': info,
+        'items': items,
+        'invoiceNumber': rng.choice(INVOICE_NUMBERS),
+        'currency': 'JPY' if rng.random() < 0.9 else rng.choice(['', None]),
+    }
+
+
+def iter_receipts(count, seed=0, year=2026):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield make_receipt(rng, year)
+
+
+def receipt_sheet_row(rng, ocr):
+    """読み取り結果 → 本番シートの1行（Status〜通貨の21列。金額は読み取りのまま書いたものとする）"""
+    info = ocr.get('_subtotalInfo') or {}
+    return [
+        rng.choice(SHEET_STATUSES), '', '2026/02/15 10:00:00', ocr['date'], ocr['storeName'],
+        ocr.get('invoiceNumber') or '', ocr.get('totalAmount') or '',
+        info.get('subtotal10', ''), info.get('tax10', ''), info.get('subtotal8', ''), info.get('tax8', ''),
+        info.get('bathTax') or info.get('accommodationTax') or info.get('dieselTax') or 0,
+        rng.choice(['消耗品費', '旅費交通費', '会議費', '接待交際費', '車両費', '']), '未払金',
+        f'receipt_{rng.randrange(10 ** 8):08d}.jpg', '',
+        rng.choice(VERIFICATION_LABELS), rng.choice(['', '0.92', '0.71', '1']), '', '',
+        ocr.get('currency') or '',
+    ]
+
+
+def iter_receipt_sheet_rows(count, seed=0, year=2026):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield receipt_sheet_row(rng, make_receipt(rng, year))
+
+
+# ============================================================
+# 出力済み行数（請求）
+# ============================================================
+
+def iter_billing_rows(count, seed=0, year=2026):
+    """本番シートの値（UNFORMATTED_VALUE の形）。日付はシリアル値、読めなかった日付は文字列のまま"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        day = _random_date(rng, year)
+        date = (day - SHEET_SERIAL_EPOCH).days if rng.random() < 0.95 else day.isoformat()
+        exported = rng.random() < 0.7
+        row = [date, STORES[rng.randrange(len(STORES))][0], rng.randint(100, 50000),
+               rng.choice(['消耗品費', '旅費交通費', '会議費']),
+               exported if rng.random() < 0.97 else ('TRUE' if exported else '')]
+        # 出力行数: 空欄（1行）・複数行・0
+        if rng.random() < 0.8:
+            row.append(rng.choice([1, 1, 1, 2, 3, 0, '']))
+        yield row
+
+
+# ============================================================
+# クレカ明細
+# ============================================================
+
+def iter_card_statements(count, seed=0, year=2026):
+    """カード会社のCSVの行 {'date', 'merchant', 'amount'}（文字列のまま）"""
+    rng = random.Random(seed)
+    domestic = [store for store, kind in STORES if kind != 'foreign']
+    for _ in range(count):
+        store = domestic[rng.randrange(len(domestic))]
+        merchant = rng.choice(CARD_MERCHANTS.get(store, [store]))
+        day = _random_date(rng, year)
+        amount = rng.randint(100, 80000)
+        if rng.random() < 0.03:
+            amount = -amount                                    # 返品・取消
+        yield {
+            'date': rng.choice([day.strftime('%Y/%m/%d'), day.isoformat(), f'{day.year}年{day.month}月{day.day}日']),
+            'merchant': merchant,
+            'amount': rng.choice([str(amount), f'{amount:,}', f'¥{amount:,}']),
+        }
+
+
+# ============================================================
+# 通帳
+# ============================================================
+
+def iter_passbook_transactions(rng, count, year):
+    """1口座の取引 (取引日, 摘要, 入金, 出金, 残高)。まったく同じ行が2件になる日を含む"""
+    balance = rng.randint(100, 500) * 1000
+    start = datetime.date(year, 1, 1)
+    for n in range(count):
+        tx_date = (start + datetime.timedelta(days=n * 365 // max(count, 1))).isoformat()
+        if n % 40 == 20 and n + 2 < count:
+            # 出金 → 入金 → 同じ額の出金
+            amount = rng.randint(1, 5) * 10000
+            yield tx_date, 'ATM', None, amount, balance - amount
+            yield tx_date, '振込 ヤマダ（カ', amount, None, balance
+            yield tx_date, 'ATM', None, amount, balance - amount
+            balance -= amount
+            continue
+        if n % 40 in (21, 22):
+            continue
+        if rng.random() < 0.3 or balance < 1000:
+            amount = rng.randint(1, 300) * 1000
+            balance += amount
+            yield tx_date, rng.choice(PASSBOOK_DESCRIPTIONS), amount, None, balance
+        else:
+            amount = min(balance - 100, rng.randint(1, 800) * 100)
+            balance -= amount
+            yield tx_date, rng.choice(PASSBOOK_DESCRIPTIONS), None, amount, balance
+
+
+def _passbook_page(spreadsheet_id, folder, name, page_number, rows):
+    page = {
+        'spreadsheetId': spreadsheet_id, 'folder': folder, 'fileName': name,
+        'fileUrl': f'https://drive.google.com/file/d/{name}/view',
+        'transactions': [{'date': r[0], 'description': r[1], 'deposit': r[2], 'withdrawal': r[3], 'balance': r[4]}
+                         for r in rows],
+    }
+    if page_number is not None:
+        page['pageNumber'] = page_number
+    return page
+
+
+def iter_passbook_pages(count, seed=0, year=2026, rows_per_account=2000, resend_rate=0.1, overlap_rate=0.1):
+    """
+    通帳ページ（1口座 rows_per_account 件、合計 count 件の取引）。20行ずつのページで2ページ目以降は先頭が繰越行、
+    月ごとのフォルダに入れる。一部を翌月のフォルダでも送り直し、ページの境目をまたいだ撮り直し（ページ番号なし）を加える
+    """
+    rng = random.Random(seed)
+    account = 0
+    while count > 0:
+        account += 1
+        size = min(count, rows_per_account)
+        count -= size
+        spreadsheet_id = f'synthetic-sheet-{account:07d}'
+        rows = list(iter_passbook_transactions(rng, size, year))
+        pages, current = [], []
+        for row in rows:
+            if len(current) == PASSBOOK_PAGE_ROWS:
+                pages.append(current)
+                current = [(current[-1][0], '繰越', None, None, current[-1][4])]
+            current.append(row)
+        pages.append(current)
+
+        folders = {}
+        for number, page_rows in enumerate(pages, start=1):
+            folders.setdefault(page_rows[-1][0][:7], []).append((number, page_rows))
+        months = sorted(folders)
+        for m, month in enumerate(months):
+            folder = f'{spreadsheet_id}-{month}'
+            items = [(f'{folder}-p{number}', number, page_rows) for number, page_rows in folders[month]]
+            if m > 0:
+                items.extend((f'{folder}-resent-p{number}', number, page_rows)
+                             for number, page_rows in folders[months[m - 1]] if rng.random() < resend_rate)
+            for (number, page_rows), (_, next_rows) in zip(folders[month], folders[month][1:]):
+                if rng.random() < overlap_rate:
+                    cut = rng.randint(8, PASSBOOK_PAGE_ROWS - 4)
+                    items.append((f'{folder}-overlap-p{number}', None, page_rows[cut:] + next_rows[:rng.randint(4, 10)]))
+            rng.shuffle(items)
+            numbered = rng.random() < 0.7
+            for name, number, page_rows in items:
+                yield _passbook_page(spreadsheet_id, folder, name, number if numbered else None, page_rows)
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+GENERATORS = {
+    'clients': lambda rows, seed, year: iter_clients(rows, seed),
+    'receipts': iter_receipts,
+    'sheet': iter_receipt_sheet_rows,
+    'billing': iter_billing_rows,
+    'card': iter_card_statements,
+    'passbook': iter_passbook_pages,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='会計処理のテスト用の合成データをJSONLで出力')
+    parser.add_argument('kind', choices=sorted(GENERATORS))
+    parser.add_argument('--rows', type=int, default=1000, help='件数（passbook は取引の件数）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--year', type=int, default=2026)
+    args = parser.parse_args(argv)
+
+    for item in GENERATORS[args.kind](args.rows, args.seed, args.year):
+        sys.stdout.write(json.dumps(item, ensure_ascii=False) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,510 @@
+"""
+税額の一括再計算（gas/Logic_Accounting.gs の calculateAccountingData のPython版）
+
+GAS版はレシート1件ずつ 税抜・税額（10% / 8%）・不課税額 を導出する。ルールを変えたときに
+全履歴を1行ずつ再計算していたのを、同じルールを列（整数円の NumPy 配列）に対する一括演算にして
+全件を1回で計算する。
+
+- calculate_accounting_data(ocr): 1件版（GAS版の逐語移植。一括版と照合するための基準）
+- build_columns(ocrs) → compute(columns): 一括版。条件分岐は「その行にだけ適用するマスク」にして、
+  GAS版と同じ順番で列全体に適用する
+- 小数を含む行（外貨の単価など整数円でないもの）は一括版では扱わず、1件版で計算して結果に差し込む
+- diff_results(): 前回の結果と比べて値が変わった行の一覧（ルール変更の影響確認用）
+
+GAS版との一致は benchmarks/bench_tax_engine.py で確認する（GAS版を Node で実行した結果のコーパスと照合）。
+
+使い方:
+    # 入力: 1行1件のJSONL {"id": ..., "ocr": OCRResult}
+    # 前回の結果（{"id": ..., "accounting": AccountingData}）と比べて変わった行をCSVに出す
+    python tools/tax_engine.py --input ocr.jsonl --baseline accounting.jsonl \\
+        --out accounting_new.jsonl --report diff.csv --columns ocr_columns.npz
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions', 'line-receipt-webhook'))
+
+from normalize import parse_amount  # noqa: E402  Utils.gs の parseAmount
+
+# gas/Config.gs の CONFIG.NON_TAXABLE_KEYWORDS
+NON_TAXABLE_KEYWORDS = ['入湯税', '宿泊税', '湯税', '滞在税', '観光税']
+
+INVOICE_NUMBER = re.compile(r'^T\d{13}$')
+
+RESULT_FIELDS = ['subtotal10', 'tax10', 'subtotal8', 'tax8', 'rawNonTaxable', 'totalAmount',
+                 'isCompound', 'hasInvoice', 'taxType', 'adjustmentNote']
+AMOUNT_FIELDS = ['subtotal10', 'tax10', 'subtotal8', 'tax8', 'rawNonTaxable', 'totalAmount']
+INFO_FIELDS = ['dieselTax', 'bathTax', 'accommodationTax', 'otherNonTaxable',
+               'subtotal10', 'tax10', 'subtotal8', 'tax8']
+
+TAX_TYPES = ['standard', 'reduced', 'exempt', 'mixed', 'foreign']
+ADJUST_NONE, ADJUST_10, ADJUST_8, ADJUST_MIXED = 0, 1, 2, 3
+ADJUST_NOTES = {
+    ADJUST_10: 'SUBTOTAL_ADJUSTED: 税抜額(10%)を{}円補正（値引等）',
+    ADJUST_8: 'SUBTOTAL_ADJUSTED: 税抜額(8%)を{}円補正（値引等）',
+    ADJUST_MIXED: 'SUBTOTAL_ADJUSTED: 税抜額(10%)を{}円補正（値引等・混合税率）',
+}
+
+
+# ============================================================
+# GAS の組み込み関数・Utils.gs 相当
+# ============================================================
+
+def js_round(x):
+    """Math.round（.5 は正の方向に丸める）"""
+    return math.floor(x + 0.5)
+
+
+def js_number_text(x):
+    """JS の数値 → 文字列（整数値は小数点なし）"""
+    if isinstance(x, float) and x.is_integer():
+        return str(int(x))
+    return str(x)
+
+
+def amount_or_zero(val):
+    """parseAmount(x) || 0"""
+    return parse_amount(val) or 0
+
+
+def is_valid_invoice_number(invoice_number):
+    """Utils.gs の isValidInvoiceNumber（T + 13桁）"""
+    if not invoice_number:
+        return False
+    return bool(INVOICE_NUMBER.match(str(invoice_number).strip()))
+
+
+def detect_non_taxable_from_items(items):
+    """明細行の品目名が不課税キーワードを含む金額の合計（detectNonTaxableFromItems_）"""
+    total = 0
+    for item in items or []:
+        name = str(item.get('name') or '').lower()
+        if name and any(keyword.lower() in name for keyword in NON_TAXABLE_KEYWORDS):
+            total += amount_or_zero(item.get('amount'))
+    return total
+
+
+def determine_tax_type(subtotal10, subtotal8, non_taxable):
+    """determineTaxType_"""
+    has10, has8, has_non_tax = subtotal10 > 0, subtotal8 > 0, non_taxable > 0
+    if (has10 and has8) or (has10 and has_non_tax) or (has8 and has_non_tax):
+        return 'mixed'
+    if has8 and not has10:
+        return 'reduced'
+    if has_non_tax and not has10 and not has8:
+        return 'exempt'
+    return 'standard'
+
+
+# ============================================================
+# 1件版（GAS版の逐語移植）
+# ============================================================
+
+def calculate_accounting_data(ocr):
+    """OCRResult → AccountingData（calculateAccountingData と同じ手順）"""
+    total_amount = amount_or_zero(ocr.get('totalAmount'))
+
+    # 外貨レシートの場合：消費税計算をスキップ
+    currency = ocr.get('currency')
+    if currency and currency != 'JPY':
+        return {
+            'subtotal10': 0, 'tax10': 0, 'subtotal8': 0, 'tax8': 0, 'rawNonTaxable': 0,
+            'totalAmount': total_amount, 'isCompound': False, 'hasInvoice': False,
+            'taxType': 'foreign', 'adjustmentNote': '',
+        }
+
+    info = ocr.get('_subtotalInfo')
+
+    # 1. 不課税額（入湯税・軽油税等）
+    raw_non_taxable = 0
+    if info:
+        raw_non_taxable = (amount_or_zero(info.get('dieselTax')) + amount_or_zero(info.get('bathTax'))
+                           + amount_or_zero(info.get('accommodationTax')) + amount_or_zero(info.get('otherNonTaxable')))
+    non_taxable_from_items = detect_non_taxable_from_items(ocr.get('items'))
+    if non_taxable_from_items > 0 and raw_non_taxable == 0:
+        raw_non_taxable = non_taxable_from_items
+
+    # 2. 課税対象額
+    taxable_amount = total_amount - raw_non_taxable
+
+    # 3. OCRの税額情報を優先
+    subtotal10 = tax10 = subtotal8 = tax8 = 0
+    if info:
+        ocr_subtotal10 = amount_or_zero(info.get('subtotal10'))
+        ocr_tax10 = amount_or_zero(info.get('tax10'))
+        ocr_subtotal8 = amount_or_zero(info.get('subtotal8'))
+        ocr_tax8 = amount_or_zero(info.get('tax8'))
+
+        if ocr_subtotal10 > 0 or ocr_tax10 > 0 or ocr_subtotal8 > 0 or ocr_tax8 > 0:
+            subtotal10, tax10, subtotal8, tax8 = ocr_subtotal10, ocr_tax10, ocr_subtotal8, ocr_tax8
+
+            # パターンA: 税額のみで税抜がない場合、総額から逆算
+            if tax10 > 0 and subtotal10 == 0:
+                derived = taxable_amount - tax10 - subtotal8 - tax8
+                subtotal10 = derived if derived > 0 else js_round(tax10 / 0.1)
+            if tax8 > 0 and subtotal8 == 0:
+                derived = taxable_amount - tax8 - subtotal10 - tax10
+                subtotal8 = derived if derived > 0 else js_round(tax8 / 0.08)
+
+            # 自動補正: 税込金額を税抜金額として読み取った場合
+            calculated_total = subtotal10 + tax10 + subtotal8 + tax8 + raw_non_taxable
+            total_tax = tax10 + tax8
+            if total_amount > 0 and calculated_total > 0:
+                delta = calculated_total - total_amount
+                if total_tax > 0 and delta > 0 and total_tax * 0.9 <= delta <= total_tax * 1.1:
+                    if subtotal10 > 0 and tax10 > 0:
+                        subtotal10 = subtotal10 - tax10
+                    if subtotal8 > 0 and tax8 > 0:
+                        subtotal8 = subtotal8 - tax8
+
+            # 税率サニティチェック
+            if subtotal10 > 0 and tax10 > 0:
+                ratio10 = tax10 / subtotal10
+                if ratio10 < 0.05 or ratio10 > 0.15:
+                    derived = taxable_amount - tax10 - subtotal8 - tax8
+                    if derived > 0 and 0.08 <= tax10 / derived <= 0.12:
+                        subtotal10 = derived
+            if subtotal8 > 0 and tax8 > 0:
+                ratio8 = tax8 / subtotal8
+                if ratio8 < 0.03 or ratio8 > 0.13:
+                    derived = taxable_amount - tax8 - subtotal10 - tax10
+                    if derived > 0 and 0.06 <= tax8 / derived <= 0.10:
+                        subtotal8 = derived
+
+    # 4. 税情報がない場合は10%内税
+    if subtotal10 == 0 and tax10 == 0 and subtotal8 == 0 and tax8 == 0 and taxable_amount > 0:
+        tax10 = math.floor(taxable_amount * 10 / 110)
+        subtotal10 = taxable_amount - tax10
+
+    # パターンB: 税抜金額があるのに税額が0
+    if subtotal10 > 0 and tax10 == 0 and total_amount > 0:
+        derived_tax = total_amount - subtotal10 - subtotal8 - tax8 - raw_non_taxable
+        if derived_tax > 0 and 0.08 <= derived_tax / subtotal10 <= 0.12:
+            tax10 = derived_tax
+    if subtotal8 > 0 and tax8 == 0 and total_amount > 0:
+        derived_tax = total_amount - subtotal8 - subtotal10 - tax10 - raw_non_taxable
+        if derived_tax > 0 and 0.06 <= derived_tax / subtotal8 <= 0.10:
+            tax8 = derived_tax
+
+    # パターンE: 不課税額が明らかにおかしい場合、総額から逆算
+    if raw_non_taxable > 0 and total_amount > 0:
+        calc_total = subtotal10 + tax10 + subtotal8 + tax8 + raw_non_taxable
+        if abs(calc_total - total_amount) > 5:
+            derived_non_taxable = total_amount - subtotal10 - tax10 - subtotal8 - tax8
+            if derived_non_taxable > 0 and derived_non_taxable != raw_non_taxable:
+                raw_non_taxable = derived_non_taxable
+
+    # 5. 値引き等による端数差異の補正
+    adjustment_note = ''
+    final_calc_total = subtotal10 + tax10 + subtotal8 + tax8 + raw_non_taxable
+    if total_amount > 0 and final_calc_total > 0:
+        final_delta = final_calc_total - total_amount
+        if final_delta != 0 and abs(final_delta) <= min(max(js_round(total_amount * 0.01), 10), 100):
+            if subtotal10 > 0 and subtotal8 == 0:
+                subtotal10 = total_amount - tax10 - raw_non_taxable
+                adjustment_note = ADJUST_NOTES[ADJUST_10].format(js_number_text(-final_delta))
+            elif subtotal8 > 0 and subtotal10 == 0:
+                subtotal8 = total_amount - tax8 - raw_non_taxable
+                adjustment_note = ADJUST_NOTES[ADJUST_8].format(js_number_text(-final_delta))
+            elif subtotal10 > 0 and subtotal8 > 0:
+                subtotal10 = total_amount - tax10 - subtotal8 - tax8 - raw_non_taxable
+                adjustment_note = ADJUST_NOTES[ADJUST_MIXED].format(js_number_text(-final_delta))
+
+    return {
+        'subtotal10': subtotal10, 'tax10': tax10, 'subtotal8': subtotal8, 'tax8': tax8,
+        'rawNonTaxable': raw_non_taxable, 'totalAmount': total_amount,
+        'isCompound': raw_non_taxable > 0,
+        'hasInvoice': is_valid_invoice_number(ocr.get('invoiceNumber')),
+        'taxType': determine_tax_type(subtotal10, subtotal8, raw_non_taxable),
+        'adjustmentNote': adjustment_note,
+    }
+
+
+# ============================================================
+# 一括版（列演算）
+# ============================================================
+
+def build_columns(ocrs):
+    """
+    OCRResult のリスト → 列（整数円の int64 配列）
+    文字列の解析（金額・明細の不課税キーワード・インボイス番号）はここで1件ずつ行い、
+    税額のルールはすべて compute() の列演算で行う
+    """
+    total, items_non_taxable = [], []
+    info_cols = {name: [] for name in INFO_FIELDS}
+    has_info, foreign, has_invoice, fractional = [], [], [], []
+    zeros = [0] * len(INFO_FIELDS)
+
+    for ocr in ocrs:
+        info = ocr.get('_subtotalInfo')
+        values = [amount_or_zero(ocr.get('totalAmount')), detect_non_taxable_from_items(ocr.get('items'))]
+        values += [amount_or_zero(info.get(name)) for name in INFO_FIELDS] if info else zeros
+        # 整数円でない行は1件版で計算する（列には0を入れておく）
+        is_fractional = any(type(v) is float and not v.is_integer() for v in values)
+        if is_fractional:
+            values = [0, 0] + zeros
+        total.append(values[0])
+        items_non_taxable.append(values[1])
+        for name, value in zip(INFO_FIELDS, values[2:]):
+            info_cols[name].append(value)
+        currency = ocr.get('currency')
+        has_info.append(bool(info) and not is_fractional)
+        foreign.append(bool(currency) and currency != 'JPY')
+        has_invoice.append(is_valid_invoice_number(ocr.get('invoiceNumber')))
+        fractional.append(is_fractional)
+
+    return {
+        'total': np.array(total, dtype=np.int64),
+        'info': {name: np.array(values, dtype=np.int64) for name, values in info_cols.items()},
+        'items_non_taxable': np.array(items_non_taxable, dtype=np.int64),
+        'has_info': np.array(has_info, dtype=bool),
+        'foreign': np.array(foreign, dtype=bool),
+        'has_invoice': np.array(has_invoice, dtype=bool),
+        'fractional': np.array(fractional, dtype=bool),
+    }
+
+
+def save_columns(path, columns):
+    """列を保存（ルールだけ変えて再計算するときは解析を飛ばして load_columns で読む）"""
+    arrays = {name: value for name, value in columns.items() if name != 'info'}
+    arrays.update({f'info_{name}': value for name, value in columns['info'].items()})
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_columns(path):
+    with np.load(path) as data:
+        columns = {name: data[name] for name in data.files if not name.startswith('info_')}
+        columns['info'] = {name: data[f'info_{name}'] for name in INFO_FIELDS}
+    return columns
+
+
+def _ratio(numerator, denominator):
+    """denominator > 0 の行だけ割り算（それ以外は nan）"""
+    out = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+
+def _between(values, low, high):
+    with np.errstate(invalid='ignore'):
+        return (values >= low) & (values <= high)
+
+
+def compute(columns):
+    """
+    一括計算。戻り値は列の辞書:
+    subtotal10 / tax10 / subtotal8 / tax8 / rawNonTaxable / totalAmount（int64）、
+    isCompound / hasInvoice（bool）、tax_type（TAX_TYPES の番号）、adjust（ADJUST_*）、adjust_delta
+    """
+    info = columns['info']
+    total = columns['total']
+    has_info = columns['has_info']
+
+    # 1. 不課税額
+    non_taxable = np.where(has_info, info['dieselTax'] + info['bathTax'] + info['accommodationTax']
+                           + info['otherNonTaxable'], 0)
+    items_nt = columns['items_non_taxable']
+    non_taxable = np.where((items_nt > 0) & (non_taxable == 0), items_nt, non_taxable)
+
+    # 2. 課税対象額
+    taxable = total - non_taxable
+
+    # 3. OCRの税額情報を優先
+    use_ocr = has_info & ((info['subtotal10'] > 0) | (info['tax10'] > 0) | (info['subtotal8'] > 0) | (info['tax8'] > 0))
+    s10 = np.where(use_ocr, info['subtotal10'], 0)
+    t10 = np.where(use_ocr, info['tax10'], 0)
+    s8 = np.where(use_ocr, info['subtotal8'], 0)
+    t8 = np.where(use_ocr, info['tax8'], 0)
+
+    # パターンA: 税額のみで税抜がない場合、総額から逆算
+    mask = use_ocr & (t10 > 0) & (s10 == 0)
+    derived = taxable - t10 - s8 - t8
+    s10 = np.where(mask, np.where(derived > 0, derived, np.floor(t10 / 0.1 + 0.5).astype(np.int64)), s10)
+    mask = use_ocr & (t8 > 0) & (s8 == 0)
+    derived = taxable - t8 - s10 - t10
+    s8 = np.where(mask, np.where(derived > 0, derived, np.floor(t8 / 0.08 + 0.5).astype(np.int64)), s8)
+
+    # 自動補正: 税込金額を税抜金額として読み取った場合
+    calculated = s10 + t10 + s8 + t8 + non_taxable
+    total_tax = t10 + t8
+    delta = calculated - total
+    swapped = (use_ocr & (total > 0) & (calculated > 0) & (total_tax > 0) & (delta > 0)
+               & (delta >= total_tax * 0.9) & (delta <= total_tax * 1.1))
+    s10 = np.where(swapped & (s10 > 0) & (t10 > 0), s10 - t10, s10)
+    s8 = np.where(swapped & (s8 > 0) & (t8 > 0), s8 - t8, s8)
+
+    # 税率サニティチェック
+    ratio = _ratio(t10, s10)
+    derived = taxable - t10 - s8 - t8
+    mask = (use_ocr & (s10 > 0) & (t10 > 0) & ~_between(ratio, 0.05, 0.15)
+            & (derived > 0) & _between(_ratio(t10, derived), 0.08, 0.12))
+    s10 = np.where(mask, derived, s10)
+    ratio = _ratio(t8, s8)
+    derived = taxable - t8 - s10 - t10
+    mask = (use_ocr & (s8 > 0) & (t8 > 0) & ~_between(ratio, 0.03, 0.13)
+            & (derived > 0) & _between(_ratio(t8, derived), 0.06, 0.10))
+    s8 = np.where(mask, derived, s8)
+
+    # 4. 税情報がない場合は10%内税
+    mask = (s10 == 0) & (t10 == 0) & (s8 == 0) & (t8 == 0) & (taxable > 0)
+    inclusive_tax = np.floor(taxable * 10 / 110).astype(np.int64)
+    t10 = np.where(mask, inclusive_tax, t10)
+    s10 = np.where(mask, taxable - inclusive_tax, s10)
+
+    # パターンB: 税抜金額があるのに税額が0
+    derived = total - s10 - s8 - t8 - non_taxable
+    mask = (s10 > 0) & (t10 == 0) & (total > 0) & (derived > 0) & _between(_ratio(derived, s10), 0.08, 0.12)
+    t10 = np.where(mask, derived, t10)
+    derived = total - s8 - s10 - t10 - non_taxable
+    mask = (s8 > 0) & (t8 == 0) & (total > 0) & (derived > 0) & _between(_ratio(derived, s8), 0.06, 0.10)
+    t8 = np.where(mask, derived, t8)
+
+    # パターンE: 不課税額が明らかにおかしい場合、総額から逆算
+    gap = np.abs(s10 + t10 + s8 + t8 + non_taxable - total)
+    derived = total - s10 - t10 - s8 - t8
+    mask = (non_taxable > 0) & (total > 0) & (gap > 5) & (derived > 0) & (derived != non_taxable)
+    non_taxable = np.where(mask, derived, non_taxable)
+
+    # 5. 値引き等による端数差異の補正
+    final_delta = s10 + t10 + s8 + t8 + non_taxable - total
+    limit = np.minimum(np.maximum(np.floor(total * 0.01 + 0.5).astype(np.int64), 10), 100)
+    adjustable = (total > 0) & (final_delta + total > 0) & (final_delta != 0) & (np.abs(final_delta) <= limit)
+    only10 = adjustable & (s10 > 0) & (s8 == 0)
+    only8 = adjustable & ~only10 & (s8 > 0) & (s10 == 0)
+    mixed = adjustable & ~only10 & ~only8 & (s10 > 0) & (s8 > 0)
+    adjust = np.select([only10, only8, mixed], [ADJUST_10, ADJUST_8, ADJUST_MIXED], ADJUST_NONE).astype(np.int8)
+    s10 = np.where(only10, total - t10 - non_taxable, s10)
+    s8 = np.where(only8, total - t8 - non_taxable, s8)
+    s10 = np.where(mixed, total - t10 - s8 - t8 - non_taxable, s10)
+
+    # 6. 税タイプ判定
+    has10, has8, has_nt = s10 > 0, s8 > 0, non_taxable > 0
+    tax_type = np.select(
+        [(has10 & has8) | (has10 & has_nt) | (has8 & has_nt), has8 & ~has10, has_nt & ~has10 & ~has8],
+        [TAX_TYPES.index('mixed'), TAX_TYPES.index('reduced'), TAX_TYPES.index('exempt')],
+        TAX_TYPES.index('standard')).astype(np.int8)
+
+    # 外貨レシートは消費税計算をしない
+    foreign = columns['foreign']
+    zero = np.zeros_like(total)
+    return {
+        'subtotal10': np.where(foreign, zero, s10),
+        'tax10': np.where(foreign, zero, t10),
+        'subtotal8': np.where(foreign, zero, s8),
+        'tax8': np.where(foreign, zero, t8),
+        'rawNonTaxable': np.where(foreign, zero, non_taxable),
+        'totalAmount': total,
+        'isCompound': ~foreign & has_nt,
+        'hasInvoice': ~foreign & columns['has_invoice'],
+        'tax_type': np.where(foreign, TAX_TYPES.index('foreign'), tax_type).astype(np.int8),
+        'adjust': np.where(foreign, ADJUST_NONE, adjust).astype(np.int8),
+        'adjust_delta': -final_delta,
+    }
+
+
+def to_records(result, start=0, stop=None):
+    """列の計算結果 → AccountingData のリスト（GAS版と同じキー）"""
+    stop = len(result['totalAmount']) if stop is None else stop
+    columns = {name: result[name][start:stop].tolist() for name in AMOUNT_FIELDS + ['isCompound', 'hasInvoice']}
+    tax_types = result['tax_type'][start:stop].tolist()
+    adjusts = result['adjust'][start:stop].tolist()
+    deltas = result['adjust_delta'][start:stop].tolist()
+    records = []
+    for i in range(stop - start):
+        record = {name: columns[name][i] for name in columns}
+        record['taxType'] = TAX_TYPES[tax_types[i]]
+        record['adjustmentNote'] = ADJUST_NOTES[adjusts[i]].format(deltas[i]) if adjusts[i] else ''
+        records.append({name: record[name] for name in RESULT_FIELDS})
+    return records
+
+
+def recompute(ocrs, columns=None):
+    """全件を一括計算（整数円でない行は1件版）して AccountingData のリストを返す"""
+    columns = build_columns(ocrs) if columns is None else columns
+    records = to_records(compute(columns))
+    for i in np.flatnonzero(columns['fractional']).tolist():
+        records[i] = calculate_accounting_data(ocrs[i])
+    return records
+
+
+# ============================================================
+# 差分
+# ============================================================
+
+def diff_results(ids, before, after):
+    """
+    前回の結果と比べて値が変わった行
+    戻り値: [(id, 項目, 前回, 今回)]
+    """
+    changes = []
+    for row_id, old, new in zip(ids, before, after):
+        if old is None:
+            changes.append((row_id, '*', '', 'new'))
+            continue
+        for name in RESULT_FIELDS:
+            if old.get(name) != new[name]:
+                changes.append((row_id, name, old.get(name), new[name]))
+    return changes
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='税額の一括再計算')
+    parser.add_argument('--input', required=True, help='{"id", "ocr"} のJSONL')
+    parser.add_argument('--baseline', help='前回の結果 {"id", "accounting"} のJSONL')
+    parser.add_argument('--out', help='結果の出力先（JSONL）')
+    parser.add_argument('--report', help='変わった行の出力先（CSV）')
+    parser.add_argument('--columns', help='列の保存先（.npz）。入力より新しければ解析を飛ばしてこれを使う')
+    args = parser.parse_args()
+
+    rows = read_jsonl(args.input)
+    ids = [row.get('id', i) for i, row in enumerate(rows)]
+    ocrs = [row['ocr'] for row in rows]
+    started = time.monotonic()
+    columns = None
+    if args.columns and os.path.exists(args.columns) and os.path.getmtime(args.columns) >= os.path.getmtime(args.input):
+        columns = load_columns(args.columns)
+    if columns is None or len(columns['total']) != len(ocrs):
+        columns = build_columns(ocrs)
+        if args.columns:
+            save_columns(args.columns, columns)
+    results = recompute(ocrs, columns)
+    elapsed = time.monotonic() - started
+    print(f'{len(results)} 件を {elapsed:.2f} 秒で再計算')
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            for row_id, result in zip(ids, results):
+                f.write(json.dumps({'id': row_id, 'accounting': result}, ensure_ascii=False) + '\n')
+
+    if args.baseline:
+        baseline = {row['id']: row['accounting'] for row in read_jsonl(args.baseline)}
+        changes = diff_results(ids, [baseline.get(row_id) for row_id in ids], results)
+        changed_rows = len({c[0] for c in changes})
+        by_field = {}
+        for _, name, _, _ in changes:
+            by_field[name] = by_field.get(name, 0) + 1
+        print(f'変わった行: {changed_rows} 件 {by_field}')
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['id', 'field', 'before', 'after'])
+                writer.writerows(changes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())